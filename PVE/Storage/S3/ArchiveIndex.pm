@@ -0,0 +1,1011 @@
+package PVE::Storage::S3::ArchiveIndex;
+
+use strict;
+use warnings;
+
+use JSON;
+use Digest::MD5 qw(md5_hex);
+use File::Basename qw(basename);
+use File::Path qw(make_path);
+
+use PVE::Storage::S3::Utils qw(log_info log_warn);
+use PVE::Storage::S3::Exception qw(S3Exception);
+
+# Index des membres d'archives vzdump (.tar*, .vma*)
+#
+# L'index est construit pendant l'upload de l'archive et stocké dans un
+# objet annexe "<clé>.index.json". Il permet ensuite de ne lire que les
+# plages d'octets nécessaires (extraction de config, restauration d'un
+# fichier ou d'un disque unique).
+
+use constant {
+    INDEX_VERSION => 1,
+    INDEX_SUFFIX => '.index.json',
+    TAR_BLOCK_SIZE => 512,
+    VMA_MAGIC => "VMA\0",
+    VMA_EXTENT_MAGIC => 'VMAE',
+    VMA_EXTENT_HEADER_SIZE => 512,
+    VMA_BLOCKS_PER_EXTENT => 59,
+    VMA_CLUSTER_SIZE => 65536,
+    VMA_BLOCK_SIZE => 4096,
+    STREAM_CHUNK_SIZE => 8 * 1024 * 1024,
+    CONFIG_SCAN_LIMIT => 64 * 1024 * 1024,
+};
+
+# Décompresseurs externes par extension
+my %DECODERS = (
+    gz => ['gzip', '-dc'],
+    zst => ['zstd', '-dc', '-q'],
+    lzo => ['lzop', '-dc'],
+);
+
+our $CONFIG_CACHE_DIR = '/var/cache/pve-s3/configs';
+
+# Nom des fichiers de configuration vzdump dans les archives
+my $CONFIG_MEMBER_RE = qr{(?:^|/)(?:etc/vzdump/)?(?:qemu-server|pct)\.conf$};
+
+# Détection du format d'une archive depuis son nom
+sub archive_format {
+    my ($name) = @_;
+    
+    return undef if !defined $name;
+    
+    if (basename($name) =~ /\.(tar|vma)(?:\.(gz|zst|lzo))?$/) {
+        return { format => $1, compression => $2 };
+    }
+    
+    return undef;
+}
+
+# Commande de décompression d'une archive (sortie sur stdout)
+sub decoder_command {
+    my ($compression) = @_;
+    
+    my $command = $DECODERS{$compression}
+        or die S3Exception("Unsupported compression '$compression'");
+    
+    return [ @$command ];
+}
+
+# Clé de l'objet annexe contenant l'index
+sub index_key {
+    my ($key) = @_;
+    
+    return $key . INDEX_SUFFIX;
+}
+
+# Constructeur d'un indexeur pour une archive en cours d'upload
+sub new {
+    my ($class, $archive_name) = @_;
+    
+    my $format = archive_format($archive_name) or return undef;
+    
+    my $self = {
+        archive => basename($archive_name),
+        format => $format->{format},
+        compression => $format->{compression},
+        stored_size => 0,
+        failed => undef,
+    };
+    
+    bless $self, $class;
+    
+    $self->{parser} = $self->{format} eq 'tar'
+        ? PVE::Storage::S3::ArchiveIndex::TarParser->new()
+        : PVE::Storage::S3::ArchiveIndex::VmaParser->new({ track_extents => !$self->{compression} });
+    
+    my $parser = $self->{parser};
+    $self->{decoder} = eval {
+        PVE::Storage::S3::ArchiveIndex::Decoder->new($self->{compression}, sub {
+            my ($data, $consumed) = @_;
+            $parser->feed($data, $consumed);
+        });
+    };
+    if ($@) {
+        log_warn("Archive index disabled for $self->{archive}: $@");
+        return undef;
+    }
+    
+    return $self;
+}
+
+# Ajout d'un bloc de données de l'archive (dans l'ordre d'upload)
+sub add {
+    my ($self, $data) = @_;
+    
+    return if $self->{failed};
+    
+    $self->{stored_size} += length($data);
+    
+    eval { $self->{decoder}->write($data); };
+    if ($@) {
+        $self->{failed} = "$@";
+        $self->{decoder}->abort();
+        log_warn("Archive index disabled for $self->{archive}: $@");
+    }
+}
+
+# Finalisation de l'index, retourne undef si l'archive n'a pas pu être analysée
+sub finish {
+    my ($self) = @_;
+    
+    return undef if $self->{failed};
+    
+    eval { $self->{decoder}->finish(); };
+    if ($@) {
+        log_warn("Archive index disabled for $self->{archive}: $@");
+        return undef;
+    }
+    
+    my $index = {
+        version => INDEX_VERSION,
+        archive => $self->{archive},
+        format => $self->{format},
+        compression => $self->{compression},
+        size => $self->{stored_size},
+        %{$self->{parser}->result()},
+    };
+    
+    return $index;
+}
+
+# Abandon de l'indexation (échec de l'upload)
+sub abort {
+    my ($self) = @_;
+    
+    $self->{decoder}->abort() if $self->{decoder};
+}
+
+# Enregistrement de l'index comme objet annexe
+sub store {
+    my ($client, $bucket, $key, $index) = @_;
+    
+    my $content = encode_json($index);
+    
+    $client->put_object($bucket, index_key($key), $content, {
+        'Content-Type' => 'application/json',
+    });
+    
+    my $count = scalar(@{$index->{members} // $index->{configs} // []});
+    log_info("Archive index stored: s3://$bucket/" . index_key($key) . " ($count entries)");
+}
+
+# Lecture de l'index d'une archive (undef si absent)
+sub fetch {
+    my ($client, $bucket, $key) = @_;
+    
+    my $content = eval { $client->get_object($bucket, index_key($key)) };
+    if ($@) {
+        return undef if _is_not_found($@);
+        die $@;
+    }
+    
+    my $index = eval { decode_json($content) };
+    if ($@ || ref($index) ne 'HASH' || ($index->{version} // 0) != INDEX_VERSION) {
+        log_warn("Ignoring invalid archive index for s3://$bucket/$key");
+        return undef;
+    }
+    
+    return $index;
+}
+
+# Extraction de la configuration VM/CT d'une archive vzdump
+sub extract_config {
+    my ($client, $bucket, $key) = @_;
+    
+    # L'entrée en cache n'est valable que pour la version de l'archive dont
+    # elle a été extraite (une archive peut être remplacée sous la même clé)
+    my $etag = $client->head_object($bucket, $key)->{ETag} // '';
+    
+    my $cache_file = _config_cache_file($bucket, $key);
+    if (my $cached = _read_cached_config($cache_file)) {
+        return $cached->{config} if $etag ne '' && ($cached->{etag} // '') eq $etag;
+    }
+    
+    my $format = archive_format($key)
+        or die S3Exception("Not a vzdump archive: $key");
+    
+    my $config;
+    if (my $index = fetch($client, $bucket, $key)) {
+        my $entry = _find_config_entry($index);
+        die S3Exception("No configuration found in archive index: $key") if !$entry;
+        $config = read_range($client, $bucket, $key, $index, $entry->{offset}, $entry->{size}, $entry->{stored_end});
+    } else {
+        log_info("No archive index for s3://$bucket/$key, scanning archive head");
+        $config = _scan_config($client, $bucket, $key, $format);
+    }
+    
+    _store_cached_config($cache_file, { etag => $etag, config => $config });
+    
+    return $config;
+}
+
+# Suppression de la configuration en cache (archive supprimée)
+sub invalidate_cached_config {
+    my ($bucket, $key) = @_;
+    
+    unlink _config_cache_file($bucket, $key);
+}
+
+# Recherche d'un membre d'archive tar dans l'index
+sub find_member {
+    my ($index, $name) = @_;
+    
+    return undef if ($index->{format} // '') ne 'tar';
+    
+    (my $wanted = $name) =~ s{^\./}{};
+    foreach my $member (@{$index->{members} // []}) {
+        (my $member_name = $member->{name}) =~ s{^\./}{};
+        return $member if $member_name eq $wanted;
+    }
+    
+    return undef;
+}
+
+# Recherche d'un disque dans l'index d'une archive VMA
+sub find_device {
+    my ($index, $name) = @_;
+    
+    return undef if ($index->{format} // '') ne 'vma';
+    
+    foreach my $device (@{$index->{devices} // []}) {
+        return $device if $device->{name} eq $name || "drive-$name" eq $device->{name};
+    }
+    
+    return undef;
+}
+
+# Lecture d'une plage de l'archive décompressée (en mémoire)
+sub read_range {
+    my ($client, $bucket, $key, $index, $offset, $size, $stored_end) = @_;
+    
+    my $content = '';
+    stream_range($client, $bucket, $key, $index, $offset, $size, $stored_end, sub {
+        $content .= $_[0];
+    });
+    
+    return $content;
+}
+
+# Lecture d'une plage de l'archive décompressée, par blocs
+sub stream_range {
+    my ($client, $bucket, $key, $index, $offset, $size, $stored_end, $callback) = @_;
+    
+    return if !$size;
+    
+    if (!$index->{compression}) {
+        # Archive non compressée: lecture directe de la plage
+        my $end = $offset + $size;
+        for (my $pos = $offset; $pos < $end; $pos += STREAM_CHUNK_SIZE) {
+            my $last = $pos + STREAM_CHUNK_SIZE - 1;
+            $last = $end - 1 if $last >= $end;
+            $callback->($client->get_object_range($bucket, $key, $pos, $last));
+        }
+        return;
+    }
+    
+    # Archive compressée: décodage du préfixe nécessaire uniquement
+    my $end = $offset + $size;
+    _decode_prefix($client, $bucket, $key, $index->{compression}, $stored_end, sub {
+        my ($data, $position) = @_;
+        
+        my $data_end = $position + length($data);
+        return 0 if $data_end <= $offset;
+        
+        my $from = $position < $offset ? $offset - $position : 0;
+        my $to = $data_end > $end ? $end - $position : length($data);
+        $callback->(substr($data, $from, $to - $from)) if $to > $from;
+        
+        return $data_end >= $end;
+    });
+}
+
+# Restauration d'un fichier unique d'une archive tar
+sub restore_member {
+    my ($client, $bucket, $key, $index, $name, $destination) = @_;
+    
+    my $member = find_member($index, $name)
+        or die S3Exception("Member '$name' not found in archive index");
+    
+    open my $fh, '>:raw', $destination or die S3Exception("Cannot create $destination: $!");
+    stream_range($client, $bucket, $key, $index, $member->{offset}, $member->{size}, $member->{stored_end}, sub {
+        print $fh $_[0] or die S3Exception("Write error on $destination: $!");
+    });
+    close $fh or die S3Exception("Write error on $destination: $!");
+    
+    return $member;
+}
+
+# Restauration d'un disque unique d'une archive VMA (image raw)
+sub restore_device {
+    my ($client, $bucket, $key, $index, $name, $destination) = @_;
+    
+    my $device = find_device($index, $name)
+        or die S3Exception("Device '$name' not found in archive index");
+    
+    open my $fh, '+>:raw', $destination or die S3Exception("Cannot create $destination: $!");
+    truncate($fh, $device->{size});
+    
+    my $writer = sub {
+        my ($extent) = @_;
+        _write_vma_extent($fh, $extent, $device->{id});
+    };
+    
+    if ($index->{extents}) {
+        # Archive non compressée: seuls les extents du disque sont lus, les
+        # extents contigus en une seule requête range
+        foreach my $range (_device_ranges($index->{extents}, $device->{id})) {
+            my ($offset, $end, $lengths) = @$range;
+            my $data = $client->get_object_range($bucket, $key, $offset, $end - 1);
+            my $pos = 0;
+            foreach my $length (@$lengths) {
+                $writer->(substr($data, $pos, $length));
+                $pos += $length;
+            }
+        }
+    } else {
+        # Archive compressée: décodage séquentiel, seuls les blocs du disque sont écrits
+        my $parser = PVE::Storage::S3::ArchiveIndex::VmaParser->new({ on_extent => $writer });
+        _decode_prefix($client, $bucket, $key, $index->{compression}, undef, sub {
+            my ($data, $position) = @_;
+            $parser->feed($data, $position + length($data));
+            return 0;
+        });
+    }
+    
+    close $fh or die S3Exception("Write error on $destination: $!");
+    
+    return $device;
+}
+
+# Regroupement des extents d'un disque en plages contiguës
+#
+# Retourne des [début, fin, [longueurs des extents]], chaque plage étant
+# limitée à STREAM_CHUNK_SIZE sauf si un extent seul la dépasse.
+sub _device_ranges {
+    my ($extents, $dev_id) = @_;
+    
+    my @ranges;
+    foreach my $extent (@$extents) {
+        my ($offset, $length, $dev_ids) = @$extent;
+        next if !grep { $_ == $dev_id } @$dev_ids;
+        
+        my $last = $ranges[-1];
+        if ($last && $last->[1] == $offset && $offset + $length - $last->[0] <= STREAM_CHUNK_SIZE) {
+            $last->[1] = $offset + $length;
+            push @{$last->[2]}, $length;
+        } else {
+            push @ranges, [$offset, $offset + $length, [$length]];
+        }
+    }
+    
+    return @ranges;
+}
+
+# Décodage du début d'une archive par requêtes range successives
+sub _decode_prefix {
+    my ($client, $bucket, $key, $compression, $limit, $consumer) = @_;
+    
+    if (!defined $limit) {
+        my $head = $client->head_object($bucket, $key);
+        $limit = $head->{ContentLength} || 0;
+    }
+    
+    my $position = 0;
+    my $stop = 0;
+    my $decoder = PVE::Storage::S3::ArchiveIndex::Decoder->new($compression, sub {
+        my ($data) = @_;
+        return if $stop;
+        $stop = 1 if $consumer->($data, $position);
+        $position += length($data);
+    });
+    
+    eval {
+        for (my $pos = 0; $pos < $limit && !$stop; $pos += STREAM_CHUNK_SIZE) {
+            my $last = $pos + STREAM_CHUNK_SIZE - 1;
+            $last = $limit - 1 if $last >= $limit;
+            $decoder->write($client->get_object_range($bucket, $key, $pos, $last));
+        }
+        # Le préfixe peut être tronqué au milieu d'une trame: le code de
+        # sortie du décompresseur n'est pas significatif ici.
+        $decoder->finish(1) if !$stop;
+    };
+    my $err = $@;
+    $decoder->abort();
+    die $err if $err;
+}
+
+# Extraction de la configuration sans index (lecture progressive du début)
+sub _scan_config {
+    my ($client, $bucket, $key, $format) = @_;
+    
+    my $config;
+    my $parser;
+    
+    if ($format->{format} eq 'tar') {
+        $parser = PVE::Storage::S3::ArchiveIndex::TarParser->new({
+            capture => sub { $_[0] =~ $CONFIG_MEMBER_RE },
+            on_capture => sub { $config //= $_[1]; },
+        });
+    } else {
+        $parser = PVE::Storage::S3::ArchiveIndex::VmaParser->new({
+            header_only => 1,
+        });
+    }
+    
+    _decode_prefix($client, $bucket, $key, $format->{compression}, undef, sub {
+        my ($data, $position) = @_;
+        $parser->feed($data, $position + length($data));
+        
+        return 1 if defined $config;
+        if ($format->{format} eq 'vma' && $parser->header_done()) {
+            my $entry = _find_config_entry($parser->result());
+            $config = $entry ? $entry->{data} : '';
+            return 1;
+        }
+        return 1 if $parser->position() > CONFIG_SCAN_LIMIT;
+        return 0;
+    });
+    
+    die S3Exception("No configuration found in archive: $key") if !defined $config || $config eq '';
+    
+    return $config;
+}
+
+# Recherche de l'entrée de configuration dans un index
+sub _find_config_entry {
+    my ($index) = @_;
+    
+    if (($index->{format} // '') eq 'tar') {
+        foreach my $member (@{$index->{members} // []}) {
+            return $member if $member->{name} =~ $CONFIG_MEMBER_RE;
+        }
+    } else {
+        foreach my $config (@{$index->{configs} // []}) {
+            return $config if $config->{name} =~ /^(?:qemu-server|pct)\.conf$/;
+        }
+    }
+    
+    return undef;
+}
+
+# Écriture des blocs d'un disque contenus dans un extent VMA
+sub _write_vma_extent {
+    my ($fh, $extent, $dev_id) = @_;
+    
+    return if length($extent) < VMA_EXTENT_HEADER_SIZE
+        || substr($extent, 0, 4) ne VMA_EXTENT_MAGIC;
+    
+    my @blockinfo = unpack('Q>' . VMA_BLOCKS_PER_EXTENT, substr($extent, 40, VMA_BLOCKS_PER_EXTENT * 8));
+    my $data_pos = VMA_EXTENT_HEADER_SIZE;
+    
+    foreach my $info (@blockinfo) {
+        my $mask = ($info >> 48) & 0xffff;
+        my $cur_dev = ($info >> 32) & 0xff;
+        my $cluster = $info & 0xffffffff;
+        
+        next if !$cur_dev;
+        
+        for my $bit (0..15) {
+            next if !($mask & (1 << $bit));
+            if ($cur_dev == $dev_id) {
+                seek($fh, $cluster * VMA_CLUSTER_SIZE + $bit * VMA_BLOCK_SIZE, 0);
+                print $fh substr($extent, $data_pos, VMA_BLOCK_SIZE);
+            }
+            $data_pos += VMA_BLOCK_SIZE;
+        }
+    }
+}
+
+# Fichier de cache d'une configuration extraite
+sub _config_cache_file {
+    my ($bucket, $key) = @_;
+    
+    return "$CONFIG_CACHE_DIR/" . md5_hex("$bucket/$key") . '.json';
+}
+
+sub _read_cached_config {
+    my ($cache_file) = @_;
+    
+    open my $fh, '<', $cache_file or return undef;
+    my $content = do { local $/; <$fh> };
+    close $fh;
+    
+    my $cached = eval { decode_json($content) };
+    return ref($cached) eq 'HASH' && defined($cached->{config}) ? $cached : undef;
+}
+
+sub _store_cached_config {
+    my ($cache_file, $cached) = @_;
+    
+    eval {
+        make_path($CONFIG_CACHE_DIR, { mode => 0700 }) if !-d $CONFIG_CACHE_DIR;
+        my $tmp = "$cache_file.tmp.$$";
+        open my $fh, '>', $tmp or die "$!\n";
+        print $fh encode_json($cached);
+        close $fh or die "$!\n";
+        rename($tmp, $cache_file) or die "$!\n";
+    };
+    log_warn("Cannot cache extracted configuration: $@") if $@;
+}
+
+sub _is_not_found {
+    my ($err) = @_;
+    
+    return ref($err) && $err->can('details') && ($err->details->{http_code} // 0) == 404;
+}
+
+# Décompression en flux via un processus externe
+#
+# La position "consumed" transmise avec chaque bloc décompressé est le
+# nombre d'octets compressés écrits jusque-là: c'est une borne supérieure
+# du préfixe compressé nécessaire pour obtenir ces données.
+package PVE::Storage::S3::ArchiveIndex::Decoder {
+    use IO::Select;
+    use POSIX qw(:sys_wait_h);
+    
+    use constant WRITE_SLICE => 65536;
+    
+    sub new {
+        my ($class, $compression, $on_output) = @_;
+        
+        my $self = bless {
+            on_output => $on_output,
+            consumed => 0,
+            pid => undef,
+        }, $class;
+        
+        return $self if !$compression;
+        
+        my $cmd = $DECODERS{$compression}
+            or die "unsupported compression '$compression'\n";
+        
+        pipe(my $child_in, my $in) or die "pipe failed: $!\n";
+        pipe(my $out, my $child_out) or die "pipe failed: $!\n";
+        
+        my $pid = fork();
+        die "fork failed: $!\n" if !defined $pid;
+        
+        if (!$pid) {
+            close $in;
+            close $out;
+            open(STDIN, '<&', $child_in) or POSIX::_exit(126);
+            open(STDOUT, '>&', $child_out) or POSIX::_exit(126);
+            open(STDERR, '>', '/dev/null');
+            exec(@$cmd) or POSIX::_exit(127);
+        }
+        
+        close $child_in;
+        close $child_out;
+        $in->blocking(0);
+        $out->blocking(0);
+        
+        $self->{pid} = $pid;
+        $self->{in} = $in;
+        $self->{out} = $out;
+        
+        return $self;
+    }
+    
+    sub write {
+        my ($self, $data) = @_;
+        
+        if (!$self->{pid}) {
+            $self->{consumed} += length($data);
+            $self->{on_output}->($data, $self->{consumed});
+            return;
+        }
+        
+        # Décompresseur arrêté (flux invalide): EPIPE au lieu de SIGPIPE, qui
+        # tuerait le processus d'upload
+        local $SIG{PIPE} = 'IGNORE';
+        
+        my $length = length($data);
+        my $offset = 0;
+        my $readers = IO::Select->new($self->{out});
+        my $writers = IO::Select->new($self->{in});
+        
+        while ($offset < $length) {
+            my ($readable, $writable) = IO::Select->select($readers, $writers, undef, 30);
+            die "decompressor stalled\n" if !$readable && !$writable;
+            
+            $self->_read_available() if $readable && @$readable;
+            
+            if ($writable && @$writable) {
+                my $slice = $length - $offset;
+                $slice = WRITE_SLICE if $slice > WRITE_SLICE;
+                my $written = syswrite($self->{in}, $data, $slice, $offset);
+                if (defined $written) {
+                    $offset += $written;
+                    $self->{consumed} += $written;
+                } elsif (!$!{EAGAIN}) {
+                    die "decompressor write failed: $!\n";
+                }
+            }
+        }
+        
+        $self->_read_available();
+    }
+    
+    # Fin du flux compressé, $partial ignore le code de sortie
+    sub finish {
+        my ($self, $partial) = @_;
+        
+        return if !$self->{pid};
+        
+        close($self->{in});
+        $self->{out}->blocking(1);
+        while (1) {
+            my $read = sysread($self->{out}, my $buffer, WRITE_SLICE);
+            die "decompressor read failed: $!\n" if !defined $read;
+            last if !$read;
+            $self->{on_output}->($buffer, $self->{consumed});
+        }
+        close($self->{out});
+        
+        waitpid($self->{pid}, 0);
+        my $status = $? >> 8;
+        $self->{pid} = undef;
+        
+        die "decompressor exited with status $status\n" if $status && !$partial;
+    }
+    
+    sub abort {
+        my ($self) = @_;
+        
+        return if !$self->{pid};
+        
+        kill('TERM', $self->{pid});
+        close($self->{in});
+        close($self->{out});
+        waitpid($self->{pid}, 0);
+        $self->{pid} = undef;
+    }
+    
+    sub _read_available {
+        my ($self) = @_;
+        
+        while (1) {
+            my $read = sysread($self->{out}, my $buffer, WRITE_SLICE);
+            if (!defined $read) {
+                last if $!{EAGAIN};
+                die "decompressor read failed: $!\n";
+            }
+            last if !$read;
+            $self->{on_output}->($buffer, $self->{consumed});
+        }
+    }
+}
+
+# Analyse en flux d'une archive tar (ustar, GNU et pax)
+package PVE::Storage::S3::ArchiveIndex::TarParser {
+    
+    use constant BLOCK => 512;
+    
+    sub new {
+        my ($class, $options) = @_;
+        
+        return bless {
+            options => $options // {},
+            buffer => '',
+            position => 0,
+            state => 'header',
+            remaining => 0,
+            padding => 0,
+            current => undef,
+            long_name => undef,
+            pax_path => undef,
+            members => [],
+            finished => 0,
+        }, $class;
+    }
+    
+    sub position { return $_[0]->{position}; }
+    
+    sub feed {
+        my ($self, $data, $consumed) = @_;
+        
+        return if $self->{finished};
+        
+        $self->{buffer} .= $data;
+        
+        while (1) {
+            my $state = $self->{state};
+            
+            if ($state eq 'header') {
+                last if length($self->{buffer}) < BLOCK;
+                my $header = substr($self->{buffer}, 0, BLOCK, '');
+                $self->{position} += BLOCK;
+                $self->_parse_header($header, $consumed);
+                last if $self->{finished};
+            } elsif ($state eq 'data') {
+                last if $self->{buffer} eq '';
+                my $take = $self->{remaining} < length($self->{buffer})
+                    ? $self->{remaining} : length($self->{buffer});
+                my $chunk = substr($self->{buffer}, 0, $take, '');
+                $self->{position} += $take;
+                $self->{remaining} -= $take;
+                $self->{current}->{data} .= $chunk if defined $self->{current}->{data};
+                if (!$self->{remaining}) {
+                    $self->_member_done($consumed);
+                    $self->{state} = $self->{padding} ? 'padding' : 'header';
+                }
+            } elsif ($state eq 'padding') {
+                last if $self->{buffer} eq '';
+                my $take = $self->{padding} < length($self->{buffer})
+                    ? $self->{padding} : length($self->{buffer});
+                substr($self->{buffer}, 0, $take, '');
+                $self->{position} += $take;
+                $self->{padding} -= $take;
+                $self->{state} = 'header' if !$self->{padding};
+            }
+        }
+    }
+    
+    sub _parse_header {
+        my ($self, $header, $consumed) = @_;
+        
+        if ($header =~ /^\0+$/) {
+            $self->{finished} = 1;
+            return;
+        }
+        
+        my ($name, $size_field, $type, $magic, $prefix) = (
+            _cstring(substr($header, 0, 100)),
+            substr($header, 124, 12),
+            substr($header, 156, 1),
+            substr($header, 257, 5),
+            _cstring(substr($header, 345, 155)),
+        );
+        
+        my $size = _parse_size($size_field);
+        $name = "$prefix/$name" if $magic eq 'ustar' && $prefix ne '';
+        
+        my $member = {
+            name => $name,
+            type => $type eq "\0" ? '0' : $type,
+            header_offset => $self->{position} - BLOCK,
+            offset => $self->{position},
+            size => $size,
+        };
+        
+        # En-têtes d'extension: nom long GNU et en-tête pax
+        if ($type eq 'L' || $type eq 'x' || $type eq 'g' || $type eq 'K') {
+            $member->{data} = '';
+            $member->{extension} = $type;
+        } else {
+            $member->{name} = $self->{pax_path} // $self->{long_name} // $name;
+            $self->{pax_path} = undef;
+            $self->{long_name} = undef;
+            
+            my $capture = $self->{options}->{capture};
+            $member->{data} = '' if $capture && $capture->($member->{name});
+        }
+        
+        $self->{current} = $member;
+        $self->{remaining} = $size;
+        $self->{padding} = $size % BLOCK ? BLOCK - ($size % BLOCK) : 0;
+        $self->{state} = $size ? 'data' : 'header';
+        
+        # Membre vide terminé dès la lecture de son en-tête
+        $self->_member_done($consumed) if !$size;
+    }
+    
+    sub _member_done {
+        my ($self, $consumed) = @_;
+        
+        my $member = $self->{current};
+        $member->{stored_end} = $consumed;
+        
+        if (my $extension = delete $member->{extension}) {
+            my $data = delete $member->{data};
+            if ($extension eq 'L') {
+                $self->{long_name} = _cstring($data);
+            } elsif ($extension eq 'x') {
+                while ($data =~ /\d+ path=([^\n]*)\n/g) {
+                    $self->{pax_path} = $1;
+                }
+            }
+            return;
+        }
+        
+        $self->_record($member);
+    }
+    
+    sub _record {
+        my ($self, $member) = @_;
+        
+        if (defined(my $data = delete $member->{data})) {
+            my $on_capture = $self->{options}->{on_capture};
+            $on_capture->($member->{name}, $data) if $on_capture;
+        }
+        
+        push @{$self->{members}}, $member;
+    }
+    
+    sub result {
+        my ($self) = @_;
+        
+        return { members => $self->{members} };
+    }
+    
+    sub _cstring {
+        my ($value) = @_;
+        $value =~ s/\0.*$//s;
+        return $value;
+    }
+    
+    sub _parse_size {
+        my ($field) = @_;
+        
+        # Encodage base-256 GNU pour les fichiers > 8 Go
+        if (ord(substr($field, 0, 1)) & 0x80) {
+            my $size = ord(substr($field, 0, 1)) & 0x7f;
+            $size = $size * 256 + ord(substr($field, $_, 1)) for 1..11;
+            return $size;
+        }
+        
+        $field =~ s/[\0 ]+$//;
+        $field =~ s/^\s+//;
+        return $field eq '' ? 0 : oct($field);
+    }
+}
+
+# Analyse en flux d'une archive VMA (en-tête, configs, extents)
+package PVE::Storage::S3::ArchiveIndex::VmaParser {
+    
+    use constant {
+        EXTENT_HEADER => 512,
+        BLOCKS_PER_EXTENT => 59,
+        BLOCK_SIZE => 4096,
+    };
+    
+    sub new {
+        my ($class, $options) = @_;
+        
+        return bless {
+            options => $options // {},
+            buffer => '',
+            position => 0,
+            header_size => undef,
+            header_done => 0,
+            configs => [],
+            devices => [],
+            extents => [],
+            extent_remaining => 0,
+            extent => undef,
+        }, $class;
+    }
+    
+    sub position { return $_[0]->{position}; }
+    sub header_done { return $_[0]->{header_done}; }
+    
+    sub feed {
+        my ($self, $data, $consumed) = @_;
+        
+        $self->{buffer} .= $data;
+        
+        if (!$self->{header_done}) {
+            return if !$self->_parse_header($consumed);
+            return if $self->{options}->{header_only};
+        }
+        
+        my $track = $self->{options}->{track_extents};
+        my $on_extent = $self->{options}->{on_extent};
+        
+        # Sans consommateur d'extents, seules les positions sont relevées
+        while (length($self->{buffer}) >= EXTENT_HEADER || $self->{extent_remaining}) {
+            if (!$self->{extent_remaining}) {
+                my $header = substr($self->{buffer}, 0, EXTENT_HEADER);
+                die "invalid VMA extent at offset $self->{position}\n"
+                    if substr($header, 0, 4) ne 'VMAE';
+                
+                my $block_count = unpack('n', substr($header, 6, 2));
+                my %dev_ids;
+                foreach my $info (unpack('Q>' . BLOCKS_PER_EXTENT, substr($header, 40, BLOCKS_PER_EXTENT * 8))) {
+                    my $dev_id = ($info >> 32) & 0xff;
+                    $dev_ids{$dev_id} = 1 if $dev_id;
+                }
+                
+                my $length = EXTENT_HEADER + $block_count * BLOCK_SIZE;
+                push @{$self->{extents}}, [$self->{position}, $length, [sort { $a <=> $b } keys %dev_ids]]
+                    if $track;
+                
+                $self->{extent_remaining} = $length;
+                $self->{extent} = $on_extent ? '' : undef;
+            }
+            
+            last if $self->{buffer} eq '';
+            
+            my $take = $self->{extent_remaining} < length($self->{buffer})
+                ? $self->{extent_remaining} : length($self->{buffer});
+            my $chunk = substr($self->{buffer}, 0, $take, '');
+            $self->{extent} .= $chunk if defined $self->{extent};
+            $self->{position} += $take;
+            $self->{extent_remaining} -= $take;
+            
+            if (!$self->{extent_remaining} && defined $self->{extent}) {
+                $on_extent->($self->{extent});
+                $self->{extent} = undef;
+            }
+        }
+    }
+    
+    sub _parse_header {
+        my ($self, $consumed) = @_;
+        
+        if (!defined $self->{header_size}) {
+            return 0 if length($self->{buffer}) < 60;
+            die "invalid VMA magic\n" if substr($self->{buffer}, 0, 4) ne "VMA\0";
+            $self->{header_size} = unpack('N', substr($self->{buffer}, 56, 4));
+        }
+        
+        return 0 if length($self->{buffer}) < $self->{header_size};
+        
+        my $header = substr($self->{buffer}, 0, $self->{header_size}, '');
+        my ($blob_offset, $blob_size) = unpack('NN', substr($header, 48, 8));
+        
+        my $blob = sub {
+            my ($ptr) = @_;
+            return undef if !$ptr || $ptr + 2 > $blob_size;
+            my $pos = $blob_offset + $ptr;
+            my $len = unpack('v', substr($header, $pos, 2));
+            return ($pos + 2, $len);
+        };
+        
+        my @config_names = unpack('N256', substr($header, 2044, 1024));
+        my @config_data = unpack('N256', substr($header, 3068, 1024));
+        
+        for my $i (0..255) {
+            next if !$config_names[$i];
+            my ($name_pos, $name_len) = $blob->($config_names[$i]) or next;
+            my ($data_pos, $data_len) = $blob->($config_data[$i]) or next;
+            my $name = substr($header, $name_pos, $name_len);
+            $name =~ s/\0.*$//s;
+            my $data = substr($header, $data_pos, $data_len);
+            $data =~ s/\0$//;
+            push @{$self->{configs}}, {
+                name => $name,
+                offset => $data_pos,
+                size => length($data),
+                stored_end => $consumed,
+                data => $data,
+            };
+        }
+        
+        for my $dev_id (1..255) {
+            my $info = substr($header, 4096 + $dev_id * 32, 32);
+            my ($name_ptr, undef, $size) = unpack('NNQ>', $info);
+            next if !$name_ptr;
+            my ($name_pos, $name_len) = $blob->($name_ptr) or next;
+            my $name = substr($header, $name_pos, $name_len);
+            $name =~ s/\0.*$//s;
+            push @{$self->{devices}}, { id => $dev_id, name => $name, size => $size };
+        }
+        
+        $self->{position} = $self->{header_size};
+        $self->{header_done} = 1;
+        
+        return 1;
+    }
+    
+    sub result {
+        my ($self) = @_;
+        
+        my $result = {
+            header_size => $self->{header_size},
+            configs => [ map { my %c = %$_; delete $c{data}; \%c } @{$self->{configs}} ],
+            devices => $self->{devices},
+        };
+        $result->{extents} = $self->{extents} if $self->{options}->{track_extents};
+        
+        # Les données de config restent disponibles pour l'extraction directe
+        if ($self->{options}->{header_only}) {
+            $result->{configs} = $self->{configs};
+        }
+        
+        return $result;
+    }
+}
+
+1;
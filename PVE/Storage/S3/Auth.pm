@@ -80,8 +80,8 @@ sub sign_request {
         $headers->{'x-amz-security-token'} = $self->{session_token};
     }
     
-    # Calcul du hash du body
-    my $body_hash = sha256_hex($body);
+    # Calcul du hash du body (sauf s'il a déjà été calculé par l'appelant)
+    my $body_hash = $headers->{'x-amz-content-sha256'} // sha256_hex($body);
     $headers->{'x-amz-content-sha256'} = $body_hash;
     
     # Construction de la requête canonique
@@ -353,6 +353,8 @@ sub test_credentials {
 
 # Accesseurs
 sub access_key { return $_[0]->{access_key}; }
+sub secret_key { return $_[0]->{secret_key}; }
+sub session_token { return $_[0]->{session_token}; }
 sub has_session_token { return defined $_[0]->{session_token}; }
 sub region { return $_[0]->{region}; }
 
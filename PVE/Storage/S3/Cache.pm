@@ -0,0 +1,260 @@
+package PVE::Storage::S3::Cache;
+
+use strict;
+use warnings;
+
+use JSON;
+use Fcntl qw(:flock);
+use File::Basename qw(dirname);
+use File::Path qw(make_path);
+
+use PVE::Storage::S3::Utils qw(log_info log_warn format_bytes);
+use PVE::Storage::S3::Exception qw(S3Exception);
+
+# Cache local en lecture des ISO et templates de conteneurs
+#
+# Chaque objet est téléchargé une seule fois dans le répertoire du cache.
+# Un fichier "<fichier>.meta" conserve l'ETag de l'objet (revalidation) et
+# sa date de modification sert de date de dernier accès (éviction LRU).
+# Un verrou par entrée évite que deux démarrages simultanés téléchargent
+# le même objet: le second attend la fin du premier téléchargement.
+
+use constant {
+    META_SUFFIX => '.meta',
+    LOCK_SUFFIX => '.lock',
+    PART_SUFFIX => '.part',
+    REVALIDATE_INTERVAL => 300,
+};
+
+my $DEFAULT_CACHE_DIR = '/var/cache/pve-s3';
+
+# Constructeur
+sub new {
+    my ($class, $s3_client, $bucket, $options) = @_;
+    
+    $options //= {};
+    
+    my $self = {
+        s3_client => $s3_client,
+        bucket => $bucket,
+        dir => $options->{dir} // "$DEFAULT_CACHE_DIR/" . ($options->{storeid} // 'default'),
+        max_size => $options->{max_size} // 10 * 1024 * 1024 * 1024,
+        revalidate_interval => $options->{revalidate_interval} // REVALIDATE_INTERVAL,
+    };
+    
+    return bless $self, $class;
+}
+
+# Chemin local d'une entrée du cache
+sub local_path {
+    my ($self, $name) = @_;
+    
+    $name =~ s|^/+||;
+    die S3Exception("Invalid cache entry name: $name") if $name =~ m{(?:^|/)\.\.(?:/|$)};
+    
+    return "$self->{dir}/$name";
+}
+
+# Retourne le chemin local d'un objet, téléchargé si absent ou modifié
+sub fetch {
+    my ($self, $key, $name) = @_;
+    
+    my $file = $self->local_path($name);
+    my $meta_file = $file . META_SUFFIX;
+    
+    make_path(dirname($file), { mode => 0755 }) if !-d dirname($file);
+    
+    # Accès récent et validé: pas de requête S3
+    if (my $meta = _read_meta($meta_file)) {
+        if (-f $file && time() - ($meta->{validated} // 0) < $self->{revalidate_interval}) {
+            _touch($meta_file);
+            return $file;
+        }
+    }
+    
+    open my $lock_fh, '>>', $file . LOCK_SUFFIX
+        or die S3Exception("Cannot open cache lock for $name: $!");
+    flock($lock_fh, LOCK_EX) or die S3Exception("Cannot lock cache entry $name: $!");
+    
+    my $result = eval {
+        my $head = eval { $self->{s3_client}->head_object($self->{bucket}, $key) };
+        if (my $err = $@) {
+            # S3 injoignable: une copie locale complète reste utilisable, la
+            # revalidation sera retentée au prochain accès
+            my $meta = _read_meta($meta_file);
+            die $err if !$meta || !-f $file || -s $file != ($meta->{size} // -1);
+            
+            log_warn("Cannot revalidate s3://$self->{bucket}/$key, using cached copy: $err");
+            _touch($meta_file);
+            return $file;
+        }
+        
+        my $etag = $head->{ETag} // '';
+        my $size = $head->{ContentLength} || 0;
+        
+        # Une autre tâche a pu remplir l'entrée pendant l'attente du verrou
+        my $meta = _read_meta($meta_file);
+        if ($meta && -f $file && ($meta->{etag} // '') eq $etag && -s $file == $size) {
+            $meta->{validated} = time();
+            _write_meta($meta_file, $meta);
+            return $file;
+        }
+        
+        log_info("Cache miss for s3://$self->{bucket}/$key (" . format_bytes($size) . ")");
+        
+        $self->_make_room($size, $file);
+        
+        my $part = $file . PART_SUFFIX;
+        unlink $part;
+        $self->{s3_client}->download_file($self->{bucket}, $key, $part);
+        
+        my $downloaded = -s $part // 0;
+        if ($downloaded != $size) {
+            unlink $part;
+            die S3Exception("Size mismatch while caching $key (expected: $size, got: $downloaded)");
+        }
+        
+        unlink $meta_file;
+        rename($part, $file) or die S3Exception("Cannot install cache entry $file: $!");
+        _write_meta($meta_file, {
+            key => $key,
+            etag => $etag,
+            size => $size,
+            validated => time(),
+        });
+        
+        return $file;
+    };
+    my $err = $@;
+    
+    close $lock_fh;
+    die $err if $err;
+    
+    return $result;
+}
+
+# Suppression d'une entrée (objet supprimé ou remplacé)
+sub invalidate {
+    my ($self, $name) = @_;
+    
+    my $file = $self->local_path($name);
+    
+    open my $lock_fh, '>>', $file . LOCK_SUFFIX or return;
+    flock($lock_fh, LOCK_EX);
+    unlink $file, $file . META_SUFFIX;
+    close $lock_fh;
+}
+
+# Liste des entrées du cache (plus ancien accès en premier)
+sub entries {
+    my ($self) = @_;
+    
+    my @entries = ();
+    
+    return \@entries if !-d $self->{dir};
+    
+    require File::Find;
+    File::Find::find({
+        no_chdir => 1,
+        wanted => sub {
+            my $meta_file = $File::Find::name;
+            return if $meta_file !~ /\Q${\META_SUFFIX}\E$/ || !-f $meta_file;
+            
+            my $file = substr($meta_file, 0, -length(META_SUFFIX));
+            return if !-f $file;
+            
+            push @entries, {
+                file => $file,
+                size => -s $file,
+                atime => (stat($meta_file))[9],
+            };
+        },
+    }, $self->{dir});
+    
+    @entries = sort { $a->{atime} <=> $b->{atime} } @entries;
+    
+    return \@entries;
+}
+
+# Taille totale du cache
+sub usage {
+    my ($self) = @_;
+    
+    my $total = 0;
+    $total += $_->{size} foreach @{$self->entries()};
+    
+    return $total;
+}
+
+# Éviction LRU jusqu'à pouvoir stocker $needed octets
+sub _make_room {
+    my ($self, $needed, $current_file) = @_;
+    
+    my $max_size = $self->{max_size};
+    
+    if ($needed > $max_size) {
+        die S3Exception("Object size " . format_bytes($needed)
+            . " exceeds the cache size limit " . format_bytes($max_size));
+    }
+    
+    my $entries = $self->entries();
+    my $total = 0;
+    $total += $_->{size} foreach @$entries;
+    
+    foreach my $entry (@$entries) {
+        last if $total + $needed <= $max_size;
+        
+        # L'ancienne version de l'entrée courante va être remplacée
+        if ($entry->{file} eq $current_file) {
+            $total -= $entry->{size};
+            next;
+        }
+        
+        # Les entrées en cours d'utilisation (verrouillées) sont conservées
+        open my $lock_fh, '>>', $entry->{file} . LOCK_SUFFIX or next;
+        if (!flock($lock_fh, LOCK_EX | LOCK_NB)) {
+            close $lock_fh;
+            next;
+        }
+        
+        log_info("Evicting cache entry $entry->{file} (" . format_bytes($entry->{size}) . ")");
+        unlink $entry->{file}, $entry->{file} . META_SUFFIX;
+        $total -= $entry->{size};
+        
+        close $lock_fh;
+    }
+    
+    if ($total + $needed > $max_size) {
+        log_warn("Cache over limit: " . format_bytes($total + $needed) . " > " . format_bytes($max_size));
+    }
+}
+
+sub _read_meta {
+    my ($meta_file) = @_;
+    
+    open my $fh, '<', $meta_file or return undef;
+    my $content = do { local $/; <$fh> };
+    close $fh;
+    
+    my $meta = eval { decode_json($content) };
+    return ref($meta) eq 'HASH' ? $meta : undef;
+}
+
+sub _write_meta {
+    my ($meta_file, $meta) = @_;
+    
+    my $tmp = "$meta_file.tmp.$$";
+    open my $fh, '>', $tmp or die S3Exception("Cannot write $meta_file: $!");
+    print $fh encode_json($meta);
+    close $fh;
+    rename($tmp, $meta_file) or die S3Exception("Cannot write $meta_file: $!");
+}
+
+sub _touch {
+    my ($file) = @_;
+    
+    my $now = time();
+    utime($now, $now, $file);
+}
+
+1;
@@ -3,17 +3,12 @@ package PVE::Storage::S3::Client;
 use strict;
 use warnings;
 
-use LWP::UserAgent;
-use HTTP::Request;
-use HTTP::Response;
-use URI;
-use JSON;
-use XML::Simple;
 use Time::HiRes qw(time);
+use URI::Escape ();
 
 use PVE::Storage::S3::Auth;
 use PVE::Storage::S3::Config;
-use PVE::Storage::S3::Transfer;
+use PVE::Storage::S3::Metrics;
 use PVE::Storage::S3::Utils qw(log_info log_warn log_error);
 use PVE::Storage::S3::Exception qw(S3Exception S3ConnectionException S3BucketException handle_http_error with_retry);
 
@@ -26,21 +21,28 @@ sub new {
         auth => $auth,
         ua => undef,
         transfer_manager => undef,
+        storage => $config->get('storage_id') // $config->get('bucket') // '',
     };
     
-    bless $self, $class;
-    
-    $self->_initialize_ua();
-    $self->{transfer_manager} = PVE::Storage::S3::Transfer->new($self, $config);
+    # User agent et moteur de transfert créés au premier usage: LWP et
+    # Transfer.pm (avec ses dépendances) ne sont chargés que si nécessaire
+    return bless $self, $class;
+}
+
+# User agent HTTP
+sub _ua {
+    my ($self) = @_;
     
-    return $self;
+    return $self->{ua} //= $self->_initialize_ua();
 }
 
 # Initialisation du user agent HTTP
 sub _initialize_ua {
     my ($self) = @_;
     
-    $self->{ua} = LWP::UserAgent->new(
+    require LWP::UserAgent;
+    
+    my $ua = LWP::UserAgent->new(
         timeout => $self->{config}->get('connection_timeout'),
         agent => 'Proxmox-S3-Plugin/1.0',
         ssl_opts => {
@@ -51,11 +53,13 @@ sub _initialize_ua {
     
     # Configuration du proxy si défini
     if (my $proxy = $ENV{HTTP_PROXY}) {
-        $self->{ua}->proxy('http', $proxy);
+        $ua->proxy('http', $proxy);
     }
     if (my $proxy = $ENV{HTTPS_PROXY}) {
-        $self->{ua}->proxy('https', $proxy);
+        $ua->proxy('https', $proxy);
     }
+    
+    return $ua;
 }
 
 # Test de connectivité
@@ -133,31 +137,12 @@ sub list_objects {
     my ($self, $bucket, $prefix, $options) = @_;
     
     $options //= {};
-    $prefix //= '';
     
-    my $max_keys = $options->{max_keys} || 1000;
     my $all_objects = [];
     my $continuation_token = '';
     
     do {
-        my %params = (
-            'list-type' => '2',
-            'max-keys' => $max_keys,
-        );
-        
-        $params{prefix} = $prefix if $prefix;
-        $params{'continuation-token'} = $continuation_token if $continuation_token;
-        
-        my $query_string = $self->_build_query_string(\%params);
-        my $response = $self->_make_request('GET', "/$bucket?$query_string");
-        
-        if (!$response->is_success) {
-            die handle_http_error($response, 'list_objects');
-        }
-        
-        # Parse de la réponse XML
-        my $xml_data = $response->content;
-        my $parsed = $self->_parse_list_objects_xml($xml_data);
+        my $parsed = $self->_list_objects_page($bucket, $prefix, $continuation_token, $options);
         
         push @$all_objects, @{$parsed->{objects}};
         $continuation_token = $parsed->{next_continuation_token} || '';
@@ -167,6 +152,52 @@ sub list_objects {
     return $all_objects;
 }
 
+# Itérateur paginé sur les objets d'un bucket (sans limite de nombre)
+sub object_iterator {
+    my ($self, $bucket, $prefix, $options) = @_;
+    
+    $options //= {};
+    
+    my @buffer = ();
+    my $continuation_token = '';
+    my $done = 0;
+    
+    return sub {
+        while (!@buffer && !$done) {
+            my $parsed = $self->_list_objects_page($bucket, $prefix, $continuation_token, $options);
+            push @buffer, @{$parsed->{objects}};
+            $continuation_token = $parsed->{next_continuation_token} || '';
+            $done = 1 if !$continuation_token;
+        }
+        
+        return shift @buffer;
+    };
+}
+
+# Requête ListObjectsV2 pour une page de résultats
+sub _list_objects_page {
+    my ($self, $bucket, $prefix, $continuation_token, $options) = @_;
+    
+    my %params = (
+        'list-type' => '2',
+        'max-keys' => $options->{max_keys} || 1000,
+    );
+    
+    $params{prefix} = $prefix if $prefix;
+    $params{'continuation-token'} = $continuation_token if $continuation_token;
+    $params{'start-after'} = $options->{start_after} if $options->{start_after} && !$continuation_token;
+    
+    my $query_string = $self->_build_query_string(\%params);
+    my $response = $self->_make_request('GET', "/$bucket?$query_string");
+    
+    if (!$response->is_success) {
+        die handle_http_error($response, 'list_objects');
+    }
+    
+    # Parse de la réponse XML
+    return $self->_parse_list_objects_xml($response->content);
+}
+
 # Récupération des métadonnées d'un objet
 sub head_object {
     my ($self, $bucket, $key) = @_;
@@ -255,6 +286,80 @@ sub delete_object {
     return 1;
 }
 
+# Suppression groupée d'objets (DeleteObjects, 1000 clés par requête)
+#
+# Sans support de DeleteObjects (batch_delete 0), les objets sont supprimés
+# un par un avec le même format de résultat.
+sub delete_objects {
+    my ($self, $bucket, $keys) = @_;
+    
+    require Digest::MD5;
+    
+    my $result = { deleted => [], errors => [] };
+    my @pending = @$keys;
+    
+    if (!$self->{config}->get('batch_delete')) {
+        foreach my $key (@pending) {
+            eval { $self->delete_object($bucket, $key) };
+            if (my $err = $@) {
+                my $exception = ref($err) && $err->can('code');
+                push @{$result->{errors}}, {
+                    Key => $key,
+                    Code => $exception ? $err->code : 'Unknown',
+                    Message => $exception ? $err->message : "$err",
+                };
+                next;
+            }
+            push @{$result->{deleted}}, $key;
+        }
+        @pending = ();
+    }
+    
+    while (my @batch = splice(@pending, 0, 1000)) {
+        my $xml_content = "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n";
+        $xml_content .= "<Delete><Quiet>true</Quiet>";
+        $xml_content .= "<Object><Key>" . _xml_escape($_) . "</Key></Object>" foreach @batch;
+        $xml_content .= "</Delete>";
+        
+        my $headers = {
+            'Content-Type' => 'application/xml',
+            'Content-Length' => length($xml_content),
+            'Content-MD5' => Digest::MD5::md5_base64($xml_content) . '==',
+        };
+        
+        my $response = $self->_make_request('POST', "/$bucket?delete", $headers, $xml_content);
+        
+        if (!$response->is_success) {
+            die handle_http_error($response, 'delete_objects');
+        }
+        
+        # En mode "Quiet", seules les erreurs sont listées
+        my %failed = ();
+        my $xml = $response->content // '';
+        while ($xml =~ /<Error>(.*?)<\/Error>/gs) {
+            my $error_xml = $1;
+            my ($key) = $error_xml =~ /<Key>([^<]*)<\/Key>/;
+            my ($code) = $error_xml =~ /<Code>([^<]*)<\/Code>/;
+            my ($message) = $error_xml =~ /<Message>([^<]*)<\/Message>/;
+            next if !defined $key;
+            $key = _xml_unescape($key);
+            $failed{$key} = 1;
+            push @{$result->{errors}}, {
+                Key => $key,
+                Code => $code // 'Unknown',
+                Message => $message // '',
+            };
+        }
+        
+        push @{$result->{deleted}}, grep { !$failed{$_} } @batch;
+    }
+    
+    log_info("Objects deleted: " . scalar(@{$result->{deleted}}) . " in s3://$bucket"
+        . (@{$result->{errors}} ? ", " . scalar(@{$result->{errors}}) . " error(s)" : ''));
+    
+    return $result;
+}
+
 # Copie d'un objet
 sub copy_object {
     my ($self, $source_bucket, $source_key, $dest_bucket, $dest_key, $options) = @_;
@@ -286,6 +391,62 @@ sub copy_object {
     return { ETag => $response->header('ETag') };
 }
 
+# Copie d'un objet de plus de 5 Go (UploadPartCopy)
+#
+# Les métadonnées de l'objet source sont reprises sur la copie.
+sub copy_object_multipart {
+    my ($self, $source_bucket, $source_key, $dest_bucket, $dest_key, $options) = @_;
+    
+    $options //= {};
+    
+    die S3Exception("UploadPartCopy is not supported by this provider (upload_part_copy 0)")
+        if !$self->{config}->get('upload_part_copy');
+    
+    my $head = $self->head_object($source_bucket, $source_key);
+    my $size = $head->{ContentLength} // die S3Exception("Cannot determine size of $source_key");
+    my $part_size = $options->{part_size} || $self->{config}->get('multipart_chunk_size') || 100 * 1024 * 1024;
+    my $max_parts = $self->{config}->get('max_parts') || 10000;
+    $part_size = int($size / $max_parts) + 1 if $size / $part_size > $max_parts;
+    
+    my %metadata = ();
+    foreach my $header (keys %$head) {
+        $metadata{$1} = $head->{$header} if $header =~ /^x-amz-meta-(.+)$/;
+    }
+    
+    my $upload_id = $self->initiate_multipart_upload($dest_bucket, $dest_key, { metadata => \%metadata });
+    
+    my @parts = ();
+    eval {
+        my $part_number = 1;
+        for (my $pos = 0; $pos < $size; $pos += $part_size) {
+            my $last = $pos + $part_size - 1;
+            $last = $size - 1 if $last >= $size;
+            
+            my $url = "/$dest_bucket/$dest_key?partNumber=$part_number&uploadId=$upload_id";
+            my $response = $self->_make_request('PUT', $url, {
+                'x-amz-copy-source' => "/$source_bucket/$source_key",
+                'x-amz-copy-source-range' => "bytes=$pos-$last",
+            });
+            
+            if (!$response->is_success) {
+                die handle_http_error($response, 'upload_part_copy');
+            }
+            
+            my ($etag) = ($response->content // '') =~ /<ETag>([^<]+)<\/ETag>/;
+            die S3Exception("Cannot parse ETag of copied part $part_number") if !$etag;
+            $etag =~ s/&quot;/"/g;
+            
+            push @parts, { PartNumber => $part_number++, ETag => $etag };
+        }
+    };
+    if (my $err = $@) {
+        $self->abort_multipart_upload($dest_bucket, $dest_key, $upload_id);
+        die $err;
+    }
+    
+    return $self->complete_multipart_upload($dest_bucket, $dest_key, $upload_id, \@parts);
+}
+
 # Initiation d'un multipart upload
 sub initiate_multipart_upload {
     my ($self, $bucket, $key, $options) = @_;
@@ -301,6 +462,10 @@ sub initiate_multipart_upload {
         }
     }
     
+    # Somme de contrôle S3 des parts (x-amz-checksum-*), vérifiée par le serveur
+    my $checksum = $self->{config}->get('checksum_algorithm') // 'md5';
+    $headers->{'x-amz-checksum-algorithm'} = uc($checksum) if $checksum ne 'md5';
+    
     my $response = $self->_make_request('POST', "/$bucket/$key?uploads", $headers);
     
     if (!$response->is_success) {
@@ -318,13 +483,21 @@ sub initiate_multipart_upload {
 
 # Upload d'une part
 sub upload_part {
-    my ($self, $bucket, $key, $upload_id, $part_number, $data) = @_;
+    my ($self, $bucket, $key, $upload_id, $part_number, $data, $digests) = @_;
     
     my $headers = {
         'Content-Length' => length($data),
         'Content-Type' => 'application/octet-stream',
     };
     
+    # Empreintes déjà calculées (PVE::Storage::S3::Hash): Content-MD5 et
+    # hash de signature sans relire la part
+    if ($digests) {
+        require PVE::Storage::S3::Hash;
+        my $digest_headers = PVE::Storage::S3::Hash::request_headers($digests);
+        @$headers{keys %$digest_headers} = values %$digest_headers;
+    }
+    
     my $url = "/$bucket/$key?partNumber=$part_number&uploadId=$upload_id";
     my $response = $self->_make_request('PUT', $url, $headers, $data);
     
@@ -342,7 +515,8 @@ sub complete_multipart_upload {
     # Construction du XML des parts
     my $xml_parts = '';
     foreach my $part (@$parts) {
-        $xml_parts .= "<Part><PartNumber>$part->{PartNumber}</PartNumber><ETag>$part->{ETag}</ETag></Part>";
+        my $checksums = join('', map { "<$_>$part->{$_}</$_>" } grep { /^Checksum/ } sort keys %$part);
+        $xml_parts .= "<Part><PartNumber>$part->{PartNumber}</PartNumber><ETag>$part->{ETag}</ETag>$checksums</Part>";
     }
     
     my $xml_content = "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n";
@@ -381,14 +555,14 @@ sub abort_multipart_upload {
 sub upload_file {
     my ($self, $local_file, $bucket, $key, $options) = @_;
     
-    return $self->{transfer_manager}->upload_file($local_file, $bucket, $key, $options);
+    return $self->transfer_manager()->upload_file($local_file, $bucket, $key, $options);
 }
 
 # Interface de haut niveau pour download de fichier
 sub download_file {
     my ($self, $bucket, $key, $local_file, $options) = @_;
     
-    return $self->{transfer_manager}->download_file($bucket, $key, $local_file, $options);
+    return $self->transfer_manager()->download_file($bucket, $key, $local_file, $options);
 }
 
 # Génération d'une URL présignée
@@ -403,16 +577,23 @@ sub generate_presigned_url {
 sub _make_request {
     my ($self, $method, $uri, $headers, $content) = @_;
     
-    $headers //= {};
+    $headers = { %{$headers // {}} };
     $content //= '';
     
-    # Construction de l'URL complète
-    my $url = $self->{config}->endpoint_url() . $uri;
+    # Construction de l'URL complète (bucket dans le chemin ou dans le nom d'hôte)
+    my ($host, $path) = $self->{config}->request_target($uri);
+    my $url = $self->{config}->endpoint_url();
+    my $endpoint_host = $self->{config}->endpoint_host();
+    $url =~ s|^(https?://)\Q$endpoint_host\E|$1$host|;
+    $url .= $path;
     
-    # Signature de la requête
-    my $signed_headers = $self->{auth}->sign_request($method, $uri, $headers, $content);
+    # Signature de la requête (le Host signé est celui effectivement envoyé)
+    delete $headers->{Host};
+    $headers->{host} = $host;
+    my $signed_headers = $self->{auth}->sign_request($method, $path, $headers, $content);
     
     # Création de la requête HTTP
+    require HTTP::Request;
     my $request = HTTP::Request->new($method, $url);
     
     # Ajout des headers
@@ -423,9 +604,18 @@ sub _make_request {
     # Ajout du contenu
     $request->content($content) if $content;
     
+    my $operation = _operation_name($method, $uri, $headers);
+    
     # Envoi de la requête avec retry automatique
     return with_retry(sub {
-        my $response = $self->{ua}->request($request);
+        my $start_time = time();
+        my $response = $self->_ua()->request($request);
+        
+        PVE::Storage::S3::Metrics::record_request(
+            $self->{storage}, $operation, $response->code, time() - $start_time,
+            length($content), length(${$response->content_ref // \''}),
+            PVE::Storage::S3::Metrics::error_class($response),
+        );
         
         # Log de debug si activé
         if ($ENV{PVE_S3_DEBUG}) {
@@ -436,6 +626,34 @@ sub _make_request {
     });
 }
 
+# Nom d'opération d'une requête (métriques)
+sub _operation_name {
+    my ($method, $uri, $headers) = @_;
+    
+    my ($path, $query) = split(/\?/, $uri, 2);
+    $query //= '';
+    my $bucket_only = $path =~ m|^/[^/]*/?$|;
+    
+    if ($method eq 'GET') {
+        return 'get_range' if $headers->{Range};
+        return $bucket_only ? 'list' : 'get';
+    }
+    if ($method eq 'PUT') {
+        my $copy = $headers->{'x-amz-copy-source'};
+        return $copy ? 'copy_part' : 'put_part' if $query =~ /(?:^|&)partNumber=/;
+        return $copy ? 'copy' : $bucket_only ? 'create_bucket' : 'put';
+    }
+    if ($method eq 'POST') {
+        return 'delete_batch' if $query =~ /^delete/;
+        return $query =~ /(?:^|&)uploads/ ? 'initiate_multipart' : 'complete_multipart';
+    }
+    if ($method eq 'DELETE') {
+        return $query =~ /(?:^|&)uploadId=/ ? 'abort_multipart' : 'delete';
+    }
+    
+    return lc($method);
+}
+
 # Construction d'une query string
 sub _build_query_string {
     my ($self, $params) = @_;
@@ -514,9 +732,42 @@ sub _parse_list_objects_xml {
     };
 }
 
+sub _xml_escape {
+    my ($value) = @_;
+    
+    $value =~ s/&/&amp;/g;
+    $value =~ s/</&lt;/g;
+    $value =~ s/>/&gt;/g;
+    $value =~ s/"/&quot;/g;
+    $value =~ s/'/&apos;/g;
+    
+    return $value;
+}
+
+sub _xml_unescape {
+    my ($value) = @_;
+    
+    $value =~ s/&lt;/</g;
+    $value =~ s/&gt;/>/g;
+    $value =~ s/&quot;/"/g;
+    $value =~ s/&apos;/'/g;
+    $value =~ s/&amp;/&/g;
+    
+    return $value;
+}
+
 # Accesseurs
 sub config { return $_[0]->{config}; }
 sub auth { return $_[0]->{auth}; }
-sub transfer_manager { return $_[0]->{transfer_manager}; }
+
+# Moteur de transfert (chargé au premier transfert)
+sub transfer_manager {
+    my ($self) = @_;
+    
+    return $self->{transfer_manager} //= do {
+        require PVE::Storage::S3::Transfer;
+        PVE::Storage::S3::Transfer->new($self, $self->{config});
+    };
+}
 
 1;
\ No newline at end of file
@@ -3,7 +3,7 @@ package PVE::Storage::S3::Config;
 use strict;
 use warnings;
 
-use PVE::Storage::S3::Utils qw(log_info log_warn log_error parse_endpoint validate_bucket_name);
+use PVE::Storage::S3::Utils qw(log_info log_warn log_error parse_endpoint validate_bucket_name is_valid_key_layout);
 use PVE::Storage::S3::Exception qw(S3ConfigException);
 
 # Configuration par défaut
@@ -19,6 +19,13 @@ my %DEFAULT_CONFIG = (
     max_concurrent_uploads => 3,
     max_concurrent_downloads => 3,
     
+    # Capacités du fournisseur (profil écrit par l'installateur)
+    addressing_style => 'path',
+    max_parts => 10000,
+    batch_delete => 1,
+    upload_part_copy => 1,
+    checksum_algorithm => 'md5',
+    
     # Paramètres de sécurité
     use_ssl => 1,
     verify_ssl => 1,
@@ -26,6 +33,7 @@ my %DEFAULT_CONFIG = (
     # Paramètres de stockage
     storage_class => 'STANDARD',
     prefix => 'proxmox/',
+    key_layout => 'flat',
     
     # Paramètres de cycle de vie
     lifecycle_enabled => 0,
@@ -106,6 +114,20 @@ sub validate {
     $self->_validate_positive_integer('max_concurrent_uploads', 1, 20);
     $self->_validate_positive_integer('max_concurrent_downloads', 1, 20);
     $self->_validate_positive_integer('max_retries', 0, 10);
+    $self->_validate_positive_integer('max_parts', 1, 10000);
+    
+    # Validation des capacités du fournisseur
+    if ($config->{addressing_style} !~ /^(?:path|virtual)$/) {
+        die S3ConfigException("Invalid addressing style: $config->{addressing_style} (path or virtual)",
+            'addressing_style');
+    }
+    if ($config->{checksum_algorithm} !~ /^(?:md5|crc32|sha256)$/) {
+        die S3ConfigException("Invalid checksum algorithm: $config->{checksum_algorithm} (md5, crc32 or sha256)",
+            'checksum_algorithm');
+    }
+    if ($config->{addressing_style} eq 'virtual' && $config->{bucket} =~ /\./ && $endpoint_info->{ssl}) {
+        log_warn("Bucket name $config->{bucket} contains dots: virtual-hosted requests may fail TLS verification");
+    }
     
     # Validation de la classe de stockage
     my @valid_storage_classes = qw(
@@ -140,6 +162,11 @@ sub validate {
         }
     }
     
+    # Validation de l'organisation des clés
+    if (!is_valid_key_layout($config->{key_layout})) {
+        die S3ConfigException("Invalid key layout: $config->{key_layout} (flat or partitioned)", 'key_layout');
+    }
+    
     # Validation du cycle de vie
     if ($config->{lifecycle_enabled}) {
         $self->_validate_positive_integer('transition_days', 1, 36500);
@@ -267,9 +294,26 @@ sub multipart_config {
         chunk_size => $self->{config}->{multipart_chunk_size},
         max_concurrent => $self->{config}->{max_concurrent_uploads},
         threshold => $self->{config}->{multipart_chunk_size},  # Utilise multipart si > chunk_size
+        max_parts => $self->{config}->{max_parts},
     };
 }
 
+# Host et chemin d'une requête "/bucket/clé" selon le style d'adressage
+#
+# En style "virtual", le bucket passe dans le nom d'hôte
+# (bucket.endpoint/clé), sinon il reste en tête du chemin.
+sub request_target {
+    my ($self, $uri) = @_;
+    
+    my $host = $self->endpoint_host();
+    if ($self->{config}->{addressing_style} eq 'virtual' && $uri =~ m|^/([^/?]+)(.*)$|) {
+        my ($bucket, $rest) = ($1, $2);
+        return ("$bucket.$host", $rest =~ m|^/| ? $rest : "/$rest");
+    }
+    
+    return ($host, $uri);
+}
+
 # Configuration du cycle de vie
 sub lifecycle_config {
     my ($self) = @_;
@@ -295,6 +339,7 @@ sub to_log_string {
     push @parts, "bucket=$config->{bucket}";
     push @parts, "region=$config->{region}";
     push @parts, "prefix=$config->{prefix}";
+    push @parts, "key_layout=$config->{key_layout}";
     push @parts, "storage_class=$config->{storage_class}";
     push @parts, "ssl=" . ($self->use_ssl() ? 'yes' : 'no');
     
@@ -0,0 +1,171 @@
+package PVE::Storage::S3::DaemonClient;
+
+use strict;
+use warnings;
+
+use IO::Select;
+use IO::Socket::UNIX;
+use JSON;
+use Socket qw(SOCK_STREAM);
+
+use PVE::Storage::S3::Exception qw(S3ConnectionException S3TransferException);
+
+# Client du service de transfert partagé (pve-s3-transferd)
+#
+# Les transferts sont confiés au service du nœud, qui garde ses connexions
+# ouvertes entre les jobs et applique une limite de concurrence commune à
+# tous les processus, partagée entre classes de priorité (restore, upload,
+# backup, maintenance). Une requête JSON par connexion; le service répond par
+# des lignes JSON: événements "progress", puis "result" ou "error". La
+# configuration de connexion accompagne chaque requête (socket root
+# uniquement).
+
+use constant DEFAULT_SOCKET => '/run/pve-s3/transferd.sock';
+
+# Chemin du socket du service
+sub socket_path {
+    return $ENV{PVE_S3_TRANSFERD_SOCKET} || DEFAULT_SOCKET;
+}
+
+# Service disponible? (désactivable avec PVE_S3_NO_DAEMON=1)
+sub available {
+    return 0 if $ENV{PVE_S3_NO_DAEMON};
+    return -S socket_path() ? 1 : 0;
+}
+
+# Constructeur
+sub new {
+    my ($class, $config, $auth) = @_;
+    
+    my $self = {
+        config => $config,
+        auth => $auth,
+    };
+    
+    return bless $self, $class;
+}
+
+# Description du stockage transmise au service
+sub storage_spec {
+    my ($self) = @_;
+    
+    my $config = $self->{config};
+    
+    return {
+        endpoint => $config->endpoint_url(),
+        region => $self->{auth}->region(),
+        access_key => $self->{auth}->access_key(),
+        secret_key => $self->{auth}->secret_key(),
+        ($self->{auth}->has_session_token() ? (session_token => $self->{auth}->session_token()) : ()),
+        addressing_style => $config->get('addressing_style') // 'path',
+        verify_ssl => $config->get('verify_ssl') ? 1 : 0,
+        connection_timeout => $config->get('connection_timeout'),
+        checksum_algorithm => $config->get('checksum_algorithm') // 'md5',
+        batch_delete => $config->get('batch_delete') // 1,
+        max_parts => $config->multipart_config()->{max_parts},
+    };
+}
+
+# Envoi d'une requête et lecture des réponses jusqu'au résultat
+#
+# $handlers->{on_progress}->($transferred, $total) à chaque événement de
+# progression; $handlers->{idle}->() est appelé tant qu'il retourne vrai
+# lorsqu'aucune réponse n'est en attente (travail local en parallèle du
+# transfert).
+sub request {
+    my ($self, $request, $handlers) = @_;
+    
+    $handlers //= {};
+    
+    my $socket = IO::Socket::UNIX->new(Type => SOCK_STREAM, Peer => socket_path())
+        or die S3ConnectionException("Cannot connect to transfer daemon " . socket_path() . ": $!");
+    
+    print $socket encode_json({ %$request, storage => $self->storage_spec() }) . "\n";
+    
+    my $select = IO::Select->new($socket);
+    my $idle = $handlers->{idle};
+    my $buffer = '';
+    
+    while (1) {
+        while ($buffer =~ s/^([^\n]*)\n//) {
+            my $message = decode_json($1);
+            
+            if ($message->{event} eq 'progress') {
+                $handlers->{on_progress}->($message->{transferred}, $message->{total})
+                    if $handlers->{on_progress};
+                next;
+            }
+            
+            close $socket;
+            
+            if ($message->{event} eq 'error') {
+                die S3TransferException("Transfer daemon: $message->{message}", $request->{op},
+                    { code => $message->{code} });
+            }
+            return $message->{result};
+        }
+        
+        if ($idle && !$select->can_read(0)) {
+            $idle = undef if !$idle->();
+            next;
+        }
+        
+        my $bytes = sysread($socket, $buffer, 65536, length($buffer));
+        die S3ConnectionException("Transfer daemon connection lost: " . (defined($bytes) ? 'closed' : $!))
+            if !$bytes;
+    }
+}
+
+# Vérification que le service répond
+sub ping {
+    my ($self) = @_;
+    
+    return $self->request({ op => 'ping' });
+}
+
+# Upload d'un fichier local
+sub upload {
+    my ($self, $local_file, $bucket, $key, $options, $handlers) = @_;
+    
+    return $self->request({
+        op => 'upload',
+        file => $local_file,
+        bucket => $bucket,
+        key => $key,
+        part_size => $options->{part_size},
+        max_concurrent => $options->{max_concurrent},
+        headers => $options->{headers} // {},
+        ($options->{priority} ? (priority => $options->{priority}) : ()),
+    }, $handlers);
+}
+
+# Download vers un fichier local
+sub download {
+    my ($self, $bucket, $key, $local_file, $options, $handlers) = @_;
+    
+    return $self->request({
+        op => 'download',
+        file => $local_file,
+        bucket => $bucket,
+        key => $key,
+        part_size => $options->{part_size},
+        max_concurrent => $options->{max_concurrent},
+        ($options->{priority} ? (priority => $options->{priority}) : ()),
+    }, $handlers);
+}
+
+# Liste des objets (ListObjectsV2)
+sub list_objects {
+    my ($self, $bucket, $prefix, $limit) = @_;
+    
+    return $self->request({ op => 'list', bucket => $bucket, prefix => $prefix, limit => $limit })->{objects};
+}
+
+# Suppression groupée
+sub delete_objects {
+    my ($self, $bucket, $keys) = @_;
+    
+    return $self->request({ op => 'delete', bucket => $bucket, keys => $keys });
+}
+
+1;
@@ -11,6 +11,9 @@ our @EXPORT_OK = qw(
     S3BucketException
     S3TransferException
     S3ConfigException
+    handle_http_error
+    with_retry
+    log_exception
 );
 
 # Exception de base S3
@@ -63,7 +66,7 @@ package PVE::Storage::S3::Exception::Base {
 
 # Exception générique S3
 package PVE::Storage::S3::Exception {
-    use parent 'PVE::Storage::S3::Exception::Base';
+    use parent -norequire, 'PVE::Storage::S3::Exception::Base';
     
     sub new {
         my ($class, $message, $details) = @_;
@@ -73,7 +76,7 @@ package PVE::Storage::S3::Exception {
 
 # Exception de connexion S3
 package PVE::Storage::S3::Exception::Connection {
-    use parent 'PVE::Storage::S3::Exception::Base';
+    use parent -norequire, 'PVE::Storage::S3::Exception::Base';
     
     sub new {
         my ($class, $message, $details) = @_;
@@ -83,7 +86,7 @@ package PVE::Storage::S3::Exception::Connection {
 
 # Exception d'authentification S3
 package PVE::Storage::S3::Exception::Auth {
-    use parent 'PVE::Storage::S3::Exception::Base';
+    use parent -norequire, 'PVE::Storage::S3::Exception::Base';
     
     sub new {
         my ($class, $message, $details) = @_;
@@ -93,7 +96,7 @@ package PVE::Storage::S3::Exception::Auth {
 
 # Exception de bucket S3
 package PVE::Storage::S3::Exception::Bucket {
-    use parent 'PVE::Storage::S3::Exception::Base';
+    use parent -norequire, 'PVE::Storage::S3::Exception::Base';
     
     sub new {
         my ($class, $message, $bucket_name, $details) = @_;
@@ -105,7 +108,7 @@ package PVE::Storage::S3::Exception::Bucket {
 
 # Exception de transfert S3
 package PVE::Storage::S3::Exception::Transfer {
-    use parent 'PVE::Storage::S3::Exception::Base';
+    use parent -norequire, 'PVE::Storage::S3::Exception::Base';
     
     sub new {
         my ($class, $message, $operation, $details) = @_;
@@ -117,7 +120,7 @@ package PVE::Storage::S3::Exception::Transfer {
 
 # Exception de configuration S3
 package PVE::Storage::S3::Exception::Config {
-    use parent 'PVE::Storage::S3::Exception::Base';
+    use parent -norequire, 'PVE::Storage::S3::Exception::Base';
     
     sub new {
         my ($class, $message, $config_key, $details) = @_;
@@ -243,9 +246,9 @@ sub with_retry {
     while ($attempt < $max_attempts) {
         $attempt++;
         
-        eval {
-            return $operation->();
-        };
+        my @result = eval { wantarray ? $operation->() : scalar($operation->()) };
+        
+        return wantarray ? @result : $result[0] if !$@;
         
         if ($@) {
             $last_exception = $@;
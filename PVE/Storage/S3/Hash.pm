@@ -0,0 +1,131 @@
+package PVE::Storage::S3::Hash;
+
+use strict;
+use warnings;
+
+use Digest::MD5;
+use Digest::SHA;
+use MIME::Base64 qw(encode_base64);
+
+use PVE::Storage::S3::Exception qw(S3Exception);
+
+# Calcul des empreintes en une seule lecture
+#
+# Les données ne sont lues qu'une fois: MD5, SHA-256 et CRC32 (optionnel)
+# sont calculés sur le même tampon, puis transmis à la signature
+# (x-amz-content-sha256), à l'en-tête Content-MD5 et au manifeste
+# d'intégrité. L'ETag composite ("md5 des md5 des parts"-N) d'un upload
+# multipart peut être calculé sans relire le fichier.
+
+use constant READ_SIZE => 8 * 1024 * 1024;
+
+# Empreintes d'un bloc de données en mémoire
+#
+# Options: crc32, ou checksum (md5, crc32, sha256: algorithme de
+# checksum_algorithm). Retourne md5 (hex), md5_base64 (Content-MD5), sha256
+# (hex), et selon les options crc32 ou sha256_base64 (base64, format
+# x-amz-checksum-*).
+sub digest_data {
+    my ($data, $options) = @_;
+    
+    my $md5 = Digest::MD5::md5($data);
+    
+    my $digests = {
+        size => length($data),
+        md5 => unpack('H*', $md5),
+        md5_base64 => encode_base64($md5, ''),
+        sha256 => Digest::SHA::sha256_hex($data),
+    };
+    
+    my $checksum = $options && $options->{checksum} // '';
+    if ($options && ($options->{crc32} || $checksum eq 'crc32')) {
+        require Compress::Raw::Zlib;
+        $digests->{crc32} = encode_base64(pack('N', Compress::Raw::Zlib::crc32($data)), '');
+    }
+    $digests->{sha256_base64} = encode_base64(pack('H*', $digests->{sha256}), '') if $checksum eq 'sha256';
+    
+    return $digests;
+}
+
+# En-têtes de requête correspondant aux empreintes d'un corps
+sub request_headers {
+    my ($digests) = @_;
+    
+    my $headers = {
+        'Content-MD5' => $digests->{md5_base64},
+        'x-amz-content-sha256' => $digests->{sha256},
+    };
+    $headers->{'x-amz-checksum-crc32'} = $digests->{crc32} if $digests->{crc32};
+    $headers->{'x-amz-checksum-sha256'} = $digests->{sha256_base64} if $digests->{sha256_base64};
+    
+    return $headers;
+}
+
+# Somme de contrôle d'une part pour CompleteMultipartUpload ({ChecksumCRC32 => ...})
+sub part_checksums {
+    my ($digests) = @_;
+    
+    my $checksums = {};
+    $checksums->{ChecksumCRC32} = $digests->{crc32} if $digests->{crc32};
+    $checksums->{ChecksumSHA256} = $digests->{sha256_base64} if $digests->{sha256_base64};
+    
+    return $checksums;
+}
+
+# ETag composite d'un upload multipart à partir des MD5 (hex) des parts
+sub composite_etag {
+    my ($part_md5s) = @_;
+    
+    return undef if !@$part_md5s;
+    
+    return Digest::MD5::md5_hex(join('', map { pack('H*', $_) } @$part_md5s)) . '-' . scalar(@$part_md5s);
+}
+
+# ETag sans guillemets, en minuscules
+sub normalize_etag {
+    my ($etag) = @_;
+    
+    $etag //= '';
+    $etag =~ s/&quot;|"//g;
+    
+    return lc($etag);
+}
+
+# Empreintes d'un fichier
+#
+# MD5 et SHA-256 (et CRC32 avec l'option crc32) du fichier entier, en une
+# seule lecture.
+sub hash_file {
+    my ($file, $options) = @_;
+    
+    $options //= {};
+    
+    open my $fh, '<:raw', $file or die S3Exception("Cannot open $file: $!");
+    
+    my $md5 = Digest::MD5->new();
+    my $sha256 = Digest::SHA->new(256);
+    my $crc;
+    require Compress::Raw::Zlib if $options->{crc32};
+    
+    my $size = 0;
+    while (my $read = read($fh, my $buffer, READ_SIZE)) {
+        $md5->add($buffer);
+        $sha256->add($buffer);
+        $crc = Compress::Raw::Zlib::crc32($buffer, $crc) if $options->{crc32};
+        $size += $read;
+    }
+    close $fh;
+    
+    my $digest = $md5->digest();
+    my $result = {
+        size => $size,
+        md5 => unpack('H*', $digest),
+        md5_base64 => encode_base64($digest, ''),
+        sha256 => $sha256->hexdigest(),
+    };
+    $result->{crc32} = encode_base64(pack('N', $crc // 0), '') if $options->{crc32};
+    
+    return $result;
+}
+
+1;
@@ -0,0 +1,461 @@
+package PVE::Storage::S3::Integrity;
+
+use strict;
+use warnings;
+
+use JSON;
+use Digest::MD5;
+use Digest::SHA;
+use Time::HiRes qw(time sleep);
+
+use PVE::Storage::S3::Utils qw(log_info log_warn);
+use PVE::Storage::S3::Exception qw(S3Exception);
+use PVE::Storage::S3::WorkerPool;
+use PVE::Storage::S3::Hash;
+
+# Vérification d'intégrité des objets stockés
+#
+# Chaque upload enregistre un manifeste "<clé>.manifest.json" contenant le
+# SHA-256 de chaque part. La vérification relit les parts par requêtes
+# range en parallèle et compare les empreintes. Sans manifeste, le MD5 de
+# l'ETag (upload simple) est utilisé, ou à défaut une simple relecture.
+
+use constant {
+    MANIFEST_VERSION => 1,
+    MANIFEST_SUFFIX => '.manifest.json',
+    DEFAULT_PART_SIZE => 64 * 1024 * 1024,
+    STREAM_CHUNK_SIZE => 8 * 1024 * 1024,
+};
+
+# Clé de l'objet annexe contenant le manifeste
+sub manifest_key {
+    my ($key) = @_;
+    
+    return $key . MANIFEST_SUFFIX;
+}
+
+# Création d'un manifeste construit pendant l'upload
+sub new_manifest {
+    my ($part_size) = @_;
+    
+    return PVE::Storage::S3::Integrity::Manifest->new($part_size || DEFAULT_PART_SIZE);
+}
+
+# Enregistrement du manifeste comme objet annexe
+sub store_manifest {
+    my ($client, $bucket, $key, $manifest) = @_;
+    
+    $client->put_object($bucket, manifest_key($key), encode_json($manifest), {
+        'Content-Type' => 'application/json',
+    });
+}
+
+# Lecture du manifeste d'un objet (undef si absent)
+sub fetch_manifest {
+    my ($client, $bucket, $key) = @_;
+    
+    my $content = eval { $client->get_object($bucket, manifest_key($key)) };
+    if ($@) {
+        my $err = $@;
+        return undef if ref($err) && $err->can('details') && ($err->details->{http_code} // 0) == 404;
+        die $err;
+    }
+    
+    my $manifest = eval { decode_json($content) };
+    if ($@ || ref($manifest) ne 'HASH' || ($manifest->{version} // 0) != MANIFEST_VERSION) {
+        log_warn("Ignoring invalid manifest for s3://$bucket/$key");
+        return undef;
+    }
+    
+    return $manifest;
+}
+
+# Découpage de la vérification d'un objet en tâches (une par part)
+sub plan_object {
+    my ($client, $bucket, $object) = @_;
+    
+    my $key = $object->{Key};
+    my $size = $object->{Size} // 0;
+    my $plan = { key => $key, size => $size, tasks => [] };
+    
+    if (my $manifest = fetch_manifest($client, $bucket, $key)) {
+        $plan->{mode} = 'sha256';
+        if (($manifest->{size} // -1) != $size) {
+            $plan->{error} = "size mismatch (manifest: $manifest->{size}, object: $size)";
+            return $plan;
+        }
+        my $etag = _clean_etag($object->{ETag});
+        if ($manifest->{composite_etag} && $etag =~ /^[0-9a-f]{32}-\d+$/ && $etag ne $manifest->{composite_etag}) {
+            $plan->{error} = "ETag mismatch (manifest: $manifest->{composite_etag}, object: $etag)";
+            return $plan;
+        }
+        foreach my $part (@{$manifest->{parts}}) {
+            push @{$plan->{tasks}}, {
+                key => $key,
+                part => $part->{number},
+                offset => $part->{offset},
+                size => $part->{size},
+                algorithm => 'sha256',
+                expected => $part->{sha256},
+            };
+        }
+        return $plan;
+    }
+    
+    my $etag = _clean_etag($object->{ETag});
+    if ($etag =~ /^[0-9a-f]{32}$/) {
+        # Upload simple: l'ETag est le MD5 de l'objet complet
+        $plan->{mode} = 'md5';
+        push @{$plan->{tasks}}, {
+            key => $key,
+            part => 1,
+            offset => 0,
+            size => $size,
+            algorithm => 'md5',
+            expected => $etag,
+        };
+        return $plan;
+    }
+    
+    # Aucune empreinte disponible: relecture complète uniquement
+    $plan->{mode} = 'read';
+    my $number = 0;
+    for (my $offset = 0; $offset < $size; $offset += DEFAULT_PART_SIZE) {
+        my $part_size = $size - $offset < DEFAULT_PART_SIZE ? $size - $offset : DEFAULT_PART_SIZE;
+        push @{$plan->{tasks}}, {
+            key => $key,
+            part => ++$number,
+            offset => $offset,
+            size => $part_size,
+        };
+    }
+    
+    return $plan;
+}
+
+# Vérification d'une part (exécutée dans un processus du pool)
+sub verify_part {
+    my ($client, $bucket, $task, $rate) = @_;
+    
+    my $digest = !$task->{algorithm} ? undef
+        : $task->{algorithm} eq 'md5' ? Digest::MD5->new()
+        : Digest::SHA->new(256);
+    
+    my $start_time = time();
+    my $read = 0;
+    my $end = $task->{offset} + $task->{size};
+    
+    for (my $pos = $task->{offset}; $pos < $end; $pos += STREAM_CHUNK_SIZE) {
+        my $last = $pos + STREAM_CHUNK_SIZE - 1;
+        $last = $end - 1 if $last >= $end;
+        
+        my $data = $client->get_object_range($bucket, $task->{key}, $pos, $last);
+        my $expected = $last - $pos + 1;
+        die "short read at offset $pos (" . length($data) . "/$expected bytes)\n"
+            if length($data) != $expected;
+        
+        $digest->add($data) if $digest;
+        $read += $expected;
+        
+        # Limitation de débit (budget d'I/O)
+        if ($rate) {
+            my $delay = $read / $rate - (time() - $start_time);
+            sleep($delay) if $delay > 0;
+        }
+    }
+    
+    my $result = { bytes => $read, ok => 1 };
+    
+    if ($digest) {
+        $result->{digest} = $digest->hexdigest();
+        $result->{ok} = $result->{digest} eq $task->{expected} ? 1 : 0;
+    }
+    
+    return $result;
+}
+
+# Vérification complète d'un objet (parts en parallèle)
+sub verify_object {
+    my ($client, $bucket, $key, $options) = @_;
+    
+    my $head = $client->head_object($bucket, $key);
+    my $object = {
+        Key => $key,
+        Size => $head->{ContentLength} // 0,
+        ETag => $head->{ETag},
+    };
+    
+    my $report;
+    my $iterator = do {
+        my @objects = ($object);
+        sub { shift @objects };
+    };
+    
+    verify_objects($client, $bucket, $iterator, {
+        %{$options // {}},
+        on_object => sub { $report = $_[0]; },
+    });
+    
+    return $report;
+}
+
+# Vérification d'une suite d'objets
+#
+# Options: workers, bwlimit (octets/s, total), max_bytes (budget de lecture),
+# on_object (résultat de chaque objet, dans l'ordre de l'itérateur),
+# should_stop (interruption). Retourne le dernier objet entièrement vérifié
+# (curseur de reprise) et indique si l'itérateur a été épuisé.
+sub verify_objects {
+    my ($client, $bucket, $iterator, $options) = @_;
+    
+    $options //= {};
+    
+    my $workers = $options->{workers} || 4;
+    my $rate = $options->{bwlimit} ? $options->{bwlimit} / $workers : 0;
+    my $max_bytes = $options->{max_bytes};
+    
+    my @pending_objects = ();
+    my @queue = ();
+    my $scheduled_bytes = 0;
+    my $exhausted = 0;
+    my $stop_reason;
+    my $cursor;
+    my %summary = (objects => 0, ok => 0, corrupt => 0, unverified => 0, error => 0, bytes => 0);
+    
+    # Publication des objets terminés, dans l'ordre de parcours
+    my $flush = sub {
+        while (@pending_objects && !$pending_objects[0]->{remaining}) {
+            my $report = _object_report(shift @pending_objects);
+            $summary{objects}++;
+            $summary{$report->{status}}++;
+            $cursor = $report->{key};
+            $options->{on_object}->($report) if $options->{on_object};
+        }
+    };
+    
+    my $next_task = sub {
+        while (!@queue) {
+            if ($options->{should_stop} && $options->{should_stop}->()) {
+                $stop_reason //= 'interrupted';
+                return undef;
+            }
+            if (defined $max_bytes && $scheduled_bytes >= $max_bytes) {
+                $stop_reason //= 'budget';
+                return undef;
+            }
+            
+            my $object = $iterator->();
+            if (!$object) {
+                $exhausted = 1;
+                return undef;
+            }
+            
+            my $plan = eval { plan_object($client, $bucket, $object) };
+            $plan = { key => $object->{Key}, size => $object->{Size}, tasks => [], error => "$@" } if $@;
+            
+            my $state = {
+                plan => $plan,
+                remaining => scalar(@{$plan->{tasks}}),
+                failed_parts => [],
+                bytes => 0,
+                errors => [],
+            };
+            push @pending_objects, $state;
+            
+            foreach my $task (@{$plan->{tasks}}) {
+                $task->{state} = $state;
+                $scheduled_bytes += $task->{size};
+                push @queue, $task;
+            }
+            
+            $flush->() if !$state->{remaining};
+        }
+        
+        return shift @queue;
+    };
+    
+    my $pool = PVE::Storage::S3::WorkerPool->new({ workers => $workers });
+    $pool->run($next_task, sub {
+        my ($task) = @_;
+        return verify_part($client, $bucket, $task, $rate);
+    }, sub {
+        my ($task, $result, $error) = @_;
+        
+        my $state = $task->{state};
+        $state->{remaining}--;
+        
+        if ($error) {
+            chomp $error;
+            push @{$state->{errors}}, "part $task->{part}: $error";
+        } else {
+            $state->{bytes} += $result->{bytes};
+            $summary{bytes} += $result->{bytes};
+            push @{$state->{failed_parts}}, $task->{part} if !$result->{ok};
+        }
+        
+        $flush->();
+    });
+    
+    $flush->();
+    
+    return {
+        complete => $exhausted && !$stop_reason ? 1 : 0,
+        stop_reason => $stop_reason,
+        cursor => $cursor,
+        summary => \%summary,
+    };
+}
+
+sub _object_report {
+    my ($state) = @_;
+    
+    my $plan = $state->{plan};
+    my $report = {
+        key => $plan->{key},
+        size => $plan->{size},
+        mode => $plan->{mode},
+        parts => scalar(@{$plan->{tasks}}),
+        bytes_read => $state->{bytes},
+    };
+    
+    if ($plan->{error}) {
+        $report->{status} = $plan->{mode} ? 'corrupt' : 'error';
+        $report->{message} = $plan->{error};
+    } elsif (@{$state->{errors}}) {
+        $report->{status} = 'error';
+        $report->{message} = join('; ', @{$state->{errors}});
+    } elsif (@{$state->{failed_parts}}) {
+        $report->{status} = 'corrupt';
+        $report->{failed_parts} = [sort { $a <=> $b } @{$state->{failed_parts}}];
+        $report->{message} = "checksum mismatch in part(s) " . join(', ', @{$report->{failed_parts}});
+    } else {
+        $report->{status} = $plan->{mode} eq 'read' ? 'unverified' : 'ok';
+    }
+    
+    return $report;
+}
+
+sub _clean_etag {
+    my ($etag) = @_;
+    
+    return PVE::Storage::S3::Hash::normalize_etag($etag);
+}
+
+# Construction incrémentale d'un manifeste (SHA-256 par part)
+package PVE::Storage::S3::Integrity::Manifest {
+    
+    use Digest::SHA;
+    
+    sub new {
+        my ($class, $part_size) = @_;
+        
+        return bless {
+            part_size => $part_size,
+            parts => [],
+            size => 0,
+            current => Digest::SHA->new(256),
+            current_size => 0,
+        }, $class;
+    }
+    
+    # Ajout de données (dans l'ordre de l'objet)
+    #
+    # $digests (PVE::Storage::S3::Hash::digest_data) évite de hacher une
+    # seconde fois un bloc qui correspond exactement à une part.
+    sub add {
+        my ($self, $data, $digests) = @_;
+        
+        my $length = length($data);
+        
+        if ($digests && !$self->{current_size} && !$self->{pending} && $length <= $self->{part_size}) {
+            $self->{size} += $length;
+            if ($length == $self->{part_size}) {
+                $self->_push_part($length, $digests);
+            } else {
+                # Dernière part probable: données gardées au cas où la suite arrive
+                $self->{pending} = [ $data, $digests ];
+            }
+            return;
+        }
+        
+        if (my $pending = delete $self->{pending}) {
+            $self->{size} -= length($pending->[0]);
+            $self->add($pending->[0]);
+        }
+        
+        my $offset = 0;
+        
+        while ($offset < $length) {
+            my $room = $self->{part_size} - $self->{current_size};
+            my $take = $length - $offset < $room ? $length - $offset : $room;
+            
+            $self->{current}->add(substr($data, $offset, $take));
+            $self->{current_size} += $take;
+            $offset += $take;
+            
+            $self->_close_part() if $self->{current_size} == $self->{part_size};
+        }
+        
+        $self->{size} += $length;
+    }
+    
+    # Ajout d'une part dont les empreintes sont déjà connues (parts envoyées
+    # par le service de transfert), sans les données
+    sub add_part {
+        my ($self, $size, $digests) = @_;
+        
+        $self->{size} += $size;
+        $self->_push_part($size, $digests);
+    }
+    
+    # Finalisation: retourne la structure à enregistrer
+    sub finish {
+        my ($self, $etag) = @_;
+        
+        if (my $pending = delete $self->{pending}) {
+            $self->_push_part(length($pending->[0]), $pending->[1]);
+        }
+        $self->_close_part() if $self->{current_size} || !@{$self->{parts}};
+        
+        my $manifest = {
+            version => PVE::Storage::S3::Integrity::MANIFEST_VERSION(),
+            algorithm => 'sha256',
+            size => $self->{size},
+            part_size => $self->{part_size},
+            etag => $etag,
+            parts => $self->{parts},
+        };
+        
+        # ETag composite attendu quand le MD5 de chaque part est connu
+        if (!grep { !$_->{md5} } @{$self->{parts}}) {
+            $manifest->{composite_etag} = PVE::Storage::S3::Hash::composite_etag(
+                [ map { $_->{md5} } @{$self->{parts}} ]);
+        }
+        
+        return $manifest;
+    }
+    
+    sub _close_part {
+        my ($self) = @_;
+        
+        $self->_push_part($self->{current_size}, { sha256 => $self->{current}->hexdigest() });
+        
+        $self->{current} = Digest::SHA->new(256);
+        $self->{current_size} = 0;
+    }
+    
+    sub _push_part {
+        my ($self, $size, $digests) = @_;
+        
+        my $number = scalar(@{$self->{parts}}) + 1;
+        push @{$self->{parts}}, {
+            number => $number,
+            offset => ($number - 1) * $self->{part_size},
+            size => $size,
+            sha256 => $digests->{sha256},
+            ($digests->{md5} ? (md5 => $digests->{md5}) : ()),
+        };
+    }
+}
+
+1;
@@ -0,0 +1,199 @@
+package PVE::Storage::S3::Logger;
+
+use strict;
+use warnings;
+
+use POSIX qw(strftime);
+use Time::HiRes ();
+
+# Journal du plugin (/var/log/pve/storage-s3.log)
+#
+# Le fichier reste ouvert. Pendant une opération (voir batch()), les lignes
+# sont accumulées dans un tampon, écrit quand la plus ancienne a
+# FLUSH_INTERVAL secondes, quand il dépasse FLUSH_SIZE, à chaque erreur et
+# à la fin de l'opération; hors opération, chaque ligne est écrite
+# immédiatement. Rien ne reste donc en attente dans un processus PVE inactif
+# (pvedaemon, pvestatd) ni dans un worker terminé par POSIX::_exit, qui
+# n'exécute pas les blocs END. Le niveau est vérifié avant tout formatage.
+# Le fichier est rouvert quand il a été remplacé (rotation par logrotate);
+# le module n'installe aucun gestionnaire de signal dans les processus qui
+# le chargent.
+#
+# Format "text" (par défaut) ou "json" (une ligne JSON par message, avec
+# l'operation_id du contexte courant).
+
+use constant {
+    FLUSH_INTERVAL => 1,
+    FLUSH_SIZE => 64 * 1024,
+    REOPEN_CHECK_INTERVAL => 5,
+};
+
+our %LEVELS = (
+    DEBUG => 0,
+    INFO => 1,
+    WARN => 2,
+    ERROR => 3,
+);
+
+# Champs ajoutés aux messages JSON (ex: local $CONTEXT{operation_id})
+our %CONTEXT = ();
+
+# Opérations en cours (mise en tampon active)
+our $BATCH_DEPTH = 0;
+
+my %config = (
+    file => '/var/log/pve/storage-s3.log',
+    format => lc($ENV{PVE_S3_LOG_FORMAT} // 'text'),
+);
+
+our $MIN_LEVEL = $LEVELS{uc($ENV{PVE_S3_LOG_LEVEL} // 'INFO')} // $LEVELS{INFO};
+
+my $fh;
+my $inode = '';
+my $buffer = '';
+my $buffer_pid = $$;
+my $buffer_since = 0;
+my $last_reopen_check = 0;
+my $json;
+
+my $last_second = -1;
+my $timestamp = '';
+
+END {
+    flush();
+}
+
+# Configuration (file, format, level)
+sub configure {
+    my ($params) = @_;
+    
+    flush();
+    
+    if (defined $params->{file} && $params->{file} ne $config{file}) {
+        $config{file} = $params->{file};
+        _close();
+    }
+    $config{format} = lc($params->{format}) if defined $params->{format};
+    $MIN_LEVEL = $LEVELS{uc($params->{level})} // $MIN_LEVEL if defined $params->{level};
+}
+
+# Mise en tampon jusqu'à la fin de l'opération en cours
+#
+#     my $log_batch = PVE::Storage::S3::Logger::batch();
+#
+# Le tampon est écrit quand le dernier objet retourné est détruit (sortie
+# de la portée, y compris sur exception).
+sub batch {
+    $BATCH_DEPTH++;
+    
+    return bless { pid => $$ }, 'PVE::Storage::S3::Logger::Batch';
+}
+
+# Écriture du tampon si sa plus ancienne ligne a FLUSH_INTERVAL secondes
+# (appelé pendant les longues attentes d'une opération)
+sub flush_if_due {
+    flush() if $buffer ne '' && Time::HiRes::time() - $buffer_since >= FLUSH_INTERVAL;
+}
+
+# Niveau actif
+sub is_enabled {
+    my ($level) = @_;
+    
+    return ($LEVELS{$level} // $LEVELS{INFO}) >= $MIN_LEVEL;
+}
+
+# Ajout d'un message au journal
+sub log_message {
+    my ($level, $message, $fields) = @_;
+    
+    return if ($LEVELS{$level} // $LEVELS{INFO}) < $MIN_LEVEL;
+    
+    # Processus fils (fork): le tampon hérité appartient au parent
+    if ($buffer_pid != $$) {
+        $buffer = '';
+        $buffer_pid = $$;
+    }
+    
+    my $now = Time::HiRes::time();
+    $buffer_since = $now if $buffer eq '';
+    my $second = int($now);
+    if ($second != $last_second) {
+        $timestamp = strftime('%Y-%m-%d %H:%M:%S', localtime($second));
+        $last_second = $second;
+    }
+    
+    if ($config{format} eq 'json') {
+        $json //= do { require JSON; JSON->new->canonical };
+        $buffer .= $json->encode({
+            %CONTEXT,
+            ($fields ? %$fields : ()),
+            time => $timestamp,
+            level => $level,
+            pid => $$,
+            message => "$message",
+        }) . "\n";
+    } else {
+        my $operation_id = $fields && $fields->{operation_id} // $CONTEXT{operation_id};
+        $buffer .= "[$timestamp] [$level] [$$] $message"
+            . (defined($operation_id) && index($message, $operation_id) < 0 ? " (op: $operation_id)" : '')
+            . "\n";
+    }
+    
+    flush() if !$BATCH_DEPTH || $level eq 'ERROR' || length($buffer) >= FLUSH_SIZE
+        || $now - $buffer_since >= FLUSH_INTERVAL;
+}
+
+# Écriture du tampon dans le fichier
+sub flush {
+    return if $buffer eq '' || $buffer_pid != $$;
+    
+    my $now = Time::HiRes::time();
+    
+    # Fichier remplacé ou supprimé (rotation)
+    if ($fh && $now - $last_reopen_check >= REOPEN_CHECK_INTERVAL) {
+        $last_reopen_check = $now;
+        my @stat = stat($config{file});
+        _close() if !@stat || "$stat[0]:$stat[1]" ne $inode;
+    }
+    
+    if (!$fh && !_open()) {
+        # Fallback vers la sortie d'erreur
+        print STDERR $buffer;
+        $buffer = '';
+        return;
+    }
+    
+    syswrite($fh, $buffer);
+    $buffer = '';
+}
+
+sub _open {
+    open($fh, '>>', $config{file}) or return 0;
+    
+    my @stat = stat($fh);
+    $inode = "$stat[0]:$stat[1]";
+    $last_reopen_check = Time::HiRes::time();
+    
+    return 1;
+}
+
+sub _close {
+    close($fh) if $fh;
+    $fh = undef;
+    $inode = '';
+}
+
+# Fin d'une opération: écriture du tampon à la sortie de la dernière
+package PVE::Storage::S3::Logger::Batch {
+    sub DESTROY {
+        my ($self) = @_;
+        
+        # Copie héritée par un processus fils
+        return if $self->{pid} != $$;
+        
+        $PVE::Storage::S3::Logger::BATCH_DEPTH--;
+        PVE::Storage::S3::Logger::flush() if !$PVE::Storage::S3::Logger::BATCH_DEPTH;
+    }
+}
+
+1;
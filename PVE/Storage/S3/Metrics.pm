@@ -0,0 +1,245 @@
+package PVE::Storage::S3::Metrics;
+
+use strict;
+use warnings;
+
+use Fcntl qw(:flock);
+use Time::HiRes ();
+
+use PVE::Storage::S3::Utils qw(log_warn);
+
+# Métriques des opérations S3 (format texte Prometheus)
+#
+# Les requêtes et transferts sont agrégés en mémoire (compteurs et
+# histogrammes de latence par opération et par stockage), puis ajoutés
+# périodiquement au fichier lu par le collecteur "textfile" de
+# node_exporter. Plusieurs processus (pvestatd, vzdump, pool de workers)
+# écrivent le même fichier: chaque écriture relit les valeurs, y ajoute les
+# nouvelles et remplace le fichier atomiquement, sous verrou.
+
+use constant {
+    FLUSH_INTERVAL => 15,
+    FILE_NAME => 'pve-s3.prom',
+};
+
+# Bornes des histogrammes de latence (secondes)
+our @LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120);
+
+our $DIRECTORY = $ENV{PVE_S3_METRICS_DIR} // '/var/lib/prometheus/node-exporter';
+
+my %FAMILIES = (
+    pve_s3_requests_total => [ 'counter', 'S3 requests by operation and HTTP status class' ],
+    pve_s3_request_errors_total => [ 'counter', 'Failed S3 requests by operation and error class' ],
+    pve_s3_request_bytes_total => [ 'counter', 'Bytes sent and received by S3 requests' ],
+    pve_s3_request_duration_seconds => [ 'histogram', 'S3 request latency' ],
+    pve_s3_transfers_total => [ 'counter', 'Uploads and downloads by result' ],
+    pve_s3_transfer_bytes_total => [ 'counter', 'Bytes moved by completed uploads and downloads' ],
+    pve_s3_transfer_duration_seconds_total => [ 'counter', 'Time spent in completed uploads and downloads' ],
+);
+
+my %counters = ();
+my %histograms = ();
+my $owner_pid = $$;
+my $last_flush = Time::HiRes::time();
+
+END {
+    flush();
+}
+
+# Enregistrement d'une requête S3
+#
+# $class: undef en cas de succès, sinon classe d'erreur (voir error_class).
+sub record_request {
+    my ($storage, $operation, $status, $duration, $sent, $received, $class) = @_;
+    
+    _check_owner();
+    
+    my $labels = _labels(storage => $storage, operation => $operation);
+    my $status_class = $status ? int($status / 100) . 'xx' : 'none';
+    
+    $counters{"pve_s3_requests_total\t" . _labels(storage => $storage, operation => $operation, status => $status_class)}++;
+    $counters{"pve_s3_request_errors_total\t" . _labels(storage => $storage, operation => $operation, class => $class)}++
+        if $class;
+    $counters{"pve_s3_request_bytes_total\t" . _labels(storage => $storage, operation => $operation, direction => 'sent')} += $sent
+        if $sent;
+    $counters{"pve_s3_request_bytes_total\t" . _labels(storage => $storage, operation => $operation, direction => 'received')} += $received
+        if $received;
+    
+    my $histogram = $histograms{"pve_s3_request_duration_seconds\t$labels"} //= {
+        counts => [ (0) x (@LATENCY_BUCKETS + 1) ],
+        sum => 0,
+    };
+    my $index = 0;
+    $index++ while $index < @LATENCY_BUCKETS && $duration > $LATENCY_BUCKETS[$index];
+    $histogram->{counts}->[$index]++;
+    $histogram->{sum} += $duration;
+    
+    _maybe_flush();
+}
+
+# Enregistrement d'un transfert complet (upload_file, download_file)
+sub record_transfer {
+    my ($storage, $type, $bytes, $duration, $ok) = @_;
+    
+    _check_owner();
+    
+    $counters{"pve_s3_transfers_total\t" . _labels(storage => $storage, type => $type, result => $ok ? 'success' : 'error')}++;
+    
+    if ($ok) {
+        my $labels = _labels(storage => $storage, type => $type);
+        $counters{"pve_s3_transfer_bytes_total\t$labels"} += $bytes // 0;
+        $counters{"pve_s3_transfer_duration_seconds_total\t$labels"} += $duration // 0;
+    }
+    
+    _maybe_flush();
+}
+
+# Classe d'erreur d'une réponse HTTP (undef si succès)
+sub error_class {
+    my ($response) = @_;
+    
+    my $code = $response->code // 0;
+    
+    return undef if $code >= 200 && $code < 400;
+    
+    # Erreurs locales de LWP (connexion, délai): réponse interne
+    if (($response->header('Client-Warning') // '') eq 'Internal response') {
+        return ($response->message // '') =~ /timeout|timed out/i ? 'timeout' : 'connection';
+    }
+    
+    return 'not_found' if $code == 404;
+    return 'forbidden' if $code == 401 || $code == 403;
+    return 'throttled' if $code == 429 || $code == 503;
+    return 'server_error' if $code >= 500;
+    
+    return 'client_error';
+}
+
+# Écriture des valeurs agrégées dans le fichier textfile
+sub flush {
+    return if $owner_pid != $$;
+    
+    $last_flush = Time::HiRes::time();
+    
+    return if !%counters && !%histograms;
+    
+    my %values = ();
+    $values{$_} = $counters{$_} foreach keys %counters;
+    
+    foreach my $series (keys %histograms) {
+        my ($name, $labels) = split(/\t/, $series, 2);
+        my $histogram = $histograms{$series};
+        my $cumulative = 0;
+        for (my $i = 0; $i <= @LATENCY_BUCKETS; $i++) {
+            $cumulative += $histogram->{counts}->[$i];
+            my $le = $i < @LATENCY_BUCKETS ? $LATENCY_BUCKETS[$i] : '+Inf';
+            $values{"${name}_bucket\t" . _add_label($labels, le => $le)} += $cumulative;
+        }
+        $values{"${name}_sum\t$labels"} += $histogram->{sum};
+        $values{"${name}_count\t$labels"} += $cumulative;
+    }
+    
+    %counters = ();
+    %histograms = ();
+    
+    return if !-d $DIRECTORY;
+    
+    eval { _merge_file(\%values) };
+    log_warn("Cannot write S3 metrics to $DIRECTORY: $@") if $@;
+}
+
+sub _merge_file {
+    my ($values) = @_;
+    
+    my $file = "$DIRECTORY/" . FILE_NAME;
+    
+    # Fichier de verrou séparé: le fichier de métriques est remplacé par rename
+    open(my $lock, '>>', "$file.lock") or die "cannot open $file.lock: $!\n";
+    flock($lock, LOCK_EX) or die "cannot lock $file.lock: $!\n";
+    
+    if (open(my $fh, '<', $file)) {
+        while (my $line = <$fh>) {
+            next if $line !~ /^(\w+)(\{.*\})? (\S+)$/;
+            $values->{"$1\t" . ($2 // '')} += $3;
+        }
+        close $fh;
+    }
+    
+    my $tmp = "$file.$$";
+    open(my $out, '>', $tmp) or die "cannot create $tmp: $!\n";
+    print $out _format($values);
+    close($out) or die "cannot write $tmp: $!\n";
+    rename($tmp, $file) or die "cannot rename $tmp: $!\n";
+    
+    close $lock;
+}
+
+# Format texte Prometheus: séries groupées par famille, buckets dans l'ordre
+sub _format {
+    my ($values) = @_;
+    
+    my %by_family = ();
+    foreach my $series (keys %$values) {
+        my ($name, $labels) = split(/\t/, $series, 2);
+        my $family = $name;
+        $family =~ s/_(?:bucket|sum|count)$// if !$FAMILIES{$name};
+        
+        my $le = $labels =~ s/,?le="([^"]*)"// ? ($1 eq '+Inf' ? 9**9**9 : $1) : -1;
+        $labels = '' if $labels eq '{}';
+        push @{$by_family{$family}}, [ $labels, $name, $le, $series ];
+    }
+    
+    my $output = '';
+    foreach my $family (sort keys %by_family) {
+        if (my $meta = $FAMILIES{$family}) {
+            $output .= "# HELP $family $meta->[1]\n# TYPE $family $meta->[0]\n";
+        }
+        foreach my $entry (sort { $a->[0] cmp $b->[0] || $a->[1] cmp $b->[1] || $a->[2] <=> $b->[2] } @{$by_family{$family}}) {
+            my ($name, $labels) = split(/\t/, $entry->[3], 2);
+            $output .= "$name$labels " . _format_value($values->{$entry->[3]}) . "\n";
+        }
+    }
+    
+    return $output;
+}
+
+sub _format_value {
+    my ($value) = @_;
+    
+    return $value == int($value) ? sprintf('%d', $value) : sprintf('%.6f', $value);
+}
+
+sub _labels {
+    my (@pairs) = @_;
+    
+    my @labels = ();
+    while (my ($name, $value) = splice(@pairs, 0, 2)) {
+        $value //= '';
+        $value =~ s/(["\\])/\\$1/g;
+        $value =~ s/\n/\\n/g;
+        push @labels, "$name=\"$value\"";
+    }
+    
+    return '{' . join(',', @labels) . '}';
+}
+
+sub _add_label {
+    my ($labels, $name, $value) = @_;
+    
+    return substr($labels, 0, -1) . ",$name=\"$value\"}";
+}
+
+sub _maybe_flush {
+    flush() if Time::HiRes::time() - $last_flush >= FLUSH_INTERVAL;
+}
+
+# Processus fils (fork): les valeurs héritées sont écrites par le parent
+sub _check_owner {
+    return if $owner_pid == $$;
+    
+    %counters = ();
+    %histograms = ();
+    $owner_pid = $$;
+}
+
+1;
@@ -0,0 +1,279 @@
+package PVE::Storage::S3::Retention;
+
+use strict;
+use warnings;
+
+use POSIX qw(strftime mktime);
+
+use PVE::Storage::S3::Exception qw(S3ConfigException);
+
+# Politique de rétention des backups (sémantique "prune-backups" de vzdump)
+#
+# Les backups sont indexés une seule fois par groupe (type/VMID). La date
+# est lue dans le nom du fichier (heure locale de vzdump): les identifiants
+# de période (heure, jour, mois, année) sont des préfixes de cette date, ce
+# qui évite tout appel à localtime pendant le marquage. Seule la semaine ISO
+# est calculée, une fois par jour, et identifiée par la date de son lundi.
+
+my @KEEP_OPTIONS = qw(keep-last keep-hourly keep-daily keep-weekly keep-monthly keep-yearly);
+
+# Index de période de chaque option
+my %ID_INDEX = (
+    'keep-last' => 0,
+    'keep-hourly' => 1,
+    'keep-daily' => 2,
+    'keep-weekly' => 3,
+    'keep-monthly' => 4,
+    'keep-yearly' => 5,
+);
+
+use constant STAMP_LENGTH => 19;
+
+# Longueur du préfixe de date identifiant la période de chaque option
+# (la semaine ISO ne se déduit pas d'un préfixe)
+my @ID_LENGTH = (STAMP_LENGTH, 13, 10, undef, 7, 4);
+
+my $BACKUP_NAME_RE = qr/^vzdump-(qemu|lxc|openvz)-(\d+)-(\d{4})_(\d{2})_(\d{2})-(\d{2})_(\d{2})_(\d{2})\.(?:tar|tgz|vma)(?:\.(?:gz|lzo|zst))?$/;
+
+# Parse d'une spécification "keep-last=3,keep-daily=7" (format prune-backups)
+sub parse_keep_spec {
+    my ($spec) = @_;
+    
+    my $keep = {};
+    
+    foreach my $item (split(/\s*,\s*/, $spec // '')) {
+        next if $item eq '';
+        my ($name, $value) = split(/\s*=\s*/, $item, 2);
+        if ($name eq 'keep-all') {
+            $keep->{'keep-all'} = $value // 1;
+        } elsif (defined $ID_INDEX{$name} && defined $value && $value =~ /^\d+$/) {
+            $keep->{$name} = $value;
+        } else {
+            die S3ConfigException("Invalid retention option: $item");
+        }
+    }
+    
+    return $keep;
+}
+
+# Description lisible d'une politique
+sub format_keep_spec {
+    my ($keep) = @_;
+    
+    return 'keep-all=1' if $keep->{'keep-all'};
+    
+    return join(',', map { "$_=$keep->{$_}" } grep { $keep->{$_} } @KEEP_OPTIONS);
+}
+
+# Parse du nom d'un backup vzdump
+sub parse_backup_name {
+    my ($key) = @_;
+    
+    my $name = substr($key, rindex($key, '/') + 1);
+    return undef if $name !~ $BACKUP_NAME_RE;
+    
+    return {
+        type => $1,
+        vmid => $2,
+        year => $3,
+        month => $4,
+        day => $5,
+        hour => $6,
+        minute => $7,
+        second => $8,
+        stamp => "$3$4$5$6$7$8",
+    };
+}
+
+# Construction de l'index des backups groupés par type/VMID
+#
+# Pour limiter les allocations sur de gros buckets, chaque backup est
+# représenté par une chaîne "<date><position>": la date du nom de fichier
+# (AAAA_MM_JJ-HH_MM_SS, longueur fixe, triable telle quelle) suivie de la
+# position de l'objet dans $objects. Les groupes sont triés du plus récent
+# au plus ancien.
+sub build_index {
+    my ($objects) = @_;
+    
+    my $groups = {};
+    
+    my ($prefix, $group) = ("\0", undef);
+    my $i = -1;
+    foreach my $object (@$objects) {
+        $i++;
+        my $key = $object->{Key};
+        
+        # Listing S3 trié par clé: les backups d'un groupe se suivent avec le
+        # même préfixe "<chemin>vzdump-<type>-<vmid>-", seule la fin du nom
+        # est alors vérifiée
+        if (index($key, $prefix) == 0
+            && substr($key, length($prefix)) =~ /^(\d{4}_\d\d_\d\d-\d\d_\d\d_\d\d)\.(?:tar|tgz|vma)(?:\.(?:gz|lzo|zst))?$/) {
+            push @$group, $1 . $i;
+            next;
+        }
+        
+        next if $key !~ m{^(.*?(?<![^/])vzdump-(qemu|lxc|openvz)-(\d+)-)(\d{4}_\d\d_\d\d-\d\d_\d\d_\d\d)\.(?:tar|tgz|vma)(?:\.(?:gz|lzo|zst))?$};
+        $prefix = $1;
+        $group = $groups->{"$2/$3"} //= [];
+        push @$group, $4 . $i;
+    }
+    
+    # Listing S3 déjà trié par clé: le tri est alors linéaire
+    foreach my $group (values %$groups) {
+        @$group = reverse sort @$group;
+    }
+    
+    return $groups;
+}
+
+# Marquage d'un groupe de l'index
+#
+# Même algorithme que PVE::Storage::prune_mark; retourne les marques ('keep'
+# ou 'remove') dans l'ordre du groupe.
+sub mark_group {
+    my ($group, $keep) = @_;
+    
+    return [ map { $_ eq 'k' ? 'keep' : 'remove' } split(//, _mark_string($group, $keep)) ];
+}
+
+# Calcul du plan de rétention pour un ensemble de backups
+#
+# Les objets qui ne sont pas des archives vzdump sont ignorés. Retourne les
+# objets à conserver et à supprimer (références vers les éléments de
+# $objects) et le nombre de groupes type/VMID.
+sub plan {
+    my ($objects, $keep) = @_;
+    
+    my $groups = build_index($objects);
+    my $plan = { keep => [], remove => [], groups => scalar(keys %$groups) };
+    
+    foreach my $name (sort keys %$groups) {
+        my $group = $groups->{$name};
+        my $marks = _mark_string($group, $keep);
+        my @entries = map { $objects->[substr($_, STAMP_LENGTH)] } @$group;
+        
+        # Objets répartis par tranches entre deux backups conservés
+        my $pos = 0;
+        while ((my $next = index($marks, 'k', $pos)) >= 0) {
+            push @{$plan->{remove}}, @entries[$pos .. $next - 1];
+            push @{$plan->{keep}}, $entries[$next];
+            $pos = $next + 1;
+        }
+        push @{$plan->{remove}}, @entries[$pos .. $#entries];
+    }
+    
+    return $plan;
+}
+
+# Marques d'un groupe sous forme de chaîne ("k", "r", "\0" si non marqué)
+#
+# Les périodes couvertes par les backups conservés sont enregistrées au fur
+# et à mesure au lieu d'être recalculées à chaque option. Le groupe étant
+# trié, les backups d'une même période sont contigus: une période déjà
+# couverte est sautée d'un bloc, les autres backups d'une période retenue
+# sont marqués d'un seul substr, et le prochain backup non marqué est
+# trouvé par index().
+sub _mark_string {
+    my ($group, $keep) = @_;
+    
+    my $size = scalar(@$group);
+    my @options = grep { $keep->{$_} } @KEEP_OPTIONS;
+    
+    return 'k' x $size if $keep->{'keep-all'} || !@options;
+    
+    my $marks = "\0" x $size;
+    my @covered = map { {} } @KEEP_OPTIONS;
+    
+    foreach my $option (@options) {
+        my $count = $keep->{$option};
+        my $index = $ID_INDEX{$option};
+        my $covered = $covered[$index];
+        
+        my $included = 0;
+        my $pos = index($marks, "\0");
+        while ($pos >= 0) {
+            my $id = _period_id($group->[$pos], $index);
+            my $end = _period_end($group, $pos, $id);
+            
+            # Période non couverte par une option précédente: le backup le
+            # plus récent est conservé, les autres supprimés (une période
+            # retenue ne contient aucun backup déjà conservé)
+            if (!$covered->{$id}) {
+                last if $included >= $count;
+                $included++;
+                substr($marks, $pos, $end - $pos) = 'k' . ('r' x ($end - $pos - 1));
+                foreach my $i (0 .. $#covered) {
+                    $covered[$i]->{$ID_LENGTH[$i] ? substr($group->[$pos], 0, $ID_LENGTH[$i]) : _week_id($group->[$pos])} = 1;
+                }
+            }
+            
+            $pos = $end < $size ? index($marks, "\0", $end) : -1;
+        }
+    }
+    
+    return $marks;
+}
+
+# Identifiant de période d'une entrée pour l'option d'index $index
+#
+# C'est aussi la plus petite date de la période: les entrées d'une même
+# période sont celles qui suivent $entry et restent supérieures ou égales.
+sub _period_id {
+    my ($entry, $index) = @_;
+    
+    my $length = $ID_LENGTH[$index];
+    
+    return $length ? substr($entry, 0, $length) : _week_id($entry);
+}
+
+# Fin (exclue) de la période $id commençant à $pos
+#
+# Recherche exponentielle puis dichotomique: les périodes courtes (heure,
+# jour) se terminent en une ou deux comparaisons.
+sub _period_end {
+    my ($group, $pos, $id) = @_;
+    
+    my $size = scalar(@$group);
+    
+    my ($low, $step) = ($pos + 1, 1);
+    while ($low < $size && $group->[$low] ge $id) {
+        $pos = $low;
+        $low += $step;
+        $step *= 2;
+    }
+    
+    my $high = $low < $size ? $low : $size;
+    $low = $pos + 1;
+    while ($low < $high) {
+        my $mid = ($low + $high) >> 1;
+        if ($group->[$mid] ge $id) {
+            $low = $mid + 1;
+        } else {
+            $high = $mid;
+        }
+    }
+    
+    return $low;
+}
+
+# Semaine ISO d'une entrée de l'index (calculée une fois par jour)
+my %week_cache = ();
+
+sub _week_id {
+    my ($entry) = @_;
+    
+    my $day = substr($entry, 0, 10);
+    return $week_cache{$day} //= _iso_week(split(/_/, $day));
+}
+
+# Identifiant de semaine ISO 8601 d'un jour: la date de son lundi
+# ("AAAA_MM_JJ", comparable aux entrées de l'index)
+sub _iso_week {
+    my ($year, $month, $day) = @_;
+    
+    my $wday = (localtime(mktime(0, 0, 12, $day, $month - 1, $year - 1900)))[6];
+    
+    return strftime('%Y_%m_%d', localtime(mktime(0, 0, 12, $day - ($wday + 6) % 7, $month - 1, $year - 1900)));
+}
+
+1;
@@ -0,0 +1,202 @@
+package PVE::Storage::S3::Stream;
+
+use strict;
+use warnings;
+
+use POSIX ();
+use Time::HiRes qw(time);
+
+use PVE::Storage::S3::Utils qw(log_info format_bytes);
+use PVE::Storage::S3::Exception qw(S3Exception);
+use PVE::Storage::S3::WorkerPool;
+use PVE::Storage::S3::ArchiveIndex;
+
+# Lecture en flux d'un objet vers un processus consommateur
+#
+# L'objet est lu par requêtes range en parallèle (processus du pool) et
+# les blocs sont réécrits dans l'ordre sur un descripteur, en général
+# l'entrée d'une chaîne décompresseur | qmrestore/pct restore. Le tampon de
+# réordonnancement est borné (fenêtre de blocs): quand le consommateur
+# n'avance plus, l'écriture bloque et aucune nouvelle range n'est demandée.
+
+use constant {
+    DEFAULT_CHUNK_SIZE => 8 * 1024 * 1024,
+    DEFAULT_WORKERS => 4,
+};
+
+# Copie d'un objet sur un descripteur, par ranges lues en parallèle
+#
+# Options: workers, chunk_size, window (nombre maximal de blocs demandés
+# ou en attente d'écriture), size (taille connue de l'objet), on_progress.
+sub stream_object {
+    my ($client, $bucket, $key, $fh, $options) = @_;
+    
+    $options //= {};
+    
+    my $workers = $options->{workers} || DEFAULT_WORKERS;
+    my $chunk_size = $options->{chunk_size} || DEFAULT_CHUNK_SIZE;
+    my $window = $options->{window} || 2 * $workers;
+    $window = $workers if $window < $workers;
+    
+    my $size = $options->{size} // $client->head_object($bucket, $key)->{ContentLength};
+    die S3Exception("Cannot determine size of s3://$bucket/$key") if !defined $size;
+    
+    my $chunks = POSIX::ceil($size / $chunk_size);
+    my $next_chunk = 0;
+    my $next_write = 0;
+    my %reorder = ();
+    my $written = 0;
+    my $first_byte;
+    my $error;
+    
+    my $start_time = time();
+    my $pool = PVE::Storage::S3::WorkerPool->new({ workers => $workers });
+    
+    local $SIG{PIPE} = 'IGNORE';
+    binmode $fh;
+    
+    my $next_task = sub {
+        return undef if $error || $next_chunk >= $chunks;
+        
+        # Fenêtre pleine: attente de l'écriture des blocs précédents
+        return PVE::Storage::S3::WorkerPool::DEFER if $next_chunk - $next_write >= $window;
+        
+        my $offset = $next_chunk * $chunk_size;
+        my $last = $offset + $chunk_size - 1;
+        $last = $size - 1 if $last >= $size;
+        
+        return { index => $next_chunk++, offset => $offset, last => $last };
+    };
+    
+    $pool->run($next_task, sub {
+        my ($task) = @_;
+        
+        my $data = $client->get_object_range($bucket, $key, $task->{offset}, $task->{last});
+        my $expected = $task->{last} - $task->{offset} + 1;
+        die "short read at offset $task->{offset} (" . length($data) . "/$expected bytes)\n"
+            if length($data) != $expected;
+        
+        return $data;
+    }, sub {
+        my ($task, $data, $task_error) = @_;
+        
+        return if $error;
+        
+        if ($task_error) {
+            chomp $task_error;
+            $error = "range $task->{offset}-$task->{last}: $task_error";
+            $pool->stop();
+            return;
+        }
+        
+        $reorder{$task->{index}} = $data;
+        
+        # Écriture bloquante: le consommateur impose son débit
+        while (defined(my $chunk = delete $reorder{$next_write})) {
+            if (!print $fh $chunk) {
+                $error = "consumer stopped reading: $!";
+                $pool->stop();
+                return;
+            }
+            $first_byte //= time() - $start_time;
+            $written += length($chunk);
+            $next_write++;
+            $options->{on_progress}->($written, $size) if $options->{on_progress};
+        }
+    });
+    
+    die S3Exception("Streaming s3://$bucket/$key failed: $error") if $error;
+    die S3Exception("Streaming s3://$bucket/$key interrupted after " . format_bytes($written))
+        if $written != $size;
+    
+    my $duration = time() - $start_time;
+    
+    return {
+        bytes => $written,
+        duration => $duration,
+        first_byte => $first_byte // $duration,
+        throughput => $duration > 0 ? $written / $duration / 1024 / 1024 : 0,
+    };
+}
+
+# Commande de restauration lisant une archive vzdump décompressée sur stdin
+sub restore_command {
+    my ($key, $vmid, $options) = @_;
+    
+    $options //= {};
+    
+    my ($type) = $key =~ /vzdump-(qemu|lxc)-\d+-/
+        or die S3Exception("Cannot determine guest type of '$key'");
+    
+    my @command = $type eq 'qemu'
+        ? ('qmrestore', '-', $vmid)
+        : ('pct', 'restore', $vmid, '-');
+    
+    push @command, '--storage', $options->{storage} if $options->{storage};
+    push @command, '--force', 1 if $options->{force};
+    
+    return \@command;
+}
+
+# Chaîne de commandes (décompresseur éventuel puis consommateur)
+#
+# Retourne un descripteur sur l'entrée de la chaîne et la liste des pid.
+sub open_pipeline {
+    my ($key, $consumer) = @_;
+    
+    my $format = PVE::Storage::S3::ArchiveIndex::archive_format($key);
+    my @commands = ($consumer);
+    if ($format && $format->{compression}) {
+        unshift @commands, PVE::Storage::S3::ArchiveIndex::decoder_command($format->{compression});
+    }
+    
+    my @pids = ();
+    my $output;
+    
+    # Lancement du dernier processus en premier: chacun écrit dans le suivant
+    foreach my $command (reverse @commands) {
+        pipe(my $reader, my $writer) or die S3Exception("Cannot create pipe: $!");
+        
+        my $pid = fork();
+        die S3Exception("Cannot fork '$command->[0]': $!") if !defined $pid;
+        
+        if (!$pid) {
+            close $writer;
+            open(STDIN, '<&', $reader) or POSIX::_exit(126);
+            if ($output) {
+                open(STDOUT, '>&', $output) or POSIX::_exit(126);
+                close $output;
+            }
+            exec(@$command) or POSIX::_exit(127);
+        }
+        
+        close $reader;
+        close $output if $output;
+        $output = $writer;
+        unshift @pids, { pid => $pid, command => $command->[0] };
+    }
+    
+    log_info("Streaming pipeline: " . join(' | ', map { join(' ', @$_) } @commands));
+    
+    return ($output, \@pids);
+}
+
+# Fin de la chaîne: attente des processus et vérification des codes de sortie
+sub close_pipeline {
+    my ($fh, $pids) = @_;
+    
+    close $fh;
+    
+    my @failed = ();
+    foreach my $process (@$pids) {
+        waitpid($process->{pid}, 0);
+        my $status = $? >> 8;
+        my $signal = $? & 127;
+        push @failed, "$process->{command} " . ($signal ? "killed by signal $signal" : "exited with status $status")
+            if $status || $signal;
+    }
+    
+    die S3Exception("Restore pipeline failed: " . join(', ', @failed)) if @failed;
+}
+
+1;
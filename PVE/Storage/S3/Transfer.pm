@@ -3,13 +3,15 @@ package PVE::Storage::S3::Transfer;
 use strict;
 use warnings;
 
-use File::stat;
-use File::Temp qw(tempfile);
 use Time::HiRes qw(time sleep);
 use POSIX qw(ceil);
 
-use PVE::Storage::S3::Utils qw(log_info log_warn log_error generate_operation_id file_md5_hex);
+use PVE::Storage::S3::Utils qw(log_info log_warn log_error generate_operation_id);
 use PVE::Storage::S3::Exception qw(S3TransferException with_retry);
+use PVE::Storage::S3::Integrity;
+use PVE::Storage::S3::Hash;
+use PVE::Storage::S3::WorkerPool;
+use PVE::Storage::S3::Metrics;
 
 # Constructeur
 sub new {
@@ -20,6 +22,7 @@ sub new {
         config => $config,
         active_transfers => {},
         transfer_stats => {},
+        storage => $config->get('storage_id') // $config->get('bucket') // '',
     };
     
     bless $self, $class;
@@ -28,6 +31,9 @@ sub new {
 }
 
 # Upload d'un fichier avec optimisations
+#
+# $options->{priority}: classe de priorité auprès du service de transfert
+# (restore, upload, backup, maintenance; backup par défaut).
 sub upload_file {
     my ($self, $local_file, $bucket, $key, $options) = @_;
     
@@ -42,31 +48,92 @@ sub upload_file {
     my $multipart_config = $self->{config}->multipart_config();
     
     my $operation_id = generate_operation_id();
+    local $PVE::Storage::S3::Logger::CONTEXT{operation_id} = $operation_id;
+    local $PVE::Storage::S3::Logger::CONTEXT{storage} = $self->{storage};
+    my $log_batch = PVE::Storage::S3::Logger::batch();
     log_info("Starting upload: $local_file -> s3://$bucket/$key (size: $file_size bytes, op: $operation_id)");
     
-    eval {
-        if ($file_size > $multipart_config->{threshold}) {
-            return $self->_multipart_upload($local_file, $bucket, $key, $options, $operation_id);
+    # Index des membres construit pendant l'upload des archives vzdump
+    my $indexer = $options->{no_archive_index} ? undef : do {
+        require PVE::Storage::S3::ArchiveIndex;
+        PVE::Storage::S3::ArchiveIndex->new($key);
+    };
+    
+    # Manifeste des empreintes SHA-256 par part pour la vérification d'intégrité
+    my $manifest = $options->{no_manifest} ? undef
+        : PVE::Storage::S3::Integrity::new_manifest($multipart_config->{chunk_size});
+    
+    my $consumers = [ grep { defined } ($indexer, $manifest) ];
+    
+    # Transfert confié au service partagé du nœud s'il répond
+    my $daemon = $self->_daemon();
+    
+    my $result = eval {
+        if ($daemon) {
+            my $daemon_result = $self->_daemon_upload($daemon, $local_file, $bucket, $key, $options,
+                $operation_id, $indexer);
+            
+            # Manifeste construit à partir des empreintes des parts calculées par le service
+            if ($manifest) {
+                $manifest = PVE::Storage::S3::Integrity::new_manifest($daemon_result->{part_size});
+                $manifest->add_part($_->{size}, $_) foreach @{$daemon_result->{parts}};
+            }
+            
+            return $daemon_result;
+        } elsif ($file_size > $multipart_config->{threshold}) {
+            return $self->_multipart_upload($local_file, $bucket, $key, $options, $operation_id, $consumers);
         } else {
-            return $self->_simple_upload($local_file, $bucket, $key, $options, $operation_id);
+            return $self->_simple_upload($local_file, $bucket, $key, $options, $operation_id, $consumers);
         }
     };
     if ($@) {
+        my $err = $@;
+        $indexer->abort() if $indexer;
         $self->_cleanup_transfer($operation_id);
-        die $@;
+        PVE::Storage::S3::Metrics::record_transfer($self->{storage}, 'upload');
+        die $err;
+    }
+    
+    PVE::Storage::S3::Metrics::record_transfer($self->{storage}, 'upload', $result->{size}, $result->{duration}, 1);
+    
+    if ($indexer) {
+        eval {
+            my $index = $indexer->finish();
+            PVE::Storage::S3::ArchiveIndex::store($self->{s3_client}, $bucket, $key, $index) if $index;
+        };
+        log_warn("Cannot store archive index for s3://$bucket/$key: $@") if $@;
     }
+    
+    if ($manifest) {
+        eval {
+            PVE::Storage::S3::Integrity::store_manifest($self->{s3_client}, $bucket, $key,
+                $manifest->finish($result->{etag}));
+        };
+        log_warn("Cannot store checksum manifest for s3://$bucket/$key: $@") if $@;
+    }
+    
+    return $result;
 }
 
 # Download d'un fichier avec optimisations
+#
+# $options->{priority}: comme pour upload_file, restore par défaut.
 sub download_file {
     my ($self, $bucket, $key, $local_file, $options) = @_;
     
     $options //= {};
     
     my $operation_id = generate_operation_id();
+    local $PVE::Storage::S3::Logger::CONTEXT{operation_id} = $operation_id;
+    local $PVE::Storage::S3::Logger::CONTEXT{storage} = $self->{storage};
+    my $log_batch = PVE::Storage::S3::Logger::batch();
     log_info("Starting download: s3://$bucket/$key -> $local_file (op: $operation_id)");
     
-    eval {
+    my $daemon = $self->_daemon();
+    
+    my $result = eval {
+        return $self->_daemon_download($daemon, $bucket, $key, $local_file, $options, $operation_id) if $daemon;
+        
         # Récupération des informations sur l'objet
         my $object_info = $self->{s3_client}->head_object($bucket, $key);
         my $file_size = $object_info->{ContentLength} || 0;
@@ -78,14 +145,141 @@ sub download_file {
         }
     };
     if ($@) {
+        my $err = $@;
         $self->_cleanup_transfer($operation_id);
-        die $@;
+        PVE::Storage::S3::Metrics::record_transfer($self->{storage}, 'download');
+        die $err;
+    }
+    
+    PVE::Storage::S3::Metrics::record_transfer($self->{storage}, 'download', $result->{size}, $result->{duration}, 1);
+    
+    return $result;
+}
+
+# Service de transfert partagé (pve-s3-transferd), s'il est installé et répond
+sub _daemon {
+    my ($self) = @_;
+    
+    require PVE::Storage::S3::DaemonClient;
+    return undef if !PVE::Storage::S3::DaemonClient::available();
+    
+    my $daemon = PVE::Storage::S3::DaemonClient->new($self->{config}, $self->{s3_client}->auth());
+    eval { $daemon->ping() };
+    if ($@) {
+        log_warn("Transfer daemon not responding, transferring in-process: $@");
+        return undef;
+    }
+    
+    return $daemon;
+}
+
+# Upload confié au service de transfert partagé
+#
+# Le service lit le fichier, calcule les empreintes des parts et les envoie
+# sur ses connexions persistantes. L'index de l'archive est construit ici en
+# parallèle, en lisant le fichier pendant l'attente des réponses.
+sub _daemon_upload {
+    my ($self, $daemon, $local_file, $bucket, $key, $options, $operation_id, $indexer) = @_;
+    
+    my $file_size = -s $local_file;
+    my $multipart_config = $self->{config}->multipart_config();
+    
+    $self->_register_transfer($operation_id, 'daemon_upload', $local_file, {
+        bucket => $bucket,
+        key => $key,
+        total_size => $file_size,
+    });
+    
+    # Headers de l'objet (chiffrement, classe de stockage, métadonnées)
+    my $headers = $self->{config}->default_headers();
+    delete @$headers{qw(Host User-Agent)};
+    $headers->{'Content-Type'} = $options->{content_type} || 'application/octet-stream';
+    foreach my $meta_key (keys %{$options->{metadata} // {}}) {
+        $headers->{"x-amz-meta-$meta_key"} = $options->{metadata}->{$meta_key};
+    }
+    
+    my $fh;
+    if ($indexer) {
+        open $fh, '<:raw', $local_file or die S3TransferException("Cannot open file: $!", 'upload');
+    }
+    my $index_chunk = sub {
+        my $bytes = read($fh, my $data, 8 * 1024 * 1024);
+        die S3TransferException("Cannot read file: $!", 'upload') if !defined $bytes;
+        $indexer->add($data) if $bytes;
+        return $bytes;
+    };
+    
+    my $transferred = 0;
+    my $result = $daemon->upload($local_file, $bucket, $key, {
+        part_size => $multipart_config->{chunk_size},
+        max_concurrent => $multipart_config->{max_concurrent},
+        headers => $headers,
+        priority => $options->{priority},
+    }, {
+        on_progress => sub {
+            my ($bytes) = @_;
+            $self->_update_transfer_progress($operation_id, $bytes - $transferred);
+            $transferred = $bytes;
+        },
+        ($fh ? (idle => $index_chunk) : ()),
+    });
+    
+    # Fin de l'index si l'envoi a été plus rapide que la lecture
+    if ($fh) {
+        1 while $index_chunk->();
+        close $fh;
+    }
+    
+    my $parts = $result->{parts};
+    if (@$parts > 1) {
+        $result->{composite_etag} = PVE::Storage::S3::Hash::composite_etag([ map { $_->{md5} } @$parts ]);
+        my $etag = PVE::Storage::S3::Hash::normalize_etag($result->{etag});
+        log_warn("ETag $etag of s3://$bucket/$key differs from computed $result->{composite_etag}")
+            if $etag =~ /^[0-9a-f]{32}-\d+$/ && $etag ne $result->{composite_etag};
+    } else {
+        $result->{md5} = $parts->[0]->{md5};
+        $result->{sha256} = $parts->[0]->{sha256};
     }
+    
+    log_info(sprintf("Upload completed by transfer daemon: $operation_id (%.2f MB/s, %.1fs)",
+        $result->{throughput}, $result->{duration}));
+    
+    $self->_unregister_transfer($operation_id);
+    
+    return { %$result, operation_id => $operation_id };
+}
+
+# Download confié au service de transfert partagé (plages en parallèle)
+sub _daemon_download {
+    my ($self, $daemon, $bucket, $key, $local_file, $options, $operation_id) = @_;
+    
+    $self->_register_transfer($operation_id, 'daemon_download', $local_file, { bucket => $bucket, key => $key });
+    
+    my $transferred = 0;
+    my $result = $daemon->download($bucket, $key, $local_file, {
+        part_size => 50 * 1024 * 1024,
+        max_concurrent => $self->{config}->multipart_config()->{max_concurrent},
+        priority => $options->{priority},
+    }, {
+        on_progress => sub {
+            my ($bytes, $total) = @_;
+            $self->{active_transfers}->{$operation_id}->{remote_info}->{total_size} //= $total;
+            $self->_update_transfer_progress($operation_id, $bytes - $transferred);
+            $transferred = $bytes;
+        },
+    });
+    
+    log_info(sprintf("Download completed by transfer daemon: $operation_id (%.2f MB/s, %.1fs)",
+        $result->{throughput}, $result->{duration}));
+    
+    $self->_unregister_transfer($operation_id);
+    
+    return { %$result, operation_id => $operation_id };
 }
 
 # Upload simple pour petits fichiers
 sub _simple_upload {
-    my ($self, $local_file, $bucket, $key, $options, $operation_id) = @_;
+    my ($self, $local_file, $bucket, $key, $options, $operation_id, $consumers) = @_;
     
     $self->_register_transfer($operation_id, 'upload', $local_file, { bucket => $bucket, key => $key });
     
@@ -96,14 +290,17 @@ sub _simple_upload {
     my $content = do { local $/; <$fh> };
     close $fh;
     
-    # Calcul du checksum
-    my $md5_hex = file_md5_hex($local_file);
+    # Empreintes calculées une fois pour Content-MD5, la signature et le manifeste
+    my $digests = PVE::Storage::S3::Hash::digest_data($content,
+        { checksum => $self->{config}->get('checksum_algorithm') });
+    
+    $_->add($content, $digests) foreach @{$consumers // []};
     
     # Préparation des headers
     my $headers = {
         'Content-Type' => $options->{content_type} || 'application/octet-stream',
         'Content-Length' => length($content),
-        'Content-MD5' => _hex_to_base64($md5_hex),
+        %{PVE::Storage::S3::Hash::request_headers($digests)},
     };
     
     # Ajout des métadonnées
@@ -121,13 +318,15 @@ sub _simple_upload {
     my $duration = time() - $start_time;
     my $throughput = length($content) / $duration / 1024 / 1024;  # MB/s
     
-    log_info("Simple upload completed: $operation_id (${throughput:.2f} MB/s)");
+    log_info(sprintf("Simple upload completed: $operation_id (%.2f MB/s, %.1fs)", $throughput, $duration));
     
     $self->_unregister_transfer($operation_id);
     
     return {
         operation_id => $operation_id,
         etag => $result->{ETag},
+        md5 => $digests->{md5},
+        sha256 => $digests->{sha256},
         size => length($content),
         duration => $duration,
         throughput => $throughput,
@@ -136,12 +335,22 @@ sub _simple_upload {
 
 # Upload multipart pour gros fichiers
 sub _multipart_upload {
-    my ($self, $local_file, $bucket, $key, $options, $operation_id) = @_;
+    my ($self, $local_file, $bucket, $key, $options, $operation_id, $consumers) = @_;
     
     my $file_size = -s $local_file;
     my $multipart_config = $self->{config}->multipart_config();
     my $chunk_size = $multipart_config->{chunk_size};
     my $max_concurrent = $multipart_config->{max_concurrent};
+    my $checksum = $self->{config}->get('checksum_algorithm');
+    
+    # Parts agrandies (au MB supérieur) si le fichier dépasse la limite de
+    # parts du fournisseur
+    my $max_parts = $multipart_config->{max_parts} || 10000;
+    if (ceil($file_size / $chunk_size) > $max_parts) {
+        $chunk_size = ceil($file_size / $max_parts / (1024 * 1024)) * 1024 * 1024;
+        die S3TransferException("File too large for $max_parts parts of at most 5GB", 'upload')
+            if $chunk_size > 5 * 1024 * 1024 * 1024;
+    }
     
     $self->_register_transfer($operation_id, 'multipart_upload', $local_file, { 
         bucket => $bucket, 
@@ -157,50 +366,113 @@ sub _multipart_upload {
     # Initiation du multipart upload
     my $upload_id = $self->{s3_client}->initiate_multipart_upload($bucket, $key, $options);
     
-    eval {
-        # Upload des parts avec parallélisation limitée
+    my $upload_result = eval {
+        # Les parts sont lues dans l'ordre par le processus principal puis
+        # hachées (MD5 + SHA-256) et envoyées par les processus du pool: le
+        # fils hérite du bloc lu (fork), aucune part n'est relue. Au plus
+        # $max_concurrent parts sont en mémoire en plus de celles en attente
+        # des consommateurs (index, manifeste), alimentés dans l'ordre.
         my @parts = ();
-        my @active_uploads = ();
+        my %pending = ();
+        my $next_part = 1;
+        my $next_consumed = 1;
+        my $eof = 0;
+        my $error;
         
         open my $fh, '<:raw', $local_file or die "Cannot open file: $!";
         
-        for my $part_number (1..$total_parts) {
-            # Lecture du chunk
-            my $chunk_data;
-            my $bytes_read = read($fh, $chunk_data, $chunk_size);
-            last if $bytes_read == 0;
+        my $pool = PVE::Storage::S3::WorkerPool->new({ workers => $max_concurrent });
+        
+        my $next_task = sub {
+            return undef if $eof || $error || $next_part > $total_parts;
+            return PVE::Storage::S3::WorkerPool::DEFER if $next_part - $next_consumed >= $max_concurrent;
             
-            # Limitation de la concurrence
-            while (@active_uploads >= $max_concurrent) {
-                $self->_wait_for_upload_completion(\@active_uploads, \@parts);
+            my $bytes_read = read($fh, my $chunk_data, $chunk_size);
+            die "Cannot read file: $!" if !defined $bytes_read;
+            if (!$bytes_read) {
+                $eof = 1;
+                return undef;
             }
             
-            # Démarrage de l'upload de la part
-            push @active_uploads, {
-                part_number => $part_number,
-                data => $chunk_data,
+            $pending{$next_part} = { data => $chunk_data };
+            
+            return {
+                part_number => $next_part++,
                 size => $bytes_read,
                 start_time => time(),
             };
+        };
+        
+        $pool->run($next_task, sub {
+            my ($upload) = @_;
             
-            $self->_start_part_upload(\@active_uploads, $bucket, $key, $upload_id, $operation_id);
-        }
+            my $data = $pending{$upload->{part_number}}->{data};
+            my $digests = PVE::Storage::S3::Hash::digest_data($data, { checksum => $checksum });
+            my $etag = with_retry(sub {
+                $self->{s3_client}->upload_part(
+                    $bucket, $key, $upload_id,
+                    $upload->{part_number},
+                    $data,
+                    $digests,
+                );
+            });
+            
+            delete $digests->{md5_base64};
+            return { etag => $etag, digests => $digests };
+        }, sub {
+            my ($upload, $result, $upload_error) = @_;
+            
+            if ($upload_error) {
+                $error //= "part $upload->{part_number}: $upload_error";
+                $pool->stop();
+                return;
+            }
+            
+            my $etag = PVE::Storage::S3::Hash::normalize_etag($result->{etag});
+            log_warn("Part $upload->{part_number}: ETag $etag differs from MD5 $result->{digests}->{md5}")
+                if $etag =~ /^[0-9a-f]{32}$/ && $etag ne $result->{digests}->{md5};
+            
+            push @parts, {
+                PartNumber => $upload->{part_number},
+                ETag => $result->{etag},
+                MD5 => $result->{digests}->{md5},
+                Checksums => PVE::Storage::S3::Hash::part_checksums($result->{digests}),
+            };
+            
+            $self->_update_transfer_progress($operation_id, $upload->{size});
+            my $duration = time() - $upload->{start_time};
+            log_info(sprintf("Part $upload->{part_number} completed in %.3fs (%.2f MB/s)",
+                $duration, $duration > 0 ? $upload->{size} / $duration / 1024 / 1024 : 0));
+            
+            # Consommateurs alimentés dans l'ordre de l'objet
+            $pending{$upload->{part_number}}->{digests} = $result->{digests};
+            while ($pending{$next_consumed} && $pending{$next_consumed}->{digests}) {
+                my $part = delete $pending{$next_consumed++};
+                $_->add($part->{data}, $part->{digests}) foreach @{$consumers // []};
+            }
+        });
         
         close $fh;
         
-        # Attendre la fin de tous les uploads
-        while (@active_uploads > 0) {
-            $self->_wait_for_upload_completion(\@active_uploads, \@parts);
-        }
+        die S3TransferException("Part upload failed: $error", 'upload') if $error;
+        die S3TransferException("File changed during upload", 'upload') if $next_consumed != $total_parts + 1;
         
         # Finalisation du multipart upload
         @parts = sort { $a->{PartNumber} <=> $b->{PartNumber} } @parts;
-        my $result = $self->{s3_client}->complete_multipart_upload($bucket, $key, $upload_id, \@parts);
+        my $result = $self->{s3_client}->complete_multipart_upload($bucket, $key, $upload_id,
+            [ map { { PartNumber => $_->{PartNumber}, ETag => $_->{ETag}, %{$_->{Checksums}} } } @parts ]);
+        
+        # ETag composite calculé localement (identique à celui du serveur
+        # hors chiffrement SSE-KMS/SSE-C)
+        my $composite_etag = PVE::Storage::S3::Hash::composite_etag([ map { $_->{MD5} } @parts ]);
+        my $etag = PVE::Storage::S3::Hash::normalize_etag($result->{ETag});
+        log_warn("ETag $etag of s3://$bucket/$key differs from computed $composite_etag")
+            if $etag =~ /^[0-9a-f]{32}-\d+$/ && $etag ne $composite_etag;
         
         my $duration = time() - $start_time;
         my $throughput = $file_size / $duration / 1024 / 1024;  # MB/s
         
-        log_info("Multipart upload completed: $operation_id (${throughput:.2f} MB/s)");
+        log_info(sprintf("Multipart upload completed: $operation_id (%.2f MB/s, %.1fs)", $throughput, $duration));
         
         $self->_unregister_transfer($operation_id);
         
@@ -208,6 +480,7 @@ sub _multipart_upload {
             operation_id => $operation_id,
             upload_id => $upload_id,
             etag => $result->{ETag},
+            composite_etag => $composite_etag,
             size => $file_size,
             parts_count => scalar(@parts),
             duration => $duration,
@@ -222,66 +495,8 @@ sub _multipart_upload {
         };
         die S3TransferException("Multipart upload failed: $@", 'upload');
     }
-}
-
-# Démarrage de l'upload d'une part (simulation - en réalité serait asynchrone)
-sub _start_part_upload {
-    my ($self, $active_uploads, $bucket, $key, $upload_id, $operation_id) = @_;
-    
-    # Dans une vraie implémentation, ceci serait asynchrone
-    my $upload = $active_uploads->[-1];
-    
-    eval {
-        my $etag = $self->{s3_client}->upload_part(
-            $bucket, $key, $upload_id, 
-            $upload->{part_number}, 
-            $upload->{data}
-        );
-        
-        $upload->{etag} = $etag;
-        $upload->{completed} = 1;
-        $upload->{end_time} = time();
-        
-        # Mise à jour des statistiques de transfert
-        $self->_update_transfer_progress($operation_id, $upload->{size});
-        
-    };
-    if ($@) {
-        $upload->{error} = $@;
-        $upload->{completed} = 1;
-    }
-}
-
-# Attente de la fin d'un upload et nettoyage
-sub _wait_for_upload_completion {
-    my ($self, $active_uploads, $completed_parts) = @_;
-    
-    # Vérifie les uploads terminés
-    my @still_active = ();
-    
-    foreach my $upload (@$active_uploads) {
-        if ($upload->{completed}) {
-            if ($upload->{error}) {
-                die S3TransferException("Part upload failed: $upload->{error}", 'upload');
-            } else {
-                push @$completed_parts, {
-                    PartNumber => $upload->{part_number},
-                    ETag => $upload->{etag},
-                };
-                
-                my $duration = $upload->{end_time} - $upload->{start_time};
-                my $throughput = $upload->{size} / $duration / 1024 / 1024;
-                log_info("Part $upload->{part_number} completed (${throughput:.2f} MB/s)");
-            }
-        } else {
-            push @still_active, $upload;
-        }
-    }
     
-    @$active_uploads = @still_active;
-    
-    # Petit délai pour éviter une boucle trop intense
-    sleep(0.1) if @still_active > 0;
+    return $upload_result;
 }
 
 # Download simple
@@ -300,7 +515,7 @@ sub _simple_download {
     my $duration = time() - $start_time;
     my $throughput = $file_size / $duration / 1024 / 1024;
     
-    log_info("Simple download completed: $operation_id (${throughput:.2f} MB/s)");
+    log_info(sprintf("Simple download completed: $operation_id (%.2f MB/s, %.1fs)", $throughput, $duration));
     
     $self->_unregister_transfer($operation_id);
     
@@ -332,13 +547,14 @@ sub _multipart_download {
     # Création du fichier de destination
     open my $output_fh, '>:raw', $local_file or die "Cannot create output file: $!";
     
-    eval {
+    my $result = eval {
         for my $part_number (1..$total_parts) {
             my $range_start = ($part_number - 1) * $chunk_size;
             my $range_end = $range_start + $chunk_size - 1;
             $range_end = $file_size - 1 if $range_end >= $file_size;
             
             # Download de la range
+            my $part_start = time();
             my $chunk_data = $self->{s3_client}->get_object_range(
                 $bucket, $key, $range_start, $range_end
             );
@@ -349,7 +565,7 @@ sub _multipart_download {
             # Mise à jour du progrès
             $self->_update_transfer_progress($operation_id, length($chunk_data));
             
-            log_info("Downloaded part $part_number/$total_parts");
+            log_info(sprintf("Downloaded part $part_number/$total_parts in %.3fs", time() - $part_start));
         }
         
         close $output_fh;
@@ -357,7 +573,7 @@ sub _multipart_download {
         my $duration = time() - $start_time;
         my $throughput = $file_size / $duration / 1024 / 1024;
         
-        log_info("Multipart download completed: $operation_id (${throughput:.2f} MB/s)");
+        log_info(sprintf("Multipart download completed: $operation_id (%.2f MB/s, %.1fs)", $throughput, $duration));
         
         $self->_unregister_transfer($operation_id);
         
@@ -375,6 +591,8 @@ sub _multipart_download {
         unlink $local_file;  # Nettoyage du fichier incomplet
         die S3TransferException("Multipart download failed: $@", 'download');
     }
+    
+    return $result;
 }
 
 # Enregistrement d'un transfert actif
@@ -430,25 +648,18 @@ sub _update_transfer_progress {
     $stats->{bytes_transferred} += $bytes_transferred;
     $stats->{last_update} = time();
     
+    PVE::Storage::S3::Logger::flush_if_due();
+    
     # Log du progrès si transfer important
     my $transfer = $self->{active_transfers}->{$operation_id};
     if ($transfer && $transfer->{remote_info}->{total_size}) {
         my $progress = ($stats->{bytes_transferred} / $transfer->{remote_info}->{total_size}) * 100;
         if (int($progress) % 10 == 0) {  # Log tous les 10%
-            log_info("Transfer progress: $operation_id - ${progress:.1f}%");
+            log_info(sprintf("Transfer progress: $operation_id - %.1f%%", $progress));
         }
     }
 }
 
-# Conversion MD5 hex vers base64 pour S3
-sub _hex_to_base64 {
-    my ($hex_string) = @_;
-    
-    require MIME::Base64;
-    my $binary = pack('H*', $hex_string);
-    return MIME::Base64::encode_base64($binary, '');
-}
-
 # Statistiques des transferts actifs
 sub get_active_transfers {
     my ($self) = @_;
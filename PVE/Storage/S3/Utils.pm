@@ -5,64 +5,45 @@ use warnings;
 use Exporter qw(import);
 
 our @EXPORT_OK = qw(
-    log_info log_warn log_error 
+    log_debug log_info log_warn log_error 
     parse_s3_time format_bytes 
     validate_bucket_name validate_key_name
     parse_endpoint sanitize_metadata
+    generate_operation_id file_md5_hex file_sha256_hex
+    is_sidecar_key sidecar_keys check_disk_space create_temp_file cleanup_temp_files
+    volname_to_s3_key s3_key_to_volname listing_prefixes is_valid_key_layout
 );
 
 use POSIX qw(strftime);
 use Time::Local;
 
-# Configuration du logging
-my $LOG_FILE = '/var/log/pve/storage-s3.log';
-my $LOG_LEVEL = $ENV{PVE_S3_LOG_LEVEL} || 'INFO';
+use PVE::Storage::S3::Logger;
+
+# Fonctions de logging (niveau vérifié avant tout formatage)
+#
+# $fields (optionnel) complète les messages JSON, par exemple avec
+# { operation_id => ... }.
+sub log_debug {
+    my ($message, $fields) = @_;
+    return if $PVE::Storage::S3::Logger::MIN_LEVEL > $PVE::Storage::S3::Logger::LEVELS{DEBUG};
+    PVE::Storage::S3::Logger::log_message('DEBUG', $message, $fields);
+}
 
-# Fonctions de logging
 sub log_info {
-    my ($message) = @_;
-    _write_log('INFO', $message);
+    my ($message, $fields) = @_;
+    return if $PVE::Storage::S3::Logger::MIN_LEVEL > $PVE::Storage::S3::Logger::LEVELS{INFO};
+    PVE::Storage::S3::Logger::log_message('INFO', $message, $fields);
 }
 
 sub log_warn {
-    my ($message) = @_;
-    _write_log('WARN', $message);
+    my ($message, $fields) = @_;
+    return if $PVE::Storage::S3::Logger::MIN_LEVEL > $PVE::Storage::S3::Logger::LEVELS{WARN};
+    PVE::Storage::S3::Logger::log_message('WARN', $message, $fields);
 }
 
 sub log_error {
-    my ($message) = @_;
-    _write_log('ERROR', $message);
-}
-
-sub _write_log {
-    my ($level, $message) = @_;
-    
-    return if !_should_log($level);
-    
-    my $timestamp = strftime('%Y-%m-%d %H:%M:%S', localtime);
-    my $pid = $$;
-    my $log_entry = "[$timestamp] [$level] [$$] $message\n";
-    
-    if (open my $fh, '>>', $LOG_FILE) {
-        print $fh $log_entry;
-        close $fh;
-    } else {
-        # Fallback vers syslog
-        warn $log_entry;
-    }
-}
-
-sub _should_log {
-    my ($level) = @_;
-    
-    my %levels = (
-        'DEBUG' => 0,
-        'INFO'  => 1,
-        'WARN'  => 2,
-        'ERROR' => 3,
-    );
-    
-    return ($levels{$level} // 1) >= ($levels{$LOG_LEVEL} // 1);
+    my ($message, $fields) = @_;
+    PVE::Storage::S3::Logger::log_message('ERROR', $message, $fields);
 }
 
 # Parse d'un timestamp S3 vers epoch Unix
@@ -155,7 +136,7 @@ sub parse_endpoint {
         url => $endpoint,
         host => $host,
         path => $path,
-        ssl => $endpoint =~ /^https:/,
+        ssl => ($endpoint =~ /^https:/ ? 1 : 0),
     };
 }
 
@@ -200,28 +181,57 @@ sub generate_operation_id {
 sub file_md5_hex {
     my ($file_path) = @_;
     
-    require Digest::MD5;
-    
-    open my $fh, '<:raw', $file_path or return undef;
-    my $md5 = Digest::MD5->new();
-    $md5->addfile($fh);
-    close $fh;
+    my $digests = _file_digests($file_path) or return undef;
     
-    return $md5->hexdigest();
+    return $digests->{md5};
 }
 
 # Calcul du hash SHA256 d'un fichier
 sub file_sha256_hex {
     my ($file_path) = @_;
     
-    require Digest::SHA;
+    my $digests = _file_digests($file_path) or return undef;
+    
+    return $digests->{sha256};
+}
+
+# MD5 et SHA-256 calculés en une seule lecture (gardés pour l'appel suivant
+# sur le même fichier inchangé)
+my %last_digests = ();
+
+sub _file_digests {
+    my ($file_path) = @_;
+    
+    my @stat = stat($file_path) or return undef;
+    my $id = join(':', $file_path, @stat[0, 1, 7, 9]);
+    
+    return $last_digests{digests} if ($last_digests{id} // '') eq $id;
     
-    open my $fh, '<:raw', $file_path or return undef;
-    my $sha = Digest::SHA->new(256);
-    $sha->addfile($fh);
-    close $fh;
+    require PVE::Storage::S3::Hash;
+    my $digests = eval { PVE::Storage::S3::Hash::hash_file($file_path) } or return undef;
+    %last_digests = (id => $id, digests => $digests);
     
-    return $sha->hexdigest();
+    return $digests;
+}
+
+# Objets annexes stockés à côté des archives (index, manifestes)
+my @SIDECAR_SUFFIXES = ('.index.json', '.manifest.json');
+
+sub is_sidecar_key {
+    my ($key) = @_;
+    
+    foreach my $suffix (@SIDECAR_SUFFIXES) {
+        return 1 if substr($key, -length($suffix)) eq $suffix;
+    }
+    
+    return 0;
+}
+
+# Clés des objets annexes possibles d'un objet
+sub sidecar_keys {
+    my ($key) = @_;
+    
+    return map { $key . $_ } @SIDECAR_SUFFIXES;
 }
 
 # Vérification de l'espace disque disponible
@@ -284,33 +294,88 @@ sub cleanup_temp_files {
     };
 }
 
+# Organisation des clés sous le préfixe du stockage
+#
+# "flat": la clé est le nom du volume. "partitioned": les backups sont
+# rangés sous backup/<vmid>/<date>/ et les disques sous images/<vmid>/, ce
+# qui permet de lister un seul VMID et répartit les requêtes sur plusieurs
+# préfixes S3. Les ISO, templates et snippets ont déjà leur propre préfixe.
+my %KEY_LAYOUTS = map { $_ => 1 } qw(flat partitioned);
+
+sub is_valid_key_layout {
+    my ($layout) = @_;
+    
+    return defined($layout) && $KEY_LAYOUTS{$layout} ? 1 : 0;
+}
+
 # Conversion d'un nom de volume Proxmox vers une clé S3
 sub volname_to_s3_key {
-    my ($volname, $prefix) = @_;
+    my ($volname, $prefix, $layout) = @_;
     
     $prefix //= '';
-    $prefix =~ s|/+$|/| if $prefix;  # Normalise le slash final
+    $prefix =~ s|/*$|/| if $prefix;  # Normalise le slash final
     
     # Échappe les caractères spéciaux pour S3
     my $key = $volname;
     $key =~ s|/+|/|g;          # Normalise les slashes
     $key =~ s|^/||;            # Supprime le slash initial
     
+    if (($layout // 'flat') eq 'partitioned') {
+        if ($key =~ m!^backup/(vzdump-(?:qemu|lxc|openvz)-(\d+)-(\d{4}_\d\d_\d\d)-.*)$!) {
+            $key = "backup/$2/$3/$1";
+        } elsif ($key =~ m!^((?:vm|base)-(\d+)-[^/]+)$!) {
+            $key = "images/$2/$1";
+        }
+    }
+    
     return $prefix . $key;
 }
 
 # Conversion d'une clé S3 vers un nom de volume Proxmox
+#
+# Les clés des deux organisations sont reconnues (migration en cours).
 sub s3_key_to_volname {
     my ($key, $prefix) = @_;
     
     $prefix //= '';
     
     if ($prefix) {
-        $prefix =~ s|/+$|/|;   # Normalise le slash final
+        $prefix =~ s|/*$|/|;   # Normalise le slash final
         $key =~ s/^\Q$prefix\E//;  # Supprime le préfixe
     }
     
+    $key =~ s!^backup/\d+/\d{4}_\d\d_\d\d/(vzdump-)!backup/$1!;
+    $key =~ s!^images/\d+/((?:vm|base)-\d+-[^/]+)$!$1!;
+    
     return $key;
 }
 
-1;
\ No newline at end of file
+# Préfixes à lister pour un type de contenu (et éventuellement un VMID)
+#
+# Les préfixes sont retournés dans l'ordre des clés. Sans VMID, les disques
+# de l'organisation "flat" sont à la racine: tout le préfixe est listé.
+sub listing_prefixes {
+    my ($prefix, $layout, $content, $vmid) = @_;
+    
+    $prefix //= '';
+    $prefix =~ s|/*$|/| if $prefix;
+    
+    my $partitioned = ($layout // 'flat') eq 'partitioned';
+    my @prefixes;
+    
+    if ($content eq 'backup') {
+        @prefixes = !defined($vmid) ? ('backup/')
+            : $partitioned ? ("backup/$vmid/")
+            : map { "backup/vzdump-$_-$vmid-" } qw(lxc openvz qemu);
+    } elsif ($content eq 'images') {
+        @prefixes = $partitioned ? (defined($vmid) ? "images/$vmid/" : 'images/')
+            : defined($vmid) ? ("base-$vmid-", "vm-$vmid-")
+            : ('');
+    } else {
+        @prefixes = ("$content/");
+    }
+    
+    return map { $prefix . $_ } @prefixes;
+}
+
+1;
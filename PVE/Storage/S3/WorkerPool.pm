@@ -0,0 +1,176 @@
+package PVE::Storage::S3::WorkerPool;
+
+use strict;
+use warnings;
+
+use IO::Select;
+use POSIX ();
+use Storable qw(freeze thaw);
+
+use PVE::Storage::S3::Exception qw(S3Exception);
+use PVE::Storage::S3::Logger;
+use PVE::Storage::S3::Metrics;
+
+# Retourné par la source de tâches quand aucune tâche n'est prête: elle sera
+# rappelée après le résultat suivant
+use constant DEFER => 'PVE::Storage::S3::WorkerPool::DEFER';
+
+# Pool de processus pour les opérations S3 parallèles
+#
+# Chaque tâche est exécutée dans un processus fils (fork) et son résultat
+# est renvoyé au parent via un pipe (sérialisé avec Storable). Les tâches
+# sont demandées au fur et à mesure, ce qui permet de parcourir de très
+# gros buckets sans tout charger en mémoire.
+
+# Constructeur
+sub new {
+    my ($class, $options) = @_;
+    
+    $options //= {};
+    
+    my $self = {
+        workers => $options->{workers} || 4,
+        stopped => 0,
+    };
+    
+    return bless $self, $class;
+}
+
+# Arrêt de la distribution des tâches (les tâches en cours se terminent)
+sub stop {
+    my ($self) = @_;
+    
+    $self->{stopped} = 1;
+}
+
+# Exécution des tâches
+#
+# $tasks: référence de tableau ou fonction retournant la tâche suivante (undef
+# quand il n'y en a plus, DEFER pour attendre un résultat). $handler est appelé dans le fils avec la tâche,
+# $on_result dans le parent avec ($task, $result, $error).
+sub run {
+    my ($self, $tasks, $handler, $on_result) = @_;
+    
+    my $next_task = ref($tasks) eq 'CODE' ? $tasks : do {
+        my @queue = @$tasks;
+        sub { shift @queue };
+    };
+    
+    my $select = IO::Select->new();
+    my %running = ();
+    my $exhausted = 0;
+    
+    $self->{stopped} = 0;
+    
+    while (1) {
+        while (!$exhausted && !$self->{stopped} && keys(%running) < $self->{workers}) {
+            my $task = $next_task->();
+            if (!defined $task) {
+                $exhausted = 1;
+                last;
+            }
+            if (!ref($task) && $task eq DEFER) {
+                die S3Exception("Task source deferred with no running task") if !%running;
+                last;
+            }
+            my $worker = $self->_spawn($task, $handler, \%running);
+            $select->add($worker->{fh});
+        }
+        
+        last if !%running;
+        
+        foreach my $fh ($select->can_read()) {
+            my $worker = $running{fileno($fh)};
+            my $bytes = sysread($fh, my $buffer, 65536);
+            
+            if (!defined $bytes) {
+                next if $!{EINTR} || $!{EAGAIN};
+                $bytes = 0;
+            }
+            
+            if ($bytes) {
+                $worker->{output} .= $buffer;
+                next;
+            }
+            
+            # Fin du fils: récupération du résultat
+            $select->remove($fh);
+            close $fh;
+            delete $running{$worker->{fd}};
+            waitpid($worker->{pid}, 0);
+            
+            my ($result, $error) = _decode_output($worker);
+            $on_result->($worker->{task}, $result, $error) if $on_result;
+        }
+    }
+    
+    return !$self->{stopped};
+}
+
+sub _spawn {
+    my ($self, $task, $handler, $running) = @_;
+    
+    pipe(my $reader, my $writer) or die S3Exception("Cannot create pipe: $!");
+    
+    # Messages en attente écrits avant ceux du fils
+    PVE::Storage::S3::Logger::flush();
+    
+    my $pid = fork();
+    die S3Exception("Cannot fork worker: $!") if !defined $pid;
+    
+    if (!$pid) {
+        close $reader;
+        close $_->{fh} foreach values %$running;
+        
+        # Interruption gérée par le parent: les tâches en cours se terminent
+        $SIG{INT} = 'IGNORE';
+        $SIG{TERM} = 'DEFAULT';
+        
+        my $result = eval { $handler->($task) };
+        my $error = $@ ? "$@" : undef;
+        
+        my $output = eval { freeze({ result => $result, error => $error }) }
+            // freeze({ error => "Cannot serialize worker result: $@" });
+        
+        binmode $writer;
+        print $writer $output;
+        close $writer;
+        
+        # Pas de bloc END avec _exit: écriture des messages et métriques du fils
+        PVE::Storage::S3::Logger::flush();
+        PVE::Storage::S3::Metrics::flush();
+        POSIX::_exit(0);
+    }
+    
+    close $writer;
+    
+    my $worker = {
+        pid => $pid,
+        fh => $reader,
+        fd => fileno($reader),
+        task => $task,
+        output => '',
+    };
+    $running->{$worker->{fd}} = $worker;
+    
+    return $worker;
+}
+
+sub _decode_output {
+    my ($worker) = @_;
+    
+    if ($worker->{output} eq '') {
+        my $status = $? >> 8;
+        my $signal = $? & 127;
+        return (undef, $signal
+            ? "worker killed by signal $signal"
+            : "worker exited without result (status $status)");
+    }
+    
+    my $data = eval { thaw($worker->{output}) };
+    return (undef, "Cannot decode worker result: $@") if !$data;
+    
+    return ($data->{result}, $data->{error});
+}
+
+1;
@@ -8,10 +8,14 @@ use PVE::Storage::Plugin;
 use PVE::JSONSchema qw(get_standard_option);
 use PVE::Tools;
 
+# Les autres modules S3 (client, LWP, index d'archive, cache...) sont chargés
+# au premier usage: le plugin est compilé par chaque processus PVE
+use PVE::Storage::S3::Utils;
+
 use base qw(PVE::Storage::Plugin);
 use File::Path qw(make_path);
 use File::Basename qw(basename dirname);
-use POSIX qw(strftime);
+use POSIX qw(strftime mktime);
 
 # Configuration du plugin
 sub type {
@@ -91,6 +95,14 @@ sub properties {
             optional => 1,
             default => 'proxmox/',
         },
+        key_layout => {
+            description => "Object key layout: 'flat' (volume name under the prefix) or "
+                . "'partitioned' (backups under backup/<vmid>/<date>/, disks under images/<vmid>/)",
+            type => 'string',
+            enum => ['flat', 'partitioned'],
+            optional => 1,
+            default => 'flat',
+        },
         storage_class => {
             description => "S3 storage class",
             type => 'string',
@@ -136,6 +148,56 @@ sub properties {
             default => 60,
             optional => 1,
         },
+        
+        # Capacités du fournisseur (profil écrit par l'installateur)
+        addressing_style => {
+            description => "Request addressing: 'path' (endpoint/bucket/key) or 'virtual' (bucket.endpoint/key)",
+            type => 'string',
+            enum => ['path', 'virtual'],
+            default => 'path',
+            optional => 1,
+        },
+        max_parts => {
+            description => "Maximum number of parts of a multipart upload (larger files use larger parts)",
+            type => 'integer',
+            minimum => 1,
+            maximum => 10000,
+            default => 10000,
+            optional => 1,
+        },
+        batch_delete => {
+            description => "Provider supports DeleteObjects (otherwise objects are deleted one by one)",
+            type => 'boolean',
+            default => 1,
+            optional => 1,
+        },
+        upload_part_copy => {
+            description => "Provider supports UploadPartCopy (server-side copy of objects over 5GB)",
+            type => 'boolean',
+            default => 1,
+            optional => 1,
+        },
+        checksum_algorithm => {
+            description => "Checksum verified by the provider on upload, in addition to Content-MD5",
+            type => 'string',
+            enum => ['md5', 'crc32', 'sha256'],
+            default => 'md5',
+            optional => 1,
+        },
+        
+        # Cache local des ISO et templates
+        cache_dir => {
+            description => "Local cache directory for ISO images and container templates",
+            type => 'string',
+            optional => 1,
+        },
+        cache_max_size => {
+            description => "Maximum size of the local ISO/template cache (MB)",
+            type => 'integer',
+            minimum => 1024,
+            default => 10240,
+            optional => 1,
+        },
     };
 }
 
@@ -151,6 +213,7 @@ sub options {
         # Options optionnelles
         region => { optional => 1 },
         prefix => { optional => 1 },
+        key_layout => { optional => 1 },
         storage_class => { optional => 1 },
         server_side_encryption => { optional => 1 },
         kms_key_id => { optional => 1 },
@@ -160,31 +223,52 @@ sub options {
         multipart_chunk_size => { optional => 1 },
         max_concurrent_uploads => { optional => 1 },
         connection_timeout => { optional => 1 },
+        addressing_style => { optional => 1 },
+        max_parts => { optional => 1 },
+        batch_delete => { optional => 1 },
+        upload_part_copy => { optional => 1 },
+        checksum_algorithm => { optional => 1 },
+        
+        # Options du cache local
+        cache_dir => { optional => 1 },
+        cache_max_size => { optional => 1 },
         
         # Options standard Proxmox
         content => { optional => 1 },
         nodes => { optional => 1 },
         disable => { optional => 1 },
         maxfiles => { optional => 1 },
+        'prune-backups' => { optional => 1 },
         shared => { optional => 1, fixed => 1 },
     };
 }
 
 # Création du client S3
 sub get_s3_client {
-    my ($class, $scfg) = @_;
+    my ($class, $scfg, $storeid) = @_;
+    
+    require PVE::Storage::S3::Config;
+    require PVE::Storage::S3::Auth;
+    require PVE::Storage::S3::Client;
     
     my $config = PVE::Storage::S3::Config->new({
+        storage_id => $storeid,
         endpoint => $scfg->{endpoint},
         region => $scfg->{region} // 'us-east-1',
         bucket => $scfg->{bucket},
         prefix => $scfg->{prefix} // 'proxmox/',
+        key_layout => $scfg->{key_layout} // 'flat',
         storage_class => $scfg->{storage_class} // 'STANDARD',
         server_side_encryption => $scfg->{server_side_encryption},
         kms_key_id => $scfg->{kms_key_id},
         multipart_chunk_size => ($scfg->{multipart_chunk_size} // 100) * 1024 * 1024,
         max_concurrent_uploads => $scfg->{max_concurrent_uploads} // 3,
         connection_timeout => $scfg->{connection_timeout} // 60,
+        addressing_style => $scfg->{addressing_style} // 'path',
+        max_parts => $scfg->{max_parts} // 10000,
+        batch_delete => $scfg->{batch_delete} // 1,
+        upload_part_copy => $scfg->{upload_part_copy} // 1,
+        checksum_algorithm => $scfg->{checksum_algorithm} // 'md5',
     });
     
     my $auth = PVE::Storage::S3::Auth->new({
@@ -196,28 +280,67 @@ sub get_s3_client {
     return PVE::Storage::S3::Client->new($config, $auth);
 }
 
-# Génération du chemin S3
-sub path {
-    my ($class, $scfg, $volname, $storeid, $snapname) = @_;
+# Emplacement S3 (bucket, clé) d'un volume
+sub s3_location {
+    my ($class, $scfg, $volname, $snapname) = @_;
     
     my $prefix = $scfg->{prefix} // 'proxmox/';
-    $prefix =~ s|/+$|/|; # Assure qu'il y a un slash final
+    $prefix =~ s|/*$|/|; # Assure qu'il y a un slash final
     
-    my $path;
+    my $key;
     if ($snapname) {
-        $path = "${prefix}snapshots/${volname}/${snapname}";
+        $key = "${prefix}snapshots/${volname}/${snapname}";
     } else {
-        $path = "${prefix}${volname}";
+        $key = PVE::Storage::S3::Utils::volname_to_s3_key($volname, $prefix, $scfg->{key_layout});
+    }
+    
+    return ($scfg->{bucket}, $key);
+}
+
+# Préfixes S3 à lister pour un type de contenu (et un VMID)
+sub s3_listing_prefixes {
+    my ($class, $scfg, $content, $vmid) = @_;
+    
+    return PVE::Storage::S3::Utils::listing_prefixes(
+        $scfg->{prefix} // 'proxmox/', $scfg->{key_layout}, $content, $vmid);
+}
+
+# Cache local des ISO et templates d'un stockage
+sub get_cache {
+    my ($class, $storeid, $scfg, $s3_client) = @_;
+    
+    $s3_client //= $class->get_s3_client($scfg, $storeid);
+    
+    require PVE::Storage::S3::Cache;
+    return PVE::Storage::S3::Cache->new($s3_client, $scfg->{bucket}, {
+        storeid => $storeid,
+        dir => $scfg->{cache_dir},
+        max_size => ($scfg->{cache_max_size} // 10240) * 1024 * 1024,
+    });
+}
+
+# Génération du chemin d'un volume
+#
+# Les ISO et templates sont servis depuis le cache local (téléchargés à la
+# demande), les autres volumes sont désignés par leur bucket et leur clé.
+sub path {
+    my ($class, $scfg, $volname, $storeid, $snapname) = @_;
+    
+    if (!$snapname && $volname =~ m!^(iso|vztmpl)/!) {
+        my $vtype = $1;
+        my (undef, $key) = $class->s3_location($scfg, $volname);
+        my $local_path = $class->get_cache($storeid, $scfg)->fetch($key, $volname);
+        return wantarray ? ($local_path, undef, $vtype) : $local_path;
     }
     
-    return ($scfg->{bucket}, $path);
+    return $class->s3_location($scfg, $volname, $snapname);
 }
 
 # Activation du stockage
 sub activate_storage {
     my ($class, $storeid, $scfg, $cache) = @_;
     
-    my $s3_client = $class->get_s3_client($scfg);
+    my $s3_client = $class->get_s3_client($scfg, $storeid);
     
     # Vérification de la connectivité
     eval {
@@ -250,50 +373,57 @@ sub activate_storage {
 }
 
 # Liste des images/backups
+#
+# Avec un VMID, seuls les préfixes de ce VMID sont listés (disques et
+# backups), sans parcourir tout le stockage.
 sub list_images {
     my ($class, $storeid, $scfg, $vmid, $vollist, $cache) = @_;
     
-    my $s3_client = $class->get_s3_client($scfg);
+    my $s3_client = $class->get_s3_client($scfg, $storeid);
     my $prefix = $scfg->{prefix} // 'proxmox/';
     
+    my @prefixes = defined($vmid)
+        ? map { $class->s3_listing_prefixes($scfg, $_, $vmid) } qw(backup images)
+        : ($prefix);
+    
     my $res = [];
     
     eval {
-        my $objects = $s3_client->list_objects($scfg->{bucket}, $prefix);
-        
-        foreach my $object (@$objects) {
-            my $key = $object->{Key};
-            next if !defined($key) || $key eq $prefix; # Skip dossiers
-            
-            # Supprime le préfixe pour obtenir le nom du volume
-            my $volname = $key;
-            $volname =~ s/^\Q$prefix\E//;
+        foreach my $list_prefix (@prefixes) {
+            my $objects = $s3_client->list_objects($scfg->{bucket}, $list_prefix);
             
-            # Parse le nom du fichier
-            if ($volname =~ /^backup\//) {
-                # C'est un backup
-                if ($volname =~ /^backup\/vzdump-(\w+)-(\d+)-(\d{4}_\d{2}_\d{2}-\d{2}_\d{2}_\d{2})\.(\w+)(?:\.(\w+))?$/) {
-                    my ($format, $vmid_found, $timestamp, $ext, $compress) = ($1, $2, $3, $4, $5);
-                    
-                    next if $vmid && $vmid ne $vmid_found;
-                    
-                    my $volid = "$storeid:backup/$volname";
+            foreach my $object (@$objects) {
+                my $key = $object->{Key};
+                next if !defined($key) || $key eq $prefix; # Skip dossiers
+                next if PVE::Storage::S3::Utils::is_sidecar_key($key);
+                
+                # Nom du volume (quelle que soit l'organisation des clés)
+                my $volname = PVE::Storage::S3::Utils::s3_key_to_volname($key, $prefix);
+                
+                # Parse le nom du fichier
+                if ($volname =~ /^backup\//) {
+                    # C'est un backup
+                    if ($volname =~ /^backup\/vzdump-(\w+)-(\d+)-(\d{4}_\d{2}_\d{2}-\d{2}_\d{2}_\d{2})\.(\w+)(?:\.(\w+))?$/) {
+                        my ($format, $vmid_found, $timestamp, $ext, $compress) = ($1, $2, $3, $4, $5);
+                        
+                        next if $vmid && $vmid ne $vmid_found;
+                        
+                        push @$res, {
+                            volid => "$storeid:$volname",
+                            format => $format,
+                            size => $object->{Size},
+                            vmid => $vmid_found,
+                            ctime => PVE::Storage::S3::Utils::parse_s3_time($object->{LastModified}),
+                        };
+                    }
+                } else {
+                    # Autres types de contenu (ISO, templates, etc.)
                     push @$res, {
-                        volid => $volid,
-                        format => $format,
+                        volid => "$storeid:$volname",
                         size => $object->{Size},
-                        vmid => $vmid_found,
                         ctime => PVE::Storage::S3::Utils::parse_s3_time($object->{LastModified}),
                     };
                 }
-            } else {
-                # Autres types de contenu (ISO, templates, etc.)
-                my $volid = "$storeid:$volname";
-                push @$res, {
-                    volid => $volid,
-                    size => $object->{Size},
-                    ctime => PVE::Storage::S3::Utils::parse_s3_time($object->{LastModified}),
-                };
             }
         }
     };
@@ -308,7 +438,7 @@ sub list_images {
 sub status {
     my ($class, $storeid, $scfg, $cache) = @_;
     
-    my $s3_client = $class->get_s3_client($scfg);
+    my $s3_client = $class->get_s3_client($scfg, $storeid);
     
     eval {
         $s3_client->test_connection();
@@ -351,8 +481,8 @@ sub alloc_image {
     my $volid = "$storeid:$volname";
     
     # Création d'un fichier temporaire vide pour réserver l'espace
-    my ($bucket, $key) = $class->path($scfg, $volname, $storeid);
-    my $s3_client = $class->get_s3_client($scfg);
+    my ($bucket, $key) = $class->s3_location($scfg, $volname);
+    my $s3_client = $class->get_s3_client($scfg, $storeid);
     
     eval {
         # Créer un fichier sparse temporaire
@@ -362,6 +492,7 @@ sub alloc_image {
         # Upload vers S3
         $s3_client->upload_file($temp_file, $bucket, $key, {
             content_type => 'application/octet-stream',
+            priority => 'upload',
             metadata => {
                 'x-pve-vmid' => $vmid,
                 'x-pve-format' => $fmt,
@@ -383,8 +514,8 @@ sub alloc_image {
 sub free_image {
     my ($class, $storeid, $scfg, $volname, $isBase) = @_;
     
-    my ($bucket, $key) = $class->path($scfg, $volname, $storeid);
-    my $s3_client = $class->get_s3_client($scfg);
+    my ($bucket, $key) = $class->s3_location($scfg, $volname);
+    my $s3_client = $class->get_s3_client($scfg, $storeid);
     
     eval {
         $s3_client->delete_object($bucket, $key);
@@ -393,6 +524,18 @@ sub free_image {
         die "Cannot delete image '$volname': $@";
     }
     
+    # Suppression des objets annexes (index, manifeste) et de la config en cache
+    foreach my $sidecar_key (PVE::Storage::S3::Utils::sidecar_keys($key)) {
+        eval { $s3_client->delete_object($bucket, $sidecar_key); };
+    }
+    require PVE::Storage::S3::ArchiveIndex;
+    PVE::Storage::S3::ArchiveIndex::invalidate_cached_config($bucket, $key);
+    
+    # Suppression de la copie locale des ISO et templates
+    if ($volname =~ m!^(?:iso|vztmpl)/!) {
+        $class->get_cache($storeid, $scfg, $s3_client)->invalidate($volname);
+    }
+    
     return undef;
 }
 
@@ -400,8 +543,8 @@ sub free_image {
 sub clone_image {
     my ($class, $scfg, $storeid, $volname, $vmid, $snap) = @_;
     
-    my $s3_client = $class->get_s3_client($scfg);
-    my ($bucket, $source_key) = $class->path($scfg, $volname, $storeid, $snap);
+    my $s3_client = $class->get_s3_client($scfg, $storeid);
+    my ($bucket, $source_key) = $class->s3_location($scfg, $volname, $snap);
     
     # Génération du nom de destination
     my $clone_name = "vm-$vmid-disk-" . int(rand(10000));
@@ -409,7 +552,7 @@ sub clone_image {
         $clone_name .= ".$1";
     }
     
-    my ($dest_bucket, $dest_key) = $class->path($scfg, $clone_name, $storeid);
+    my ($dest_bucket, $dest_key) = $class->s3_location($scfg, $clone_name);
     
     eval {
         $s3_client->copy_object($bucket, $source_key, $dest_bucket, $dest_key, {
@@ -433,7 +576,7 @@ sub archive_info {
     my ($class, $scfg, $volname) = @_;
     
     my $s3_client = $class->get_s3_client($scfg);
-    my ($bucket, $key) = $class->path($scfg, $volname, undef);
+    my ($bucket, $key) = $class->s3_location($scfg, $volname);
     
     my $info = {};
     
@@ -465,33 +608,88 @@ sub extract_vzdump_config {
     my ($class, $scfg, $volname) = @_;
     
     my $s3_client = $class->get_s3_client($scfg);
-    my ($bucket, $key) = $class->path($scfg, $volname, undef);
-    
-    # Télécharge temporairement le début du fichier pour extraire la config
-    my $temp_file = "/tmp/pve-s3-extract-" . int(rand(10000));
+    my ($bucket, $key) = $class->s3_location($scfg, $volname);
     
-    eval {
-        # Télécharge seulement les premiers 64KB
-        $s3_client->download_range($bucket, $key, $temp_file, 0, 65536);
-        
-        # Extraction de la config selon le format
-        my $config = '';
-        if ($volname =~ /\.tar\./) {
-            # Format tar
-            $config = `tar -xOf $temp_file qemu-server.conf 2>/dev/null || tar -xOf $temp_file pct.conf 2>/dev/null`;
-        } elsif ($volname =~ /\.vma\./) {
-            # Format VMA
-            $config = `vma config $temp_file 2>/dev/null`;
-        }
-        
-        unlink $temp_file;
-        
-        return $config;
+    # Lecture ciblée via l'index de l'archive (ou du début de l'archive)
+    require PVE::Storage::S3::ArchiveIndex;
+    my $config = eval {
+        PVE::Storage::S3::ArchiveIndex::extract_config($s3_client, $bucket, $key);
     };
     if ($@) {
-        unlink $temp_file if -f $temp_file;
         die "Cannot extract config from '$volname': $@";
     }
+    
+    return $config;
+}
+
+# Application d'une politique de rétention (prune-backups)
+#
+# Les backups sont indexés une seule fois (seuls les préfixes du VMID sont
+# listés quand il est donné) puis supprimés par lots avec leurs objets annexes.
+sub prune_backups {
+    my ($class, $scfg, $storeid, $keep, $vmid, $type, $dryrun, $logfunc) = @_;
+    
+    $logfunc //= sub { print "$_[1]\n" };
+    
+    my $s3_client = $class->get_s3_client($scfg, $storeid);
+    my $bucket = $scfg->{bucket};
+    my $prefix = $scfg->{prefix} // 'proxmox/';
+    
+    my @prefixes = $class->s3_listing_prefixes($scfg, 'backup', $vmid);
+    
+    my @objects = ();
+    foreach my $list_prefix (@prefixes) {
+        my $listing = $s3_client->object_iterator($bucket, $list_prefix);
+        while (my $object = $listing->()) {
+            push @objects, $object if !PVE::Storage::S3::Utils::is_sidecar_key($object->{Key});
+        }
+    }
+    
+    require PVE::Storage::S3::Retention;
+    my $plan = PVE::Storage::S3::Retention::plan(\@objects, $keep // {});
+    
+    my $prune_list = [];
+    my @remove_keys = ();
+    
+    foreach my $mark (qw(keep remove)) {
+        foreach my $object (@{$plan->{$mark}}) {
+            my $info = PVE::Storage::S3::Retention::parse_backup_name($object->{Key});
+            next if $type && $info->{type} ne $type;
+            next if !$type && $info->{type} !~ /^(?:qemu|lxc)$/;
+            
+            push @$prune_list, {
+                volid => "$storeid:" . PVE::Storage::S3::Utils::s3_key_to_volname($object->{Key}, $prefix),
+                type => $info->{type},
+                vmid => $info->{vmid},
+                ctime => mktime($info->{second}, $info->{minute}, $info->{hour},
+                    $info->{day}, $info->{month} - 1, $info->{year} - 1900),
+                mark => $mark,
+            };
+            push @remove_keys, $object->{Key} if $mark eq 'remove';
+        }
+    }
+    
+    return $prune_list if $dryrun || !@remove_keys;
+    
+    my $result = $s3_client->delete_objects($bucket, [
+        map { ($_, PVE::Storage::S3::Utils::sidecar_keys($_)) } @remove_keys
+    ]);
+    
+    require PVE::Storage::S3::ArchiveIndex;
+    my %failed = map { $_->{Key} => $_ } @{$result->{errors}};
+    foreach my $key (@remove_keys) {
+        my $volname = PVE::Storage::S3::Utils::s3_key_to_volname($key, $prefix);
+        if (my $error = $failed{$key}) {
+            $logfunc->('err', "error when removing backup '$volname' - $error->{Code}: $error->{Message}");
+            next;
+        }
+        PVE::Storage::S3::ArchiveIndex::invalidate_cached_config($bucket, $key);
+        $logfunc->('info', "removed backup '$volname'");
+    }
+    
+    die "error pruning backups - check log\n" if grep { $failed{$_} } @remove_keys;
+    
+    return $prune_list;
 }
 
 # Enregistrement du plugin
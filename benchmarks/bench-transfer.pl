@@ -0,0 +1,88 @@
+#!/usr/bin/perl
+
+use strict;
+use warnings;
+use Getopt::Long;
+use JSON::PP;
+use Time::HiRes qw(time);
+use FindBin;
+
+# Modules du dépôt (et non ceux installés dans /usr/share/perl5)
+use lib "$FindBin::Bin/..";
+
+use PVE::Storage::S3::Client;
+use PVE::Storage::S3::Config;
+use PVE::Storage::S3::Auth;
+
+# Exécute une phase de benchmark (upload, download, list) avec le client du
+# plugin et écrit le résultat en JSON sur la sortie standard. Lancé par
+# run_benchmarks.py, un processus par phase pour mesurer la mémoire de pointe.
+
+my %options = (
+    endpoint => undef,
+    bucket => 'bench',
+    key => undef,
+    prefix => '',
+    file => undef,
+    part_size => 8 * 1024 * 1024,
+    concurrency => 3,
+);
+
+GetOptions(
+    'endpoint=s' => \$options{endpoint},
+    'bucket=s' => \$options{bucket},
+    'key=s' => \$options{key},
+    'prefix=s' => \$options{prefix},
+    'file=s' => \$options{file},
+    'part-size=i' => \$options{part_size},
+    'concurrency=i' => \$options{concurrency},
+) or die "usage: $0 --endpoint URL {upload|download|list} [options]\n";
+
+my $phase = shift @ARGV // die "phase required (upload, download, list)\n";
+die "--endpoint required\n" if !$options{endpoint};
+
+my $storage_config = {
+    type => 's3',
+    storage_id => 'bench',
+    endpoint => $options{endpoint},
+    bucket => $options{bucket},
+    region => 'us-east-1',
+    access_key => 'BENCHACCESSKEY000001',
+    secret_key => 'bench/secret/key/00000000000000000000000',
+    multipart_chunk_size => $options{part_size},
+    max_concurrent_uploads => $options{concurrency},
+};
+
+my $client = PVE::Storage::S3::Client->new(
+    PVE::Storage::S3::Config->new($storage_config),
+    PVE::Storage::S3::Auth->new($storage_config),
+);
+
+my %phases = (
+    upload => sub {
+        die "--file and --key required\n" if !$options{file} || !$options{key};
+        $client->upload_file($options{file}, $options{bucket}, $options{key});
+        return -s $options{file};
+    },
+    download => sub {
+        die "--file and --key required\n" if !$options{file} || !$options{key};
+        $client->download_file($options{bucket}, $options{key}, $options{file});
+        return -s $options{file};
+    },
+    list => sub {
+        my $objects = $client->list_objects($options{bucket}, $options{prefix}, { limit => 1_000_000 });
+        return scalar(@$objects);
+    },
+);
+
+my $run = $phases{$phase} // die "unknown phase: $phase\n";
+
+my $start = time();
+my $count = $run->();
+my $seconds = time() - $start;
+
+print JSON::PP->new->canonical->encode({
+    phase => $phase,
+    seconds => $seconds,
+    ($phase eq 'list' ? (objects => $count) : (bytes => $count)),
+}), "\n";
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+Proxy S3 injectant des pannes et de la latence
+
+Se place entre le plugin et un endpoint S3 (réel ou s3_standin.py) en mode
+reverse proxy: l'endpoint du stockage pointe sur le proxy, qui relaie les
+requêtes vers --upstream. Des règles, par type d'opération (noms de
+PVE::Storage::S3::Client::_operation_name), injectent:
+
+- slowdown: 503 SlowDown (erreur S3)
+- error: 500 InternalError
+- reset: connexion réinitialisée (RST), avant ou après relais vers l'amont
+- truncate: corps de réponse tronqué (Content-Length complet annoncé)
+- throttle: débit limité (bandwidth en MB/s) de la requête et de la réponse
+- latency: délai tiré d'une distribution (fixed, uniform, lognormal, pareto)
+
+Exemple de fichier de règles (JSON):
+
+    {"seed": 42, "rules": [
+        {"operation": "put_part", "fault": "slowdown", "probability": 0.2},
+        {"operation": "put_part", "fault": "slowdown", "start": 10, "count": 30},
+        {"operation": "get_range", "fault": "truncate", "every": 7, "fraction": 0.5},
+        {"operation": "*", "fault": "latency", "distribution": "lognormal", "median": 20, "sigma": 1.2},
+        {"operation": "get*", "fault": "throttle", "bandwidth": 20}
+    ]}
+
+Les règles throttle et latency se cumulent; la première règle de panne
+(slowdown, error, reset, truncate) qui s'applique est injectée. start/count
+et every portent sur le rang de la requête parmi celles de l'opération.
+
+Le proxy reconnaît les nouvelles tentatives du plugin (même requête après
+un échec) et rapporte par opération: tentatives, requêtes relancées,
+échecs définitifs, pannes injectées et latence de bout en bout (de la
+première tentative à la dernière réponse).
+
+    python3 benchmarks/fault_proxy.py --upstream http://127.0.0.1:9000 --port 9100 \\
+        --rules faults.json --report fault-report.json
+"""
+
+import argparse
+import fnmatch
+import hashlib
+import http.client
+import json
+import math
+import random
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from s3_standin import operation_name, percentile
+
+IO_CHUNK = 64 * 1024
+FAULTS = ('slowdown', 'error', 'reset', 'truncate')
+MODIFIERS = ('throttle', 'latency')
+HOP_BY_HOP = {'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'te', 'trailer', 'upgrade'}
+
+
+class Rule:
+    """Règle d'injection pour un motif d'opération"""
+
+    def __init__(self, spec):
+        self.operation = spec.get('operation', '*')
+        self.fault = spec['fault']
+        if self.fault not in FAULTS + MODIFIERS:
+            raise ValueError(f"unknown fault '{self.fault}' (expected one of {', '.join(FAULTS + MODIFIERS)})")
+        self.probability = float(spec.get('probability', 1.0))
+        self.every = int(spec.get('every', 0))
+        self.start = int(spec.get('start', 0))
+        self.count = spec.get('count')
+        self.spec = spec
+
+    def matches(self, operation, index, rng):
+        """index: rang (à partir de 0) de la requête parmi celles de l'opération"""
+        if not fnmatch.fnmatchcase(operation, self.operation):
+            return False
+        if index < self.start or (self.count is not None and index >= self.start + int(self.count)):
+            return False
+        if self.every and (index - self.start + 1) % self.every:
+            return False
+        return self.probability >= 1.0 or rng.random() < self.probability
+
+    def sample_latency(self, rng):
+        """Délai en secondes selon la distribution de la règle (paramètres en ms)"""
+        spec = self.spec
+        kind = spec.get('distribution', 'fixed')
+        if kind == 'fixed':
+            value = spec.get('ms', spec.get('median', 0))
+        elif kind == 'uniform':
+            value = rng.uniform(spec.get('min', 0), spec['max'])
+        elif kind == 'lognormal':
+            value = spec['median'] * math.exp(rng.gauss(0, spec.get('sigma', 1.0)))
+        elif kind == 'pareto':
+            value = spec.get('scale', 1) * rng.paretovariate(spec.get('alpha', 1.5))
+        else:
+            raise ValueError(f"unknown latency distribution '{kind}'")
+        return min(value, spec.get('cap', 120000)) / 1000
+
+
+class RetryTracker:
+    """Regroupe les tentatives d'une même requête et mesure la latence de bout en bout
+
+    Une requête identique (méthode, URI, taille et empreinte du corps) reçue
+    après un échec est une nouvelle tentative; après un succès, c'est une
+    nouvelle requête.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.completed = []
+
+    @staticmethod
+    def request_id(method, path, headers, body):
+        digest = headers.get('Content-MD5') or headers.get('x-amz-content-sha256') or hashlib.md5(body).hexdigest()
+        return (method, path, len(body), digest)
+
+    def begin(self, request_id, operation, now):
+        with self.lock:
+            entry = self.pending.get(request_id)
+            if entry is None:
+                entry = self.pending[request_id] = {
+                    'operation': operation, 'start': now, 'attempts': 0, 'faults': [],
+                }
+            entry['attempts'] += 1
+            return entry['attempts']
+
+    def end(self, request_id, status, fault, now):
+        failed = fault in FAULTS or status == 0 or status == 429 or status >= 500
+        with self.lock:
+            entry = self.pending.get(request_id)
+            if entry is None:
+                return
+            entry['end'] = now
+            entry['status'] = status
+            if fault:
+                entry['faults'].append(fault)
+            if not failed:
+                self.completed.append(self.pending.pop(request_id))
+
+    def entries(self):
+        """Requêtes terminées, puis celles restées en échec (abandonnées par le plugin)"""
+        with self.lock:
+            abandoned = [dict(entry, abandoned=True) for entry in self.pending.values() if 'end' in entry]
+            return self.completed + abandoned
+
+    def reset(self):
+        with self.lock:
+            self.pending.clear()
+            self.completed = []
+
+
+class FaultProxy(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, upstream, rules=(), seed=None):
+        super().__init__(address, ProxyHandler)
+        upstream = urlsplit(upstream)
+        if upstream.scheme not in ('http', 'https'):
+            raise ValueError(f'unsupported upstream URL: {upstream.geturl()}')
+        self.upstream = upstream
+        self.rules = [Rule(spec) for spec in rules]
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.counters = {}
+        self.tracker = RetryTracker()
+        self.local = threading.local()
+
+    def reset(self):
+        """Remet à zéro les rangs des opérations et les statistiques"""
+        with self.rng_lock:
+            self.counters.clear()
+        self.tracker.reset()
+
+    def plan(self, operation):
+        """Pannes et modificateurs à appliquer à la prochaine requête de l'opération"""
+        with self.rng_lock:
+            index = self.counters.get(operation, 0)
+            self.counters[operation] = index + 1
+            fault, latency, bandwidth = None, 0.0, None
+            for rule in self.rules:
+                if not rule.matches(operation, index, self.rng):
+                    continue
+                if rule.fault == 'latency':
+                    latency += rule.sample_latency(self.rng)
+                elif rule.fault == 'throttle':
+                    rate = float(rule.spec['bandwidth']) * 1024 * 1024
+                    bandwidth = min(bandwidth, rate) if bandwidth else rate
+                elif fault is None:
+                    fault = rule
+            return fault, latency, bandwidth
+
+    def upstream_connection(self):
+        """Connexion persistante vers l'amont, une par thread"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.upstream.scheme == 'https' else http.client.HTTPConnection
+            conn = self.local.conn = cls(self.upstream.hostname, self.upstream.port, timeout=300)
+        return conn
+
+    def drop_upstream_connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+    def report(self):
+        """Statistiques par opération (voir RetryTracker)"""
+        by_operation = {}
+        for entry in self.tracker.entries():
+            by_operation.setdefault(entry['operation'], []).append(entry)
+
+        report = {}
+        for operation, entries in sorted(by_operation.items()):
+            latencies = [entry['end'] - entry['start'] for entry in entries if not entry.get('abandoned')]
+            faults = {}
+            for entry in entries:
+                for fault in entry['faults']:
+                    faults[fault] = faults.get(fault, 0) + 1
+            attempts = [entry['attempts'] for entry in entries]
+            report[operation] = {
+                'requests': len(entries),
+                'attempts': sum(attempts),
+                'retried': sum(1 for count in attempts if count > 1),
+                'max_attempts': max(attempts),
+                'failed': sum(1 for entry in entries if entry.get('abandoned')),
+                'faults': faults,
+                'latency_ms': {
+                    'p50': _ms(percentile(latencies, 0.50)),
+                    'p99': _ms(percentile(latencies, 0.99)),
+                    'max': _ms(max(latencies) if latencies else None),
+                },
+            }
+        return report
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._proxy('GET')
+
+    def do_PUT(self):
+        self._proxy('PUT')
+
+    def do_POST(self):
+        self._proxy('POST')
+
+    def do_DELETE(self):
+        self._proxy('DELETE')
+
+    def do_HEAD(self):
+        self._proxy('HEAD')
+
+    def _proxy(self, method):
+        server = self.server
+        url = urlsplit(self.path)
+        operation = operation_name(method, unquote(url.path), parse_qs(url.query, keep_blank_values=True),
+                                   self.headers)
+        fault, latency, bandwidth = server.plan(operation)
+
+        start = time.monotonic()
+        body = self._read_body(bandwidth)
+        request_id = RetryTracker.request_id(method, self.path, self.headers, body)
+        server.tracker.begin(request_id, operation, start)
+
+        if latency:
+            time.sleep(latency)
+
+        kind = fault.fault if fault else None
+        status = 0
+        try:
+            if kind in ('slowdown', 'error'):
+                status = self._send_error(kind)
+            elif kind == 'reset' and fault.spec.get('when', 'before') == 'before':
+                self._reset()
+            else:
+                status, reason, headers, data = self._forward(method, body)
+                if kind == 'reset':
+                    # Requête exécutée par l'amont mais réponse perdue
+                    status = 0
+                    self._reset()
+                elif kind == 'truncate' and data:
+                    self._send(status, reason, headers, data[:int(len(data) * float(fault.spec.get('fraction', 0.5)))],
+                               bandwidth, length=len(data))
+                    self.close_connection = True
+                else:
+                    self._send(status, reason, headers, data, bandwidth)
+        except (BrokenPipeError, ConnectionResetError):
+            status = 0
+            self.close_connection = True
+        except (OSError, http.client.HTTPException) as e:
+            server.drop_upstream_connection()
+            status = self._send_error('upstream', str(e))
+
+        server.tracker.end(request_id, status, kind, time.monotonic())
+
+    def _forward(self, method, body):
+        headers = {name: value for name, value in self.headers.items() if name.lower() not in HOP_BY_HOP}
+        for attempt in (1, 2):
+            conn = self.server.upstream_connection()
+            try:
+                conn.request(method, self.path, body=body or None, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                break
+            except (ConnectionError, http.client.RemoteDisconnected, http.client.CannotSendRequest):
+                # Connexion persistante fermée par l'amont: une seule reconnexion
+                self.server.drop_upstream_connection()
+                if attempt == 2:
+                    raise
+        response_headers = [(name, value) for name, value in response.getheaders()
+                            if name.lower() not in HOP_BY_HOP and name.lower() != 'content-length']
+        return response.status, response.reason, response_headers, data
+
+    def _read_body(self, bandwidth):
+        length = int(self.headers.get('Content-Length') or 0)
+        chunks, received, start = [], 0, time.monotonic()
+        while received < length:
+            chunk = self.rfile.read(min(IO_CHUNK, length - received))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            received += len(chunk)
+            _throttle(start, received, bandwidth)
+        return b''.join(chunks)
+
+    def _send(self, status, reason, headers, data, bandwidth=None, length=None):
+        self.send_response(status, reason)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data) if length is None else length))
+        self.end_headers()
+
+        if self.command == 'HEAD':
+            return
+        view, start = memoryview(data), time.monotonic()
+        for offset in range(0, len(view), IO_CHUNK):
+            _throttle(start, offset, bandwidth)
+            self.wfile.write(view[offset:offset + IO_CHUNK])
+        self.wfile.flush()
+
+    def _send_error(self, kind, detail=''):
+        status, code, message = {
+            'slowdown': (503, 'SlowDown', 'Please reduce your request rate.'),
+            'error': (500, 'InternalError', 'We encountered an internal error. Please try again.'),
+            'upstream': (502, 'BadGateway', f'Upstream request failed: {detail}'),
+        }[kind]
+        xml = (
+            f'<?xml version="1.0" encoding="UTF-8"?>\n<Error><Code>{code}</Code><Message>{message}</Message>'
+            f'<RequestId>{uuid.uuid4().hex[:16].upper()}</RequestId></Error>'
+        ).encode()
+        self._send(status, None, [('Content-Type', 'application/xml')], xml)
+        return status
+
+    def _reset(self):
+        """Ferme la connexion cliente avec un RST (SO_LINGER à 0)"""
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        self.close_connection = True
+        self.connection.close()
+
+
+def _throttle(start, transferred, bandwidth):
+    if not bandwidth:
+        return
+    delay = transferred / bandwidth - (time.monotonic() - start)
+    if delay > 0:
+        time.sleep(delay)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+def load_rules(path):
+    """Règles et graine d'un fichier JSON ({"seed": ..., "rules": [...]} ou liste de règles)"""
+    with open(path) as fh:
+        config = json.load(fh)
+    if isinstance(config, list):
+        return config, None
+    return config.get('rules', []), config.get('seed')
+
+
+def start_proxy(upstream, rules=(), seed=None, host='127.0.0.1', port=0):
+    """Démarre le proxy dans un thread; retourne (proxy, URL de l'endpoint)"""
+    proxy = FaultProxy((host, port), upstream, rules, seed)
+    thread = threading.Thread(target=proxy.serve_forever, name='s3-fault-proxy', daemon=True)
+    thread.start()
+    return proxy, f'http://{host}:{proxy.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Proxy S3 injectant pannes et latence')
+    parser.add_argument('--upstream', required=True, help='Endpoint S3 relayé (http://hôte:port)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--rules', help='Fichier JSON des règles')
+    parser.add_argument('--seed', type=int, help='Graine du tirage aléatoire')
+    parser.add_argument('--report', help='Rapport JSON écrit à l\'arrêt (défaut: sortie standard)')
+    args = parser.parse_args()
+
+    rules, seed = load_rules(args.rules) if args.rules else ([], None)
+    proxy = FaultProxy((args.host, args.port), args.upstream, rules, args.seed if args.seed is not None else seed)
+    print(f'Fault proxy listening on http://{args.host}:{proxy.server_address[1]} -> {args.upstream}',
+          file=sys.stderr)
+
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=proxy.shutdown).start())
+    try:
+        proxy.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    report = json.dumps(proxy.report(), indent=2)
+    if args.report:
+        with open(args.report, 'w') as fh:
+            fh.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
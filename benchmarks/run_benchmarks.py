@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Benchmarks du chemin de transfert du plugin S3
+
+Démarre le serveur S3 local (s3_standin.py) dans le processus, puis exécute
+avec les modules Perl du dépôt:
+- upload_file et download_file pour chaque combinaison taille de fichier x
+  taille de part x concurrence,
+- list_objects sur un bucket peuplé de nombreux objets,
+- les actions de pve-s3-maintenance sur les sauvegardes uploadées.
+
+Chaque phase tourne dans son propre processus Perl (mémoire de pointe via
+wait4). Les résultats (MB/s, p50/p99 par type de requête, RSS de pointe)
+sont écrits en JSON avec le commit courant, et peuvent être comparés entre
+deux commits avec --compare.
+
+    python3 benchmarks/run_benchmarks.py --output before.json
+    git checkout autre-branche
+    python3 benchmarks/run_benchmarks.py --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fault_proxy import load_rules, start_proxy  # noqa: E402
+from s3_standin import StoredObject, percentile, start_server  # noqa: E402
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DRIVER = REPO_ROOT / 'benchmarks' / 'bench-transfer.pl'
+MAINTENANCE = REPO_ROOT / 'scripts' / 'pve-s3-maintenance'
+BUCKET = 'bench'
+PREFIX = 'proxmox/'
+# Clés fictives (non vérifiées par le serveur local) de longueur valide pour Auth.pm
+ACCESS_KEY = 'BENCHACCESSKEY000001'
+SECRET_KEY = 'bench/secret/key/00000000000000000000000'
+UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(text):
+    """Taille avec suffixe optionnel K, M ou G (puissances de 1024)"""
+    text = text.strip().upper()
+    if text and text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def parse_list(text, convert=int):
+    return [convert(item) for item in text.split(',') if item.strip()]
+
+
+def format_size(size):
+    for suffix in ('G', 'M', 'K'):
+        if size >= UNITS[suffix] and size % UNITS[suffix] == 0:
+            return f'{size // UNITS[suffix]}{suffix}'
+    return str(size)
+
+
+def request_stats(requests):
+    """Nombre, erreurs et latences p50/p99 (ms) par opération S3"""
+    by_operation = {}
+    for request in requests:
+        by_operation.setdefault(request['operation'], []).append(request)
+
+    stats = {}
+    for operation, entries in sorted(by_operation.items()):
+        durations = [entry['duration'] for entry in entries]
+        stats[operation] = {
+            'count': len(entries),
+            'errors': sum(1 for entry in entries if not 200 <= entry['status'] < 300),
+            'p50_ms': round(percentile(durations, 0.50) * 1000, 3),
+            'p99_ms': round(percentile(durations, 0.99) * 1000, 3),
+        }
+    return stats
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def perl_command(script, *args):
+    """Commande perl qui charge les modules S3 du dépôt avant le script
+
+    Les scripts ajoutent /usr/share/perl5 en tête de @INC: les modules sont
+    préchargés depuis le dépôt pour ne pas mesurer une version installée.
+    """
+    modules = sorted(p.stem for p in (REPO_ROOT / 'PVE' / 'Storage' / 'S3').glob('*.pm'))
+    return ['perl', f'-I{REPO_ROOT}'] + [f'-MPVE::Storage::S3::{m}' for m in modules] + [str(script)] + list(args)
+
+
+class BenchmarkRunner:
+    """Exécution de la matrice contre le serveur local"""
+
+    def __init__(self, args, workdir):
+        self.args = args
+        self.workdir = Path(workdir)
+        self.server, self.endpoint = start_server(
+            latency=args.latency / 1000,
+            bandwidth=args.bandwidth * UNITS['M'] if args.bandwidth else None,
+            buckets=[BUCKET],
+        )
+        self.proxy = None
+        if args.faults:
+            # Le plugin passe par le proxy d'injection de pannes
+            rules, seed = load_rules(args.faults)
+            self.proxy, self.endpoint = start_proxy(self.endpoint, rules, seed)
+        self.env = dict(os.environ, PVE_S3_LOG_LEVEL=args.log_level, PVE_S3_METRICS_DIR=str(self.workdir / 'metrics'),
+                        S3_ENDPOINT=self.endpoint, S3_BUCKET=BUCKET, S3_ACCESS_KEY=ACCESS_KEY,
+                        S3_SECRET_KEY=SECRET_KEY, S3_PREFIX=PREFIX)
+        self.results = []
+
+    def close(self):
+        if self.proxy:
+            self.proxy.shutdown()
+            self.proxy.server_close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def run(self):
+        backups = []
+        for index, size in enumerate(self.args.sizes):
+            source = self._make_file(size)
+            key = f'{PREFIX}backup/vzdump-qemu-{100 + index}-2024_01_01-00_00_{index:02d}.vma.zst'
+            backups.append(key)
+            for part_size in self.args.part_sizes:
+                for concurrency in self.args.concurrency:
+                    case = {'size': size, 'part_size': part_size, 'concurrency': concurrency}
+                    options = ['--key', key, '--part-size', str(part_size), '--concurrency', str(concurrency)]
+                    self._run_phase('upload', case, DRIVER, 'upload', '--file', str(source), *options)
+
+                    target = self.workdir / 'download.bin'
+                    self._run_phase('download', case, DRIVER, 'download', '--file', str(target), *options)
+                    target.unlink(missing_ok=True)
+            source.unlink()
+
+        if self.args.list_objects:
+            self._seed_listing(self.args.list_objects)
+            self._run_phase('list', {'objects': self.args.list_objects}, DRIVER, 'list',
+                            '--prefix', f'{PREFIX}listing/')
+
+        state_file = self.workdir / 'integrity-state.json'
+        for action in self.args.maintenance:
+            options = ['--storage', 'bench', '--action', action, '--parallel', str(max(self.args.concurrency))]
+            if action == 'check-integrity':
+                options += ['--state-file', str(state_file)]
+            elif action == 'cleanup':
+                options += ['--older-than', '1d', '--dry-run']
+            self._run_phase(f'maintenance:{action}', {'backups': len(backups)}, MAINTENANCE, *options)
+
+        return self.results
+
+    def _make_file(self, size):
+        """Fichier source: un bloc aléatoire de 1 Mo répété (contenu sans incidence sur le débit)"""
+        path = self.workdir / f'source-{format_size(size)}.bin'
+        block = os.urandom(UNITS['M'])
+        with open(path, 'wb') as fh:
+            remaining = size
+            while remaining > 0:
+                fh.write(block[:remaining])
+                remaining -= len(block)
+        return path
+
+    def _seed_listing(self, count):
+        """Objets vides ajoutés directement au stockage du serveur (sans requêtes)"""
+        objects = self.server.store.bucket(BUCKET)
+        for index in range(count):
+            objects[f'{PREFIX}listing/object-{index:07d}'] = StoredObject(b'')
+
+    def _run_phase(self, phase, case, script, *args):
+        command = perl_command(script, *args)
+        if script == DRIVER:
+            command += ['--endpoint', self.endpoint, '--bucket', BUCKET]
+
+        self.server.take_requests()
+        if self.proxy:
+            self.proxy.reset()
+        stderr_path = self.workdir / 'stderr.log'
+        start = time.monotonic()
+        with open(stderr_path, 'wb') as stderr:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, env=self.env, cwd=self.workdir)
+            output = process.stdout.read()
+            process.stdout.close()
+            # wait4: statut et ressources du processus (ru_maxrss en Ko sous Linux)
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+        elapsed = time.monotonic() - start
+        requests = self.server.take_requests()
+
+        result = dict(phase=phase, **case)
+        result['peak_rss_kb'] = usage.ru_maxrss
+        result['requests'] = request_stats(requests)
+        if self.proxy:
+            # Vu du plugin: tentatives, relances et latence de bout en bout
+            result['faults'] = self.proxy.report()
+
+        if process.returncode != 0:
+            # Dernière ligne significative (pas "BEGIN failed" après un module manquant)
+            lines = [line for line in stderr_path.read_text(errors='replace').splitlines()
+                     if line.strip() and not line.startswith(('BEGIN failed', 'Compilation failed'))]
+            result['error'] = re.sub(r' \(@INC contains: [^)]*\)', '', lines[-1]) if lines else f'exit {process.returncode}'
+        elif script == DRIVER:
+            measured = json.loads(output.decode().strip().splitlines()[-1])
+            result['seconds'] = round(measured['seconds'], 4)
+            if 'bytes' in measured:
+                result['bytes'] = measured['bytes']
+                result['mb_s'] = round(measured['bytes'] / UNITS['M'] / measured['seconds'], 2) if measured['seconds'] else None
+            else:
+                result['objects'] = measured['objects']
+        else:
+            result['seconds'] = round(elapsed, 4)
+
+        self.results.append(result)
+        self._print_result(result)
+        return result
+
+    @staticmethod
+    def _print_result(result):
+        label = case_name(result)
+        if 'error' in result:
+            print(f'  {label:<45} ÉCHEC: {result["error"]}', file=sys.stderr)
+            return
+        throughput = f'{result["mb_s"]:>9.1f} MB/s' if result.get('mb_s') is not None else ' ' * 14
+        print(f'  {label:<45} {result["seconds"]:>8.2f}s {throughput} {result["peak_rss_kb"] / 1024:>8.1f} Mo RSS',
+              file=sys.stderr)
+
+
+def case_name(result):
+    """Identifiant stable d'un cas, pour comparer deux exécutions"""
+    name = result['phase']
+    if 'size' in result:
+        name += f' size={format_size(result["size"])} part={format_size(result["part_size"])} c={result["concurrency"]}'
+    elif 'objects' in result and result['phase'] == 'list':
+        name += f' objects={result["objects"]}'
+    return name
+
+
+def compare(previous, current):
+    """Tableau des écarts de durée, débit et mémoire par cas"""
+    before = {case_name(r): r for r in previous['results'] if 'error' not in r}
+    lines = [f'Comparaison {previous.get("commit") or "?"} -> {current.get("commit") or "?"}',
+             f'{"Cas":<45} {"Durée":>16} {"Débit":>18} {"RSS":>10}']
+    for result in current['results']:
+        name = case_name(result)
+        old = before.get(name)
+        if old is None or 'error' in result:
+            continue
+        duration = f'{old["seconds"]:.2f}->{result["seconds"]:.2f}s'
+        throughput = ''
+        if result.get('mb_s') and old.get('mb_s'):
+            throughput = f'{(result["mb_s"] / old["mb_s"] - 1) * 100:+.1f}% MB/s'
+        rss = f'{(result["peak_rss_kb"] - old["peak_rss_kb"]) / 1024:+.1f} Mo'
+        lines.append(f'{name:<45} {duration:>16} {throughput:>18} {rss:>10}')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks du chemin de transfert du plugin S3 (hors ligne)')
+    parser.add_argument('--sizes', type=lambda v: parse_list(v, parse_size), default='8M,64M,256M',
+                        help='Tailles de fichier (défaut: 8M,64M,256M)')
+    parser.add_argument('--part-sizes', type=lambda v: parse_list(v, parse_size), default='5M,16M',
+                        help='Tailles de part multipart, minimum 5M (défaut: 5M,16M)')
+    parser.add_argument('--concurrency', type=parse_list, default='1,4',
+                        help='Uploads simultanés (défaut: 1,4)')
+    parser.add_argument('--list-objects', type=int, default=5000,
+                        help="Nombre d'objets pour le benchmark list_objects (0 pour l'ignorer)")
+    parser.add_argument('--maintenance', type=lambda v: parse_list(v, str), default='status,check-integrity',
+                        help='Actions de pve-s3-maintenance (défaut: status,check-integrity)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Latence simulée par requête (ms)')
+    parser.add_argument('--bandwidth', type=float, default=None, help='Débit simulé par requête (MB/s)')
+    parser.add_argument('--faults', metavar='FILE',
+                        help='Règles JSON du proxy d\'injection de pannes (fault_proxy.py)')
+    parser.add_argument('--log-level', default='WARN', help='PVE_S3_LOG_LEVEL des processus Perl')
+    parser.add_argument('--output', '-o', help='Fichier JSON des résultats (défaut: sortie standard)')
+    parser.add_argument('--compare', metavar='FILE', help='Résultats précédents à comparer')
+    args = parser.parse_args()
+
+    if min(args.part_sizes) < 5 * UNITS['M']:
+        parser.error('part sizes must be at least 5M (multipart minimum)')
+
+    with tempfile.TemporaryDirectory(prefix='pve-s3-bench-') as workdir:
+        runner = BenchmarkRunner(args, workdir)
+        print(f'S3 stand-in: {runner.endpoint} (latence {args.latency} ms, '
+              f'débit {args.bandwidth or "illimité"} MB/s)', file=sys.stderr)
+        try:
+            results = runner.run()
+        finally:
+            runner.close()
+
+    report = {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'host': platform.node(),
+        'perl': subprocess.run(['perl', '-e', 'print $^V'], capture_output=True, text=True).stdout,
+        'settings': {
+            'latency_ms': args.latency,
+            'bandwidth_mb_s': args.bandwidth,
+            'faults': json.loads(Path(args.faults).read_text()) if args.faults else None,
+        },
+        'results': results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        print(compare(json.loads(Path(args.compare).read_text()), report), file=sys.stderr)
+
+    return 1 if any('error' in r for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
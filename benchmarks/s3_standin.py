@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+"""
+Serveur S3 local en mémoire pour les benchmarks du chemin de transfert
+
+Implémente le sous-ensemble de l'API S3 utilisé par le plugin, en style
+"path" (/bucket/clé): PUT/GET/HEAD/DELETE d'objets, lectures partielles
+(Range), copie (x-amz-copy-source, y compris UploadPartCopy), multipart
+upload (initiate, upload part, complete, abort), ListObjectsV2 (prefix,
+start-after, continuation-token, max-keys) et suppression groupée
+(POST ?delete). Les signatures ne sont pas vérifiées.
+
+Une latence fixe par requête et une bande passante maximale par requête
+peuvent être simulées. Chaque requête est enregistrée (opération, statut,
+durée, octets) pour le calcul des percentiles par le lanceur de benchmarks.
+
+Utilisable seul:
+    python3 benchmarks/s3_standin.py --port 9000 --latency 5 --bandwidth 200
+"""
+
+import argparse
+import base64
+import hashlib
+import re
+import threading
+import time
+import uuid
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+IO_CHUNK = 64 * 1024
+XMLNS = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+
+class StoredObject:
+    """Objet en mémoire"""
+
+    __slots__ = ('data', 'etag', 'modified', 'metadata', 'content_type')
+
+    def __init__(self, data, etag=None, metadata=None, content_type='application/octet-stream'):
+        self.data = data
+        self.etag = etag or hashlib.md5(data).hexdigest()
+        self.modified = time.time()
+        self.metadata = metadata or {}
+        self.content_type = content_type
+
+
+def operation_name(method, path, query, headers):
+    """Nom d'opération, identique à PVE::Storage::S3::Client::_operation_name"""
+    has_key = '/' in path.lstrip('/')
+    if method == 'GET':
+        if not has_key:
+            return 'list'
+        return 'get_range' if headers.get('Range') else 'get'
+    if method == 'PUT':
+        if 'partNumber' in query:
+            return 'copy_part' if headers.get('x-amz-copy-source') else 'put_part'
+        if headers.get('x-amz-copy-source'):
+            return 'copy'
+        return 'put' if has_key else 'create_bucket'
+    if method == 'POST':
+        if 'delete' in query:
+            return 'delete_batch'
+        if 'uploads' in query:
+            return 'initiate_multipart'
+        return 'complete_multipart'
+    if method == 'DELETE':
+        return 'abort_multipart' if 'uploadId' in query else 'delete'
+    return 'head'
+
+
+class S3Store:
+    """Buckets, objets et uploads multipart en cours"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.uploads = {}
+
+    def bucket(self, name, create=False):
+        with self.lock:
+            if create:
+                return self.buckets.setdefault(name, {})
+            return self.buckets.get(name)
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Le client ouvre une connexion par worker: file d'attente suffisante
+    request_queue_size = 128
+
+    def __init__(self, address, latency=0.0, bandwidth=None, buckets=()):
+        super().__init__(address, S3Handler)
+        self.store = S3Store()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.log_lock = threading.Lock()
+        self.requests = []
+        for name in buckets:
+            self.store.bucket(name, create=True)
+
+    def record(self, entry):
+        with self.log_lock:
+            self.requests.append(entry)
+
+    def take_requests(self):
+        """Retourne et vide le journal des requêtes"""
+        with self.log_lock:
+            requests, self.requests = self.requests, []
+        return requests
+
+
+class S3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'S3StandIn/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def do_HEAD(self):
+        self._dispatch('HEAD')
+
+    def _dispatch(self, method):
+        start = time.monotonic()
+        url = urlsplit(self.path)
+        self.query = parse_qs(url.query, keep_blank_values=True)
+        path = unquote(url.path)
+        bucket, _, key = path.lstrip('/').partition('/')
+        self.sent = 0
+
+        body = self._read_body()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        try:
+            status = self._handle(method, bucket, key, body)
+        except (BrokenPipeError, ConnectionResetError):
+            status = 0
+            self.close_connection = True
+
+        self.server.record({
+            'operation': operation_name(method, path, self.query, self.headers),
+            'status': status,
+            'duration': time.monotonic() - start,
+            'received': len(body),
+            'sent': self.sent,
+        })
+
+    def _handle(self, method, bucket, key, body):
+        store = self.server.store
+        if store.bucket(bucket) is None and not (method == 'PUT' and not key):
+            return self._error(404, 'NoSuchBucket', 'The specified bucket does not exist', bucket)
+
+        if not key:
+            if method == 'PUT':
+                store.bucket(bucket, create=True)
+                return self._send(200)
+            if method == 'HEAD':
+                return self._send(200)
+            if method == 'GET':
+                return self._list_objects(bucket)
+            if method == 'POST' and 'delete' in self.query:
+                return self._delete_objects(bucket, body)
+            return self._error(405, 'MethodNotAllowed', 'Method not allowed', bucket)
+
+        if 'uploads' in self.query and method == 'POST':
+            return self._initiate_multipart(bucket, key)
+        if 'uploadId' in self.query:
+            upload_id = self.query['uploadId'][0]
+            with store.lock:
+                upload = store.uploads.get(upload_id)
+            if upload is None:
+                return self._error(404, 'NoSuchUpload', 'The specified upload does not exist', key)
+            if method == 'PUT':
+                return self._upload_part(upload, body)
+            if method == 'POST':
+                return self._complete_multipart(bucket, key, upload_id, upload, body)
+            if method == 'DELETE':
+                with store.lock:
+                    store.uploads.pop(upload_id, None)
+                return self._send(204)
+
+        objects = store.bucket(bucket)
+        if method == 'PUT':
+            if self.headers.get('x-amz-copy-source'):
+                return self._copy_object(bucket, key)
+            objects[key] = StoredObject(
+                body, metadata=self._metadata_headers(),
+                content_type=self.headers.get('Content-Type', 'application/octet-stream'),
+            )
+            return self._send(200, headers={'ETag': f'"{objects[key].etag}"'})
+        if method == 'DELETE':
+            objects.pop(key, None)
+            return self._send(204)
+
+        obj = objects.get(key)
+        if obj is None:
+            return self._error(404, 'NoSuchKey', 'The specified key does not exist', key)
+
+        headers = {
+            'ETag': f'"{obj.etag}"',
+            'Last-Modified': formatdate(obj.modified, usegmt=True),
+            'Content-Type': obj.content_type,
+            'Accept-Ranges': 'bytes',
+        }
+        headers.update({f'x-amz-meta-{name}': value for name, value in obj.metadata.items()})
+
+        if method == 'HEAD':
+            headers['Content-Length'] = str(len(obj.data))
+            return self._send(200, headers=headers, head_only=True)
+
+        data_range = parse_range(self.headers.get('Range'), len(obj.data))
+        if data_range is None:
+            return self._send(200, obj.data, headers)
+        first, last = data_range
+        headers['Content-Range'] = f'bytes {first}-{last}/{len(obj.data)}'
+        return self._send(206, memoryview(obj.data)[first:last + 1], headers)
+
+    def _list_objects(self, bucket):
+        prefix = self._param('prefix', '')
+        max_keys = min(int(self._param('max-keys', '1000')), 1000)
+        marker = self._param('continuation-token') or self._param('start-after') or ''
+        if self._param('continuation-token'):
+            marker = base64.urlsafe_b64decode(marker.encode()).decode()
+
+        objects = self.server.store.bucket(bucket)
+        keys = sorted(k for k in list(objects) if k.startswith(prefix) and k > marker)
+        page, truncated = keys[:max_keys], len(keys) > max_keys
+
+        contents = []
+        for key in page:
+            obj = objects.get(key)
+            if obj is None:
+                continue
+            contents.append(
+                f'<Contents><Key>{escape(key)}</Key>'
+                f'<LastModified>{time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(obj.modified))}</LastModified>'
+                f'<ETag>&quot;{obj.etag}&quot;</ETag><Size>{len(obj.data)}</Size>'
+                f'<StorageClass>STANDARD</StorageClass></Contents>'
+            )
+        token = ''
+        if truncated:
+            token = '<NextContinuationToken>' + base64.urlsafe_b64encode(page[-1].encode()).decode() + '</NextContinuationToken>'
+
+        return self._send_xml(
+            f'<ListBucketResult xmlns="{XMLNS}"><Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>'
+            f'<KeyCount>{len(contents)}</KeyCount><MaxKeys>{max_keys}</MaxKeys>'
+            f'<IsTruncated>{"true" if truncated else "false"}</IsTruncated>{token}{"".join(contents)}</ListBucketResult>'
+        )
+
+    def _delete_objects(self, bucket, body):
+        expected = self.headers.get('Content-MD5')
+        if expected and base64.b64encode(hashlib.md5(body).digest()).decode() != expected:
+            return self._error(400, 'BadDigest', 'The Content-MD5 you specified did not match', bucket)
+
+        objects = self.server.store.bucket(bucket)
+        keys = [unescape_xml(k) for k in re.findall(r'<Key>(.*?)</Key>', body.decode())]
+        for key in keys:
+            objects.pop(key, None)
+
+        deleted = ''
+        if not re.search(r'<Quiet>\s*true\s*</Quiet>', body.decode(), re.IGNORECASE):
+            deleted = ''.join(f'<Deleted><Key>{escape(k)}</Key></Deleted>' for k in keys)
+        return self._send_xml(f'<DeleteResult xmlns="{XMLNS}">{deleted}</DeleteResult>')
+
+    def _initiate_multipart(self, bucket, key):
+        upload_id = uuid.uuid4().hex
+        with self.server.store.lock:
+            self.server.store.uploads[upload_id] = {
+                'key': key, 'parts': {}, 'metadata': self._metadata_headers(),
+            }
+        return self._send_xml(
+            f'<InitiateMultipartUploadResult xmlns="{XMLNS}"><Bucket>{escape(bucket)}</Bucket>'
+            f'<Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>'
+        )
+
+    def _upload_part(self, upload, body):
+        part_number = int(self._param('partNumber', '0'))
+        if not 1 <= part_number <= 10000:
+            return self._error(400, 'InvalidArgument', 'Part number must be between 1 and 10000', upload['key'])
+
+        source = self.headers.get('x-amz-copy-source')
+        if source:
+            obj = self._copy_source(source)
+            if obj is None:
+                return self._error(404, 'NoSuchKey', 'The specified key does not exist', source)
+            data_range = parse_range(self.headers.get('x-amz-copy-source-range'), len(obj.data))
+            body = obj.data[data_range[0]:data_range[1] + 1] if data_range else obj.data
+
+        expected = self.headers.get('Content-MD5')
+        digest = hashlib.md5(body)
+        if expected and not source and base64.b64encode(digest.digest()).decode() != expected:
+            return self._error(400, 'BadDigest', 'The Content-MD5 you specified did not match', upload['key'])
+
+        etag = digest.hexdigest()
+        with self.server.store.lock:
+            upload['parts'][part_number] = (bytes(body), etag)
+
+        if source:
+            return self._send_xml(
+                f'<CopyPartResult><LastModified>{time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())}</LastModified>'
+                f'<ETag>&quot;{etag}&quot;</ETag></CopyPartResult>'
+            )
+        return self._send(200, headers={'ETag': f'"{etag}"'})
+
+    def _complete_multipart(self, bucket, key, upload_id, upload, body):
+        requested = re.findall(r'<PartNumber>(\d+)</PartNumber>\s*<ETag>(.*?)</ETag>', body.decode(), re.DOTALL)
+        chunks, md5s = [], []
+        for number, etag in requested:
+            part = upload['parts'].get(int(number))
+            if part is None or part[1] != unescape_xml(etag).strip('"'):
+                return self._error(400, 'InvalidPart', f'Part {number} not found or ETag mismatch', key)
+            chunks.append(part[0])
+            md5s.append(bytes.fromhex(part[1]))
+
+        etag = f'{hashlib.md5(b"".join(md5s)).hexdigest()}-{len(md5s)}'
+        self.server.store.bucket(bucket)[key] = StoredObject(b''.join(chunks), etag, upload['metadata'])
+        with self.server.store.lock:
+            self.server.store.uploads.pop(upload_id, None)
+
+        return self._send_xml(
+            f'<CompleteMultipartUploadResult xmlns="{XMLNS}"><Bucket>{escape(bucket)}</Bucket>'
+            f'<Key>{escape(key)}</Key><ETag>&quot;{etag}&quot;</ETag></CompleteMultipartUploadResult>',
+            headers={'ETag': f'"{etag}"'},
+        )
+
+    def _copy_object(self, bucket, key):
+        obj = self._copy_source(self.headers['x-amz-copy-source'])
+        if obj is None:
+            return self._error(404, 'NoSuchKey', 'The specified key does not exist', key)
+
+        metadata = obj.metadata
+        if self.headers.get('x-amz-metadata-directive', 'COPY').upper() == 'REPLACE':
+            metadata = self._metadata_headers()
+        copy = StoredObject(obj.data, obj.etag, metadata, obj.content_type)
+        self.server.store.bucket(bucket)[key] = copy
+
+        return self._send_xml(
+            f'<CopyObjectResult><LastModified>{time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())}</LastModified>'
+            f'<ETag>&quot;{copy.etag}&quot;</ETag></CopyObjectResult>',
+            headers={'ETag': f'"{copy.etag}"'},
+        )
+
+    def _copy_source(self, source):
+        bucket, _, key = unquote(source).lstrip('/').partition('/')
+        objects = self.server.store.bucket(bucket)
+        return objects.get(key) if objects is not None else None
+
+    def _metadata_headers(self):
+        return {
+            name[len('x-amz-meta-'):]: value
+            for name, value in self.headers.items() if name.lower().startswith('x-amz-meta-')
+        }
+
+    def _param(self, name, default=None):
+        return self.query.get(name, [default])[0]
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return b''
+
+        chunks, remaining, start = [], length, time.monotonic()
+        while remaining:
+            chunk = self.rfile.read(min(IO_CHUNK, remaining))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+            self._throttle(start, length - remaining)
+        return b''.join(chunks)
+
+    def _throttle(self, start, transferred):
+        """Limite le débit de la requête à la bande passante configurée"""
+        if not self.server.bandwidth:
+            return
+        delay = transferred / self.server.bandwidth - (time.monotonic() - start)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _send(self, status, data=b'', headers=None, head_only=False):
+        self.send_response(status)
+        headers = dict(headers or {})
+        headers.setdefault('Content-Length', str(len(data)))
+        headers['x-amz-request-id'] = uuid.uuid4().hex[:16].upper()
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+        if not head_only and data:
+            view, start = memoryview(data), time.monotonic()
+            for offset in range(0, len(view), IO_CHUNK):
+                self._throttle(start, offset)
+                self.wfile.write(view[offset:offset + IO_CHUNK])
+                self.sent += min(IO_CHUNK, len(view) - offset)
+        return status
+
+    def _send_xml(self, xml, headers=None):
+        headers = dict(headers or {})
+        headers['Content-Type'] = 'application/xml'
+        return self._send(200, ('<?xml version="1.0" encoding="UTF-8"?>\n' + xml).encode(), headers)
+
+    def _error(self, status, code, message, resource):
+        xml = (
+            f'<?xml version="1.0" encoding="UTF-8"?>\n<Error><Code>{code}</Code><Message>{escape(message)}</Message>'
+            f'<Resource>{escape(quote(resource))}</Resource><RequestId>{uuid.uuid4().hex[:16].upper()}</RequestId></Error>'
+        )
+        return self._send(status, xml.encode(), {'Content-Type': 'application/xml'},
+                          head_only=self.command == 'HEAD')
+
+
+def parse_range(header, size):
+    """Bornes (incluses) d'un en-tête "bytes=a-b", None si absent ou invalide"""
+    match = re.match(r'^bytes=(\d*)-(\d*)$', header or '')
+    if not match or size == 0:
+        return None
+    first, last = match.groups()
+    if first == '':
+        first, last = max(size - int(last or 0), 0), size - 1
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+    return (first, last) if first <= last else None
+
+
+def percentile(values, fraction):
+    """Percentile par rang le plus proche"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def unescape_xml(text):
+    return (text.replace('&quot;', '"').replace('&apos;', "'").replace('&lt;', '<')
+            .replace('&gt;', '>').replace('&amp;', '&'))
+
+
+def start_server(host='127.0.0.1', port=0, latency=0.0, bandwidth=None, buckets=()):
+    """Démarre le serveur dans un thread; retourne (serveur, URL de l'endpoint)
+
+    latency en secondes par requête, bandwidth en octets/s par requête.
+    """
+    server = StandInServer((host, port), latency=latency, bandwidth=bandwidth, buckets=buckets)
+    thread = threading.Thread(target=server.serve_forever, name='s3-standin', daemon=True)
+    thread.start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serveur S3 local en mémoire pour benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency', type=float, default=0.0, help='Latence par requête (ms)')
+    parser.add_argument('--bandwidth', type=float, default=None, help='Débit max par requête (MB/s)')
+    parser.add_argument('--bucket', action='append', default=[], help='Bucket créé au démarrage')
+    args = parser.parse_args()
+
+    server = StandInServer(
+        (args.host, args.port), latency=args.latency / 1000,
+        bandwidth=args.bandwidth * 1024 * 1024 if args.bandwidth else None, buckets=args.bucket,
+    )
+    print(f'S3 stand-in listening on http://{args.host}:{server.server_address[1]}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
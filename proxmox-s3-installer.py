@@ -21,20 +21,28 @@ import argparse
 import sys
 import os
 import getpass
+import hashlib
+import io
 import json
 import re
+import shlex
+import tarfile
 from datetime import datetime
 from pathlib import Path
 
 try:
     import paramiko
-    import scp
 except ImportError:
     print("ERREUR: Modules requis manquants. Installez avec:")
-    print("pip install paramiko scp")
+    print("pip install paramiko")
     sys.exit(1)
 
 # Configuration des providers S3
+#
+# "profile": taille des parts, concurrence et capacités du fournisseur,
+# écrites dans storage.cfg avec le style d'adressage (path_style) pour que le
+# plugin prenne directement le bon chemin (DeleteObjects, UploadPartCopy,
+# x-amz-checksum-*).
 S3_PROVIDERS = {
     "1": {
         "name": "AWS S3",
@@ -42,6 +50,14 @@ S3_PROVIDERS = {
         "default_region": "us-east-1",
         "use_ssl": True,
         "path_style": False,
+        "profile": {
+            "multipart_chunk_size": 100,
+            "max_concurrent_uploads": 8,
+            "max_parts": 10000,
+            "batch_delete": 1,
+            "upload_part_copy": 1,
+            "checksum_algorithm": "sha256"
+        },
         "regions": ["us-east-1", "us-west-1", "us-west-2", "eu-west-1", "eu-central-1", "ap-southeast-1"]
     },
     "2": {
@@ -50,6 +66,14 @@ S3_PROVIDERS = {
         "default_region": "us-east-1", 
         "use_ssl": False,
         "path_style": True,
+        "profile": {
+            "multipart_chunk_size": 64,
+            "max_concurrent_uploads": 8,
+            "max_parts": 10000,
+            "batch_delete": 1,
+            "upload_part_copy": 1,
+            "checksum_algorithm": "sha256"
+        },
         "regions": ["us-east-1"]
     },
     "3": {
@@ -58,6 +82,14 @@ S3_PROVIDERS = {
         "default_region": "default",
         "use_ssl": False,
         "path_style": True,
+        "profile": {
+            "multipart_chunk_size": 64,
+            "max_concurrent_uploads": 4,
+            "max_parts": 10000,
+            "batch_delete": 1,
+            "upload_part_copy": 1,
+            "checksum_algorithm": "md5"
+        },
         "regions": ["default"]
     },
     "4": {
@@ -66,6 +98,14 @@ S3_PROVIDERS = {
         "default_region": "us-east-1",
         "use_ssl": True,
         "path_style": False,
+        "profile": {
+            "multipart_chunk_size": 64,
+            "max_concurrent_uploads": 6,
+            "max_parts": 10000,
+            "batch_delete": 1,
+            "upload_part_copy": 1,
+            "checksum_algorithm": "md5"
+        },
         "regions": ["us-east-1", "us-west-1", "eu-central-1", "ap-northeast-1"]
     },
     "5": {
@@ -74,6 +114,14 @@ S3_PROVIDERS = {
         "default_region": "us-west-002",
         "use_ssl": True,
         "path_style": False,
+        "profile": {
+            "multipart_chunk_size": 100,
+            "max_concurrent_uploads": 4,
+            "max_parts": 10000,
+            "batch_delete": 1,
+            "upload_part_copy": 1,
+            "checksum_algorithm": "md5"
+        },
         "regions": ["us-west-002", "eu-central-003"]
     },
     "6": {
@@ -82,6 +130,14 @@ S3_PROVIDERS = {
         "default_region": "fra1", 
         "use_ssl": True,
         "path_style": False,
+        "profile": {
+            "multipart_chunk_size": 64,
+            "max_concurrent_uploads": 4,
+            "max_parts": 10000,
+            "batch_delete": 1,
+            "upload_part_copy": 1,
+            "checksum_algorithm": "md5"
+        },
         "regions": ["nyc3", "ams3", "sgp1", "fra1", "sfo3"]
     },
     "7": {
@@ -90,6 +146,14 @@ S3_PROVIDERS = {
         "default_region": "fr-par",
         "use_ssl": True,
         "path_style": False,
+        "profile": {
+            "multipart_chunk_size": 100,
+            "max_concurrent_uploads": 4,
+            "max_parts": 1000,
+            "batch_delete": 1,
+            "upload_part_copy": 1,
+            "checksum_algorithm": "md5"
+        },
         "regions": ["fr-par", "nl-ams", "pl-waw"]
     },
     "8": {
@@ -98,6 +162,14 @@ S3_PROVIDERS = {
         "default_region": "gra", 
         "use_ssl": True,
         "path_style": False,
+        "profile": {
+            "multipart_chunk_size": 100,
+            "max_concurrent_uploads": 4,
+            "max_parts": 10000,
+            "batch_delete": 1,
+            "upload_part_copy": 1,
+            "checksum_algorithm": "md5"
+        },
         "regions": ["gra", "sbg", "waw", "de", "uk"]
     },
     "9": {
@@ -115,7 +187,6 @@ class ProxmoxS3Installer:
         self.host = host
         self.user = user
         self.ssh = None
-        self.scp_client = None
         self.storage_config = {}
         
     def print_header(self):
@@ -144,9 +215,6 @@ class ProxmoxS3Installer:
             hostname = stdout.read().decode().strip()
             
             print(f"✅ Connexion SSH réussie vers {hostname}")
-            
-            # Initialiser SCP
-            self.scp_client = scp.SCPClient(self.ssh.get_transport())
             return True
             
         except Exception as e:
@@ -204,66 +272,85 @@ class ProxmoxS3Installer:
             print(f"❌ Erreur de sauvegarde: {e}")
             return False
 
+    def plugin_files(self):
+        """Fichiers locaux du plugin et leur destination (local, distant, mode)"""
+        files = [("PVE/Storage/S3Plugin-fixed.pm", "/usr/share/perl5/PVE/Storage/S3Plugin.pm", 0o644)]
+        
+        if os.path.isdir("PVE/Storage/S3"):
+            for file in sorted(os.listdir("PVE/Storage/S3")):
+                if file.endswith('.pm'):
+                    files.append((f"PVE/Storage/S3/{file}", f"/usr/share/perl5/PVE/Storage/S3/{file}", 0o644))
+        
+        if os.path.isdir("scripts"):
+            for script_file in sorted(os.listdir("scripts")):
+                if script_file.endswith('.service'):
+                    files.append((f"scripts/{script_file}", f"/etc/systemd/system/{script_file}", 0o644))
+                elif script_file.startswith('pve-s3-'):
+                    files.append((f"scripts/{script_file}", f"/usr/local/bin/{script_file}", 0o755))
+        
+        return files
+
     def copy_plugin_files(self):
-        """Copie les fichiers du plugin vers le serveur Proxmox"""
+        """Copie les fichiers du plugin vers le serveur Proxmox
+
+        Les empreintes des fichiers distants sont lues en une commande et
+        seuls les fichiers modifiés sont envoyés, dans un flux tar unique
+        extrait (permissions et propriétaire root compris) par une seule
+        commande distante.
+        """
         print("\n📁 Copie des fichiers du plugin...")
         
-        # Chemins locaux (à adapter selon votre structure)
-        local_files = {
-            "PVE/Storage/S3Plugin-fixed.pm": "/usr/share/perl5/PVE/Storage/S3Plugin.pm",
-            "PVE/Storage/S3/": "/usr/share/perl5/PVE/Storage/S3/",
-            "scripts/": "/usr/local/bin/"
-        }
+        if not os.path.exists("PVE/Storage/S3Plugin-fixed.pm"):
+            print("❌ Fichier S3Plugin-fixed.pm non trouvé")
+            return False
+        
+        directories = ["/var/log/pve", "/etc/pve/s3-credentials"]
         
         try:
-            # Créer les répertoires nécessaires
-            directories = [
-                "/usr/share/perl5/PVE/Storage/S3",
-                "/var/log/pve",
-                "/etc/pve/s3-credentials"
-            ]
-            
-            for directory in directories:
-                stdin, stdout, stderr = self.ssh.exec_command(f"mkdir -p {directory}")
-                stderr_output = stderr.read().decode()
-                if stderr_output and "File exists" not in stderr_output:
-                    print(f"⚠️ Erreur création répertoire {directory}: {stderr_output}")
-            
-            # Copier le plugin principal
-            if os.path.exists("PVE/Storage/S3Plugin-fixed.pm"):
-                self.scp_client.put("PVE/Storage/S3Plugin-fixed.pm", 
-                                  "/usr/share/perl5/PVE/Storage/S3Plugin.pm")
-                print("✅ Plugin principal copié")
-                
-                # Définir les permissions
-                self.ssh.exec_command("chown root:root /usr/share/perl5/PVE/Storage/S3Plugin.pm")
-                self.ssh.exec_command("chmod 644 /usr/share/perl5/PVE/Storage/S3Plugin.pm")
-            else:
-                print("❌ Fichier S3Plugin-fixed.pm non trouvé")
-                return False
+            files = []
+            for local_path, remote_path, mode in self.plugin_files():
+                with open(local_path, 'rb') as f:
+                    content = f.read()
+                files.append((remote_path, mode, content, hashlib.sha256(content).hexdigest()))
+            
+            # Répertoires et empreintes distantes en une seule commande
+            remote_paths = ' '.join(shlex.quote(remote_path) for remote_path, _, _, _ in files)
+            stdin, stdout, stderr = self.ssh.exec_command(
+                f"mkdir -p {' '.join(directories)} && sha256sum {remote_paths} 2>/dev/null"
+            )
+            remote_checksums = {}
+            for line in stdout.read().decode().splitlines():
+                digest, _, path = line.partition('  ')
+                remote_checksums[path] = digest
+            
+            changed = [f for f in files if remote_checksums.get(f[0]) != f[3]]
+            if not changed:
+                print("✅ Fichiers du plugin déjà à jour")
+                return True
             
-            # Copier les modules S3 si ils existent
-            if os.path.exists("PVE/Storage/S3"):
-                for root, dirs, files in os.walk("PVE/Storage/S3"):
-                    for file in files:
-                        if file.endswith('.pm'):
-                            local_path = os.path.join(root, file)
-                            remote_path = f"/usr/share/perl5/PVE/Storage/S3/{file}"
-                            self.scp_client.put(local_path, remote_path)
-                            self.ssh.exec_command(f"chown root:root {remote_path}")
-                            self.ssh.exec_command(f"chmod 644 {remote_path}")
-                print("✅ Modules S3 copiés")
-            
-            # Copier les scripts utilitaires si ils existent
-            if os.path.exists("scripts"):
-                for script_file in os.listdir("scripts"):
-                    if script_file.startswith('pve-s3-'):
-                        local_path = os.path.join("scripts", script_file)
-                        remote_path = f"/usr/local/bin/{script_file}"
-                        self.scp_client.put(local_path, remote_path)
-                        self.ssh.exec_command(f"chmod +x {remote_path}")
-                print("✅ Scripts utilitaires copiés")
+            archive = io.BytesIO()
+            with tarfile.open(fileobj=archive, mode='w') as tar:
+                for remote_path, mode, content, _ in changed:
+                    info = tarfile.TarInfo(remote_path.lstrip('/'))
+                    info.size = len(content)
+                    info.mode = mode
+                    info.mtime = int(datetime.now().timestamp())
+                    info.uid = info.gid = 0
+                    info.uname = info.gname = 'root'
+                    tar.addfile(info, io.BytesIO(content))
+            
+            stdin, stdout, stderr = self.ssh.exec_command('tar --same-owner -xpf - -C /')
+            stdin.write(archive.getvalue())
+            stdin.channel.shutdown_write()
+            error_output = stderr.read().decode().strip()
+            
+            if stdout.channel.recv_exit_status() != 0:
+                print(f"❌ Erreur lors de l'extraction: {error_output}")
+                return False
             
+            for remote_path, _, _, _ in changed:
+                print(f"✅ {remote_path}")
+            print(f"✅ {len(changed)}/{len(files)} fichier(s) mis à jour")
             return True
             
         except Exception as e:
@@ -373,6 +460,11 @@ class ProxmoxS3Installer:
             'content': content,
             'provider': provider['name']
         }
+        if provider.get('profile'):
+            self.storage_config['profile'] = dict(
+                provider['profile'],
+                addressing_style='path' if provider['path_style'] else 'virtual'
+            )
         
         return True
 
@@ -533,6 +625,10 @@ region = {self.storage_config['region']}
         if 'shared' in self.storage_config:
             config_lines.append(f"        shared {self.storage_config['shared']}")
         
+        # Profil du fournisseur
+        for key, value in self.storage_config.get('profile', {}).items():
+            config_lines.append(f"        {key} {value}")
+        
         config_text = '\n'.join(config_lines)
         
         try:
@@ -557,7 +653,14 @@ region = {self.storage_config['region']}
         """Redémarrage des services Proxmox"""
         print("\n🔄 Redémarrage des services Proxmox...")
         
-        services = ['pvedaemon', 'pveproxy']
+        services = ['pve-s3-transferd', 'pvedaemon', 'pveproxy']
+        
+        # Service de transfert partagé (unité copiée avec les scripts)
+        stdin, stdout, stderr = self.ssh.exec_command(
+            'systemctl daemon-reload && systemctl enable pve-s3-transferd')
+        if stdout.channel.recv_exit_status() != 0:
+            print(f"   ⚠️  pve-s3-transferd non activé: {stderr.read().decode().strip()}")
+            services.remove('pve-s3-transferd')
         
         for service in services:
             try:
@@ -701,8 +804,6 @@ region = {self.storage_config['region']}
             print(f"\n\n❌ Erreur inattendue: {e}")
             return False
         finally:
-            if self.scp_client:
-                self.scp_client.close()
             if self.ssh:
                 self.ssh.close()
 
@@ -718,7 +819,7 @@ Exemples d'utilisation:
 
 Prérequis:
   - Serveur Proxmox VE accessible en SSH
-  - Modules Python: paramiko, scp (pip install paramiko scp)
+  - Modules Python: paramiko (pip install paramiko)
   - Fichiers du plugin S3 dans le répertoire courant
         """
     )
@@ -2,11 +2,38 @@
 """
 Script de diagnostic post-installation pour le plugin S3 Proxmox
 À exécuter sur le serveur Proxmox pour vérifier l'installation
+
+Les vérifications s'exécutent en parallèle. Avec --cluster, le diagnostic
+est lancé sur tous les nœuds du cluster (via SSH, en parallèle) et les
+résultats sont regroupés dans un seul rapport avec la durée de chaque
+vérification.
+
+Avec --perf, les performances de l'endpoint des stockages S3 configurés sont
+mesurées (latences HEAD, LIST, PUT/GET de petits objets, débit d'un upload
+multipart et de lectures par ranges en parallèle) et comparées à la taille
+de part et à la concurrence de storage.cfg.
+
+Usage:
+    python3 diagnostic-proxmox.py
+    python3 diagnostic-proxmox.py --cluster
+    python3 diagnostic-proxmox.py --perf [--storage ID]
 """
 
-import subprocess
+import argparse
+import hashlib
+import hmac
+import json
 import os
+import re
+import subprocess
 import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from urllib.parse import quote
 
 def run_command(cmd, description=""):
     """Exécute une commande et retourne le résultat"""
@@ -22,28 +49,54 @@ def print_section(title):
     print(f"   {title}")
     print("="*60)
 
-def check_files():
+PLUGIN_DIR = "/usr/share/perl5/PVE/Storage"
+PERL_LIB = "/usr/share/perl5"
+
+REQUIRED_FILES = [
+    "/usr/share/perl5/PVE/Storage/S3Plugin.pm",
+    "/usr/share/perl5/PVE/Storage/S3/Client.pm",
+    "/usr/share/perl5/PVE/Storage/S3/Config.pm",
+    "/usr/share/perl5/PVE/Storage/S3/Auth.pm",
+    "/usr/share/perl5/PVE/Storage/S3/Transfer.pm",
+    "/usr/share/perl5/PVE/Storage/S3/Metadata.pm",
+    "/usr/share/perl5/PVE/Storage/S3/Utils.pm",
+    "/usr/share/perl5/PVE/Storage/S3/Exception.pm",
+    "/usr/local/bin/pve-s3-backup",
+    "/usr/local/bin/pve-s3-restore", 
+    "/usr/local/bin/pve-s3-maintenance"
+]
+
+LOG_ANALYZER = "/usr/local/bin/pve-s3-log-analyze"
+
+# Compilation de tous les modules dans un seul processus perl: les modules
+# communs (PVE::Storage, LWP...) ne sont chargés qu'une fois
+PERL_CHECK_SCRIPT = r"""
+local $SIG{__WARN__} = sub {};
+foreach my $module (@ARGV) {
+    if (eval { require $module; 1 }) {
+        print "OK\t$module\n";
+    } else {
+        my $err = $@;
+        $err =~ s/\s+/ /g;
+        print "ERR\t$module\t$err\n";
+    }
+}
+"""
+
+def tail_file(path, max_bytes=1000):
+    """Fin d'un fichier, lue depuis la fin sans charger le reste"""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - max_bytes))
+        return f.read().decode(errors='replace')
+
+def check_files(out):
     """Vérification des fichiers du plugin"""
-    print_section("VÉRIFICATION DES FICHIERS")
-    
-    required_files = [
-        "/usr/share/perl5/PVE/Storage/S3Plugin.pm",
-        "/usr/share/perl5/PVE/Storage/S3/Client.pm",
-        "/usr/share/perl5/PVE/Storage/S3/Config.pm",
-        "/usr/share/perl5/PVE/Storage/S3/Auth.pm",
-        "/usr/share/perl5/PVE/Storage/S3/Transfer.pm",
-        "/usr/share/perl5/PVE/Storage/S3/Metadata.pm",
-        "/usr/share/perl5/PVE/Storage/S3/Utils.pm",
-        "/usr/share/perl5/PVE/Storage/S3/Exception.pm",
-        "/usr/local/bin/pve-s3-backup",
-        "/usr/local/bin/pve-s3-restore", 
-        "/usr/local/bin/pve-s3-maintenance"
-    ]
-    
     missing_files = []
-    for file_path in required_files:
+    for file_path in REQUIRED_FILES:
         if os.path.exists(file_path):
-            print(f"✅ {file_path}")
+            out.append(f"✅ {file_path}")
             
             # Vérifier les permissions
             stat_info = os.stat(file_path)
@@ -51,154 +104,787 @@ def check_files():
             
             if file_path.endswith('.pm'):
                 if perms != '644':
-                    print(f"   ⚠️  Permissions incorrectes: {perms} (devrait être 644)")
+                    out.append(f"   ⚠️  Permissions incorrectes: {perms} (devrait être 644)")
             elif '/bin/' in file_path:
                 if perms != '755':
-                    print(f"   ⚠️  Permissions incorrectes: {perms} (devrait être 755)")
+                    out.append(f"   ⚠️  Permissions incorrectes: {perms} (devrait être 755)")
         else:
-            print(f"❌ {file_path} - MANQUANT")
+            out.append(f"❌ {file_path} - MANQUANT")
             missing_files.append(file_path)
     
     return len(missing_files) == 0
 
-def check_perl_syntax():
-    """Vérification de la syntaxe Perl"""
-    print_section("VÉRIFICATION SYNTAXE PERL")
-    
-    perl_files = [
-        "/usr/share/perl5/PVE/Storage/S3Plugin.pm",
-        "/usr/share/perl5/PVE/Storage/S3/Client.pm",
-        "/usr/share/perl5/PVE/Storage/S3/Config.pm",
-        "/usr/share/perl5/PVE/Storage/S3/Auth.pm",
-        "/usr/share/perl5/PVE/Storage/S3/Transfer.pm",
-        "/usr/share/perl5/PVE/Storage/S3/Metadata.pm",
-        "/usr/share/perl5/PVE/Storage/S3/Utils.pm",
-        "/usr/share/perl5/PVE/Storage/S3/Exception.pm"
-    ]
+def check_perl_syntax(out):
+    """Vérification de la syntaxe Perl (tous les modules en un processus)"""
+    perl_files = [f"{PLUGIN_DIR}/S3Plugin.pm"]
+    modules_dir = f"{PLUGIN_DIR}/S3"
+    if os.path.isdir(modules_dir):
+        perl_files += sorted(
+            os.path.join(modules_dir, f) for f in os.listdir(modules_dir) if f.endswith('.pm')
+        )
     
     all_syntax_ok = True
+    modules = []
     for perl_file in perl_files:
         if os.path.exists(perl_file):
-            success, stdout, stderr = run_command(f"perl -c {perl_file}")
-            if success and "syntax OK" in stderr:
-                print(f"✅ {os.path.basename(perl_file)} - Syntaxe OK")
-            else:
-                print(f"❌ {os.path.basename(perl_file)} - ERREUR SYNTAXE:")
-                print(f"   {stderr}")
-                all_syntax_ok = False
+            modules.append(os.path.relpath(perl_file, PERL_LIB))
         else:
-            print(f"⚠️  {perl_file} - Fichier manquant")
+            out.append(f"⚠️  {perl_file} - Fichier manquant")
+            all_syntax_ok = False
+    
+    if not modules:
+        return False
+    
+    result = subprocess.run(['perl', f'-I{PERL_LIB}', '-e', PERL_CHECK_SCRIPT] + modules, capture_output=True, text=True)
+    checked = set()
+    for line in result.stdout.splitlines():
+        status, module, *error = line.split('\t', 2)
+        checked.add(module)
+        if status == 'OK':
+            out.append(f"✅ {os.path.basename(module)} - Syntaxe OK")
+        else:
+            out.append(f"❌ {os.path.basename(module)} - ERREUR SYNTAXE:")
+            out.append(f"   {error[0] if error else ''}")
+            all_syntax_ok = False
+    
+    # Arrêt de perl avant la fin de la liste
+    for module in modules:
+        if module not in checked:
+            out.append(f"❌ {os.path.basename(module)} - non vérifié: {result.stderr.strip()}")
             all_syntax_ok = False
     
     return all_syntax_ok
 
-def check_services():
+def check_services(out):
     """Vérification des services Proxmox"""
-    print_section("VÉRIFICATION DES SERVICES")
-    
     services = ['pvedaemon', 'pveproxy', 'pvestatd']
     all_services_ok = True
     
-    for service in services:
-        success, stdout, stderr = run_command(f"systemctl is-active {service}")
-        if success and stdout == "active":
-            print(f"✅ {service} - Actif")
+    success, stdout, stderr = run_command(f"systemctl is-active {' '.join(services)}")
+    states = stdout.split('\n')
+    for service, state in zip(services, states + [''] * len(services)):
+        if state == "active":
+            out.append(f"✅ {service} - Actif")
         else:
-            print(f"❌ {service} - Inactif ou erreur")
+            out.append(f"❌ {service} - Inactif ou erreur")
             all_services_ok = False
     
     return all_services_ok
 
-def check_storage_config():
+def check_storage_config(out):
     """Vérification de la configuration storage.cfg"""
-    print_section("VÉRIFICATION CONFIGURATION")
-    
     config_file = "/etc/pve/storage.cfg"
     
     if not os.path.exists(config_file):
-        print(f"❌ {config_file} - Fichier manquant")
+        out.append(f"❌ {config_file} - Fichier manquant")
         return False
     
     with open(config_file, 'r') as f:
         content = f.read()
     
     if 's3:' in content:
-        print("✅ Configuration S3 trouvée dans storage.cfg")
-        print("\nConfiguration S3 actuelle:")
-        print("-" * 40)
+        out.append("✅ Configuration S3 trouvée dans storage.cfg")
+        out.append("\nConfiguration S3 actuelle:")
+        out.append("-" * 40)
         
         lines = content.split('\n')
         in_s3_section = False
         for line in lines:
             if line.startswith('s3:'):
                 in_s3_section = True
-                print(f"📋 {line}")
-            elif in_s3_section and line.startswith('    '):
-                print(f"   {line}")
+                out.append(f"📋 {line}")
+            elif in_s3_section and line.startswith(('    ', '\t')):
+                out.append(f"   {line}")
             elif in_s3_section and line.strip() == '':
                 continue
             elif in_s3_section:
                 in_s3_section = False
         
-        print("-" * 40)
+        out.append("-" * 40)
         return True
     else:
-        print("❌ Aucune configuration S3 trouvée dans storage.cfg")
+        out.append("❌ Aucune configuration S3 trouvée dans storage.cfg")
         return False
 
-def check_pvesm_status():
+def check_pvesm_status(out):
     """Vérification du statut via pvesm"""
-    print_section("TEST PVESM (GESTIONNAIRE DE STOCKAGE)")
-    
     # Test pvesm status général
     success, stdout, stderr = run_command("pvesm status")
     if success:
-        print("✅ pvesm status fonctionne")
+        out.append("✅ pvesm status fonctionne")
         
         # Chercher les stockages S3
         if 's3' in stdout.lower():
-            print("✅ Stockage S3 détecté dans la liste")
-            print("\nStockages détectés:")
-            for line in stdout.split('\n')[1:]:  # Skip header
-                if line.strip():
-                    print(f"   📦 {line}")
+            out.append("✅ Stockage S3 détecté dans la liste")
+            out.append("\nStockages détectés:")
         else:
-            print("⚠️  Aucun stockage S3 visible dans la liste")
-            print("\nStockages actuels:")
-            for line in stdout.split('\n')[1:]:  # Skip header
-                if line.strip():
-                    print(f"   📦 {line}")
+            out.append("⚠️  Aucun stockage S3 visible dans la liste")
+            out.append("\nStockages actuels:")
+        for line in stdout.split('\n')[1:]:  # Skip header
+            if line.strip():
+                out.append(f"   📦 {line}")
     else:
-        print(f"❌ Erreur pvesm status: {stderr}")
+        out.append(f"❌ Erreur pvesm status: {stderr}")
         return False
     
     return True
 
-def check_logs():
+def check_logs(out):
     """Vérification des logs"""
-    print_section("VÉRIFICATION DES LOGS")
-    
-    # Journalctl pour pvedaemon
-    success, stdout, stderr = run_command("journalctl -u pvedaemon --since '1 hour ago' | tail -10")
+    # Journalctl pour pvedaemon (5 dernières lignes de la dernière heure)
+    success, stdout, stderr = run_command("journalctl -u pvedaemon --since '1 hour ago' -n 5 --no-pager")
     if success and stdout:
-        print("📋 Derniers logs pvedaemon (1h):")
-        for line in stdout.split('\n')[-5:]:  # Dernières 5 lignes
+        out.append("📋 Derniers logs pvedaemon (1h):")
+        for line in stdout.split('\n'):
             if line.strip():
-                print(f"   {line}")
+                out.append(f"   {line}")
     
     # Vérifier si le fichier de log S3 existe
     s3_log = "/var/log/pve/storage-s3.log"
     if os.path.exists(s3_log):
-        print(f"✅ {s3_log} existe")
-        with open(s3_log, 'r') as f:
-            content = f.read()[-1000:]  # Derniers 1000 caractères
-            if content.strip():
-                print("📋 Contenu récent:")
-                print(content)
+        out.append(f"✅ {s3_log} existe")
+        # Synthèse des transferts des dernières 24h, sinon fin du fichier
+        if os.path.exists(LOG_ANALYZER):
+            success, stdout, stderr = run_command(f"{LOG_ANALYZER} --since 24h --window 1d --top 5")
+            if success and stdout.strip():
+                out.append("📋 Transferts des dernières 24h:")
+                out.extend(f"   {line}" for line in stdout.rstrip().split('\n'))
+                return None
+        content = tail_file(s3_log, 1000)  # Derniers 1000 caractères
+        if content.strip():
+            out.append("📋 Contenu récent:")
+            out.append(content)
+        else:
+            out.append("📋 Fichier vide")
+    else:
+        out.append(f"ℹ️  {s3_log} n'existe pas encore (normal si pas encore utilisé)")
+    
+    return None
+
+# Temps de démarrage: meilleur de STARTUP_RUNS lancements, moins celui de
+# la référence (les autres vérifications tournent en parallèle)
+STARTUP_RUNS = 5
+STARTUP_LIMIT = 0.1  # secondes ajoutées au-delà de la référence
+
+# Modules qui ne doivent être chargés qu'au premier usage
+STARTUP_HEAVY_MODULES = [
+    'LWP/UserAgent.pm',
+    'HTTP/Request.pm',
+    'IO/Socket/SSL.pm',
+    'XML/Simple.pm',
+    'PVE/Storage/S3/Client.pm',
+    'PVE/Storage/S3/Transfer.pm',
+    'PVE/Storage/S3/ArchiveIndex.pm',
+    'PVE/Storage/S3/Cache.pm',
+]
+
+def time_command(argv, runs=STARTUP_RUNS):
+    """Meilleur temps d'exécution d'une commande (None si elle échoue)"""
+    best = None
+    for _ in range(runs):
+        start = time.monotonic()
+        result = subprocess.run(argv, capture_output=True)
+        elapsed = time.monotonic() - start
+        if result.returncode != 0:
+            return None
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def check_startup(out):
+    """Temps de démarrage du plugin et des scripts (chargement différé des modules)"""
+    all_ok = True
+    
+    # Plugin: compilé par chaque processus PVE (pvedaemon, pvestatd, pvesm...)
+    plugin = ['perl', f'-I{PERL_LIB}', '-e', 'use PVE::Storage::S3Plugin; print "$_\\n" for sort keys %INC']
+    base = time_command(['perl', f'-I{PERL_LIB}', '-e', 'use PVE::Storage::Plugin'])
+    elapsed = time_command(plugin)
+    if elapsed is None or base is None:
+        out.append("❌ S3Plugin.pm - chargement impossible")
+        return False
+    
+    loaded = subprocess.run(plugin, capture_output=True, text=True).stdout.split()
+    s3_modules = [m for m in loaded if m.startswith('PVE/Storage/S3/')]
+    added = elapsed - base
+    status = "✅" if added <= STARTUP_LIMIT else "⚠️ "
+    out.append(f"{status} S3Plugin.pm: +{added * 1000:.0f} ms ({len(loaded)} modules, dont {len(s3_modules)} S3)")
+    heavy = [m for m in STARTUP_HEAVY_MODULES if m in loaded]
+    if heavy:
+        out.append(f"   ⚠️  Chargés au démarrage: {', '.join(heavy)}")
+    if heavy or added > STARTUP_LIMIT:
+        all_ok = False
+    
+    # Scripts: appel court (--version), sans accès S3
+    base = time_command(['perl', '-e', '1'])
+    for script in ('pve-s3-backup', 'pve-s3-restore', 'pve-s3-maintenance'):
+        path = f"/usr/local/bin/{script}"
+        if not os.path.exists(path):
+            continue
+        elapsed = time_command([path, '--version'])
+        if elapsed is None:
+            out.append(f"❌ {script} --version a échoué")
+            all_ok = False
+            continue
+        added = elapsed - base
+        if added > STARTUP_LIMIT:
+            out.append(f"⚠️  {script}: {elapsed * 1000:.0f} ms (+{added * 1000:.0f} ms)")
+            all_ok = False
+        else:
+            out.append(f"✅ {script}: {elapsed * 1000:.0f} ms")
+    
+    if not all_ok:
+        out.append(f"   ℹ️  Seuil: +{STARTUP_LIMIT * 1000:.0f} ms; les modules S3 et LWP doivent être chargés au premier usage")
+    return all_ok
+
+# Vérifications: (clé, titre, fonction, nom dans le résumé)
+CHECKS = [
+    ('files', "VÉRIFICATION DES FICHIERS", check_files, "Fichiers présents"),
+    ('syntax', "VÉRIFICATION SYNTAXE PERL", check_perl_syntax, "Syntaxe Perl"),
+    ('services', "VÉRIFICATION DES SERVICES", check_services, "Services actifs"),
+    ('config', "VÉRIFICATION CONFIGURATION", check_storage_config, "Configuration S3"),
+    ('pvesm', "TEST PVESM (GESTIONNAIRE DE STOCKAGE)", check_pvesm_status, "pvesm status"),
+    ('logs', "VÉRIFICATION DES LOGS", check_logs, "Logs"),
+    ('startup', "TEMPS DE DÉMARRAGE", check_startup, "Démarrage"),
+]
+
+def _run_check(key, title, function, label):
+    out = []
+    start = time.monotonic()
+    try:
+        ok = function(out)
+    except Exception as e:
+        out.append(f"❌ Erreur: {e}")
+        ok = False
+    return {
+        'key': key,
+        'title': title,
+        'label': label,
+        'ok': ok,
+        'lines': out,
+        'duration': time.monotonic() - start,
+    }
+
+def run_checks():
+    """Exécution concurrente des vérifications (résultats dans l'ordre de CHECKS)"""
+    with ThreadPoolExecutor(max_workers=len(CHECKS)) as executor:
+        futures = [executor.submit(_run_check, *check) for check in CHECKS]
+        return [future.result() for future in futures]
+
+def print_results(results):
+    """Affichage détaillé des vérifications d'un nœud"""
+    for result in results:
+        print_section(f"{result['title']} ({result['duration']:.2f}s)")
+        for line in result['lines']:
+            print(line)
+
+def parse_cluster_nodes(nodes_output, status_output):
+    """Nœuds du cluster d'après `pvecm nodes` et `pvecm status`
+
+    Retourne une liste de (nom, adresse, local).
+    """
+    addresses = {}
+    for line in status_output.splitlines():
+        match = re.match(r'^\s*0x([0-9a-fA-F]+)\s+\d+\s+(\S+)', line)
+        if match:
+            addresses[int(match.group(1), 16)] = match.group(2)
+    
+    nodes = []
+    for line in nodes_output.splitlines():
+        match = re.match(r'^\s*(\d+)\s+\d+\s+(\S+)(\s+\(local\))?', line)
+        if match:
+            nodeid = int(match.group(1))
+            nodes.append((match.group(2), addresses.get(nodeid, match.group(2)), bool(match.group(3))))
+    return nodes
+
+def run_remote_checks(address):
+    """Diagnostic d'un nœud distant: ce script envoyé sur stdin via SSH"""
+    with open(os.path.abspath(__file__), 'rb') as f:
+        script = f.read()
+    
+    result = subprocess.run(
+        ['ssh', '-o', 'BatchMode=yes', '-o', 'ConnectTimeout=5', f'root@{address}', 'python3', '-', '--json'],
+        input=script, capture_output=True, timeout=300,
+    )
+    if result.returncode != 0 and not result.stdout:
+        raise RuntimeError(result.stderr.decode(errors='replace').strip() or f"ssh: code {result.returncode}")
+    return json.loads(result.stdout.decode())
+
+def run_cluster():
+    """Diagnostic de tous les nœuds en parallèle et rapport fusionné"""
+    _, nodes_output, _ = run_command("pvecm nodes")
+    _, status_output, _ = run_command("pvecm status")
+    nodes = parse_cluster_nodes(nodes_output, status_output)
+    if not nodes:
+        print("❌ Aucun nœud trouvé (pvecm nodes): ce serveur n'est pas membre d'un cluster")
+        return False
+    
+    start = time.monotonic()
+    reports = {}
+    with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        futures = {
+            executor.submit(run_checks if local else run_remote_checks, *([] if local else [address])): name
+            for name, address, local in nodes
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                reports[name] = future.result()
+            except Exception as e:
+                reports[name] = e
+    total = time.monotonic() - start
+    
+    names = [name for name, _, _ in nodes]
+    width = max(len(name) for name in names + ['Vérification'])
+    
+    print_section(f"RÉSUMÉ DU CLUSTER ({len(names)} nœuds, {total:.1f}s)")
+    header = f"{'Vérification':<24}" + ''.join(f"  {name:>{width}}" for name in names)
+    print(header)
+    print('-' * len(header))
+    for key, _, _, label in CHECKS:
+        row = f"{label:<24}"
+        for name in names:
+            report = reports[name]
+            if isinstance(report, Exception):
+                cell = '⛔'
+            else:
+                result = next(r for r in report if r['key'] == key)
+                icon = 'ℹ️' if result['ok'] is None else '✅' if result['ok'] else '❌'
+                cell = f"{icon} {result['duration']:.2f}s"
+            row += f"  {cell:>{width}}"
+        print(row)
+    
+    # Détail des vérifications en échec
+    all_ok = True
+    for name in names:
+        report = reports[name]
+        if isinstance(report, Exception):
+            all_ok = False
+            print_section(f"{name}: NŒUD INACCESSIBLE")
+            print(f"⛔ {report}")
+            continue
+        for result in report:
+            if result['ok'] is False:
+                all_ok = False
+                print_section(f"{name}: {result['title']} ({result['duration']:.2f}s)")
+                for line in result['lines']:
+                    print(line)
+    
+    if all_ok:
+        print("\n🎉 Installation correcte sur tous les nœuds!")
+    else:
+        print("\n⚠️  Des problèmes ont été détectés, voir le détail ci-dessus")
+    return all_ok
+
+# Mesure de performance (--perf). Le client S3 est intégré au script (signature
+# V4, bibliothèque standard) pour que celui-ci reste autonome sur les nœuds.
+
+STORAGE_CFG = "/etc/pve/storage.cfg"
+MB = 1024 * 1024
+PERF_SAMPLES = 10
+PERF_SMALL_OBJECT = 4096
+
+# Au-delà de ces seuils, un paramètre est signalé comme limitant
+PART_RTT_RATIO = 20      # durée d'une part / RTT: en dessous, la latence pèse sur chaque part
+LINEAR_SCALING = 0.8     # débit à N flux / (N x débit d'un flux): au-dessus, le lien n'est pas saturé
+CONCURRENCY_GAIN = 0.25  # gain du double de flux en lecture
+
+class PerfError(Exception):
+    pass
+
+def read_s3_storages(path=STORAGE_CFG):
+    """Stockages S3 de storage.cfg: {id: {propriété: valeur}}"""
+    storages = {}
+    current = None
+    with open(path) as f:
+        for line in f:
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            if line[0] in ' \t':
+                if current is not None:
+                    key, _, value = line.strip().partition(' ')
+                    current[key] = value.strip()
+                continue
+            kind, _, name = line.partition(':')
+            current = storages.setdefault(name.strip(), {}) if kind.strip() == 's3' else None
+    return storages
+
+def percentiles(values):
+    """n, p50, p95, p99 et max (secondes, rang le plus proche)"""
+    values = sorted(values)
+    rank = lambda fraction: values[min(len(values) - 1, int(fraction * len(values)))]
+    return {'count': len(values), 'p50': rank(0.5), 'p95': rank(0.95), 'p99': rank(0.99), 'max': values[-1]}
+
+class PerfClient:
+    """Client S3 minimal: mêmes règles d'endpoint et d'adressage que le plugin
+    
+    Une connexion persistante par thread.
+    """
+    
+    def __init__(self, scfg):
+        match = re.match(r'^(?:(https?)://)?([^/:]+)(?::(\d+))?/?$', scfg['endpoint'].strip())
+        if not match:
+            raise PerfError(f"endpoint invalide: {scfg['endpoint']}")
+        self.secure = (match.group(1) or 'https') == 'https'
+        self.host = match.group(2)
+        self.port = int(match.group(3)) if match.group(3) else None
+        self.bucket = scfg['bucket']
+        self.region = scfg.get('region') or 'us-east-1'
+        self.access_key = scfg.get('access_key', '')
+        self.secret_key = scfg.get('secret_key', '')
+        self.session_token = scfg.get('session_token')
+        self.timeout = int(scfg.get('connection_timeout') or 60)
+        self.virtual = scfg.get('addressing_style') == 'virtual'
+        if self.virtual:
+            self.host = f"{self.bucket}.{self.host}"
+        self.local = threading.local()
+    
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            cls = HTTPSConnection if self.secure else HTTPConnection
+            conn = self.local.conn = cls(self.host, self.port, timeout=self.timeout)
+        return conn
+    
+    def close(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+    
+    def request(self, method, key='', query=None, body=b'', headers=None, payload_hash=None, discard=False):
+        """Requête signée; retourne (statut, réponse, corps) — avec discard, le corps
+        est lu par blocs et seule sa taille est retournée"""
+        path = ('' if self.virtual else f"/{self.bucket}") + (f"/{quote(key, safe='/')}" if key else '')
+        path = path or '/'
+        canonical_query = '&'.join(
+            f"{quote(k, safe='-_.~')}={quote(str(v), safe='-_.~')}" for k, v in sorted((query or {}).items())
+        )
+        request_headers = self._sign(method, path, canonical_query, payload_hash or hashlib.sha256(body).hexdigest())
+        request_headers['Content-Length'] = str(len(body))
+        request_headers.update(headers or {})
+        
+        conn = self.connection()
+        try:
+            conn.request(method, path + (f"?{canonical_query}" if canonical_query else ''), body=body or None,
+                         headers=request_headers)
+            response = conn.getresponse()
+            if discard and response.status < 300:
+                data = 0
+                while True:
+                    block = response.read(MB)
+                    if not block:
+                        break
+                    data += len(block)
             else:
-                print("📋 Fichier vide")
+                data = response.read()
+        except (OSError, HTTPException):
+            self.close()
+            raise
+        return response.status, response, data
+    
+    def _sign(self, method, path, canonical_query, payload_hash):
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        date = now.strftime('%Y%m%d')
+        host = self.host if self.port is None else f"{self.host}:{self.port}"
+        
+        headers = {'host': host, 'x-amz-content-sha256': payload_hash, 'x-amz-date': amz_date}
+        if self.session_token:
+            headers['x-amz-security-token'] = self.session_token
+        signed_headers = ';'.join(sorted(headers))
+        canonical_request = '\n'.join([
+            method, path, canonical_query,
+            ''.join(f"{name}:{headers[name]}\n" for name in sorted(headers)),
+            signed_headers, payload_hash,
+        ])
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+        
+        key = ('AWS4' + self.secret_key).encode()
+        for part in (date, self.region, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+        
+        headers['Authorization'] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+                                    f"SignedHeaders={signed_headers}, Signature={signature}")
+        return headers
+
+class PerfProbe:
+    """Mesures sur un stockage, sous un préfixe temporaire supprimé à la fin
+    
+    L'upload multipart utilise la taille de part et la concurrence de
+    storage.cfg: une part sur un flux seul, puis deux parts par flux à la
+    concurrence configurée. L'objet obtenu est relu par ranges d'une part,
+    à la concurrence configurée puis au double.
+    """
+    
+    def __init__(self, storage, scfg, log=print):
+        self.storage = storage
+        self.scfg = scfg
+        self.client = PerfClient(scfg)
+        prefix = scfg.get('prefix', 'proxmox/').strip('/')
+        self.base = f"{prefix + '/' if prefix else ''}.pve-s3-perf-{uuid.uuid4().hex[:12]}"
+        self.part_size = int(scfg.get('multipart_chunk_size') or 100) * MB
+        self.concurrency = int(scfg.get('max_concurrent_uploads') or 3)
+        self.log = log
+        self.keys = []
+        self.uploads = []
+        self.connect_time = None
+        self.latencies = {}
+        self.throughput = {}
+    
+    def run(self):
+        try:
+            self.measure_requests()
+            self.measure_multipart_upload()
+            self.measure_ranged_download()
+        finally:
+            self.cleanup()
+        return self.report()
+    
+    def timed(self, name, method, key='', expect=(200,), **kwargs):
+        start = time.monotonic()
+        status, response, data = self.client.request(method, key, **kwargs)
+        elapsed = time.monotonic() - start
+        if status not in expect:
+            raise PerfError(f"{name}: HTTP {status} {data[:200]!r}")
+        self.latencies.setdefault(name, []).append(elapsed)
+        return response, data
+    
+    def measure_requests(self):
+        """Latence des petites requêtes sur une connexion établie"""
+        # Première requête: ouverture de la connexion (TCP + TLS) comprise
+        start = time.monotonic()
+        status, _, data = self.client.request('HEAD')
+        if status != 200:
+            raise PerfError(f"HEAD bucket: HTTP {status} (bucket {self.client.bucket} inaccessible)")
+        self.connect_time = time.monotonic() - start
+        
+        payload = os.urandom(PERF_SMALL_OBJECT)
+        for _ in range(PERF_SAMPLES):
+            self.timed('HEAD bucket', 'HEAD')
+        for _ in range(PERF_SAMPLES):
+            self.timed('LIST', 'GET', query={'list-type': 2, 'prefix': self.base, 'max-keys': 100})
+        for index in range(PERF_SAMPLES):
+            key = f"{self.base}/small-{index}"
+            self.keys.append(key)
+            self.timed('PUT 4 KB', 'PUT', key, body=payload)
+        for key in self.keys:
+            self.timed('GET 4 KB', 'GET', key)
+        self.log(f"   Petites requêtes: HEAD {self._p50('HEAD bucket')}, PUT {self._p50('PUT 4 KB')}")
+    
+    def measure_multipart_upload(self):
+        """Débit d'un flux seul puis à la concurrence configurée"""
+        key = f"{self.base}/multipart"
+        _, body = self.timed('POST (initiation)', 'POST', key, query={'uploads': ''})
+        match = re.search(rb'<UploadId>([^<]+)</UploadId>', body)
+        if not match:
+            raise PerfError(f"initiation du multipart upload: {body[:200]!r}")
+        upload_id = match.group(1).decode()
+        self.uploads.append((key, upload_id))
+        
+        payload = os.urandom(self.part_size)
+        payload_hash = hashlib.sha256(payload).hexdigest()
+        etags = {}
+        
+        def put_part(number, name):
+            response, _ = self.timed(name, 'PUT', key, query={'partNumber': number, 'uploadId': upload_id},
+                                     body=payload, payload_hash=payload_hash)
+            etags[number] = response.getheader('ETag')
+        
+        part_mb = self.part_size // MB
+        start = time.monotonic()
+        put_part(1, 'PUT part (1 flux)')
+        self.throughput['upload_1'] = self.part_size / (time.monotonic() - start) / MB
+        self.log(f"   Upload, 1 flux, parts de {part_mb} MB: {self.throughput['upload_1']:.1f} MB/s")
+        
+        # Deux parts par flux: la première absorbe l'ouverture de connexion
+        numbers = range(2, 2 + 2 * self.concurrency)
+        name = f"PUT part ({self.concurrency} flux)"
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(lambda number: put_part(number, name), numbers))
+        self.throughput['upload'] = len(numbers) * self.part_size / (time.monotonic() - start) / MB
+        if self.concurrency > 1:
+            self.log(f"   Upload, {self.concurrency} flux: {self.throughput['upload']:.1f} MB/s")
+        
+        parts = ''.join(f"<Part><PartNumber>{number}</PartNumber><ETag>{etags[number]}</ETag></Part>"
+                        for number in sorted(etags))
+        _, body = self.timed('POST (complétion)', 'POST', key, query={'uploadId': upload_id},
+                             body=f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode())
+        if b'<Error>' in body:
+            raise PerfError(f"complétion du multipart upload: {body[:200]!r}")
+        self.uploads.remove((key, upload_id))
+        self.keys.append(key)
+        self.object = (key, len(etags) * self.part_size)
+    
+    def measure_ranged_download(self):
+        """Lecture par ranges d'une part, à la concurrence configurée puis au double"""
+        key, size = self.object
+        ranges = [(first, min(size, first + self.part_size) - 1) for first in range(0, size, self.part_size)]
+        
+        for label, workers in (('download', self.concurrency), ('download_2x', min(2 * self.concurrency, 20))):
+            if label == 'download_2x' and workers == self.concurrency:
+                break
+            name = f"GET range ({workers} flux)"
+            
+            def get_range(bounds):
+                self.timed(name, 'GET', key, expect=(206,), headers={'Range': 'bytes=%d-%d' % bounds}, discard=True)
+            
+            start = time.monotonic()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(get_range, ranges))
+            self.throughput[label] = size / (time.monotonic() - start) / MB
+            self.log(f"   Download par ranges, {workers} flux: {self.throughput[label]:.1f} MB/s")
+    
+    def cleanup(self):
+        """Suppression des objets de test et annulation de l'upload en cours"""
+        for key, upload_id in self.uploads:
+            self._delete(key, {'uploadId': upload_id})
+        for key in self.keys:
+            self._delete(key)
+        self.uploads = []
+        self.keys = []
+        self.client.close()
+    
+    def _delete(self, key, query=None):
+        try:
+            status, _, _ = self.client.request('DELETE', key, query=query)
+            if status not in (200, 204, 404):
+                self.log(f"   ⚠️  Suppression de {key}: HTTP {status}")
+        except (OSError, HTTPException) as e:
+            self.log(f"   ⚠️  Suppression de {key}: {e}")
+    
+    def _p50(self, name):
+        return f"{percentiles(self.latencies[name])['p50'] * 1000:.0f} ms"
+    
+    def hints(self):
+        """Paramètres de storage.cfg qui limitent clairement le débit"""
+        hints = []
+        part_mb = self.part_size // MB
+        rtt = percentiles(self.latencies['HEAD bucket'])['p50']
+        part_time = self.latencies['PUT part (1 flux)'][0]
+        if part_time < PART_RTT_RATIO * rtt:
+            hints.append(
+                f"multipart_chunk_size {part_mb}: une part prend {part_time:.2f}s pour un RTT de "
+                f"{rtt * 1000:.0f} ms, la latence pèse sur chaque part; augmentez la taille de part"
+            )
+        
+        upload_1, upload = self.throughput['upload_1'], self.throughput['upload']
+        if self.concurrency > 1 and upload >= LINEAR_SCALING * self.concurrency * upload_1:
+            hints.append(
+                f"max_concurrent_uploads {self.concurrency}: le débit croît avec le nombre de flux "
+                f"({upload_1:.1f} → {upload:.1f} MB/s), le lien n'est pas saturé; essayez "
+                f"{min(2 * self.concurrency, 20)}"
+            )
+        elif self.concurrency > 1 and upload < (1 + CONCURRENCY_GAIN) * upload_1:
+            hints.append(
+                f"max_concurrent_uploads {self.concurrency}: un flux atteint déjà {upload_1:.1f} MB/s "
+                f"({upload:.1f} MB/s à {self.concurrency}); moins de flux réduirait la mémoire utilisée "
+                f"({part_mb} MB par flux)"
+            )
+        
+        download, download_2x = self.throughput['download'], self.throughput.get('download_2x')
+        if download_2x and download_2x > (1 + CONCURRENCY_GAIN) * download:
+            hints.append(
+                f"lectures: {download_2x:.1f} MB/s à {min(2 * self.concurrency, 20)} flux contre "
+                f"{download:.1f} MB/s à {self.concurrency}; les restaurations par pve-s3-transferd "
+                f"utilisent max_concurrent_uploads"
+            )
+        
+        small = percentiles(self.latencies['HEAD bucket'])
+        if small['p95'] > 5 * small['p50']:
+            hints.append(
+                f"latence irrégulière: HEAD p95 {small['p95'] * 1000:.0f} ms pour p50 {small['p50'] * 1000:.0f} ms "
+                f"(endpoint chargé ou réseau instable)"
+            )
+        return hints
+    
+    def report(self):
+        return {
+            'storage': self.storage,
+            'endpoint': self.scfg['endpoint'],
+            'bucket': self.scfg['bucket'],
+            'part_size_mb': self.part_size // MB,
+            'concurrency': self.concurrency,
+            'connect_ms': round(self.connect_time * 1000, 1),
+            'latency_ms': {
+                name: {stat: round(value * 1000, 1) if stat != 'count' else value
+                       for stat, value in percentiles(values).items()}
+                for name, values in self.latencies.items()
+            },
+            'throughput_mb_s': {name: round(value, 1) for name, value in self.throughput.items()},
+            'hints': self.hints(),
+        }
+
+def print_perf_report(report):
+    """Latences par opération, débits et paramètres limitants"""
+    print(f"Endpoint: {report['endpoint']}, bucket {report['bucket']}")
+    print(f"Paramètres: parts de {report['part_size_mb']} MB, {report['concurrency']} flux simultanés")
+    print(f"Ouverture de connexion (TCP + TLS + 1re requête): {report['connect_ms']:.0f} ms\n")
+    print(f"{'Opération':<22} {'n':>3} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    print('-' * 65)
+    for name, stats in report['latency_ms'].items():
+        print(f"{name:<22} {stats['count']:>3}" + ''.join(
+            f" {stats[stat]:>6.0f} ms" for stat in ('p50', 'p95', 'p99', 'max')))
+    
+    labels = {
+        'upload_1': "Upload multipart, 1 flux",
+        'upload': f"Upload multipart, {report['concurrency']} flux",
+        'download': f"Download par ranges, {report['concurrency']} flux",
+        'download_2x': f"Download par ranges, {min(2 * report['concurrency'], 20)} flux",
+    }
+    print("\nDébits:")
+    for name, value in report['throughput_mb_s'].items():
+        if name == 'upload' and report['concurrency'] == 1:
+            continue
+        print(f"   {labels[name]:<34} {value:>8.1f} MB/s")
+    
+    print()
+    if report['hints']:
+        for hint in report['hints']:
+            print(f"💡 {hint}")
     else:
-        print(f"ℹ️  {s3_log} n'existe pas encore (normal si pas encore utilisé)")
+        print("✅ Aucun paramètre clairement limitant")
+
+def run_perf(storage=None, as_json=False):
+    """Mesure de performance des stockages S3 (ou d'un seul)"""
+    storages = read_s3_storages()
+    if storage:
+        if storage not in storages:
+            print(f"❌ Stockage S3 '{storage}' absent de {STORAGE_CFG}")
+            return False
+        storages = {storage: storages[storage]}
+    if not storages:
+        print(f"❌ Aucun stockage S3 dans {STORAGE_CFG}")
+        return False
+    
+    reports = []
+    all_ok = True
+    log = (lambda message: None) if as_json else print
+    for name, scfg in storages.items():
+        if not as_json:
+            print_section(f"PERFORMANCE DU STOCKAGE {name}")
+        start = time.monotonic()
+        try:
+            report = PerfProbe(name, scfg, log=log).run()
+        except (PerfError, OSError, HTTPException, KeyError) as e:
+            all_ok = False
+            reports.append({'storage': name, 'error': str(e)})
+            if not as_json:
+                print(f"❌ Mesure impossible: {e}")
+            continue
+        report['duration'] = round(time.monotonic() - start, 1)
+        reports.append(report)
+        if not as_json:
+            print()
+            print_perf_report(report)
+            print(f"\n(mesures en {report['duration']:.0f}s, objets de test supprimés)")
+    
+    if as_json:
+        print(json.dumps(reports))
+    return all_ok
 
 def provide_solutions(files_ok, syntax_ok, services_ok, config_ok):
     """Propose des solutions basées sur les résultats"""
@@ -232,8 +918,17 @@ def provide_solutions(files_ok, syntax_ok, services_ok, config_ok):
 
 def main():
     """Fonction principale de diagnostic"""
-    print("🔍 DIAGNOSTIC PLUGIN S3 PROXMOX")
-    print("=" * 60)
+    parser = argparse.ArgumentParser(description="Diagnostic du plugin S3 Proxmox")
+    parser.add_argument('--cluster', action='store_true', help="Diagnostic de tous les nœuds du cluster en parallèle")
+    parser.add_argument('--json', action='store_true', help="Résultats au format JSON")
+    parser.add_argument('--perf', action='store_true',
+                        help="Mesure des performances de l'endpoint S3 (crée puis supprime des objets de test)")
+    parser.add_argument('--storage', help="Stockage mesuré avec --perf (défaut: tous les stockages S3)")
+    args = parser.parse_args()
+    
+    if not args.json:
+        print("🔍 DIAGNOSTIC PLUGIN S3 PROXMOX")
+        print("=" * 60)
     
     # Vérification root uniquement sur Linux
     try:
@@ -246,20 +941,32 @@ def main():
     except:
         pass
     
+    if args.perf:
+        sys.exit(0 if run_perf(args.storage, args.json) else 1)
+    
+    if args.cluster:
+        sys.exit(0 if run_cluster() else 1)
+    
     # Exécuter toutes les vérifications
-    files_ok = check_files()
-    syntax_ok = check_perl_syntax()
-    services_ok = check_services()
-    config_ok = check_storage_config()
+    start = time.monotonic()
+    results = run_checks()
+    
+    if args.json:
+        print(json.dumps(results))
+        return
     
-    check_pvesm_status()
-    check_logs()
+    print_results(results)
+    status = {result['key']: result['ok'] for result in results}
+    files_ok = status['files']
+    syntax_ok = status['syntax']
+    services_ok = status['services']
+    config_ok = status['config']
     
     # Proposer des solutions
     provide_solutions(files_ok, syntax_ok, services_ok, config_ok)
     
     # Résumé final
-    print_section("RÉSUMÉ")
+    print_section(f"RÉSUMÉ ({time.monotonic() - start:.2f}s)")
     checks = [
         ("Fichiers présents", files_ok),
         ("Syntaxe Perl", syntax_ok),
@@ -281,4 +988,4 @@ def main():
         print("📌 Consultez les recommandations ci-dessus")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
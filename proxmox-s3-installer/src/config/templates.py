@@ -1,3 +1,14 @@
+from installer.s3_providers import get_provider_profile, profile_properties
+
+# Fournisseur (installer.s3_providers) de chaque modèle
+PROFILE_NAMES = {
+    "aws": "AWS S3",
+    "minio": "MinIO",
+    "ceph": "Ceph RadosGW",
+    "wasabi": "Wasabi",
+}
+
+
 class ConfigTemplates:
     def __init__(self):
         self.templates = {
@@ -51,5 +62,12 @@ class ConfigTemplates:
             },
         }
 
+        # Taille des parts, concurrence et capacités selon le profil du fournisseur
+        for key, name in PROFILE_NAMES.items():
+            profile = get_provider_profile(name)
+            self.templates[key]["multipart_chunk_size"] = profile["chunk_size"]
+            self.templates[key]["max_concurrent_uploads"] = profile["concurrency"]
+            self.templates[key].update(profile_properties(profile))
+
     def get_template(self, provider):
         return self.templates.get(provider, {})
\ No newline at end of file
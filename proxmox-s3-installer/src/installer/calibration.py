@@ -0,0 +1,314 @@
+"""
+Calibration de multipart_chunk_size et max_concurrent_uploads
+
+Mesure, contre le bucket configuré, la latence (RTT), le débit d'un flux
+seul selon la taille de part, puis le débit agrégé selon le nombre
+d'uploads simultanés. Les parts sont envoyées dans des multipart uploads
+temporaires qui sont annulés à la fin (aucun objet n'est créé).
+
+Le client S3 est volontairement minimal (signature V4, style "path" comme
+le plugin, bibliothèque standard uniquement) pour ne pas ajouter de
+dépendance à l'installateur.
+"""
+
+import hashlib
+import hmac
+import itertools
+import os
+import re
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.client import HTTPConnection, HTTPSConnection
+from urllib.parse import quote
+
+from installer.s3_providers import get_provider_profile
+
+MB = 1024 * 1024
+
+# Tailles de part essayées (MB) et niveaux de concurrence
+PART_SIZES = [8, 16, 32, 64, 128]
+CONCURRENCY_LEVELS = [1, 2, 4, 8, 16]
+
+# Borne du plugin (S3Plugin.pm); les bornes des parts viennent du profil du
+# fournisseur (installer.s3_providers)
+MAX_CONCURRENCY = 20
+
+# Un gain inférieur à ce seuil ne justifie pas une part plus grande ou un
+# upload simultané de plus
+PLATEAU = 0.10
+
+
+class S3Probe:
+    """Client S3 minimal (signature V4) pour les mesures"""
+
+    def __init__(self, endpoint, region, access_key, secret_key, bucket, addressing_style='path', timeout=60):
+        # Même règle que parse_endpoint du plugin: https sans schéma explicite
+        match = re.match(r'^(?:(https?)://)?([^/:]+)(?::(\d+))?/?$', endpoint.strip())
+        if not match:
+            raise ValueError(f"endpoint invalide: {endpoint}")
+        self.secure = (match.group(1) or 'https') == 'https'
+        self.host = match.group(2)
+        self.port = int(match.group(3)) if match.group(3) else None
+        self.region = region or 'us-east-1'
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.bucket = bucket
+        self.timeout = timeout
+        # Style "virtual": bucket dans le nom d'hôte, comme le plugin (addressing_style)
+        self.virtual = addressing_style == 'virtual'
+        if self.virtual:
+            self.host = f"{bucket}.{self.host}"
+
+    def connect(self):
+        """Nouvelle connexion persistante (une par flux)"""
+        cls = HTTPSConnection if self.secure else HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    def request(self, conn, method, key='', query=None, body=b'', payload_hash=None):
+        """Requête signée; retourne (statut, corps)"""
+        path = ('' if self.virtual else f"/{self.bucket}") + (f"/{quote(key, safe='/')}" if key else '')
+        path = path or '/'
+        query = query or {}
+        canonical_query = '&'.join(
+            f"{quote(k, safe='-_.~')}={quote(str(v), safe='-_.~')}" for k, v in sorted(query.items())
+        )
+        headers = self._sign(method, path, canonical_query, payload_hash or hashlib.sha256(body).hexdigest())
+        headers['Content-Length'] = str(len(body))
+
+        conn.request(method, path + (f"?{canonical_query}" if canonical_query else ''), body=body or None,
+                     headers=headers)
+        response = conn.getresponse()
+        return response.status, response.read()
+
+    def _sign(self, method, path, canonical_query, payload_hash):
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        date = now.strftime('%Y%m%d')
+        host = self.host if self.port is None else f"{self.host}:{self.port}"
+
+        headers = {'host': host, 'x-amz-content-sha256': payload_hash, 'x-amz-date': amz_date}
+        signed_headers = ';'.join(sorted(headers))
+        canonical_request = '\n'.join([
+            method, path, canonical_query,
+            ''.join(f"{name}:{headers[name]}\n" for name in sorted(headers)),
+            signed_headers, payload_hash,
+        ])
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+
+        key = ('AWS4' + self.secret_key).encode()
+        for part in (date, self.region, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+        headers['Authorization'] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+                                    f"SignedHeaders={signed_headers}, Signature={signature}")
+        return headers
+
+
+class CalibrationError(Exception):
+    pass
+
+
+class Calibrator:
+    """Mesures et choix de la taille de part et de la concurrence
+
+    budget: durée approximative des mesures (secondes). memory_limit (MB)
+    borne parts x concurrence, soit la mémoire tenue par le pool d'upload.
+    Les tailles de part restent dans les bornes du profil du fournisseur
+    (profil par défaut sinon); le plugin agrandit lui-même les parts des
+    fichiers qui dépasseraient max_parts.
+    """
+
+    def __init__(self, probe, prefix='', budget=45, memory_limit=1024, profile=None, log=print):
+        self.profile = profile or get_provider_profile(None)
+        self.probe = probe
+        prefix = prefix.strip('/')
+        self.key = f"{prefix + '/' if prefix else ''}.pve-s3-calibration-{uuid.uuid4().hex[:12]}"
+        self.budget = budget
+        self.memory_limit = memory_limit
+        self.log = log
+        self.uploads = []
+        self.results = {'rtt_ms': None, 'single_stream': {}, 'concurrency': {}}
+        self._payloads = {}
+
+    def run(self):
+        """Exécute les mesures; retourne (part_size MB, concurrence, raisons)"""
+        deadline = time.monotonic() + self.budget
+        try:
+            self.measure_rtt()
+            self.measure_part_sizes(deadline)
+            self.measure_concurrency(deadline)
+        finally:
+            self.cleanup()
+        return self.recommend()
+
+    def measure_rtt(self, samples=5):
+        """Médiane de HEAD bucket sur une connexion déjà établie"""
+        conn = self.probe.connect()
+        try:
+            timings = []
+            for _ in range(samples + 1):
+                start = time.monotonic()
+                status, body = self.probe.request(conn, 'HEAD')
+                if status != 200:
+                    raise CalibrationError(f"HEAD bucket: HTTP {status} {body[:200]!r}")
+                timings.append(time.monotonic() - start)
+        finally:
+            conn.close()
+        # La première requête inclut la connexion TCP/TLS
+        self.results['rtt_ms'] = statistics.median(timings[1:]) * 1000
+        self.log(f"   RTT: {self.results['rtt_ms']:.1f} ms")
+
+    def measure_part_sizes(self, deadline):
+        """Débit d'un flux seul pour des parts de taille croissante"""
+        upload_id = self._initiate()
+        conn = self.probe.connect()
+        try:
+            part_number = 1
+            best = 0
+            for size in PART_SIZES:
+                # Temps prévisible d'après le débit mesuré: on ne dépasse pas le budget
+                if best and time.monotonic() + size * MB / best > deadline:
+                    break
+                elapsed = self._upload_part(conn, upload_id, part_number, size)
+                part_number += 1
+                throughput = size * MB / elapsed
+                self.results['single_stream'][size] = throughput / MB
+                self.log(f"    1 flux, parts de {size:>3} MB: {throughput / MB:7.1f} MB/s")
+                if best and throughput < best * (1 + PLATEAU):
+                    break
+                best = max(best, throughput)
+        finally:
+            conn.close()
+
+    def measure_concurrency(self, deadline):
+        """Débit agrégé selon le nombre d'uploads simultanés"""
+        size = self._concurrency_part_size()
+        upload_id = self._initiate()
+        # Numéros de part partagés par les threads (next() sur un compteur est atomique)
+        part_numbers = itertools.count(1)
+        best = 0
+
+        def worker(count):
+            conn = self.probe.connect()
+            try:
+                for _ in range(count):
+                    self._upload_part(conn, upload_id, next(part_numbers), size)
+            finally:
+                conn.close()
+
+        for level in CONCURRENCY_LEVELS:
+            # Deux parts par flux: la première absorbe l'ouverture de connexion
+            volume = 2 * level * size * MB
+            if best and time.monotonic() + volume / best > deadline:
+                break
+            start = time.monotonic()
+            with ThreadPoolExecutor(max_workers=level) as executor:
+                for future in [executor.submit(worker, 2) for _ in range(level)]:
+                    future.result()
+            throughput = volume / (time.monotonic() - start)
+            self.results['concurrency'][level] = throughput / MB
+            self.log(f"   {level:>2} flux, parts de {size:>3} MB: {throughput / MB:7.1f} MB/s")
+            if best and throughput < best * (1 + PLATEAU):
+                break
+            best = max(best, throughput)
+
+    def recommend(self):
+        """Choix à partir des mesures, avec l'explication de chaque contrainte"""
+        reasons = []
+        single = self.results['single_stream']
+        concurrency = self.results['concurrency']
+        if not single or not concurrency:
+            raise CalibrationError("mesures insuffisantes")
+
+        best_single = max(single.values())
+        part_size = min(size for size, rate in single.items() if rate >= best_single * (1 - PLATEAU))
+        reasons.append(
+            f"parts de {part_size} MB: plus petite taille atteignant 90% du meilleur débit d'un flux "
+            f"({best_single:.1f} MB/s); au-delà, le RTT de {self.results['rtt_ms']:.0f} ms est amorti"
+        )
+
+        best_total = max(concurrency.values())
+        workers = min(level for level, rate in concurrency.items() if rate >= best_total * (1 - PLATEAU))
+        reasons.append(
+            f"{workers} upload(s) simultané(s): plus petit nombre atteignant 90% du débit agrégé maximal "
+            f"({best_total:.1f} MB/s)"
+        )
+
+        if part_size * workers > self.memory_limit:
+            workers = max(1, self.memory_limit // part_size)
+            reasons.append(
+                f"concurrence réduite à {workers}: {workers} parts de {part_size} MB en mémoire "
+                f"au plus (limite {self.memory_limit} MB)"
+            )
+
+        part_size = max(self.profile['min_part_size'], min(self.profile['max_part_size'], part_size))
+        workers = max(1, min(MAX_CONCURRENCY, workers))
+        return part_size, workers, reasons
+
+    def cleanup(self):
+        """Annulation des multipart uploads: les parts envoyées sont supprimées"""
+        conn = self.probe.connect()
+        try:
+            for upload_id in self.uploads:
+                try:
+                    status, _ = self.probe.request(conn, 'DELETE', self.key, {'uploadId': upload_id})
+                    if status not in (200, 204, 404):
+                        self.log(f"   ⚠️  Annulation de l'upload {upload_id}: HTTP {status}")
+                except OSError as e:
+                    self.log(f"   ⚠️  Annulation de l'upload {upload_id}: {e}")
+                    conn.close()
+                    conn = self.probe.connect()
+        finally:
+            conn.close()
+        self.uploads = []
+
+    def _initiate(self):
+        conn = self.probe.connect()
+        try:
+            status, body = self.probe.request(conn, 'POST', self.key, {'uploads': ''})
+        finally:
+            conn.close()
+        match = re.search(rb'<UploadId>([^<]+)</UploadId>', body)
+        if status != 200 or not match:
+            raise CalibrationError(f"initiation du multipart upload: HTTP {status} {body[:200]!r}")
+        upload_id = match.group(1).decode()
+        self.uploads.append(upload_id)
+        return upload_id
+
+    def _upload_part(self, conn, upload_id, part_number, size):
+        payload, payload_hash = self._payload(size)
+        start = time.monotonic()
+        status, body = self.probe.request(conn, 'PUT', self.key,
+                                          {'partNumber': part_number, 'uploadId': upload_id},
+                                          body=payload, payload_hash=payload_hash)
+        if status != 200:
+            raise CalibrationError(f"upload de part: HTTP {status} {body[:200]!r}")
+        return time.monotonic() - start
+
+    def _payload(self, size):
+        """Données aléatoires (non compressibles) et leur SHA-256, calculés une fois par taille"""
+        if size not in self._payloads:
+            data = os.urandom(size * MB)
+            self._payloads[size] = (data, hashlib.sha256(data).hexdigest())
+        return self._payloads[size]
+
+    def _concurrency_part_size(self):
+        """Parts de taille modérée pour la mesure de concurrence (durée bornée)"""
+        rates = self.results['single_stream']
+        best_single = max(rates.values())
+        return min(size for size, rate in rates.items() if rate >= best_single * (1 - PLATEAU))
+
+
+def calibrate(config, log=print, **kwargs):
+    """Calibration pour une configuration de ConfigManager; retourne (part MB, concurrence, raisons)"""
+    profile = kwargs.get('profile') or get_provider_profile(None)
+    probe = S3Probe(config['endpoint'], config.get('region'), config['access_key'], config['secret_key'],
+                    config['bucket'], addressing_style=profile['addressing_style'])
+    return Calibrator(probe, prefix=config.get('prefix', ''), log=log, **kwargs).run()
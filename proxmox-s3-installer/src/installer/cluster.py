@@ -0,0 +1,217 @@
+"""
+Déploiement du plugin S3 sur tous les nœuds d'un cluster Proxmox
+
+Les fichiers sont copiés en parallèle (une connexion SSH par nœud, pool de
+threads), puis les services sont redémarrés nœud par nœud: le cluster doit
+être quorate avant chaque redémarrage et le nœud doit être revenu (services
+actifs) avant de passer au suivant.
+"""
+
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import paramiko
+
+from installer.file_copier import (DEFAULT_BASE_PATH, ENABLE_SERVICE_COMMAND, TRANSFER_SERVICE, get_plugin_files,
+                                   upload_plugin_files)
+
+RESTART_SERVICES = [TRANSFER_SERVICE, 'pvedaemon', 'pveproxy', 'pvestatd']
+DEFAULT_WORKERS = 8
+SERVICE_TIMEOUT = 60
+
+
+def run_command(ssh, command):
+    """Exécute une commande et retourne (code de sortie, stdout, stderr)"""
+    _, stdout, stderr = ssh.exec_command(command)
+    output = stdout.read().decode()
+    error = stderr.read().decode()
+    return stdout.channel.recv_exit_status(), output, error
+
+
+def parse_pvecm_nodes(output):
+    """Noms des nœuds listés par `pvecm nodes` (nodeid -> nom)"""
+    nodes = {}
+    for line in output.splitlines():
+        match = re.match(r'^\s*(\d+)\s+\d+\s+(\S+)(\s+\(local\))?', line)
+        if match:
+            nodes[int(match.group(1))] = {'name': match.group(2), 'local': bool(match.group(3))}
+    return nodes
+
+
+def parse_pvecm_status(output):
+    """Quorum et adresses des membres d'après `pvecm status`"""
+    quorate = bool(re.search(r'^Quorate:\s+Yes', output, re.MULTILINE))
+    addresses = {}
+    for line in output.splitlines():
+        match = re.match(r'^\s*0x([0-9a-fA-F]+)\s+\d+\s+(\S+)', line)
+        if match:
+            addresses[int(match.group(1), 16)] = match.group(2)
+    return quorate, addresses
+
+
+class ClusterDeployer:
+    """Déploiement parallèle et redémarrage progressif sur un cluster"""
+
+    def __init__(self, nodes, username, password, base_path=DEFAULT_BASE_PATH,
+                 workers=DEFAULT_WORKERS, port=22):
+        self.nodes = list(nodes)
+        self.username = username
+        self.password = password
+        self.base_path = base_path
+        self.workers = workers
+        self.port = port
+        self.results = {node: {'status': 'pending', 'timings': {}} for node in self.nodes}
+
+    @classmethod
+    def discover(cls, entry_host, username, password, **kwargs):
+        """Découverte des nœuds via `pvecm nodes` sur un nœud du cluster"""
+        ssh = cls._connect(entry_host, username, password, kwargs.get('port', 22))
+        try:
+            _, nodes_output, _ = run_command(ssh, 'pvecm nodes')
+            _, status_output, _ = run_command(ssh, 'pvecm status')
+        finally:
+            ssh.close()
+
+        nodes = parse_pvecm_nodes(nodes_output)
+        _, addresses = parse_pvecm_status(status_output)
+        if not nodes:
+            # Nœud isolé (pas de cluster)
+            return cls([entry_host], username, password, **kwargs)
+
+        # Adresse de membership si connue, sinon le nom du nœud; nœud
+        # d'entrée en dernier pour le redémarrage
+        hosts = []
+        for nodeid in sorted(nodes, key=lambda n: (nodes[n]['local'], nodes[n]['name'])):
+            hosts.append(entry_host if nodes[nodeid]['local'] else addresses.get(nodeid, nodes[nodeid]['name']))
+        return cls(hosts, username, password, **kwargs)
+
+    @staticmethod
+    def _connect(host, username, password, port=22):
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect(host, port=port, username=username, password=password, timeout=10)
+        return ssh
+
+    def deploy(self):
+        """Copie des fichiers sur tous les nœuds en parallèle"""
+        files_to_copy = get_plugin_files(self.base_path)
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(self.nodes)) or 1) as executor:
+            futures = {executor.submit(self._deploy_node, node, files_to_copy): node for node in self.nodes}
+            for future in as_completed(futures):
+                node = futures[future]
+                result = self.results[node]
+                try:
+                    future.result()
+                except Exception as e:
+                    result['status'] = 'failed'
+                    result['error'] = str(e)
+                if result['status'] == 'failed':
+                    print(f"   ✗ {node}: {result['error']}")
+                elif result['status'] == 'unchanged':
+                    print(f"   ✓ {node}: déjà à jour")
+                else:
+                    print(f"   ✓ {node}: {result['files']} fichier(s) copié(s)")
+
+        return all(r['status'] != 'failed' for r in self.results.values())
+
+    def _deploy_node(self, node, files_to_copy):
+        result = self.results[node]
+        start = time.monotonic()
+
+        ssh = self._connect(node, self.username, self.password, self.port)
+        try:
+            result['timings']['connect'] = time.monotonic() - start
+
+            step = time.monotonic()
+            copied, errors = upload_plugin_files(ssh, files_to_copy, log=lambda message: None)
+            result['timings']['copy'] = time.monotonic() - step
+            result['files'] = copied
+            if errors:
+                raise RuntimeError(f"{len(errors)} fichier(s) non copié(s): {errors[0]}")
+            if not copied:
+                result['status'] = 'unchanged'
+                return
+
+            step = time.monotonic()
+            code, _, error = run_command(ssh, 'perl -c /usr/share/perl5/PVE/Storage/S3Plugin.pm')
+            result['timings']['check'] = time.monotonic() - step
+            if code != 0:
+                raise RuntimeError(f"perl -c: {error.strip().splitlines()[-1] if error.strip() else code}")
+
+            code, _, error = run_command(ssh, ENABLE_SERVICE_COMMAND)
+            if code != 0:
+                raise RuntimeError(f"{TRANSFER_SERVICE}: {error.strip() or code}")
+
+            result['status'] = 'copied'
+        finally:
+            ssh.close()
+
+    def rolling_restart(self, services=RESTART_SERVICES):
+        """Redémarrage des services nœud par nœud, sans perte de quorum
+
+        Seuls les nœuds modifiés sont redémarrés. S'arrête au premier nœud
+        dont les services ne reviennent pas ou si le cluster n'est plus
+        quorate.
+        """
+        for node in self.nodes:
+            result = self.results[node]
+            if result['status'] != 'copied':
+                continue
+
+            start = time.monotonic()
+            ssh = self._connect(node, self.username, self.password, self.port)
+            try:
+                if not self._is_quorate(ssh):
+                    result['status'] = 'failed'
+                    result['error'] = 'cluster non quorate, redémarrages interrompus'
+                    print(f"   ✗ {node}: {result['error']}")
+                    return False
+
+                run_command(ssh, 'systemctl restart ' + ' '.join(services))
+                if not self._wait_for_services(ssh, services):
+                    result['status'] = 'failed'
+                    result['error'] = 'services inactifs après redémarrage'
+                    print(f"   ✗ {node}: {result['error']}")
+                    return False
+            finally:
+                ssh.close()
+
+            result['timings']['restart'] = time.monotonic() - start
+            result['status'] = 'ok'
+            print(f"   ✓ {node}: services redémarrés ({result['timings']['restart']:.1f}s)")
+
+        return True
+
+    def _is_quorate(self, ssh):
+        code, output, _ = run_command(ssh, 'pvecm status')
+        if code != 0:
+            # Nœud hors cluster: pas de quorum à préserver
+            return 'Quorate' not in output
+        quorate, _ = parse_pvecm_status(output)
+        return quorate
+
+    def _wait_for_services(self, ssh, services):
+        deadline = time.monotonic() + SERVICE_TIMEOUT
+        while time.monotonic() < deadline:
+            _, output, _ = run_command(ssh, 'systemctl is-active ' + ' '.join(services))
+            if output.split() == ['active'] * len(services):
+                return True
+            time.sleep(1)
+        return False
+
+    def report(self):
+        """Tableau des durées et statuts par nœud"""
+        columns = ['connect', 'copy', 'check', 'restart']
+        width = max([len('Nœud')] + [len(node) for node in self.nodes])
+        lines = [f"{'Nœud':<{width}}  " + '  '.join(f'{c:>8}' for c in columns) + '  Statut']
+        lines.append('-' * len(lines[0]))
+        for node in self.nodes:
+            result = self.results[node]
+            timings = '  '.join(
+                f"{result['timings'][c]:>7.1f}s" if c in result['timings'] else f"{'-':>8}" for c in columns
+            )
+            status = result['status'] + (f" ({result['error']})" if result.get('error') else '')
+            lines.append(f"{node:<{width}}  {timings}  {status}")
+        return '\n'.join(lines)
@@ -3,10 +3,18 @@ from utils.validation import (
     validate_access_key, validate_secret_key,
     get_storage_name_examples, get_bucket_name_examples, get_prefix_examples
 )
+from installer.calibration import CalibrationError, calibrate
+from installer.endpoint_probe import format_probe_results, probe_candidates
+from installer.s3_providers import get_provider_profile, get_provider_regions, profile_properties
 
 class ConfigManager:
     def __init__(self):
         self.config = {}
+        # Endpoints régionaux sondés pour le fournisseur choisi {région: endpoint}
+        self.region_endpoints = {}
+        # Fournisseur choisi et son profil de performance (None: endpoint personnalisé)
+        self.provider = None
+        self.profile = get_provider_profile(None)
 
     def prompt_with_validation(self, prompt_text, validator, examples=None):
         """Prompt avec validation et exemples"""
@@ -70,8 +78,15 @@ class ConfigManager:
             print("   Exemples: us-east-1, eu-west-1, eu-central-1")
             default_region = "us-east-1"
             
+        if self.region_endpoints:
+            default_region = self.config['default_region']
+            print(f"   ⚡ Région la plus proche mesurée: {default_region}")
+            
         region_input = input(f"Entrez la région (défaut: {default_region}): ").strip()
         self.config['region'] = region_input or default_region
+        # L'endpoint régional suit la région choisie
+        if self.config['region'] in self.region_endpoints:
+            self.config['endpoint'] = self.region_endpoints[self.config['region']]
         
         # Clé d'accès avec instructions claires
         print("\n5. Authentification S3 - Clé d'accès")
@@ -164,20 +179,52 @@ class ConfigManager:
         
         # Paramètres de performance
         print("\n9. Paramètres de performance")
-        print("   Taille des chunks multipart (5-5120 MB, défaut: 100)")
-        chunk_size = input("Taille des chunks (MB): ").strip()
-        self.config['multipart_chunk_size'] = chunk_size or "100"
-        
-        print("   Nombre d'uploads simultanés (1-20, défaut: 3)")
-        concurrent_uploads = input("Uploads simultanés: ").strip()
-        self.config['max_concurrent_uploads'] = concurrent_uploads or "3"
+        if not self.calibrate_performance():
+            profile = self.profile
+            print(f"   Taille des chunks multipart ({profile['min_part_size']}-{profile['max_part_size']} MB, "
+                  f"défaut: {profile['chunk_size']})")
+            chunk_size = input("Taille des chunks (MB): ").strip()
+            self.config['multipart_chunk_size'] = chunk_size or str(profile['chunk_size'])
+            
+            print(f"   Nombre d'uploads simultanés (1-20, défaut: {profile['concurrency']})")
+            concurrent_uploads = input("Uploads simultanés: ").strip()
+            self.config['max_concurrent_uploads'] = concurrent_uploads or str(profile['concurrency'])
         
         # Classe de stockage
         print("\n10. Classe de stockage")
-        storage_classes = ["STANDARD", "STANDARD_IA", "REDUCED_REDUNDANCY", "GLACIER"]
-        print("Classes disponibles:", ", ".join(storage_classes))
-        storage_class = input("Classe de stockage (défaut: STANDARD): ").strip()
-        self.config['storage_class'] = storage_class.upper() if storage_class else "STANDARD"
+        storage_classes = self.profile['storage_classes']
+        if len(storage_classes) == 1:
+            print(f"   {self.provider} ne propose que la classe {storage_classes[0]}")
+            self.config['storage_class'] = storage_classes[0]
+        else:
+            print("Classes disponibles:", ", ".join(storage_classes))
+            storage_class = input("Classe de stockage (défaut: STANDARD): ").strip()
+            self.config['storage_class'] = storage_class.upper() if storage_class else "STANDARD"
+
+    def calibrate_performance(self):
+        """Mesure le bucket pour choisir taille des chunks et uploads simultanés
+
+        Retourne False si la calibration est refusée ou échoue (saisie manuelle).
+        """
+        print("   Une calibration (~1 min) peut mesurer le bucket pour choisir ces valeurs.")
+        print("   Elle envoie des parts temporaires, supprimées à la fin (multipart upload annulé).")
+        answer = input("   Lancer la calibration ? (O/n): ").strip().lower()
+        if answer not in ('', 'o', 'oui', 'y', 'yes'):
+            return False
+
+        try:
+            part_size, workers, reasons = calibrate(self.config, log=print, profile=self.profile)
+        except (CalibrationError, OSError, ValueError) as e:
+            print(f"   ❌ Calibration impossible: {e}")
+            print("   Saisie manuelle des paramètres.")
+            return False
+
+        print(f"   ✅ multipart_chunk_size {part_size}, max_concurrent_uploads {workers}")
+        for reason in reasons:
+            print(f"      • {reason}")
+        self.config['multipart_chunk_size'] = str(part_size)
+        self.config['max_concurrent_uploads'] = str(workers)
+        return True
 
     def choose_endpoint(self):
         endpoints = [
@@ -188,6 +235,9 @@ class ConfigManager:
             {"name": "Scaleway Object Storage", "endpoint": "s3.fr-par.scw.cloud", "default_region": "fr-par"},
             {"name": "DigitalOcean Spaces", "endpoint": "fra1.digitaloceanspaces.com", "default_region": "fra1"},
             {"name": "Linode Object Storage", "endpoint": "eu-central-1.linodeobjects.com", "default_region": "eu-central-1"},
+            {"name": "Backblaze B2", "endpoint": "s3.eu-central-003.backblazeb2.com", "default_region": "eu-central-003"},
+            {"name": "OVH Object Storage", "endpoint": "s3.gra.perf.cloud.ovh.net", "default_region": "gra"},
+            {"name": "Google Cloud Storage", "endpoint": "storage.googleapis.com", "default_region": "auto"},
             {"name": "Autre (personnalisé)", "endpoint": "", "default_region": "us-east-1"}
         ]
         
@@ -203,7 +253,11 @@ class ConfigManager:
                 if 1 <= choice <= len(endpoints):
                     selected = endpoints[choice - 1]
                     
+                    self.provider = selected['name']
+                    self.profile = get_provider_profile(selected['name'])
+                    
                     if selected['name'] == "Autre (personnalisé)":
+                        self.provider = None
                         endpoint = input("Entrez votre endpoint personnalisé: ").strip()
                         while not endpoint:
                             print("L'endpoint ne peut pas être vide.")
@@ -213,12 +267,41 @@ class ConfigManager:
                         # Mise à jour automatique de la région par défaut
                         if 'region' not in self.config:
                             self.config['default_region'] = selected['default_region']
-                        return selected['endpoint']
+                        return self.probe_regions(selected['name']) or selected['endpoint']
                 else:
                     print(f"Veuillez entrer un nombre entre 1 et {len(endpoints)}")
             except ValueError:
                 print("Veuillez entrer un nombre valide")
 
+    def probe_regions(self, provider_name):
+        """Sonde les endpoints régionaux du fournisseur; retourne le plus rapide (ou None)"""
+        candidates = get_provider_regions(provider_name)
+        if not candidates:
+            return None
+        answer = input(f"Mesurer la latence des {len(candidates)} régions ? (O/n): ").strip().lower()
+        if answer not in ('', 'o', 'oui', 'y', 'yes'):
+            return None
+
+        print("   Mesure en cours...")
+        ranked = probe_candidates(candidates)
+        print(format_probe_results(ranked))
+        reachable = [result for result in ranked if 'error' not in result]
+        if not reachable:
+            print("   ❌ Aucune région joignable, endpoint par défaut conservé.")
+            return None
+
+        best = reachable[0]
+        print(f"   ✅ Région présélectionnée: {best['region']} ({best['get_ms']:.0f} ms par requête)")
+        self.region_endpoints = {result['region']: result['endpoint'] for result in ranked}
+        self.config['default_region'] = best['region']
+        return best['endpoint']
+
+    def profile_lines(self):
+        """Capacités du fournisseur pour storage.cfg (aucune pour un endpoint personnalisé)"""
+        if self.provider is None:
+            return []
+        return [f"    {key} {value}" for key, value in profile_properties(self.profile)]
+
     def create_storage_config(self):
         # Construction de la configuration en fonction des paramètres
         config_lines = [
@@ -240,6 +323,7 @@ class ConfigManager:
             f"    multipart_chunk_size {self.config['multipart_chunk_size']}",
             f"    max_concurrent_uploads {self.config['max_concurrent_uploads']}"
         ])
+        config_lines.extend(self.profile_lines())
         
         config_content = "\n".join(config_lines)
         
@@ -280,6 +364,7 @@ class ConfigManager:
             f"    multipart_chunk_size {self.config['multipart_chunk_size']}",
             f"    max_concurrent_uploads {self.config['max_concurrent_uploads']}"
         ])
+        config_lines.extend(self.profile_lines())
         
         config_content = "\n".join(config_lines)
         
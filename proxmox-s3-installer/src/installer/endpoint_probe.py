@@ -0,0 +1,89 @@
+"""
+Mesure de latence des endpoints S3 candidats
+
+Chaque candidat (une région d'un fournisseur) est sondé en parallèle:
+résolution DNS, connexion TCP, poignée de main TLS puis un petit GET
+anonyme sur "/" (toute réponse HTTP convient, un 403 compris). Le
+classement se fait sur la médiane du GET, qui correspond au coût d'une
+petite requête sur une connexion déjà ouverte, puis sur la connexion.
+"""
+
+import socket
+import ssl
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def parse_host(endpoint):
+    """(hôte, port, https) d'un endpoint, https par défaut comme le plugin"""
+    secure = not endpoint.startswith('http://')
+    host = endpoint.split('://', 1)[-1].split('/', 1)[0]
+    if ':' in host:
+        host, port = host.rsplit(':', 1)
+        return host, int(port), secure
+    return host, 443 if secure else 80, secure
+
+
+def probe_endpoint(endpoint, samples=3, timeout=3.0):
+    """Mesures d'un endpoint en millisecondes (médianes), ou 'error'"""
+    host, port, secure = parse_host(endpoint)
+    context = ssl.create_default_context() if secure else None
+    timings = {'dns_ms': [], 'connect_ms': [], 'tls_ms': [], 'get_ms': []}
+
+    try:
+        for _ in range(samples):
+            start = time.monotonic()
+            address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0][4]
+            resolved = time.monotonic()
+            sock = socket.create_connection(address[:2], timeout=timeout)
+            connected = time.monotonic()
+            try:
+                if context:
+                    sock = context.wrap_socket(sock, server_hostname=host)
+                handshake = time.monotonic()
+                sock.sendall(f"GET / HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+                if not sock.recv(1024).startswith(b'HTTP/'):
+                    raise OSError("réponse non HTTP")
+                answered = time.monotonic()
+            finally:
+                sock.close()
+
+            timings['dns_ms'].append((resolved - start) * 1000)
+            timings['connect_ms'].append((connected - resolved) * 1000)
+            timings['tls_ms'].append((handshake - connected) * 1000)
+            timings['get_ms'].append((answered - handshake) * 1000)
+    except (OSError, ssl.SSLError) as e:
+        return {'error': str(e) or type(e).__name__}
+
+    return {name: statistics.median(values) for name, values in timings.items()}
+
+
+def probe_candidates(candidates, samples=3, timeout=3.0, max_workers=16):
+    """Sonde les candidats [{'region', 'endpoint'}] en parallèle; retourne la liste classée
+
+    Chaque candidat reçoit ses mesures; les endpoints injoignables sont en fin de liste.
+    """
+    if not candidates:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(candidates))) as executor:
+        results = list(executor.map(lambda c: probe_endpoint(c['endpoint'], samples, timeout), candidates))
+
+    ranked = [dict(candidate, **result) for candidate, result in zip(candidates, results)]
+    ranked.sort(key=lambda r: (1, 0, 0) if 'error' in r else (0, r['get_ms'], r['connect_ms']))
+    return ranked
+
+
+def format_probe_results(ranked):
+    """Tableau des mesures, meilleur candidat en premier"""
+    lines = [f"   {'Région':<16} {'DNS':>7} {'TCP':>7} {'TLS':>7} {'GET':>7}  Endpoint"]
+    for result in ranked:
+        if 'error' in result:
+            lines.append(f"   {result['region']:<16} {'injoignable':>31}  {result['endpoint']} ({result['error']})")
+        else:
+            lines.append(
+                f"   {result['region']:<16} {result['dns_ms']:>5.0f}ms {result['connect_ms']:>5.0f}ms "
+                f"{result['tls_ms']:>5.0f}ms {result['get_ms']:>5.0f}ms  {result['endpoint']}"
+            )
+    return '\n'.join(lines)
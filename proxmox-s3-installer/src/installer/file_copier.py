@@ -1,60 +1,142 @@
+import hashlib
+import io
 import os
+import shlex
+import tarfile
+import time
 import paramiko
 import getpass
 from installer.config_manager import ConfigManager
 from installer.s3_providers import get_s3_providers
 from utils.interactive import interactive_prompt
 
-def copy_files(proxmox_ip, username, password):
-    # Define the S3 plugin files to be copied
-    base_path = "C:/Projects/S3-plugin"
+DEFAULT_BASE_PATH = "C:/Projects/S3-plugin"
+
+# Service de transfert partagé: unité systemd activée à chaque déploiement
+TRANSFER_SERVICE = 'pve-s3-transferd'
+ENABLE_SERVICE_COMMAND = f'systemctl daemon-reload && systemctl enable {TRANSFER_SERVICE}'
+
+def get_plugin_files(base_path=DEFAULT_BASE_PATH):
+    """Liste des fichiers du plugin à déployer (local, remote)"""
     files_to_copy = [
         {
             'local': f'{base_path}/PVE/Storage/S3Plugin.pm',
             'remote': '/usr/share/perl5/PVE/Storage/S3Plugin.pm'
-        },
-        {
-            'local': f'{base_path}/PVE/Storage/S3/Client.pm',
-            'remote': '/usr/share/perl5/PVE/Storage/S3/Client.pm'
-        },
-        {
-            'local': f'{base_path}/PVE/Storage/S3/Config.pm',
-            'remote': '/usr/share/perl5/PVE/Storage/S3/Config.pm'
-        },
-        {
-            'local': f'{base_path}/PVE/Storage/S3/Auth.pm',
-            'remote': '/usr/share/perl5/PVE/Storage/S3/Auth.pm'
-        },
-        {
-            'local': f'{base_path}/PVE/Storage/S3/Transfer.pm',
-            'remote': '/usr/share/perl5/PVE/Storage/S3/Transfer.pm'
-        },
-        {
-            'local': f'{base_path}/PVE/Storage/S3/Metadata.pm',
-            'remote': '/usr/share/perl5/PVE/Storage/S3/Metadata.pm'
-        },
-        {
-            'local': f'{base_path}/PVE/Storage/S3/Utils.pm',
-            'remote': '/usr/share/perl5/PVE/Storage/S3/Utils.pm'
-        },
-        {
-            'local': f'{base_path}/PVE/Storage/S3/Exception.pm',
-            'remote': '/usr/share/perl5/PVE/Storage/S3/Exception.pm'
-        },
-        {
-            'local': f'{base_path}/scripts/pve-s3-backup',
-            'remote': '/usr/local/bin/pve-s3-backup'
-        },
-        {
-            'local': f'{base_path}/scripts/pve-s3-restore',
-            'remote': '/usr/local/bin/pve-s3-restore'
-        },
-        {
-            'local': f'{base_path}/scripts/pve-s3-maintenance',
-            'remote': '/usr/local/bin/pve-s3-maintenance'
         }
     ]
     
+    # Tous les modules S3 présents localement
+    modules_dir = os.path.join(base_path, 'PVE', 'Storage', 'S3')
+    modules = sorted(f for f in os.listdir(modules_dir) if f.endswith('.pm')) if os.path.isdir(modules_dir) else [
+        'Client.pm', 'Config.pm', 'Auth.pm', 'Transfer.pm', 'Metadata.pm', 'Utils.pm', 'Exception.pm'
+    ]
+    for module in modules:
+        files_to_copy.append({
+            'local': f'{base_path}/PVE/Storage/S3/{module}',
+            'remote': f'/usr/share/perl5/PVE/Storage/S3/{module}'
+        })
+    
+    for script in ('pve-s3-backup', 'pve-s3-restore', 'pve-s3-maintenance', 'pve-s3-log-analyze', TRANSFER_SERVICE):
+        files_to_copy.append({
+            'local': f'{base_path}/scripts/{script}',
+            'remote': f'/usr/local/bin/{script}'
+        })
+    
+    files_to_copy.append({
+        'local': f'{base_path}/scripts/{TRANSFER_SERVICE}.service',
+        'remote': f'/etc/systemd/system/{TRANSFER_SERVICE}.service'
+    })
+    
+    return files_to_copy
+
+def file_mode(remote_file):
+    """Permissions d'un fichier déployé (scripts exécutables)"""
+    return 0o755 if remote_file.startswith('/usr/local/bin/') else 0o644
+
+def remote_checksums(ssh, remote_files):
+    """SHA-256 des fichiers distants, en une seule commande (absents ignorés)"""
+    quoted = ' '.join(shlex.quote(f) for f in remote_files)
+    _, stdout, _ = ssh.exec_command(f'sha256sum {quoted} 2>/dev/null')
+    output = stdout.read().decode()
+    stdout.channel.recv_exit_status()
+    
+    checksums = {}
+    for line in output.splitlines():
+        digest, _, path = line.partition('  ')
+        if path:
+            checksums[path] = digest
+    return checksums
+
+def build_tar(files):
+    """Archive tar (en mémoire) des fichiers à déployer, propriétaire root"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for file_info in files:
+            info = tarfile.TarInfo(file_info['remote'].lstrip('/'))
+            info.size = len(file_info['content'])
+            info.mode = file_mode(file_info['remote'])
+            info.mtime = int(time.time())
+            info.uid = info.gid = 0
+            info.uname = info.gname = 'root'
+            tar.addfile(info, io.BytesIO(file_info['content']))
+    return buffer.getvalue()
+
+def upload_plugin_files(ssh, files_to_copy, log=print, force=False):
+    """Déploiement différentiel des fichiers sur une connexion SSH ouverte
+
+    Les empreintes distantes sont lues en une commande, seuls les fichiers
+    modifiés sont envoyés dans un flux tar unique, extrait avec leurs
+    permissions et leur propriétaire par la même commande distante.
+    Retourne le nombre de fichiers copiés et la liste des erreurs.
+    """
+    errors = []
+    files = []
+    for file_info in files_to_copy:
+        local_file = file_info['local']
+        
+        # Check if local file exists
+        if not os.path.exists(local_file):
+            log(f"Warning: Local file not found: {local_file}")
+            continue
+        
+        with open(local_file, 'rb') as f:
+            content = f.read()
+        files.append({
+            'local': local_file,
+            'remote': file_info['remote'],
+            'content': content,
+            'sha256': hashlib.sha256(content).hexdigest(),
+        })
+    
+    if not files:
+        return 0, errors
+    
+    checksums = {} if force else remote_checksums(ssh, [f['remote'] for f in files])
+    changed = [f for f in files if checksums.get(f['remote']) != f['sha256']]
+    
+    if not changed:
+        log('✓ All plugin files are up to date')
+        return 0, errors
+    
+    stdin, stdout, stderr = ssh.exec_command('tar --same-owner -xpf - -C /')
+    stdin.write(build_tar(changed))
+    stdin.channel.shutdown_write()
+    error_output = stderr.read().decode().strip()
+    
+    if stdout.channel.recv_exit_status() != 0:
+        errors.append(f'tar: {error_output}')
+        log(f'✗ Failed to extract plugin files: {error_output}')
+        return 0, errors
+    
+    for file_info in changed:
+        log(f'✓ Copied {os.path.basename(file_info["local"])} to {file_info["remote"]}')
+    
+    return len(changed), errors
+
+def copy_files(proxmox_ip, username, password, base_path=DEFAULT_BASE_PATH):
+    # Define the S3 plugin files to be copied
+    files_to_copy = get_plugin_files(base_path)
+    
     # Create an SSH client
     ssh = paramiko.SSHClient()
     ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
@@ -63,61 +145,29 @@ def copy_files(proxmox_ip, username, password):
         # Connect to the Proxmox server
         ssh.connect(proxmox_ip, username=username, password=password)
         
-        # Copy files using SCP
-        scp = paramiko.SFTPClient.from_transport(ssh.get_transport())
-        
         print("Copying S3 plugin files to Proxmox server...")
+        copied, errors = upload_plugin_files(ssh, files_to_copy)
         
-        for file_info in files_to_copy:
-            local_file = file_info['local']
-            remote_file = file_info['remote']
-            
-            # Create remote directory if it doesn't exist
-            remote_dir = os.path.dirname(remote_file)
-            try:
-                ssh.exec_command(f'mkdir -p {remote_dir}')
-            except:
-                pass
-            
-            # Check if local file exists
-            if not os.path.exists(local_file):
-                print(f"Warning: Local file not found: {local_file}")
-                continue
-            
-            try:
-                scp.put(local_file, remote_file)
-                # Make script files executable
-                if remote_file.startswith('/usr/local/bin/'):
-                    ssh.exec_command(f'chmod +x {remote_file}')
-                print(f'✓ Copied {os.path.basename(local_file)} to {remote_file}')
-            except Exception as e:
-                print(f'✗ Failed to copy {local_file}: {str(e)}')
-        
-        scp.close()
+        # Aucun changement: ni vérification ni redémarrage
+        if not copied and not errors:
+            print("\n✅ Le plugin est déjà à jour")
+            return
         
-        # Vérification post-installation
+        # Vérification post-installation et redémarrage en une commande
         print("\n🔍 Vérification de l'installation...")
-        
-        # Test de la syntaxe Perl du plugin principal
-        stdin, stdout, stderr = ssh.exec_command('perl -c /usr/share/perl5/PVE/Storage/S3Plugin.pm')
+        stdin, stdout, stderr = ssh.exec_command(
+            'perl -c /usr/share/perl5/PVE/Storage/S3Plugin.pm'
+            f' && {ENABLE_SERVICE_COMMAND}'
+            f' && systemctl restart {TRANSFER_SERVICE} pvedaemon pveproxy'
+        )
         syntax_output = stderr.read().decode().strip()
         
-        if "syntax OK" in syntax_output:
+        if stdout.channel.recv_exit_status() == 0:
             print("✓ Syntaxe Perl du plugin validée")
+            print(f"✓ Services redémarrés ({TRANSFER_SERVICE}, pvedaemon, pveproxy)")
         else:
             print(f"⚠️  Avertissement syntaxe Perl: {syntax_output}")
-        
-        # Vérification des permissions
-        stdin, stdout, stderr = ssh.exec_command('ls -la /usr/share/perl5/PVE/Storage/S3Plugin.pm')
-        perms_output = stdout.read().decode().strip()
-        if perms_output:
-            print(f"✓ Permissions: {perms_output}")
-        
-        # Redémarrage des services Proxmox
-        print("\n🔄 Redémarrage des services Proxmox...")
-        ssh.exec_command('systemctl restart pvedaemon')
-        ssh.exec_command('systemctl restart pveproxy')
-        print("✓ Services redémarrés (pvedaemon, pveproxy)")
+            print("⚠️  Services non redémarrés")
         
         print("\n✅ Installation terminée avec succès!")
         print("📌 Le stockage devrait maintenant apparaître dans Proxmox > Datacenter > Storage")
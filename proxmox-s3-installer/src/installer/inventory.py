@@ -0,0 +1,383 @@
+"""
+Provisionnement non interactif de stockages S3 depuis un inventaire
+
+L'inventaire (YAML ou JSON) liste les stockages à créer, avec des valeurs
+communes optionnelles:
+
+    defaults:
+      provider: Scaleway Object Storage
+      endpoint: s3.fr-par.scw.cloud
+      region: fr-par
+      content: backup
+    storages:
+      - storage_name: tenant-a
+        bucket: tenant-a-backups
+        access_key: SCWXXXXXXXXXXXXXXXXX
+        secret_key: ...
+
+"provider" applique le profil du fournisseur (installer.s3_providers):
+taille des parts, concurrence et capacités écrites dans storage.cfg.
+
+Toutes les entrées sont validées en une passe (utils.validation), puis
+fusionnées dans storage.cfg analysé section par section: les autres
+stockages sont conservés tels quels et le fichier est écrit une seule fois,
+atomiquement (fichier temporaire puis rename). Sur le nœud, l'écriture se
+fait sous le verrou de cluster de storage.cfg, comme pvesm et l'API.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shlex
+
+from installer.s3_providers import PROVIDER_PROFILES, get_provider_profile, profile_properties
+from utils.validation import (
+    validate_storage_name, validate_s3_bucket_name, validate_s3_prefix,
+    validate_access_key, validate_secret_key, validate_non_empty
+)
+
+STORAGE_CFG = '/etc/pve/storage.cfg'
+
+DEFAULTS = {
+    'content': 'backup,iso,vztmpl,snippets',
+    'storage_class': 'STANDARD',
+    'multipart_chunk_size': '100',
+    'max_concurrent_uploads': '3',
+}
+
+# Ordre des propriétés, identique à ConfigManager.create_storage_config
+PROPERTY_ORDER = [
+    'bucket', 'endpoint', 'region', 'access_key', 'secret_key', 'prefix',
+    'content', 'storage_class', 'multipart_chunk_size', 'max_concurrent_uploads',
+    'addressing_style', 'max_parts', 'batch_delete', 'upload_part_copy', 'checksum_algorithm',
+]
+
+# Valeurs admises des capacités du fournisseur (S3Plugin.pm)
+CAPABILITY_VALUES = {
+    'addressing_style': ('path', 'virtual'),
+    'batch_delete': ('0', '1'),
+    'upload_part_copy': ('0', '1'),
+    'checksum_algorithm': ('md5', 'crc32', 'sha256'),
+}
+
+SECTION_HEADER = re.compile(r'^(\S+):\s*(\S+)\s*$')
+
+# Écriture sur le nœud sous le verrou de storage.cfg (cfs_lock_file), refusée
+# si le fichier a changé depuis sa lecture (digest SHA-1, comme l'API PVE)
+LOCKED_WRITE_SCRIPT = r"""
+use strict;
+use warnings;
+use Digest::SHA;
+use PVE::Storage;
+use PVE::Tools;
+
+my ($path, $digest) = @ARGV;
+my $content = do { local $/; <STDIN> };
+eval {
+    PVE::Storage::lock_storage_config(sub {
+        my $current = -e $path ? PVE::Tools::file_get_contents($path) : '';
+        die "digest mismatch\n" if Digest::SHA::sha1_hex($current) ne $digest;
+        PVE::Tools::file_set_contents($path, $content);
+    });
+};
+if (my $err = $@) {
+    print STDERR $err;
+    exit($err =~ /digest mismatch/ ? 3 : 1);
+}
+"""
+
+# Code de sortie du script: storage.cfg modifié entre lecture et écriture
+DIGEST_MISMATCH = 3
+
+# Nombre de lectures/fusions tentées en cas de modification concurrente
+WRITE_ATTEMPTS = 3
+
+
+class InventoryError(Exception):
+    """Inventaire illisible ou entrées invalides (une ligne par erreur)"""
+
+    def __init__(self, errors):
+        self.errors = errors if isinstance(errors, list) else [errors]
+        super().__init__('\n'.join(self.errors))
+
+
+def load_inventory(path):
+    """Entrées de l'inventaire, valeurs par défaut appliquées"""
+    with open(path) as inventory_file:
+        text = inventory_file.read()
+
+    try:
+        if path.endswith(('.yaml', '.yml')):
+            import yaml
+            data = yaml.safe_load(text)
+        else:
+            data = json.loads(text)
+    except ImportError:
+        raise InventoryError("PyYAML est requis pour les inventaires YAML (pip install PyYAML)")
+    except Exception as e:
+        # json.JSONDecodeError ou yaml.YAMLError
+        raise InventoryError(f"{path}: {e}")
+
+    return parse_inventory(data)
+
+
+def parse_inventory(data):
+    """Liste de stockages depuis {"defaults": ..., "storages": [...]} ou une liste"""
+    defaults = {}
+    if isinstance(data, dict):
+        defaults = data.get('defaults') or {}
+        data = data.get('storages')
+    if not isinstance(data, list) or not all(isinstance(entry, dict) for entry in data):
+        raise InventoryError("l'inventaire doit contenir une liste 'storages' d'objets")
+
+    entries = []
+    errors = []
+    for index, entry in enumerate(data):
+        merged = dict(DEFAULTS)
+        # Profil du fournisseur ("provider: Wasabi"): taille des parts,
+        # concurrence et capacités, surchargées par les valeurs explicites
+        provider = entry.get('provider', defaults.get('provider'))
+        if provider is not None:
+            if provider not in PROVIDER_PROFILES:
+                errors.append(f"storages[{index}]: fournisseur inconnu '{provider}' "
+                              f"({', '.join(PROVIDER_PROFILES)})")
+                continue
+            profile = get_provider_profile(provider)
+            merged['multipart_chunk_size'] = profile['chunk_size']
+            merged['max_concurrent_uploads'] = profile['concurrency']
+            merged.update(profile_properties(profile))
+        merged.update(defaults)
+        merged.update(entry)
+        merged.pop('provider', None)
+        if 'name' in merged and 'storage_name' not in merged:
+            merged['storage_name'] = merged.pop('name')
+        entries.append({key: '' if value is None else str(value) for key, value in merged.items()})
+    if errors:
+        raise InventoryError(errors)
+    return entries
+
+
+def validate_entries(entries):
+    """Erreurs de toutes les entrées (liste vide si tout est valide)"""
+    errors = []
+    seen = set()
+    for index, entry in enumerate(entries):
+        label = f"storages[{index}] ({entry.get('storage_name') or '?'})"
+
+        checks = [
+            ('storage_name', validate_storage_name),
+            ('bucket', validate_s3_bucket_name),
+            ('access_key', validate_access_key),
+            ('secret_key', validate_secret_key),
+            ('prefix', validate_s3_prefix),
+        ]
+        for key, validator in checks:
+            is_valid, message = validator(entry.get(key, ''))
+            if not is_valid:
+                errors.append(f"{label}: {message}")
+
+        for key in ('endpoint', 'region'):
+            if not validate_non_empty(entry.get(key, '')):
+                errors.append(f"{label}: {key} est obligatoire")
+
+        for key, low, high in (('multipart_chunk_size', 5, 5120), ('max_concurrent_uploads', 1, 20)):
+            value = entry.get(key, '')
+            if not value.isdigit() or not low <= int(value) <= high:
+                errors.append(f"{label}: {key} doit être un entier entre {low} et {high}")
+
+        if entry.get('max_parts') and not (entry['max_parts'].isdigit() and 1 <= int(entry['max_parts']) <= 10000):
+            errors.append(f"{label}: max_parts doit être un entier entre 1 et 10000")
+        for key, allowed in CAPABILITY_VALUES.items():
+            if entry.get(key) and entry[key] not in allowed:
+                errors.append(f"{label}: {key} doit valoir {', '.join(allowed)}")
+
+        for key, value in entry.items():
+            if re.search(r'\s', key) or '\n' in value:
+                errors.append(f"{label}: propriété '{key}' invalide")
+
+        name = entry.get('storage_name')
+        if name in seen:
+            errors.append(f"{label}: nom de stockage en double dans l'inventaire")
+        seen.add(name)
+    return errors
+
+
+def parse_storage_cfg(text):
+    """Sections de storage.cfg: [{'type', 'id', 'properties': [(clé, valeur)], 'comments'}]
+
+    Les commentaires précédant une section lui sont rattachés pour être
+    réécrits à l'identique.
+    """
+    sections = []
+    comments = []
+    current = None
+    for line in text.splitlines():
+        if not line.strip() or line.lstrip().startswith('#'):
+            if current is not None and line.strip():
+                current['properties'].append((line, None))
+            elif line.strip():
+                comments.append(line)
+            else:
+                current = None
+            continue
+
+        if line[0] in ' \t':
+            if current is None:
+                raise InventoryError(f"storage.cfg: propriété hors section: {line.strip()}")
+            key, _, value = line.strip().partition(' ')
+            current['properties'].append((key, value.strip()))
+            continue
+
+        match = SECTION_HEADER.match(line)
+        if not match:
+            raise InventoryError(f"storage.cfg: ligne invalide: {line}")
+        current = {'type': match.group(1), 'id': match.group(2), 'properties': [], 'comments': comments}
+        comments = []
+        sections.append(current)
+
+    if comments:
+        sections.append({'type': None, 'id': None, 'properties': [], 'comments': comments})
+    return sections
+
+
+def format_storage_cfg(sections):
+    """Texte de storage.cfg (format de pvesm: tabulation et ligne vide entre sections)"""
+    blocks = []
+    for section in sections:
+        lines = list(section['comments'])
+        if section['type'] is not None:
+            lines.append(f"{section['type']}: {section['id']}")
+            for key, value in section['properties']:
+                if value is None:
+                    lines.append(key)
+                else:
+                    lines.append(f"\t{key} {value}".rstrip())
+        blocks.append('\n'.join(lines))
+    return '\n\n'.join(blocks) + '\n' if blocks else ''
+
+
+def entry_properties(entry):
+    """Propriétés storage.cfg d'une entrée, dans l'ordre habituel"""
+    properties = []
+    for key in PROPERTY_ORDER:
+        if entry.get(key, '').strip():
+            properties.append((key, entry[key]))
+    for key, value in entry.items():
+        if key not in PROPERTY_ORDER and key != 'storage_name' and value.strip():
+            properties.append((key, value))
+    return properties
+
+
+def merge_storages(sections, entries, replace=False):
+    """Ajoute (ou remplace avec replace=True) les stockages de l'inventaire
+
+    Retourne {'added', 'updated', 'unchanged', 'skipped'}: skipped liste les
+    stockages existants et différents, laissés tels quels sans replace. Un
+    stockage existant d'un autre type est une erreur.
+    """
+    by_id = {section['id']: section for section in sections if section['type'] is not None}
+    summary = {'added': [], 'updated': [], 'unchanged': [], 'skipped': []}
+    errors = []
+
+    for entry in entries:
+        name = entry['storage_name']
+        properties = entry_properties(entry)
+        section = by_id.get(name)
+
+        if section is None:
+            section = {'type': 's3', 'id': name, 'properties': properties, 'comments': []}
+            # Avant les commentaires de fin de fichier éventuels
+            position = len(sections) - 1 if sections and sections[-1]['type'] is None else len(sections)
+            sections.insert(position, section)
+            by_id[name] = section
+            summary['added'].append(name)
+        elif section['type'] != 's3':
+            errors.append(f"{name}: existe déjà avec le type '{section['type']}'")
+        elif [p for p in section['properties'] if p[1] is not None] == properties:
+            summary['unchanged'].append(name)
+        elif replace:
+            section['properties'] = properties
+            summary['updated'].append(name)
+        else:
+            summary['skipped'].append(name)
+
+    if errors:
+        raise InventoryError(errors)
+    return summary
+
+
+def apply_inventory(cfg_text, entries, replace=False):
+    """Valide et fusionne les entrées; retourne (nouveau storage.cfg, résumé)"""
+    errors = validate_entries(entries)
+    if errors:
+        raise InventoryError(errors)
+
+    sections = parse_storage_cfg(cfg_text)
+    summary = merge_storages(sections, entries, replace=replace)
+    return format_storage_cfg(sections), summary
+
+
+def write_storage_cfg(content, path=STORAGE_CFG):
+    """Écriture atomique locale: fichier temporaire dans le même répertoire puis rename"""
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    try:
+        with open(tmp_path, 'w') as tmp_file:
+            tmp_file.write(content)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def storage_cfg_digest(text):
+    """Digest de storage.cfg (SHA-1 du contenu, comme le paramètre digest de l'API)"""
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def read_remote_storage_cfg(ssh, path=STORAGE_CFG):
+    """Contenu de storage.cfg sur le nœud (vide s'il n'existe pas encore)"""
+    _, stdout, _ = ssh.exec_command(f"cat {shlex.quote(path)} 2>/dev/null")
+    return stdout.read().decode()
+
+
+def write_remote_storage_cfg(ssh, content, digest, path=STORAGE_CFG):
+    """Écriture via SSH sous le verrou de cluster de storage.cfg
+
+    Le contenu passe sur stdin. Retourne False si le fichier ne correspond
+    plus à digest (modifié par pvesm, l'interface web ou un autre nœud).
+    """
+    command = (f"perl -e {shlex.quote(LOCKED_WRITE_SCRIPT)} "
+               f"{shlex.quote(path)} {shlex.quote(digest)}")
+    stdin, stdout, stderr = ssh.exec_command(command)
+    stdin.write(content)
+    stdin.channel.shutdown_write()
+    error = stderr.read().decode()
+    status = stdout.channel.recv_exit_status()
+    if status == DIGEST_MISMATCH:
+        return False
+    if status != 0:
+        raise OSError(f"écriture de {path} impossible: {error.strip()}")
+    return True
+
+
+def provision(ssh, inventory_path, replace=False, dry_run=False, path=STORAGE_CFG):
+    """Provisionnement sur un nœud via SSH: lecture, fusion et une seule écriture
+
+    Si storage.cfg change entre la lecture et l'écriture, la fusion est
+    refaite sur le nouveau contenu.
+    """
+    entries = load_inventory(inventory_path)
+
+    for _ in range(WRITE_ATTEMPTS):
+        current = read_remote_storage_cfg(ssh, path)
+        content, summary = apply_inventory(current, entries, replace=replace)
+        if dry_run or not (summary['added'] or summary['updated']):
+            return content, summary
+        if write_remote_storage_cfg(ssh, content, storage_cfg_digest(current), path):
+            return content, summary
+
+    raise OSError(f"{path} modifié pendant le provisionnement ({WRITE_ATTEMPTS} tentatives)")
@@ -1,3 +1,7 @@
+import asyncio
+from urllib.parse import quote
+
+
 class ProxmoxClient:
     def __init__(self, ip, username, password):
         self.ip = ip
@@ -55,4 +59,179 @@ class ProxmoxClient:
 
         url = f"https://{self.ip}:8006/api2/json/storage/{storage_id}"
         response = self.session.put(url, json=config_data)
-        return response.ok
\ No newline at end of file
+        return response.ok
+
+
+class ProxmoxAPIError(Exception):
+    """Erreur renvoyée par l'API Proxmox (statut HTTP et message)"""
+
+    def __init__(self, status, message, path=None):
+        super().__init__(f"{path}: HTTP {status} {message}" if path else f"HTTP {status} {message}")
+        self.status = status
+        self.path = path
+
+
+class AsyncProxmoxClient:
+    """Client asynchrone de l'API Proxmox VE
+
+    L'authentification passe une seule fois par /access/ticket: le ticket
+    (cookie PVEAuthCookie) et le jeton CSRF sont réutilisés pour toutes les
+    requêtes, sur un pool de connexions persistantes. pveproxy relaie les
+    appels /nodes/{node}/... vers le nœud concerné: un seul point d'entrée
+    suffit pour interroger tout le cluster en parallèle.
+
+        async with AsyncProxmoxClient('192.168.1.100', 'root', password) as client:
+            results = await client.cluster_storage_status('s3-backup')
+    """
+
+    def __init__(self, host, username, password, port=8006, verify_ssl=False, max_connections=32, timeout=30):
+        self.base_url = f"https://{host}:{port}/api2/json"
+        # Le realm est obligatoire pour l'API (root -> root@pam)
+        self.username = username if '@' in username else f"{username}@pam"
+        self.password = password
+        self.verify_ssl = verify_ssl
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.session = None
+        self.ticket = None
+        self.csrf_token = None
+        self.ticket_generation = 0
+        self._login_lock = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def connect(self):
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(limit=self.max_connections, ssl=None if self.verify_ssl else False)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        self._login_lock = asyncio.Lock()
+        try:
+            await self.login()
+        except BaseException:
+            await self.close()
+            raise
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def login(self):
+        """Obtention d'un ticket (valable 2 heures) et du jeton CSRF"""
+        async with self.session.post(f"{self.base_url}/access/ticket",
+                                     data={'username': self.username, 'password': self.password}) as response:
+            if response.status != 200:
+                raise ProxmoxAPIError(response.status, response.reason or 'authentication failed', '/access/ticket')
+            data = (await response.json())['data']
+
+        # Cookie envoyé tel quel: le cookie jar d'aiohttp mettrait entre
+        # guillemets le ticket (':', '=', '/', '@'), ce que pveproxy refuse
+        self.ticket = data['ticket']
+        self.csrf_token = data['CSRFPreventionToken']
+        self.ticket_generation += 1
+
+    async def request(self, method, path, params=None, data=None):
+        """Appel de l'API; nouveau ticket et seconde tentative si le ticket a expiré"""
+        for attempt in (1, 2):
+            generation = self.ticket_generation
+            headers = {'Cookie': f"PVEAuthCookie={quote(self.ticket, safe='')}"}
+            if method != 'GET':
+                headers['CSRFPreventionToken'] = self.csrf_token
+            async with self.session.request(method, f"{self.base_url}{path}", params=params, data=data,
+                                            headers=headers) as response:
+                if response.status == 401 and attempt == 1:
+                    async with self._login_lock:
+                        # Un seul renouvellement pour toutes les requêtes concurrentes
+                        if self.ticket_generation == generation:
+                            await self.login()
+                    continue
+                if response.status != 200:
+                    raise ProxmoxAPIError(response.status, response.reason, path)
+                return (await response.json()).get('data')
+
+    async def get(self, path, **params):
+        return await self.request('GET', path, params=params or None)
+
+    async def nodes(self):
+        """Nœuds du cluster (champs node, status, ...)"""
+        return await self.get('/nodes')
+
+    async def storage_status(self, node, storage):
+        return await self.get(f"/nodes/{node}/storage/{storage}/status")
+
+    async def storage_content(self, node, storage, content=None):
+        params = {'content': content} if content else {}
+        return await self.get(f"/nodes/{node}/storage/{storage}/content", **params)
+
+    async def cluster_storage_status(self, storage, nodes=None, content=True):
+        """Statut (et contenu) du stockage sur chaque nœud, tous interrogés en parallèle
+
+        Retourne {nœud: {'status': ..., 'content': [...] ou None, 'error': ...}};
+        les nœuds hors ligne ne sont pas interrogés.
+        """
+        if nodes is None:
+            listed = await self.nodes()
+            results = {n['node']: {'status': None, 'content': None, 'error': 'node offline'}
+                       for n in listed if n.get('status') != 'online'}
+            nodes = sorted(n['node'] for n in listed if n.get('status') == 'online')
+        else:
+            results = {}
+
+        async def query(node):
+            calls = [self.storage_status(node, storage)]
+            if content:
+                calls.append(self.storage_content(node, storage))
+            replies = await asyncio.gather(*calls, return_exceptions=True)
+            errors = [reply for reply in replies if isinstance(reply, Exception)]
+            results[node] = {
+                'status': None if isinstance(replies[0], Exception) else replies[0],
+                'content': None if not content or isinstance(replies[-1], Exception) else replies[-1],
+                'error': str(errors[0]) if errors else None,
+            }
+
+        await asyncio.gather(*(query(node) for node in nodes))
+        return dict(sorted(results.items()))
+
+
+def format_storage_report(storage, results):
+    """Tableau par nœud: état, espace utilisé et nombre de volumes"""
+    width = max([len('Node')] + [len(node) for node in results])
+    lines = [f"{'Node':<{width}}  {'Active':<6}  {'Used':>10}  {'Total':>10}  {'Volumes':>7}  Error",
+             '-' * (width + 50)]
+    for node, result in results.items():
+        status = result['status'] or {}
+        active = 'yes' if status.get('active') else 'no'
+        used, total = _format_bytes(status.get('used')), _format_bytes(status.get('total'))
+        volumes = len(result['content']) if result['content'] is not None else '-'
+        lines.append(f"{node:<{width}}  {active:<6}  {used:>10}  {total:>10}  {volumes:>7}  {result['error'] or ''}")
+    return f"Storage '{storage}':\n" + '\n'.join(lines)
+
+
+def verify_storage(host, username, password, storage, nodes=None):
+    """Vérifie le stockage sur tous les nœuds (une connexion API); retourne (ok, rapport)"""
+
+    async def run():
+        async with AsyncProxmoxClient(host, username, password) as client:
+            return await client.cluster_storage_status(storage, nodes=nodes)
+
+    results = asyncio.run(run())
+    ok = bool(results) and all(r['error'] is None and (r['status'] or {}).get('active') for r in results.values())
+    return ok, format_storage_report(storage, results)
+
+
+def _format_bytes(value):
+    if value is None:
+        return '-'
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if value < 1024 or unit == 'TiB':
+            return f"{value:.0f} {unit}" if unit == 'B' else f"{value:.1f} {unit}"
+        value /= 1024
@@ -1,9 +1,19 @@
+# Endpoints régionaux: "endpoint_template" est complété par chaque région de
+# "regions" (sondées par installer.endpoint_probe pour choisir la plus proche)
+
+
 def get_s3_providers():
     return [
         {
             "name": "AWS S3",
             "endpoint": "s3.amazonaws.com",
-            "region": "us-east-1"
+            "region": "us-east-1",
+            "endpoint_template": "s3.{region}.amazonaws.com",
+            "regions": [
+                "eu-west-3", "eu-west-1", "eu-west-2", "eu-central-1", "eu-south-1", "eu-north-1",
+                "us-east-1", "us-east-2", "us-west-2", "ca-central-1", "ap-southeast-1",
+                "ap-northeast-1"
+            ]
         },
         {
             "name": "MinIO",
@@ -18,41 +28,188 @@ def get_s3_providers():
         {
             "name": "Wasabi",
             "endpoint": "s3.wasabisys.com",
-            "region": "us-east-1"
+            "region": "us-east-1",
+            "endpoint_template": "s3.{region}.wasabisys.com",
+            "regions": [
+                "eu-west-1", "eu-west-2", "eu-central-1", "eu-central-2", "us-east-1", "us-east-2",
+                "us-central-1", "us-west-1", "ap-northeast-1", "ap-southeast-1"
+            ]
         },
         {
             "name": "DigitalOcean Spaces",
             "endpoint": "nyc3.digitaloceanspaces.com",
-            "region": "nyc3"
+            "region": "nyc3",
+            "endpoint_template": "{region}.digitaloceanspaces.com",
+            "regions": ["fra1", "ams3", "lon1", "nyc3", "sfo3", "sgp1", "syd1", "blr1"]
         },
         {
             "name": "Linode Object Storage",
             "endpoint": "us-east-1.linodeobjects.com",
-            "region": "us-east-1"
+            "region": "us-east-1",
+            "endpoint_template": "{region}.linodeobjects.com",
+            "regions": ["fr-par-1", "eu-central-1", "us-east-1", "us-southeast-1", "ap-south-1"]
         },
         {
             "name": "Backblaze B2",
             "endpoint": "s3.us-west-002.backblazeb2.com",
-            "region": "us-west-002"
+            "region": "us-west-002",
+            "endpoint_template": "s3.{region}.backblazeb2.com",
+            "regions": [
+                "eu-central-003", "us-west-001", "us-west-002", "us-west-004", "us-east-005"
+            ]
         },
         {
             "name": "Scaleway Object Storage",
             "endpoint": "s3.fr-par.scw.cloud",
-            "region": "fr-par"
+            "region": "fr-par",
+            "endpoint_template": "s3.{region}.scw.cloud",
+            "regions": ["fr-par", "nl-ams", "pl-waw"]
         },
         {
             "name": "IBM Cloud Object Storage",
             "endpoint": "s3.us-south.cloud-object-storage.appdomain.cloud",
-            "region": "us-south"
+            "region": "us-south",
+            "endpoint_template": "s3.{region}.cloud-object-storage.appdomain.cloud",
+            "regions": ["eu-de", "eu-gb", "us-south", "us-east", "jp-tok", "au-syd"]
         },
         {
             "name": "OVH Object Storage",
             "endpoint": "s3.gra.perf.cloud.ovh.net",
-            "region": "gra"
+            "region": "gra",
+            "endpoint_template": "s3.{region}.perf.cloud.ovh.net",
+            "regions": ["gra", "sbg", "rbx", "de", "uk", "waw", "bhs"]
+        },
+        {
+            "name": "Google Cloud Storage",
+            "endpoint": "storage.googleapis.com",
+            "region": "auto"
         },
         {
             "name": "Other",
             "endpoint": "",
             "region": ""
         }
-    ]
\ No newline at end of file
+    ]
+
+
+def get_provider_regions(name):
+    """Candidats [{'region', 'endpoint'}] d'un fournisseur (liste vide sans endpoints régionaux)"""
+    for provider in get_s3_providers():
+        if provider["name"] == name and provider.get("endpoint_template"):
+            return [
+                {"region": region, "endpoint": provider["endpoint_template"].format(region=region)}
+                for region in provider["regions"]
+            ]
+    return []
+
+
+# Profils de performance par fournisseur
+#
+# Bornes des parts (MB) et nombre maximal de parts, valeurs recommandées pour
+# multipart_chunk_size et max_concurrent_uploads, et capacités écrites dans
+# storage.cfg (profile_properties) pour que le plugin prenne directement le
+# bon chemin: DeleteObjects, UploadPartCopy, somme de contrôle vérifiée par le
+# serveur (x-amz-checksum-*) et style d'adressage.
+DEFAULT_PROFILE = {
+    "min_part_size": 5,
+    "max_part_size": 5120,
+    "max_parts": 10000,
+    "chunk_size": 100,
+    "concurrency": 3,
+    "batch_delete": True,
+    "upload_part_copy": True,
+    "checksum_algorithm": "md5",
+    "addressing_style": "path",
+    "storage_classes": ["STANDARD", "STANDARD_IA", "REDUCED_REDUNDANCY", "GLACIER"],
+}
+
+PROVIDER_PROFILES = {
+    "AWS S3": {
+        "concurrency": 8,
+        "checksum_algorithm": "sha256",
+        "addressing_style": "virtual",
+        "storage_classes": [
+            "STANDARD", "STANDARD_IA", "ONEZONE_IA", "INTELLIGENT_TIERING", "GLACIER", "DEEP_ARCHIVE"
+        ],
+    },
+    "MinIO": {
+        "chunk_size": 64,
+        "concurrency": 8,
+        "checksum_algorithm": "sha256",
+        "storage_classes": ["STANDARD", "REDUCED_REDUNDANCY"],
+    },
+    "Ceph RadosGW": {
+        "chunk_size": 64,
+        "concurrency": 4,
+        "storage_classes": ["STANDARD"],
+    },
+    "Wasabi": {
+        "chunk_size": 64,
+        "concurrency": 6,
+        "addressing_style": "virtual",
+        # Une seule classe de stockage: x-amz-storage-class est refusé
+        "storage_classes": ["STANDARD"],
+    },
+    "DigitalOcean Spaces": {
+        "chunk_size": 64,
+        "concurrency": 4,
+        "addressing_style": "virtual",
+        "storage_classes": ["STANDARD"],
+    },
+    "Linode Object Storage": {
+        "chunk_size": 64,
+        "concurrency": 4,
+        "addressing_style": "virtual",
+        "storage_classes": ["STANDARD"],
+    },
+    "Backblaze B2": {
+        # Taille de part recommandée par Backblaze: 100 MB
+        "concurrency": 4,
+        "addressing_style": "virtual",
+        "storage_classes": ["STANDARD"],
+    },
+    "Scaleway Object Storage": {
+        # 1000 parts au plus par multipart upload
+        "max_parts": 1000,
+        "concurrency": 4,
+        "addressing_style": "virtual",
+        "storage_classes": ["STANDARD", "ONEZONE_IA", "GLACIER"],
+    },
+    "IBM Cloud Object Storage": {
+        "concurrency": 6,
+        "addressing_style": "virtual",
+        # La classe est celle du bucket (choisie à sa création)
+        "storage_classes": ["STANDARD"],
+    },
+    "Google Cloud Storage": {
+        # API XML interopérable: ni DeleteObjects ni UploadPartCopy
+        "concurrency": 4,
+        "batch_delete": False,
+        "upload_part_copy": False,
+        "addressing_style": "virtual",
+        "storage_classes": ["STANDARD"],
+    },
+    "OVH Object Storage": {
+        "concurrency": 4,
+        "addressing_style": "virtual",
+        "storage_classes": ["STANDARD", "STANDARD_IA"],
+    },
+}
+
+
+def get_provider_profile(name):
+    """Profil complet d'un fournisseur (profil par défaut s'il est inconnu)"""
+    profile = dict(DEFAULT_PROFILE)
+    profile.update(PROVIDER_PROFILES.get(name, {}))
+    return profile
+
+
+def profile_properties(profile):
+    """Propriétés storage.cfg des capacités d'un profil, dans l'ordre d'écriture"""
+    return [
+        ("addressing_style", profile["addressing_style"]),
+        ("max_parts", str(profile["max_parts"])),
+        ("batch_delete", "1" if profile["batch_delete"] else "0"),
+        ("upload_part_copy", "1" if profile["upload_part_copy"] else "0"),
+        ("checksum_algorithm", profile["checksum_algorithm"]),
+    ]
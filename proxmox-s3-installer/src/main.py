@@ -1,10 +1,72 @@
 import argparse
 import getpass
+import paramiko
 from installer.file_copier import copy_files
+from installer.cluster import ClusterDeployer
 from installer.config_manager import ConfigManager
+from installer.inventory import InventoryError, provision
+from installer.proxmox_client import verify_storage
 from installer.s3_providers import get_s3_providers
 from utils.interactive import interactive_prompt
 
+def deploy_cluster(args, password):
+    """Déploiement parallèle sur les nœuds du cluster puis redémarrage progressif"""
+    if args.nodes:
+        nodes = [node.strip() for node in args.nodes.split(',') if node.strip()]
+        deployer = ClusterDeployer(nodes, args.login, password, workers=args.workers)
+    else:
+        deployer = ClusterDeployer.discover(args.ip, args.login, password, workers=args.workers)
+    
+    print(f"Deploying to {len(deployer.nodes)} node(s): {', '.join(deployer.nodes)}")
+    deployed = deployer.deploy()
+    
+    print("\nRolling restart of Proxmox services...")
+    restarted = deployer.rolling_restart()
+    
+    print()
+    print(deployer.report())
+    
+    if not (deployed and restarted):
+        print("✗ Cluster deployment incomplete, see the table above.")
+        return False
+    return True
+
+def verify_cluster_storage(args, password):
+    """Statut du stockage sur tous les nœuds via l'API (requêtes parallèles)"""
+    nodes = [node.strip() for node in args.nodes.split(',') if node.strip()] if args.nodes else None
+    print(f"\n=== Verifying storage '{args.verify_storage}' on all nodes ===")
+    ok, report = verify_storage(args.ip, args.login, password, args.verify_storage, nodes=nodes)
+    print(report)
+    print("✓ Storage active on every node" if ok else "✗ Storage not active on every node, see the table above.")
+    return ok
+
+def provision_inventory(args, password):
+    """Création non interactive des stockages de l'inventaire (une écriture de storage.cfg)"""
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    ssh.connect(args.ip, username=args.login, password=password)
+    try:
+        content, summary = provision(ssh, args.inventory, replace=args.replace, dry_run=args.dry_run)
+    except InventoryError as e:
+        print(f"✗ Inventory rejected, storage.cfg left unchanged ({len(e.errors)} error(s)):")
+        for error in e.errors:
+            print(f"   • {error}")
+        return False
+    finally:
+        ssh.close()
+    
+    if args.dry_run:
+        print("🔍 DRY RUN MODE - storage.cfg that would be written:")
+        print(content)
+    for state in ('added', 'updated', 'unchanged', 'skipped'):
+        if summary[state]:
+            print(f"   {state}: {len(summary[state])} ({', '.join(summary[state])})")
+    if summary['skipped']:
+        print("   Existing storages with different settings were skipped, use --replace to overwrite them.")
+    print("✓ storage.cfg " + ("unchanged" if args.dry_run or not (summary['added'] or summary['updated'])
+                              else "written"))
+    return True
+
 def main():
     # Set up command-line argument parsing
     parser = argparse.ArgumentParser(
@@ -12,6 +74,10 @@ def main():
         epilog='''
 Example usage:
     python src/main.py 192.168.1.100 root
+    python src/main.py 192.168.1.100 root --cluster
+    python src/main.py 192.168.1.100 root --nodes pve1,pve2,pve3
+    python src/main.py 192.168.1.100 root --cluster --verify-storage s3-backup
+    python src/main.py 192.168.1.100 root --inventory tenants.yaml
     
 This script will:
 1. Connect to your Proxmox server via SSH
@@ -25,6 +91,15 @@ This script will:
     parser.add_argument('ip', type=str, help='Proxmox server IP address')
     parser.add_argument('login', type=str, help='Proxmox server login username')
     parser.add_argument('--dry-run', action='store_true', help='Show what would be done without making changes')
+    parser.add_argument('--cluster', action='store_true', help='Deploy to every cluster node (discovered with pvecm nodes)')
+    parser.add_argument('--nodes', type=str, help='Comma-separated list of nodes to deploy to')
+    parser.add_argument('--workers', type=int, default=8, help='Number of nodes deployed in parallel (default: 8)')
+    parser.add_argument('--verify-storage', metavar='STORAGE_ID',
+                        help='After copying the files, check an existing storage on every node through the API and exit')
+    parser.add_argument('--inventory', metavar='FILE',
+                        help='Create the storages listed in a YAML or JSON inventory, without prompts')
+    parser.add_argument('--replace', action='store_true',
+                        help='With --inventory, overwrite existing storages whose settings differ')
     args = parser.parse_args()
 
     print("=== Proxmox S3 Storage Plugin Installer ===")
@@ -33,6 +108,14 @@ This script will:
     if args.dry_run:
         print("🔍 DRY RUN MODE - No actual changes will be made")
     print()
+    
+    if args.inventory:
+        password = getpass.getpass(prompt='Enter your Proxmox password: ')
+        try:
+            provision_inventory(args, password)
+        except Exception as e:
+            print(f"✗ Error provisioning storages: {str(e)}")
+        return
 
     if not args.dry_run:
         # Prompt for password
@@ -41,13 +124,24 @@ This script will:
         try:
             # Copy necessary files to Proxmox
             print("\n=== Step 1: Copying plugin files ===")
-            copy_files(args.ip, args.login, password)
+            if args.cluster or args.nodes:
+                if not deploy_cluster(args, password):
+                    return
+            else:
+                copy_files(args.ip, args.login, password)
             print("✓ File copying completed successfully!")
             
         except Exception as e:
             print(f"✗ Error copying files: {str(e)}")
             print("Please check your connection and credentials.")
             return
+        
+        if args.verify_storage:
+            try:
+                verify_cluster_storage(args, password)
+            except Exception as e:
+                print(f"✗ Error querying the Proxmox API: {str(e)}")
+            return
     else:
         print("\n=== Step 1: Files that would be copied ===")
         print("The following files would be copied to your Proxmox server:")
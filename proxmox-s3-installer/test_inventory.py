@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Tests du provisionnement par inventaire (validation et fusion de storage.cfg)
+"""
+
+import json
+import os
+import shlex
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+from installer.inventory import (
+    InventoryError, apply_inventory, load_inventory, parse_inventory,
+    parse_storage_cfg, format_storage_cfg, write_storage_cfg, provision, storage_cfg_digest
+)
+
+STORAGE_CFG = """# Stockages du cluster
+dir: local
+\tpath /var/lib/vz
+\tcontent iso,vztmpl,backup
+
+lvmthin: local-lvm
+\tthinpool data
+\tvgname pve
+\tcontent rootdir,images
+"""
+
+
+def tenant(name, **overrides):
+    entry = {
+        'storage_name': name,
+        'bucket': f'{name}-backups',
+        'access_key': 'tenantaccess',
+        'secret_key': 'tenant-secret-key',
+    }
+    entry.update(overrides)
+    return entry
+
+
+def inventory(*storages):
+    return parse_inventory({
+        'defaults': {'endpoint': 's3.fr-par.scw.cloud', 'region': 'fr-par', 'content': 'backup'},
+        'storages': list(storages),
+    })
+
+
+def test_storage_cfg_round_trip():
+    assert format_storage_cfg(parse_storage_cfg(STORAGE_CFG)) == STORAGE_CFG
+
+
+def test_apply_inventory_adds_all_storages_in_one_pass():
+    entries = inventory(*(tenant(f'tenant-{i:03d}') for i in range(100)))
+
+    content, summary = apply_inventory(STORAGE_CFG, entries)
+
+    assert len(summary['added']) == 100
+    assert content.startswith(STORAGE_CFG.rstrip('\n') + '\n\ns3: tenant-000\n\tbucket tenant-000-backups\n')
+    sections = parse_storage_cfg(content)
+    assert [s['id'] for s in sections[:2]] == ['local', 'local-lvm']
+    assert dict(sections[2]['properties'])['content'] == 'backup'
+    assert dict(sections[2]['properties'])['max_concurrent_uploads'] == '3'
+
+
+def test_validation_reports_every_invalid_entry():
+    entries = inventory(
+        tenant('tenant-a'),
+        tenant('Tenant_B'),
+        tenant('tenant-c', bucket='x', max_concurrent_uploads=50),
+        tenant('tenant-a'),
+    )
+
+    with pytest.raises(InventoryError) as excinfo:
+        apply_inventory(STORAGE_CFG, entries)
+
+    errors = excinfo.value.errors
+    assert any(e.startswith('storages[1] (Tenant_B)') for e in errors)
+    assert sum(e.startswith('storages[2] (tenant-c)') for e in errors) == 2
+    assert any(e.startswith('storages[3] (tenant-a)') and 'double' in e for e in errors)
+    assert not any(e.startswith('storages[0]') for e in errors)
+
+
+def test_existing_storages_are_skipped_unless_replaced():
+    content, _ = apply_inventory(STORAGE_CFG, inventory(tenant('tenant-a'), tenant('tenant-b')))
+    changed = inventory(tenant('tenant-a', bucket='tenant-a-new'), tenant('tenant-b'))
+
+    _, summary = apply_inventory(content, changed)
+    assert summary == {'added': [], 'updated': [], 'unchanged': ['tenant-b'], 'skipped': ['tenant-a']}
+
+    replaced, summary = apply_inventory(content, changed, replace=True)
+    assert summary['updated'] == ['tenant-a']
+    assert '\tbucket tenant-a-new\n' in replaced
+    assert replaced.count('s3: tenant-a\n') == 1
+
+
+def test_conflicting_storage_type_is_rejected():
+    with pytest.raises(InventoryError, match="local"):
+        apply_inventory(STORAGE_CFG, inventory(tenant('local')))
+
+
+def test_provider_profile_sets_capabilities():
+    entries = inventory(
+        tenant('tenant-a', provider='Scaleway Object Storage'),
+        tenant('tenant-b', provider='Google Cloud Storage', max_concurrent_uploads=2),
+    )
+
+    content, _ = apply_inventory(STORAGE_CFG, entries)
+
+    sections = {s['id']: dict(s['properties']) for s in parse_storage_cfg(content)}
+    assert sections['tenant-a']['max_parts'] == '1000'
+    assert sections['tenant-a']['addressing_style'] == 'virtual'
+    assert 'provider' not in sections['tenant-a']
+    assert sections['tenant-b']['batch_delete'] == '0'
+    assert sections['tenant-b']['max_concurrent_uploads'] == '2'
+
+    with pytest.raises(InventoryError, match='inconnu'):
+        inventory(tenant('tenant-c', provider='Nowhere'))
+
+
+def test_load_inventory_json_and_yaml(tmp_path):
+    data = {'defaults': {'endpoint': 'minio.example.com:9000', 'region': 'us-east-1'},
+            'storages': [{'name': 'tenant-a', 'bucket': 'tenant-a-backups'}]}
+    json_path = tmp_path / 'inventory.json'
+    json_path.write_text(json.dumps(data))
+    entry = load_inventory(str(json_path))[0]
+    assert entry['storage_name'] == 'tenant-a'
+    assert entry['endpoint'] == 'minio.example.com:9000'
+
+    yaml = pytest.importorskip('yaml')
+    yaml_path = tmp_path / 'inventory.yaml'
+    yaml_path.write_text(yaml.safe_dump(data))
+    assert load_inventory(str(yaml_path)) == load_inventory(str(json_path))
+
+
+def test_write_storage_cfg_is_atomic(tmp_path):
+    path = tmp_path / 'storage.cfg'
+    path.write_text(STORAGE_CFG)
+    content, _ = apply_inventory(STORAGE_CFG, inventory(tenant('tenant-a')))
+
+    write_storage_cfg(content, str(path))
+
+    assert path.read_text() == content
+    assert os.listdir(tmp_path) == ['storage.cfg']
+
+
+class FakeChannel:
+    """stdin/stdout/stderr d'une commande paramiko simulée"""
+
+    def __init__(self, data=b'', on_exit=None):
+        self.channel = self
+        self.data = data
+        self.written = ''
+        self.on_exit = on_exit
+
+    def read(self):
+        return self.data
+
+    def write(self, text):
+        self.written += text
+
+    def shutdown_write(self):
+        pass
+
+    def recv_exit_status(self):
+        return self.on_exit() if self.on_exit else 0
+
+
+class FakeNode:
+    """Nœud PVE simulé: storage.cfg modifié par un tiers après certaines lectures"""
+
+    def __init__(self, content, changes=()):
+        self.content = content
+        self.changes = list(changes)
+        self.commands = []
+        self.writes = 0
+
+    def exec_command(self, command):
+        self.commands.append(command)
+        argv = shlex.split(command)
+        if argv[0] == 'cat':
+            data = self.content.encode()
+            if self.changes:
+                self.content += self.changes.pop(0)
+            return FakeChannel(), FakeChannel(data), FakeChannel()
+
+        assert argv[:2] == ['perl', '-e'] and 'PVE::Storage::lock_storage_config' in argv[2]
+        stdin = FakeChannel()
+
+        def write():
+            self.writes += 1
+            if storage_cfg_digest(self.content) != argv[4]:
+                return 3
+            self.content = stdin.written
+            return 0
+
+        return stdin, FakeChannel(on_exit=write), FakeChannel()
+
+
+def test_provision_writes_under_lock_and_merges_again_after_concurrent_change(tmp_path):
+    path = tmp_path / 'inventory.json'
+    path.write_text(json.dumps({'defaults': {'endpoint': 's3.fr-par.scw.cloud', 'region': 'fr-par'},
+                                'storages': [tenant('tenant-a')]}))
+    node = FakeNode(STORAGE_CFG, changes=['\nnfs: backups\n\tserver 10.0.0.5\n'])
+
+    content, summary = provision(node, str(path))
+
+    assert summary['added'] == ['tenant-a']
+    assert node.writes == 2
+    assert node.content == content
+    assert [s['id'] for s in parse_storage_cfg(content)] == ['local', 'local-lvm', 'backups', 'tenant-a']
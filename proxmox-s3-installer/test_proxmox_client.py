@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Tests du client asynchrone de l'API Proxmox (contre un pveproxy simulé)
+"""
+
+import asyncio
+import os
+import sys
+from urllib.parse import unquote
+
+import pytest
+
+web = pytest.importorskip('aiohttp.web')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
+
+from installer.proxmox_client import AsyncProxmoxClient, ProxmoxAPIError
+
+
+class StubProxy:
+    """pveproxy minimal: /access/ticket, /nodes et statut de stockage
+
+    Le cookie est vérifié comme le fait pveproxy: valeur décodée, sans
+    retirer d'éventuels guillemets.
+    """
+
+    def __init__(self):
+        self.logins = 0
+        self.ticket = None
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = []
+
+    def new_ticket(self):
+        self.logins += 1
+        self.ticket = f'PVE:root@pam:6700{self.logins:04X}::a/b+c=='
+        return self.ticket
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post('/api2/json/access/ticket', self.login)
+        app.router.add_get('/api2/json/nodes', self.nodes)
+        app.router.add_get('/api2/json/nodes/{node}/storage/{storage}/status', self.status)
+        return app
+
+    def authorized(self, request):
+        cookie = request.headers.get('Cookie', '')
+        name, _, value = cookie.partition('=')
+        return name == 'PVEAuthCookie' and self.ticket is not None and unquote(value) == self.ticket
+
+    async def login(self, request):
+        form = await request.post()
+        if form.get('username') != 'root@pam' or form.get('password') != 'secret':
+            raise web.HTTPUnauthorized()
+        return web.json_response({'data': {'ticket': self.new_ticket(), 'CSRFPreventionToken': 'csrf'}})
+
+    async def nodes(self, request):
+        self.requests.append(request.headers.get('Cookie'))
+        if not self.authorized(request):
+            raise web.HTTPUnauthorized()
+        return web.json_response({'data': [{'node': 'pve1', 'status': 'online'},
+                                           {'node': 'pve2', 'status': 'offline'}]})
+
+    async def status(self, request):
+        if not self.authorized(request):
+            raise web.HTTPUnauthorized()
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.02)
+        finally:
+            self.in_flight -= 1
+        return web.json_response({'data': {'active': 1, 'node': request.match_info['node']}})
+
+
+def run_with_proxy(scenario, **client_options):
+    """Exécute scenario(client, proxy) contre un pveproxy simulé en HTTP"""
+    async def main():
+        proxy = StubProxy()
+        runner = web.AppRunner(proxy.app())
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        try:
+            client = AsyncProxmoxClient('127.0.0.1', 'root', client_options.pop('password', 'secret'),
+                                        port=port, **client_options)
+            client.base_url = f"http://127.0.0.1:{port}/api2/json"
+            async with client:
+                return await scenario(client, proxy)
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def test_login_sends_ticket_cookie_unquoted():
+    async def scenario(client, proxy):
+        nodes = await client.nodes()
+        return nodes, proxy
+
+    nodes, proxy = run_with_proxy(scenario)
+
+    assert [n['node'] for n in nodes] == ['pve1', 'pve2']
+    assert proxy.logins == 1
+    assert proxy.requests[0].startswith('PVEAuthCookie=PVE%3Aroot%40pam%3A')
+    assert '"' not in proxy.requests[0]
+
+
+def test_login_failure_raises():
+    async def scenario(client, proxy):
+        return None
+
+    with pytest.raises(ProxmoxAPIError) as excinfo:
+        run_with_proxy(scenario, password='wrong')
+    assert excinfo.value.status == 401
+
+
+def test_expired_ticket_is_renewed_once_for_concurrent_requests():
+    async def scenario(client, proxy):
+        await client.nodes()
+        proxy.ticket = 'expired'
+        results = await asyncio.gather(*(client.storage_status('pve1', 's3') for _ in range(5)))
+        return results, proxy
+
+    results, proxy = run_with_proxy(scenario)
+
+    assert all(r['active'] == 1 for r in results)
+    assert proxy.logins == 2
+
+
+def test_concurrent_requests_are_limited_by_max_connections():
+    async def scenario(client, proxy):
+        await asyncio.gather(*(client.storage_status(f'pve{i}', 's3') for i in range(12)))
+        return proxy
+
+    proxy = run_with_proxy(scenario, max_connections=3)
+
+    assert 1 < proxy.max_in_flight <= 3
@@ -0,0 +1,175 @@
+#!/usr/bin/perl
+
+use strict;
+use warnings;
+
+use File::Temp qw(tempdir);
+use FindBin;
+use Test::More;
+
+use lib "$FindBin::Bin/..";
+
+use PVE::Storage::S3::Logger;
+use PVE::Storage::S3::ArchiveIndex;
+
+my $dir = tempdir(CLEANUP => 1);
+PVE::Storage::S3::Logger::configure({ file => "$dir/storage-s3.log" });
+
+use constant {
+    CLUSTER => 65536,
+    BLOCK => 4096,
+};
+
+# Construction d'une archive VMA: configs, disques [nom, taille] et extents
+# [[dev_id, cluster, masque], ...]; le bloc n d'un cluster contient
+# l'octet "dev_id * 16 + n"
+sub build_vma {
+    my ($configs, $devices, $extents) = @_;
+    
+    my $blob = "\0";
+    my $add_blob = sub {
+        my ($data) = @_;
+        my $ptr = length($blob);
+        $blob .= pack('v', length($data)) . $data;
+        return $ptr;
+    };
+    
+    my $header = "\0" x (4096 + 256 * 32);
+    substr($header, 0, 4) = "VMA\0";
+    substr($header, 4, 4) = pack('N', 1);
+    
+    my $i = 0;
+    foreach my $config (@$configs) {
+        substr($header, 2044 + $i * 4, 4) = pack('N', $add_blob->("$config->[0]\0"));
+        substr($header, 3068 + $i * 4, 4) = pack('N', $add_blob->("$config->[1]\0"));
+        $i++;
+    }
+    
+    my $dev_id = 1;
+    foreach my $device (@$devices) {
+        substr($header, 4096 + $dev_id * 32, 32) = pack('NNQ>N4', $add_blob->("$device->[0]\0"), 0, $device->[1], 0, 0, 0, 0);
+        $dev_id++;
+    }
+    
+    my $blob_offset = length($header);
+    $header .= $blob;
+    substr($header, 48, 12) = pack('NNN', $blob_offset, length($blob), length($header));
+    
+    my $archive = $header;
+    foreach my $extent (@$extents) {
+        my ($info, $data, $blocks) = ('', '', 0);
+        foreach my $entry (@$extent) {
+            my ($id, $cluster, $mask) = @$entry;
+            $info .= pack('Q>', ($mask << 48) | ($id << 32) | $cluster);
+            for my $bit (0..15) {
+                next if !($mask & (1 << $bit));
+                $data .= chr($id * 16 + $bit) x BLOCK;
+                $blocks++;
+            }
+        }
+        $info .= "\0" x (59 * 8 - length($info));
+        $archive .= 'VMAE' . "\0\0" . pack('n', $blocks) . ("\0" x 32) . $info . $data;
+    }
+    
+    return $archive;
+}
+
+# Client S3 minimal sur une archive en mémoire
+package FakeClient {
+    sub new {
+        my ($class, $data) = @_;
+        return bless { data => $data, ranges => [] }, $class;
+    }
+    
+    sub get_object_range {
+        my ($self, $bucket, $key, $start, $end) = @_;
+        push @{$self->{ranges}}, [$start, $end];
+        return substr($self->{data}, $start, $end - $start + 1);
+    }
+    
+    sub head_object { { ETag => $_[0]->{etag} // '"1"', ContentLength => length($_[0]->{data}) } }
+    
+    # Seul l'objet annexe d'index est lu en entier
+    sub get_object {
+        my ($self, $bucket, $key) = @_;
+        die "Unexpected GET $key\n" if !$self->{index} || $key !~ /\.index\.json$/;
+        return JSON::encode_json($self->{index});
+    }
+}
+
+package main;
+
+my $archive = build_vma(
+    [['qemu-server.conf', "scsi0: local:100/vm-100-disk-0.raw\n"]],
+    [['drive-scsi0', 2 * CLUSTER], ['drive-scsi1', CLUSTER], ['drive-efidisk0', 128 * 1024]],
+    [
+        [[1, 0, 0xffff], [2, 0, 0x0001]],
+        [[1, 1, 0x00ff]],
+        [[3, 1, 0x0003]],
+        [[2, 0, 0x8000]],
+        [[2, 0, 0x0002]],
+    ],
+);
+
+my $indexer = PVE::Storage::S3::ArchiveIndex->new('dump/vzdump-qemu-100-2024_01_01-00_00_00.vma');
+$indexer->add(substr($archive, $_ * 10000, 10000)) for 0..int(length($archive) / 10000);
+my $index = $indexer->finish();
+
+# En-tête: noms et tailles de tous les disques
+is_deeply($index->{devices}, [
+    { id => 1, name => 'drive-scsi0', size => 2 * CLUSTER },
+    { id => 2, name => 'drive-scsi1', size => CLUSTER },
+    { id => 3, name => 'drive-efidisk0', size => 128 * 1024 },
+], 'devices parsed from VMA header');
+is($index->{configs}[0]{name}, 'qemu-server.conf', 'config name');
+is(scalar(@{$index->{extents}}), 5, 'extents tracked');
+
+# Restauration d'un disque: extents contigus lus en une requête
+my $client = FakeClient->new($archive);
+my $device = PVE::Storage::S3::ArchiveIndex::restore_device($client, 'bucket', 'key', $index, 'scsi1', "$dir/scsi1.raw");
+is($device->{id}, 2, 'restored device');
+is(scalar(@{$client->{ranges}}), 2, 'contiguous extents merged into one range');
+
+open my $fh, '<:raw', "$dir/scsi1.raw" or die "Cannot open: $!";
+my $image = do { local $/; <$fh> };
+close $fh;
+is(length($image), CLUSTER, 'image size');
+is(substr($image, 0, BLOCK), chr(32) x BLOCK, 'block 0');
+is(substr($image, BLOCK, BLOCK), chr(33) x BLOCK, 'block 1');
+is(substr($image, 15 * BLOCK, BLOCK), chr(47) x BLOCK, 'block 15');
+is(substr($image, 2 * BLOCK, BLOCK), "\0" x BLOCK, 'block absent from the archive');
+
+$client = FakeClient->new($archive);
+PVE::Storage::S3::ArchiveIndex::restore_device($client, 'bucket', 'key', $index, 'efidisk0', "$dir/efidisk0.raw");
+open $fh, '<:raw', "$dir/efidisk0.raw" or die "Cannot open: $!";
+$image = do { local $/; <$fh> };
+close $fh;
+is(length($image), 128 * 1024, 'third device size');
+is(substr($image, CLUSTER + BLOCK, BLOCK), chr(49) x BLOCK, 'third device data');
+
+# Configuration en cache revalidée par l'ETag de l'archive
+{
+    local $PVE::Storage::S3::ArchiveIndex::CONFIG_CACHE_DIR = "$dir/configs";
+    my $key = 'dump/vzdump-qemu-100-2024_01_01-00_00_00.vma';
+    
+    my $client = FakeClient->new($archive);
+    $client->{index} = $index;
+    my $config = PVE::Storage::S3::ArchiveIndex::extract_config($client, 'bucket', $key);
+    is($config, "scsi0: local:100/vm-100-disk-0.raw\n", 'config extracted through the index');
+    
+    $client->{ranges} = [];
+    $config = PVE::Storage::S3::ArchiveIndex::extract_config($client, 'bucket', $key);
+    is(scalar(@{$client->{ranges}}), 0, 'unchanged archive served from the config cache');
+    
+    # Archive remplacée sous la même clé: nouvel ETag, config relue
+    my $replaced = build_vma([['qemu-server.conf', "memory: 4096\n"]], [['drive-scsi0', CLUSTER]], [[[1, 0, 0x0001]]]);
+    my $replaced_indexer = PVE::Storage::S3::ArchiveIndex->new($key);
+    $replaced_indexer->add($replaced);
+    $client = FakeClient->new($replaced);
+    $client->{index} = $replaced_indexer->finish();
+    $client->{etag} = '"2"';
+    $config = PVE::Storage::S3::ArchiveIndex::extract_config($client, 'bucket', $key);
+    is($config, "memory: 4096\n", 'replaced archive invalidates the cached config');
+}
+
+done_testing();
@@ -0,0 +1,76 @@
+#!/usr/bin/perl
+
+use strict;
+use warnings;
+
+use File::Temp qw(tempdir);
+use FindBin;
+use Test::More;
+
+use lib "$FindBin::Bin/..";
+
+use PVE::Storage::S3::Logger;
+use PVE::Storage::S3::Cache;
+use PVE::Storage::S3::Exception;
+
+my $dir = tempdir(CLEANUP => 1);
+PVE::Storage::S3::Logger::configure({ file => "$dir/storage-s3.log" });
+
+# Client S3 minimal: objets en mémoire, HEAD en échec quand "offline" est posé
+package FakeClient {
+    sub new {
+        my ($class, $objects) = @_;
+        return bless { objects => $objects, offline => 0, downloads => 0 }, $class;
+    }
+    
+    sub head_object {
+        my ($self, $bucket, $key) = @_;
+        die PVE::Storage::S3::Exception::S3Exception("Connection refused") if $self->{offline};
+        my $data = $self->{objects}->{$key} // die PVE::Storage::S3::Exception::S3Exception("Not found: $key");
+        return { ETag => '"' . length($data) . '"', ContentLength => length($data) };
+    }
+    
+    sub download_file {
+        my ($self, $bucket, $key, $file) = @_;
+        die PVE::Storage::S3::Exception::S3Exception("Connection refused") if $self->{offline};
+        $self->{downloads}++;
+        open my $fh, '>', $file or die "$file: $!";
+        print $fh $self->{objects}->{$key};
+        close $fh;
+    }
+}
+
+package main;
+
+my $client = FakeClient->new({ 'iso/debian.iso' => 'x' x 1000, 'iso/other.iso' => 'y' x 10 });
+my $cache = PVE::Storage::S3::Cache->new($client, 'bucket', {
+    dir => "$dir/cache",
+    revalidate_interval => 0,
+});
+
+# Premier accès: téléchargement
+my $file = eval { $cache->fetch('iso/debian.iso', 'iso/debian.iso') };
+is($@, '', 'fetch downloads the object');
+is(-s $file, 1000, 'cached copy is complete');
+is($client->{downloads}, 1, 'one download');
+
+# Revalidation réussie: pas de nouveau téléchargement
+$cache->fetch('iso/debian.iso', 'iso/debian.iso');
+is($client->{downloads}, 1, 'unchanged object is not downloaded again');
+
+# HEAD en échec avec une copie complète: la copie locale est retournée
+$client->{offline} = 1;
+my $offline = eval { $cache->fetch('iso/debian.iso', 'iso/debian.iso') };
+is($@, '', 'failed revalidation does not die with a cached copy');
+is($offline, $file, 'cached copy returned when S3 is unreachable');
+
+# HEAD en échec sans copie locale: erreur
+eval { $cache->fetch('iso/other.iso', 'iso/other.iso') };
+like($@, qr/Connection refused/, 'failed revalidation dies without a cached copy');
+
+# HEAD en échec avec une copie incomplète: erreur
+truncate($file, 10);
+eval { $cache->fetch('iso/debian.iso', 'iso/debian.iso') };
+like($@, qr/Connection refused/, 'failed revalidation dies with an incomplete copy');
+
+done_testing();
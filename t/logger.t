@@ -0,0 +1,86 @@
+#!/usr/bin/perl
+
+use strict;
+use warnings;
+
+use File::Temp qw(tempdir);
+use FindBin;
+use POSIX ();
+use Test::More;
+
+use lib "$FindBin::Bin/..";
+
+use PVE::Storage::S3::Logger;
+
+# Module chargé par pvesm, vzdump, qmrestore: SIGHUP laissé au processus
+ok(!$SIG{HUP} || $SIG{HUP} eq 'DEFAULT', 'SIGHUP handler left untouched');
+
+my $dir = tempdir(CLEANUP => 1);
+my $file = "$dir/storage-s3.log";
+PVE::Storage::S3::Logger::configure({ file => $file, format => 'text', level => 'INFO' });
+
+sub logged {
+    open my $fh, '<', $file or return '';
+    local $/;
+    return scalar <$fh>;
+}
+
+# Hors opération: écriture immédiate (processus PVE inactif)
+PVE::Storage::S3::Logger::log_message('INFO', 'outside batch');
+like(logged(), qr/\[INFO\] \[\d+\] outside batch$/m, 'line written outside a batch');
+
+# Pendant une opération: écriture à la fin de la dernière
+{
+    my $batch = PVE::Storage::S3::Logger::batch();
+    {
+        my $inner = PVE::Storage::S3::Logger::batch();
+        PVE::Storage::S3::Logger::log_message('INFO', 'inside batch');
+    }
+    unlike(logged(), qr/inside batch/, 'line buffered during the batch');
+    
+    PVE::Storage::S3::Logger::log_message('ERROR', 'error in batch');
+    like(logged(), qr/inside batch\n.*error in batch/, 'buffer written on error');
+    
+    PVE::Storage::S3::Logger::log_message('INFO', 'before exit');
+}
+like(logged(), qr/before exit/, 'buffer written at the end of the batch');
+
+# Batch interrompu par une exception
+eval {
+    my $batch = PVE::Storage::S3::Logger::batch();
+    PVE::Storage::S3::Logger::log_message('INFO', 'before die');
+    die "failed\n";
+};
+like(logged(), qr/before die/, 'buffer written when the batch dies');
+
+# Longue attente pendant une opération
+{
+    my $batch = PVE::Storage::S3::Logger::batch();
+    PVE::Storage::S3::Logger::log_message('INFO', 'waiting');
+    PVE::Storage::S3::Logger::flush_if_due();
+    unlike(logged(), qr/waiting/, 'recent line kept in the buffer');
+    select(undef, undef, undef, PVE::Storage::S3::Logger::FLUSH_INTERVAL + 0.1);
+    PVE::Storage::S3::Logger::flush_if_due();
+    like(logged(), qr/waiting/, 'line written once older than the flush interval');
+}
+
+# Rotation (logrotate): nouveau fichier détecté sans signal
+rename($file, "$file.1") or die "rename: $!";
+select(undef, undef, undef, PVE::Storage::S3::Logger::REOPEN_CHECK_INTERVAL + 0.1);
+PVE::Storage::S3::Logger::log_message('INFO', 'after rotation');
+like(logged(), qr/^\S+ \S+ \[INFO\] \[\d+\] after rotation$/, 'file reopened after rotation');
+
+# Worker PVE (fork_worker): pas de bloc END avec POSIX::_exit
+my $pid = fork() // die "fork: $!";
+if (!$pid) {
+    {
+        my $batch = PVE::Storage::S3::Logger::batch();
+        PVE::Storage::S3::Logger::log_message('INFO', 'worker transfer');
+    }
+    PVE::Storage::S3::Logger::log_message('INFO', 'worker done');
+    POSIX::_exit(0);
+}
+waitpid($pid, 0);
+like(logged(), qr/worker transfer\n.*worker done/, 'worker lines written before POSIX::_exit');
+
+done_testing();
@@ -0,0 +1,154 @@
+#!/usr/bin/perl
+
+use strict;
+use warnings;
+
+use FindBin;
+use POSIX qw(strftime);
+use Test::More;
+
+use lib "$FindBin::Bin/..";
+
+use PVE::Storage::S3::Retention;
+
+$ENV{TZ} = 'UTC';
+POSIX::tzset();
+
+# Référence: PVE::Storage::prune_mark_backup_group (pve-storage)
+my $prune_mark = sub {
+    my ($prune_entries, $keep_count, $id_func) = @_;
+    
+    return if !$keep_count;
+    
+    my $already_included = {};
+    my $newly_included = {};
+    
+    foreach my $prune_entry (@{$prune_entries}) {
+        my $mark = $prune_entry->{mark};
+        my $id = $id_func->($prune_entry->{ctime});
+        $already_included->{$id} = 1 if defined($mark) && $mark eq 'keep';
+    }
+    
+    foreach my $prune_entry (@{$prune_entries}) {
+        my $mark = $prune_entry->{mark};
+        my $id = $id_func->($prune_entry->{ctime});
+        
+        next if defined($mark) || $already_included->{$id};
+        
+        if (!$newly_included->{$id}) {
+            last if scalar(keys %{$newly_included}) >= $keep_count;
+            $newly_included->{$id} = 1;
+            $prune_entry->{mark} = 'keep';
+        } else {
+            $prune_entry->{mark} = 'remove';
+        }
+    }
+};
+
+sub prune_mark_backup_group {
+    my ($backup_group, $keep) = @_;
+    
+    my %keep = %$keep;
+    my $keep_all = delete $keep{'keep-all'};
+    
+    if ($keep_all || !scalar(grep { $_ > 0 } values %keep)) {
+        $_->{mark} = 'keep' foreach @$backup_group;
+        return;
+    }
+    
+    my $prune_list = [ sort { $b->{ctime} <=> $a->{ctime} } @{$backup_group} ];
+    
+    $prune_mark->($prune_list, $keep{'keep-last'}, sub { $_[0] });
+    $prune_mark->($prune_list, $keep{'keep-hourly'}, sub {
+        my (undef, undef, $hour, $day, $month, $year) = localtime($_[0]);
+        return "$hour/$day/$month/$year";
+    });
+    $prune_mark->($prune_list, $keep{'keep-daily'}, sub {
+        my (undef, undef, undef, $day, $month, $year) = localtime($_[0]);
+        return "$day/$month/$year";
+    });
+    $prune_mark->($prune_list, $keep{'keep-weekly'}, sub {
+        my ($sec, $min, $hour, $day, $month, $year) = localtime($_[0]);
+        my $iso_week = int(strftime("%V", $sec, $min, $hour, $day, $month, $year));
+        my $iso_week_year = int(strftime("%G", $sec, $min, $hour, $day, $month, $year));
+        return "$iso_week/$iso_week_year";
+    });
+    $prune_mark->($prune_list, $keep{'keep-monthly'}, sub {
+        my (undef, undef, undef, undef, $month, $year) = localtime($_[0]);
+        return "$month/$year";
+    });
+    $prune_mark->($prune_list, $keep{'keep-yearly'}, sub {
+        my $year = (localtime($_[0]))[5];
+        return "$year";
+    });
+    
+    $_->{mark} //= 'remove' foreach @$backup_group;
+}
+
+# Groupe de backups aléatoire: rafales (plusieurs par heure), trous de
+# plusieurs mois, passages d'année et semaines ISO à cheval sur deux années
+sub random_backups {
+    my ($vmid) = @_;
+    
+    my $time = 1577836800 - int(rand(3 * 365)) * 86400;
+    my @backups;
+    for (1 .. 1 + int(rand(300))) {
+        my $gap = rand() < 0.1 ? int(rand(90 * 86400)) : rand() < 0.3 ? int(rand(3600)) : int(rand(2 * 86400));
+        $time += 1 + $gap;
+        push @backups, {
+            ctime => $time,
+            Key => "dump/" . strftime("vzdump-qemu-$vmid-%Y_%m_%d-%H_%M_%S.vma.zst", localtime($time)),
+        };
+    }
+    
+    return \@backups;
+}
+
+sub random_keep {
+    my $keep = {};
+    foreach my $option (qw(keep-last keep-hourly keep-daily keep-weekly keep-monthly keep-yearly)) {
+        $keep->{$option} = int(rand(12)) if rand() < 0.6;
+    }
+    $keep->{'keep-all'} = 1 if rand() < 0.02;
+    
+    return $keep;
+}
+
+srand(20240101);
+
+my $mismatches = 0;
+for my $case (1 .. 300) {
+    my @objects = map { @{random_backups($_)} } 100 .. 100 + int(rand(3));
+    my $keep = random_keep();
+    
+    my %expected;
+    foreach my $vmid (100 .. 102) {
+        my @group = grep { $_->{Key} =~ /-$vmid-/ } @objects;
+        prune_mark_backup_group(\@group, $keep);
+        $expected{$_->{Key}} = $_->{mark} foreach @group;
+    }
+    
+    # Ordre du listing S3 (clés triées) mélangé avec des objets étrangers
+    my @listing = sort { $a->{Key} cmp $b->{Key} } @objects;
+    push @listing, { Key => 'dump/vzdump-qemu-100-2020_01_01-00_00_00.log' }, { Key => 'iso/debian.iso' };
+    
+    my $plan = PVE::Storage::S3::Retention::plan(\@listing, $keep);
+    my %got = ((map { $_->{Key} => 'keep' } @{$plan->{keep}}), (map { $_->{Key} => 'remove' } @{$plan->{remove}}));
+    
+    if (!is_deeply(\%got, \%expected, "case $case matches prune_mark")) {
+        diag(PVE::Storage::S3::Retention::format_keep_spec($keep));
+        last if ++$mismatches >= 3;
+    }
+}
+
+# mark_group: marques dans l'ordre du groupe (du plus récent au plus ancien)
+my $groups = PVE::Storage::S3::Retention::build_index([
+    map { { Key => "vzdump-lxc-200-2024_0${_}_01-00_00_00.tar.zst" } } 1 .. 5
+]);
+is_deeply(
+    PVE::Storage::S3::Retention::mark_group($groups->{'lxc/200'}, { 'keep-last' => 1, 'keep-monthly' => 2 }),
+    [qw(keep keep keep remove remove)],
+    'mark_group order',
+);
+
+done_testing();
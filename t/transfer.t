@@ -0,0 +1,72 @@
+#!/usr/bin/perl
+
+use strict;
+use warnings;
+
+use File::Temp qw(tempdir);
+use FindBin;
+use Test::More;
+
+use lib "$FindBin::Bin/..";
+
+use PVE::Storage::S3::Logger;
+use PVE::Storage::S3::Transfer;
+
+# Transferts dans le processus, sans le service partagé
+$ENV{PVE_S3_NO_DAEMON} = 1;
+
+my $dir = tempdir(CLEANUP => 1);
+PVE::Storage::S3::Logger::configure({ file => "$dir/storage-s3.log" });
+
+# Configuration et client S3 minimaux: l'objet distant est généré à la demande
+package FakeConfig {
+    sub new { bless {}, shift }
+    sub get { undef }
+    sub multipart_config { { chunk_size => 8 * 1024 * 1024, threshold => 16 * 1024 * 1024, max_concurrent => 2 } }
+}
+
+package FakeClient {
+    sub new {
+        my ($class, $size) = @_;
+        return bless { size => $size, ranges => [] }, $class;
+    }
+    
+    sub head_object { { ContentLength => $_[0]->{size} } }
+    
+    # Octet n de l'objet: n modulo 251
+    sub get_object_range {
+        my ($self, $bucket, $key, $start, $end) = @_;
+        push @{$self->{ranges}}, [$start, $end];
+        return join('', map { chr($_ % 251) } $start..$end) if $end - $start < 4096;
+        my $block = join('', map { chr($_ % 251) } 0..(251 * 64 - 1));
+        my $data = substr($block, $start % 251) . ($block x (int(($end - $start + 1) / length($block)) + 1));
+        return substr($data, 0, $end - $start + 1);
+    }
+}
+
+package main;
+
+# Download multipart (> 100 Mo): fichier complet et résultat du transfert
+{
+    my $size = 101 * 1024 * 1024 + 123;
+    my $client = FakeClient->new($size);
+    my $transfer = PVE::Storage::S3::Transfer->new($client, FakeConfig->new());
+    my $file = "$dir/download.bin";
+    
+    my $result = eval { $transfer->download_file('bucket', 'dump/vzdump.vma.zst', $file) };
+    is($@, '', 'multipart download succeeds');
+    is(ref($result), 'HASH', 'multipart download returns a result');
+    is($result->{size}, $size, 'result size');
+    is($result->{parts_count}, 3, 'result parts count');
+    ok(defined $result->{duration}, 'result duration');
+    is(-s $file, $size, 'downloaded file size');
+    is_deeply($client->{ranges}[-1], [100 * 1024 * 1024, $size - 1], 'last range');
+    
+    open my $fh, '<:raw', $file or die "Cannot open $file: $!";
+    seek($fh, 50 * 1024 * 1024 - 2, 0);
+    read($fh, my $data, 4);
+    is($data, join('', map { chr($_ % 251) } (50 * 1024 * 1024 - 2)..(50 * 1024 * 1024 + 1)), 'data across parts');
+    close $fh;
+}
+
+done_testing();